@@ -3,7 +3,11 @@
 """
 
 import logging
+import os
+import threading
+import time
 from datetime import datetime, timedelta
+from html import escape
 from keyboards import (
     create_admin_keyboard,
     create_notifications_keyboard,
@@ -12,9 +16,25 @@ from keyboards import (
 )
 from utils import format_price, format_date
 from localization import t
+from config import BOT_CONFIG, QUERY_PROFILER_CONFIG
 
 logger = logging.getLogger(__name__)
 
+# Лимит Bot API на отправку файлов
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+EXPORT_REPORTS = {
+    'inventory': {
+        'stock_levels': '📦 Остатки',
+        'movements': '🔄 Движения (30 дней)',
+        'movements_history': '🗂 Движения (все)'
+    },
+    'finance': {
+        'transactions': '💳 Транзакции',
+        'products_performance': '📊 Эффективность товаров'
+    }
+}
+
 class AdminHandler:
     def __init__(self, bot, db):
         self.bot = bot
@@ -43,6 +63,12 @@ class AdminHandler:
         
         if text == '/admin' or text == '📊 Статистика':
             self.show_admin_panel(chat_id)
+        elif text.startswith('/admin_loglevel'):
+            self.handle_log_level_command(chat_id, text)
+        elif text.startswith('/admin_queries'):
+            self.handle_queries_command(chat_id, text)
+        elif text == '/admin_ship':
+            self.handle_ship_command(chat_id)
         elif text == '📦 Заказы':
             self.show_orders_management(chat_id)
         elif text == '🛠 Товары':
@@ -68,6 +94,111 @@ class AdminHandler:
         elif text == '🔙 Пользовательский режим':
             self.exit_admin_mode(chat_id)
     
+    def handle_log_level_command(self, chat_id, text):
+        """Смена уровня логирования модуля: /admin_loglevel updates DEBUG"""
+        from logger import logger as production_logger
+        
+        parts = text.split()
+        if len(parts) == 3:
+            try:
+                name = production_logger.set_level(parts[1], parts[2])
+                self.bot.send_message(chat_id, f"✅ Уровень {name}: {parts[2].upper()}")
+            except ValueError as e:
+                self.bot.send_message(chat_id, f"❌ {e}")
+            return
+        
+        levels_text = "📝 <b>Уровни логирования</b>\n\n"
+        for name, level in production_logger.get_levels().items():
+            levels_text += f"• {name}: {level}\n"
+        
+        stats = production_logger.get_stats()
+        levels_text += f"\nВ очереди: {stats['queued']}, отброшено: {stats['dropped_queue_full']}\n"
+        for name, count in stats['dropped_sampling'].items():
+            levels_text += f"• {name}: отфильтровано {count}\n"
+        levels_text += "\nИспользование: /admin_loglevel модуль УРОВЕНЬ"
+        
+        self.bot.send_message(chat_id, levels_text)
+    
+    def handle_queries_command(self, chat_id, text):
+        """Самые дорогие SQL-запросы: /admin_queries [N | calls | p99 | reset]"""
+        from query_profiler import profiler
+        
+        parts = text.split()
+        if len(parts) == 2 and parts[1] == 'reset':
+            profiler.reset()
+            self.bot.send_message(chat_id, "✅ Статистика запросов сброшена")
+            return
+        
+        # Больше top_n не выводится: длинный список не помещается в сообщения Telegram
+        limit = min(int(parts[1]), QUERY_PROFILER_CONFIG['top_n']) if len(parts) == 2 and parts[1].isdigit() else None
+        order = {'calls': 'calls', 'p99': 'p99_ms'}.get(parts[1] if len(parts) == 2 else '', 'total_ms')
+        
+        stats = profiler.get_stats()
+        queries_text = "🐢 <b>SQL-запросы</b>\n\n"
+        if not stats['enabled']:
+            queries_text += "Профилирование выключено (QUERY_PROFILER=false)"
+            self.bot.send_message(chat_id, queries_text)
+            return
+        
+        queries_text += (
+            f"С {stats['since']}: {stats['calls']} вызовов, {stats['total_ms'] / 1000:.1f} с, "
+            f"медленных {stats['slow']}, ошибок {stats['errors']}\n\n"
+        )
+        
+        blocks = [queries_text]
+        for i, query in enumerate(profiler.get_top(limit, order), 1):
+            site = query['sites'][0][0] if query['sites'] else '?'
+            block = (
+                f"{i}. <code>{query['id']}</code> {query['total_ms'] / 1000:.2f} с, {query['calls']} выз.\n"
+                f"p50/p95/p99: {query['p50_ms']:.1f}/{query['p95_ms']:.1f}/{query['p99_ms']:.1f} мс, "
+                f"строк ~{query['avg_rows'] if query['avg_rows'] is not None else '?'}\n"
+                f"📍 {escape(site[:200])}\n"
+            )
+            if query['errors']:
+                block += f"❌ Ошибок {query['errors']}: {escape(query['last_error'][:300])}\n"
+            block += f"<code>{escape(query['sql'][:160])}</code>\n\n"
+            blocks.append(block)
+        blocks.append("Использование: /admin_queries [N | calls | p99 | reset]")
+        
+        # Сообщения не длиннее лимита Telegram; запрос не разрывается между сообщениями
+        message = ''
+        for block in blocks:
+            if message and len(message) + len(block) > BOT_CONFIG['max_message_length']:
+                self.bot.send_message(chat_id, message)
+                message = ''
+            message += block
+        self.bot.send_message(chat_id, message)
+    
+    def handle_ship_command(self, chat_id):
+        """Отправка всех подтвержденных заказов одним пакетом через API службы доставки: /admin_ship"""
+        logistics = self.bot.logistics_manager
+        order_ids = [
+            row[0] for row in self.db.execute_query("SELECT id FROM orders WHERE status = 'confirmed' ORDER BY id") or []
+        ]
+        if not order_ids:
+            self.bot.send_message(chat_id, "🚚 Нет подтвержденных заказов к отправке")
+            return
+        
+        result = logistics.create_shipments_batch(order_ids, logistics.get_default_delivery_option())
+        
+        ship_text = "🚚 <b>Отправка заказов</b>\n\n"
+        ship_text += f"Создано отправлений: {len(result['created'])}\n"
+        ship_text += f"С ошибкой: {len(result['failed'])}\n"
+        ship_text += f"Пропущено (не оплачены или уже отправлены): {len(result['skipped'])}\n"
+        for order_id, error in list(result['failed'].items())[:20]:
+            ship_text += f"• #{order_id}: {escape(str(error))}\n"
+        
+        self.bot.send_message(chat_id, ship_text)
+    
+    def get_reports_db(self):
+        """База для отчетов: снимок только для чтения, если бот его ведет"""
+        snapshot = getattr(self.bot, 'analytics_snapshot', None)
+        return snapshot.db if snapshot else self.db
+    
+    def format_report_freshness(self):
+        snapshot = getattr(self.bot, 'analytics_snapshot', None)
+        return f"\n{snapshot.format_freshness()}" if snapshot else ''
+    
     def show_admin_panel(self, chat_id):
         """Показ главной админ-панели"""
         try:
@@ -211,6 +342,17 @@ class AdminHandler:
             
             self.bot.send_message(chat_id, security_text, create_admin_keyboard())
             
+            # Черный список антиспама: блокировки с кнопками снятия
+            spam_filter = getattr(self.bot, 'spam_filter', None)
+            blacklist = spam_filter.get_blacklist() if spam_filter else []
+            if blacklist:
+                blacklist_text = f"🚫 <b>Черный список антиспама:</b> {len(blacklist)}\n\n"
+                keyboard = []
+                for user_id, until in blacklist[:20]:
+                    blacklist_text += f"• {user_id} до {datetime.fromtimestamp(until).strftime('%d.%m %H:%M')}\n"
+                    keyboard.append([{'text': f"✅ Разблокировать {user_id}", 'callback_data': f"unblock_user_{user_id}"}])
+                self.bot.send_message(chat_id, blacklist_text, {'inline_keyboard': keyboard})
+            
         except Exception as e:
             logger.error(f"Ошибка панели безопасности: {e}")
             self.bot.send_message(chat_id, "❌ Ошибка получения данных безопасности")
@@ -219,7 +361,7 @@ class AdminHandler:
         """Финансовые отчеты"""
         try:
             # Получаем финансовую статистику за месяц
-            month_revenue = self.db.execute_query('''
+            month_revenue = self.get_reports_db().execute_query('''
                 SELECT 
                     COUNT(*) as orders_count,
                     SUM(total_amount) as total_revenue,
@@ -235,8 +377,10 @@ class AdminHandler:
             financial_text += f"💰 Выручка: {format_price(month_revenue[1] or 0)}\n"
             financial_text += f"💳 Средний чек: {format_price(month_revenue[2] or 0)}\n\n"
             financial_text += f"📋 Подробные отчеты в веб-панели"
+            financial_text += self.format_report_freshness()
             
             self.bot.send_message(chat_id, financial_text, create_admin_keyboard())
+            self.bot.send_message(chat_id, "📥 <b>Выгрузка данных:</b>", self.create_export_keyboard('finance'))
             
         except Exception as e:
             logger.error(f"Ошибка финансовых отчетов: {e}")
@@ -268,6 +412,7 @@ class AdminHandler:
                 inventory_text += f"✅ Склад в порядке"
             
             self.bot.send_message(chat_id, inventory_text, create_admin_keyboard())
+            self.bot.send_message(chat_id, "📥 <b>Выгрузка данных:</b>", self.create_export_keyboard('inventory'))
             
         except Exception as e:
             logger.error(f"Ошибка управления складом: {e}")
@@ -300,7 +445,7 @@ class AdminHandler:
         try:
             # Получаем сегментацию клиентов
             from crm import CRMManager
-            crm = CRMManager(self.db)
+            crm = CRMManager(self.db, self.get_reports_db())
             segments = crm.segment_customers()
             
             crm_text = f"👥 <b>CRM - Управление клиентами</b>\n\n"
@@ -311,6 +456,7 @@ class AdminHandler:
             crm_text += f"⚠️ Требуют внимания: {len(segments.get('need_attention', []))}\n"
             crm_text += f"🚨 В зоне риска: {len(segments.get('at_risk', []))}\n\n"
             crm_text += f"📊 Подробная аналитика в веб-панели"
+            crm_text += self.format_report_freshness()
             
             self.bot.send_message(chat_id, crm_text, create_admin_keyboard())
             
@@ -367,6 +513,114 @@ class AdminHandler:
         elif data.startswith('order_details_'):
             self.handle_order_details(callback_query)
     
+    def create_export_keyboard(self, source):
+        """Кнопки выгрузки отчетов в CSV и NDJSON"""
+        keyboard = []
+        for report_type, title in EXPORT_REPORTS[source].items():
+            keyboard.append([
+                {'text': f"{title} CSV", 'callback_data': f"export_{source}_{report_type}_csv"},
+                {'text': 'NDJSON', 'callback_data': f"export_{source}_{report_type}_ndjson"}
+            ])
+        return {'inline_keyboard': keyboard}
+    
+    def handle_security_callback(self, callback_query):
+        """Снятие блокировки антиспама: unblock_user_<telegram_id>"""
+        data = callback_query['data']
+        chat_id = callback_query['message']['chat']['id']
+        telegram_id = callback_query['from']['id']
+        
+        if not self.is_admin(telegram_id):
+            return
+        
+        if data.startswith('unblock_user_'):
+            try:
+                user_id = int(data[len('unblock_user_'):])
+            except ValueError:
+                return
+            
+            spam_filter = getattr(self.bot, 'spam_filter', None)
+            security_manager = getattr(self.bot, 'security_manager', None)
+            removed = spam_filter.remove_from_blacklist(user_id) if spam_filter else False
+            if security_manager:
+                security_manager.blocked_users.discard(user_id)
+                security_manager.log_security_event(user_id, 'spam_unblocked', {'admin': telegram_id})
+            
+            if removed:
+                self.bot.send_message(chat_id, f"✅ Пользователь {user_id} разблокирован")
+            else:
+                self.bot.send_message(chat_id, f"ℹ️ Пользователь {user_id} не был заблокирован")
+        elif data.startswith('security_'):
+            self.show_security_panel(chat_id)
+    
+    def handle_export_callback(self, callback_query):
+        """Запуск выгрузки в фоне: export_<источник>_<отчет>_<формат>"""
+        data = callback_query['data']
+        chat_id = callback_query['message']['chat']['id']
+        telegram_id = callback_query['from']['id']
+        
+        if not self.is_admin(telegram_id):
+            return
+        
+        try:
+            body, fmt = data[len('export_'):].rsplit('_', 1)
+            source, report_type = body.split('_', 1)
+        except ValueError:
+            return
+        
+        if report_type not in EXPORT_REPORTS.get(source, {}) or fmt not in ('csv', 'ndjson'):
+            self.bot.send_message(chat_id, "❌ Неизвестный тип выгрузки")
+            return
+        
+        # Выгрузка может занять минуты - не блокируем цикл обновлений
+        threading.Thread(
+            target=self.run_export, args=(chat_id, source, report_type, fmt), daemon=True
+        ).start()
+    
+    def run_export(self, chat_id, source, report_type, fmt):
+        """Выгрузка во временный файл с прогрессом и отправка администратору"""
+        title = EXPORT_REPORTS[source][report_type]
+        status = self.bot.send_message(chat_id, f"⏳ Готовлю выгрузку «{title}»...")
+        message_id = status['result']['message_id'] if status and status.get('ok') else None
+        last_update = [0]
+        
+        def report_progress(rows, finished):
+            now = time.time()
+            if message_id and not finished and now - last_update[0] >= 3:
+                last_update[0] = now
+                self.bot.edit_message_text(chat_id, message_id, f"⏳ «{title}»: выгружено строк {rows}")
+        
+        result = None
+        try:
+            if source == 'inventory' and getattr(self.bot, 'inventory_manager', None):
+                result = self.bot.inventory_manager.export_inventory_file(report_type, fmt, report_progress)
+            elif source == 'finance' and getattr(self.bot, 'financial_reports', None):
+                end_date = datetime.now().strftime('%Y-%m-%d')
+                result = self.bot.financial_reports.export_financial_file(
+                    report_type, '1970-01-01', end_date, fmt, report_progress
+                )
+            else:
+                self.bot.send_message(chat_id, "❌ Модуль отчетов недоступен")
+                return
+            
+            if message_id:
+                self.bot.edit_message_text(chat_id, message_id, f"✅ «{title}»: {result['rows']} строк")
+            
+            if result['size'] > TELEGRAM_DOCUMENT_LIMIT:
+                self.bot.send_message(
+                    chat_id,
+                    f"⚠️ Файл {result['size'] // (1024 * 1024)} МБ больше лимита Telegram, скачайте его в веб-панели"
+                )
+                return
+            
+            caption = f"📥 {title}\n📄 Строк: {result['rows']}"
+            self.bot.send_document(chat_id, result['path'], result['filename'], caption)
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки {source}/{report_type}: {e}")
+            self.bot.send_message(chat_id, "❌ Ошибка выгрузки данных")
+        finally:
+            if result and os.path.exists(result['path']):
+                os.remove(result['path'])
+    
     def handle_admin_callback(self, callback_query):
         """Обработка админ callback'ов"""
         data = callback_query['data']
@@ -409,7 +663,7 @@ class AdminHandler:
             else:
                 return
             
-            stats = self.db.execute_query('''
+            stats = self.get_reports_db().execute_query('''
                 SELECT 
                     COUNT(*) as orders,
                     SUM(total_amount) as revenue,
@@ -425,6 +679,7 @@ class AdminHandler:
             analytics_text += f"💳 Средний чек: {format_price(stats[2] or 0)}\n"
             analytics_text += f"👥 Клиентов: {stats[3]}\n\n"
             analytics_text += f"📈 Подробная аналитика в веб-панели"
+            analytics_text += self.format_report_freshness()
             
             self.bot.send_message(chat_id, analytics_text, create_admin_keyboard())
             
@@ -512,14 +767,26 @@ class AdminHandler:
             order_id = int(parts[2])
             new_status = parts[3]
             
-            # Обновляем статус
-            result = self.db.update_order_status(order_id, new_status)
-            
-            if result is not None:
+            # Отмена - общим путем бота: резерв, промокоды, заявки флеш-распродажи и уведомление клиента
+            if new_status == 'cancelled':
+                result = self.bot.cancel_order(order_id)
+            elif new_status == 'shipped':
+                # Отправка - через API службы доставки: отправление, статус и уведомление клиента
+                logistics = self.bot.logistics_manager
+                shipping = logistics.create_shipments_batch([order_id], logistics.get_default_delivery_option())
+                if not shipping['created']:
+                    error = shipping['failed'].get(order_id, 'заказ не подтвержден, не оплачен или уже отправлен')
+                    self.bot.send_message(chat_id, f"❌ Заказ #{order_id} не отправлен: {escape(str(error))}")
+                    return
+                result = len(shipping['created'])
+            else:
+                result = self.db.update_order_status(order_id, new_status)
+                
                 # Уведомляем клиента
-                if self.notification_manager:
+                if result is not None and self.notification_manager:
                     self.notification_manager.send_order_status_notification(order_id, new_status)
-                
+            
+            if result is not None:
                 status_names = {
                     'confirmed': 'подтвержден',
                     'shipped': 'отправлен',
@@ -1,5 +1,5 @@
 
-"""Аналитика: сводные метрики, топы, временные ряды."""
+"""Аналитика: сводные метрики, топы, временные ряды. db - обычно снимок для отчетов (AnalyticsSnapshot.db)."""
 from datetime import datetime
 
 def get_sales_report(db, start_date, end_date):
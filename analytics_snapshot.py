@@ -0,0 +1,251 @@
+"""
+Снимок базы для отчетов: копия только для чтения, обновляемая через online backup API
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote
+from config import ANALYTICS_SNAPSHOT_CONFIG
+from database import DatabaseManager
+from query_profiler import profiler, ProfiledConnection
+
+def connect_readonly(path, factory=sqlite3.Connection, immutable=True):
+    """Соединение только для чтения; файл снимка не меняется на месте (immutable), поэтому блокировки не нужны"""
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro" + ('&immutable=1' if immutable else '')
+    return sqlite3.connect(uri, uri=True, timeout=30, factory=factory)
+
+class SnapshotDatabase(DatabaseManager):
+    """DatabaseManager поверх снимка: те же методы чтения, запись отклоняется"""
+    def __init__(self, snapshot):
+        # Схема не создается: файл снимка целиком копируется из основной базы
+        self.snapshot = snapshot
+
+    @property
+    def db_path(self):
+        return self.snapshot.get_path() or self.snapshot.source.db_path
+
+    def connect(self, factory=sqlite3.Connection):
+        """Соединение со снимком; пока снимка нет - с основной базой только для чтения (WAL: запись не ждет)"""
+        path = self.snapshot.get_path()
+        if path:
+            return connect_readonly(path, factory)
+        return connect_readonly(self.snapshot.source.db_path, factory, immutable=False)
+
+    def execute_query(self, query, params=None):
+        """Выполнение SELECT на снимке -> list[tuple]; запрос на запись - ошибка, None"""
+        started = time.perf_counter()
+        result = None
+        error = None
+        try:
+            conn = self.connect()
+            result = conn.execute(query, params or ()).fetchall()
+            return result
+        except Exception as e:
+            error = e
+            logging.info(f"Ошибка выполнения запроса к снимку: {e}")
+            return None
+        finally:
+            if 'conn' in locals():
+                conn.close()
+            profiler.record(self.snapshot.path, query, params, time.perf_counter() - started,
+                            len(result) if result is not None else None, error)
+
+    @contextmanager
+    def transaction(self):
+        """Согласованное чтение нескольких запросов: снимок не меняется, пока соединение открыто"""
+        conn = self.connect(factory=ProfiledConnection)
+        conn.db_path = self.snapshot.path
+        try:
+            # Для основной базы (снимка еще нет) - одна транзакция чтения на все запросы
+            conn.execute('BEGIN')
+            yield conn
+        finally:
+            conn.close()
+
+    def iterate_query(self, query, params=None, chunk_size=1000):
+        """Построчная выборка со снимка порциями по chunk_size"""
+        conn = self.connect()
+        elapsed = 0
+        count = 0
+        error = None
+        try:
+            started = time.perf_counter()
+            cursor = conn.execute(query, params or ())
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                elapsed += time.perf_counter() - started
+                if not rows:
+                    break
+                count += len(rows)
+                yield from rows
+                started = time.perf_counter()
+        except Exception as e:
+            error = e
+            logging.info(f"Ошибка построчной выборки со снимка: {e}")
+            raise
+        finally:
+            conn.close()
+            profiler.record(self.snapshot.path, query, params, elapsed, count, error)
+
+class AnalyticsSnapshot:
+    def __init__(self, db):
+        self.source = db
+        self.path = os.path.join(
+            os.path.dirname(os.path.abspath(db.db_path)),
+            os.path.splitext(os.path.basename(db.db_path))[0] + ANALYTICS_SNAPSHOT_CONFIG['file_suffix'] + '.db'
+        )
+        self.db = SnapshotDatabase(self)
+        self.meta = None
+        self.refresh_lock = threading.Lock()
+        self.metrics = {'refreshes': 0, 'failures': 0, 'on_demand': 0}
+        self.stop_event = threading.Event()
+        self.scheduler_thread = None
+
+    def refresh(self):
+        """Новый снимок во временный файл и атомарная подмена; начатые отчеты дочитывают прежний файл"""
+        with self.refresh_lock:
+            return self.take_snapshot()
+
+    def request_refresh(self):
+        """Обновление в отдельном потоке, если оно еще не идет; вызывающий не ждет копирования"""
+        if not self.refresh_lock.acquire(blocking=False):
+            return False
+        self.metrics['on_demand'] += 1
+
+        def refresh_worker():
+            try:
+                self.take_snapshot()
+            except Exception as e:
+                logging.info(f"Ошибка обновления снимка для отчетов: {e}")
+            finally:
+                self.refresh_lock.release()
+
+        threading.Thread(target=refresh_worker, daemon=True).start()
+        return True
+
+    def take_snapshot(self):
+        """Копирование базы в снимок; вызывается под refresh_lock"""
+        started = time.time()
+        taken_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        source = sqlite3.connect(self.source.db_path, timeout=30)
+        target = sqlite3.connect(tmp_path)
+        try:
+            # Основная база в режиме WAL: копия одним шагом (backup_pages = -1) согласована и не блокирует
+            # запись; пошаговая копия перезапускается при каждой записи в базу
+            source.backup(
+                target,
+                pages=ANALYTICS_SNAPSHOT_CONFIG['backup_pages'],
+                sleep=ANALYTICS_SNAPSHOT_CONFIG['backup_sleep']
+            )
+            duration = round(time.time() - started, 3)
+            # Снимок открывается с immutable=1: журнал WAL ему не нужен
+            target.execute('PRAGMA journal_mode = DELETE')
+            target.execute('DROP TABLE IF EXISTS snapshot_meta')
+            target.execute('CREATE TABLE snapshot_meta (taken_at TEXT, duration REAL, source_size INTEGER)')
+            target.execute(
+                'INSERT INTO snapshot_meta (taken_at, duration, source_size) VALUES (?, ?, ?)',
+                (taken_at, duration, os.path.getsize(self.source.db_path))
+            )
+            target.commit()
+            target.close()
+            os.replace(tmp_path, self.path)
+        except Exception:
+            target.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.metrics['failures'] += 1
+            raise
+        finally:
+            source.close()
+
+        self.metrics['refreshes'] += 1
+        return self.load_meta()
+
+    def load_meta(self):
+        """Метаданные снимка из файла: снимок мог обновить другой процесс (бот или веб-панель)"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        if self.meta and self.meta['mtime'] == mtime:
+            return self.meta
+
+        try:
+            conn = connect_readonly(self.path)
+            try:
+                taken_at, duration, source_size = conn.execute(
+                    'SELECT taken_at, duration, source_size FROM snapshot_meta'
+                ).fetchone()
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.info(f"Ошибка чтения метаданных снимка: {e}")
+            return None
+
+        self.meta = {'taken_at': taken_at, 'duration': duration, 'source_size': source_size, 'mtime': mtime}
+        return self.meta
+
+    def get_age(self):
+        """Возраст снимка в секундах; None - снимка нет"""
+        meta = self.load_meta()
+        if not meta:
+            return None
+        return (datetime.now() - datetime.strptime(meta['taken_at'], '%Y-%m-%d %H:%M:%S')).total_seconds()
+
+    def get_path(self):
+        """Путь к снимку, None - снимка еще нет; отсутствующий или старше max_staleness снимок
+        обновляется в фоне, а отчет читает то, что есть
+        """
+        age = self.get_age()
+        if age is None or age > ANALYTICS_SNAPSHOT_CONFIG['max_staleness']:
+            self.request_refresh()
+        return self.path if age is not None else None
+
+    def get_freshness(self):
+        """Актуальность снимка для отчетов и панели"""
+        meta = self.load_meta()
+        if not meta:
+            return {'available': False, **self.metrics}
+
+        age = self.get_age()
+        return {
+            'available': True,
+            'taken_at': meta['taken_at'],
+            'age_seconds': int(age),
+            'stale': age > ANALYTICS_SNAPSHOT_CONFIG['max_staleness'],
+            'refresh_duration': meta['duration'],
+            'size': os.path.getsize(self.path),
+            **self.metrics
+        }
+
+    def format_freshness(self):
+        """Строка для отчетов: на какой момент данные"""
+        meta = self.load_meta()
+        return f"🕒 Данные на {meta['taken_at']}" if meta else ''
+
+    def start_scheduler(self):
+        """Фоновое обновление: первое сразу, далее раз в refresh_interval"""
+        if self.scheduler_thread and self.scheduler_thread.is_alive():
+            return
+
+        def snapshot_worker():
+            delay = 0
+            while not self.stop_event.wait(delay):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logging.info(f"Ошибка обновления снимка для отчетов: {e}")
+                delay = ANALYTICS_SNAPSHOT_CONFIG['refresh_interval']
+
+        self.stop_event.clear()
+        self.scheduler_thread = threading.Thread(target=snapshot_worker, daemon=True)
+        self.scheduler_thread.start()
+
+    def stop_scheduler(self):
+        self.stop_event.set()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк снимка для отчетов: задержка оформления заказов, пока тяжелые отчеты идут по основной базе и по снимку
+"""
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы логов, базы и снимка создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from datetime import datetime, timedelta
+from database import DatabaseManager
+from analytics_snapshot import AnalyticsSnapshot
+from crm import CRMManager
+from financial_reports import FinancialReportsManager
+from inventory_management import InventoryManager
+
+def seed_orders(db_path, users, orders, days):
+    """users покупателей и orders заказов по 1-3 позиции за последние days дней"""
+    now = datetime.now()
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        'INSERT INTO users (telegram_id, name) VALUES (?, ?)',
+        ((900000 + i, f'Покупатель {i}') for i in range(users))
+    )
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users WHERE telegram_id >= 900000')]
+    product_ids = [row[0] for row in conn.execute('SELECT id FROM products')]
+    conn.executemany(
+        "INSERT INTO orders (user_id, total_amount, status, payment_status, created_at) VALUES (?, ?, ?, 'paid', ?)",
+        ((
+            random.choice(user_ids), random.randint(10, 500), random.choice(['delivered', 'delivered', 'shipped', 'cancelled']),
+            (now - timedelta(seconds=random.randint(0, days * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+        ) for _ in range(orders))
+    )
+    conn.executemany(
+        'INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)',
+        ((order_id, random.choice(product_ids), random.randint(1, 3), random.randint(5, 200))
+         for (order_id,) in conn.execute('SELECT id FROM orders').fetchall()
+         for _ in range(random.randint(1, 3)))
+    )
+    conn.commit()
+    conn.close()
+    return user_ids, product_ids
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+def checkout(db, user_id, product_id):
+    """Запись как при оформлении: заказ, позиция и списание остатка одной транзакцией"""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with db.transaction() as conn:
+        order_id = conn.execute(
+            "INSERT INTO orders (user_id, total_amount, delivery_address, payment_method, created_at) VALUES (?, 100, 'Ташкент', 'cash', ?)",
+            (user_id, now)
+        ).lastrowid
+        conn.execute('INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, 1, 100)', (order_id, product_id))
+        conn.execute('UPDATE products SET stock = stock - 1 WHERE id = ?', (product_id,))
+
+def run_phase(db, reports_db, user_ids, product_ids, duration, snapshot=None, refresh_every=None):
+    """Оформление заказов, пока второй поток строит отчеты (reports_db=None - без отчетов).
+    Возвращает задержки записи и число построенных отчетов.
+    """
+    stop_event = threading.Event()
+    reports = {'count': 0}
+    financial = FinancialReportsManager(db, reports_db or db)
+    inventory = InventoryManager(db, reports_db or db)
+    crm = CRMManager(db, reports_db or db)
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    def reporter():
+        while not stop_event.is_set():
+            financial.generate_profit_loss_report('1970-01-01', today)
+            inventory.get_turnover_analysis(365)
+            crm.segment_customers()
+            reports['count'] += 1
+
+    def refresher():
+        while not stop_event.wait(refresh_every):
+            snapshot.refresh()
+
+    threads = [threading.Thread(target=reporter)] if reports_db else []
+    if snapshot and refresh_every:
+        threads.append(threading.Thread(target=refresher))
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        checkout(db, random.choice(user_ids), random.choice(product_ids))
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.005)
+
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    return latencies, reports['count']
+
+def run_benchmark(users=5000, orders=150000, days=365, duration=10, refresh_every=2):
+    random.seed(42)
+    db = DatabaseManager(os.path.join(os.getcwd(), 'bench.db'))
+    user_ids, product_ids = seed_orders(db.db_path, users, orders, days)
+    snapshot = AnalyticsSnapshot(db)
+    snapshot.refresh()
+
+    quiet, _ = run_phase(db, None, user_ids, product_ids, duration / 2)
+    live, live_reports = run_phase(db, db, user_ids, product_ids, duration)
+    snap, snap_reports = run_phase(db, snapshot.db, user_ids, product_ids, duration, snapshot, refresh_every)
+    freshness = snapshot.get_freshness()
+
+    logging.info(f"Заказов в базе: {orders}, покупателей {users}, база {os.path.getsize(db.db_path) / 1024 / 1024:.1f} МБ")
+    for name, latencies, count in (
+        ('Без отчетов', quiet, None),
+        ('Отчеты по основной базе', live, live_reports),
+        ('Отчеты по снимку', snap, snap_reports)
+    ):
+        logging.info(
+            f"{name}: оформление p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс, max {max(latencies) * 1000:.0f} мс, "
+            f"заказов {len(latencies)}" + (f", отчетов {count}" if count is not None else '')
+        )
+    logging.info(
+        f"Снимок: обновлений {freshness['refreshes']}, копия за {freshness['refresh_duration'] * 1000:.0f} мс, "
+        f"возраст {freshness['age_seconds']} с"
+    )
+
+    return {
+        'live_p99_ms': percentile(live, 0.99) * 1000,
+        'snapshot_p99_ms': percentile(snap, 0.99) * 1000,
+        'refresh_ms': freshness['refresh_duration'] * 1000
+    }
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк отправки заказов в службы доставки: пакетные запросы против запроса на заказ
+"""
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы логов и базы создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from config import CARRIER_CONFIG
+from database import DatabaseManager
+from logistics import LogisticsManager
+from carriers import CarrierDispatcher
+from fake_carrier import FakeCarrierServer
+
+def seed_orders(db_path, count):
+    """count подтвержденных заказов; у 1% нет адреса - служба их отклонит"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (telegram_id, name, phone) VALUES (999000, 'Покупатель', '+998900000000')")
+    user_id = conn.execute('SELECT id FROM users WHERE telegram_id = 999000').fetchone()[0]
+    conn.executemany('''
+        INSERT INTO orders (user_id, total_amount, delivery_address, payment_method, status)
+        VALUES (?, ?, ?, 'cash', 'confirmed')
+    ''', (
+        (user_id, random.randint(10, 500), '' if random.random() < 0.01 else f'Ташкент, ул. {i}')
+        for i in range(count)
+    ))
+    conn.commit()
+    order_ids = [row[0] for row in conn.execute("SELECT id FROM orders WHERE status = 'confirmed'")]
+    conn.close()
+    return order_ids
+
+def run_benchmark(orders=2000, legacy_orders=100, latency=0.05, failure_rate=0.05):
+    """Вечерняя отправка пакетами и прежний путь (запрос на заказ) на выборке с экстраполяцией"""
+    random.seed(42)
+    CARRIER_CONFIG['backoff'] = 0.05
+    db = DatabaseManager(os.path.join(os.getcwd(), 'bench.db'))
+    order_ids = seed_orders(db.db_path, orders + legacy_orders)
+    fake = FakeCarrierServer(latency=latency, failure_rate=failure_rate).start()
+
+    logistics = LogisticsManager(db)
+    carriers = {carrier: {**settings, 'base_url': fake.url(carrier)} for carrier, settings in CARRIER_CONFIG['carriers'].items()}
+    logistics.carrier_dispatcher = CarrierDispatcher(carriers)
+    delivery_option = {'id': 'standard', 'provider': 'dhl'}
+
+    started = time.perf_counter()
+    result = logistics.create_shipments_batch(order_ids[:orders], delivery_option)
+    batch_s = time.perf_counter() - started
+    stats = logistics.carrier_dispatcher.get_stats()['dhl']
+
+    # Прежний путь: один блокирующий запрос на заказ по одному соединению
+    max_connections = CARRIER_CONFIG['max_connections']
+    CARRIER_CONFIG['max_connections'] = 1
+    legacy = CarrierDispatcher({'dhl': {**carriers['dhl'], 'batch_size': 1}})
+    started = time.perf_counter()
+    for order_id in order_ids[orders:]:
+        legacy.create_shipments({'dhl': [{'order_id': order_id, 'address': 'Ташкент'}]})
+    legacy_s = time.perf_counter() - started
+    legacy_per_order = legacy_s / legacy_orders
+    CARRIER_CONFIG['max_connections'] = max_connections
+
+    shipments = db.execute_query('SELECT COUNT(*), COUNT(DISTINCT order_id) FROM shipments')[0]
+    shipped = db.execute_query("SELECT COUNT(*) FROM orders WHERE status = 'shipped'")[0][0]
+
+    logging.info(f"Заказов: {orders}, задержка службы {latency * 1000:.0f} мс, отказов {failure_rate:.0%}")
+    logging.info(
+        f"Пакетами: {batch_s:.2f} с, создано {len(result['created'])}, с ошибкой {len(result['failed'])}; "
+        f"запросов {stats['requests']}, соединений {stats['connections']}, повторов {stats['retries']}"
+    )
+    logging.info(
+        f"По заказу ({legacy_orders} заказов): {legacy_per_order * 1000:.1f} мс/заказ, "
+        f"оценка для {orders} заказов: {legacy_per_order * orders:.1f} с"
+    )
+    logging.info(
+        f"Отправлений в базе: {shipments[0]} (заказов {shipments[1]}), заказов 'shipped': {shipped}, "
+        f"повторно отданных службой пакетов: {fake.stats['replayed']}"
+    )
+
+    # Недоступная служба: после серии ошибок запросы больше не отправляются
+    fake.stop()
+    CARRIER_CONFIG['retries'] = 0
+    for order_id in order_ids[:20]:
+        logistics.carrier_dispatcher.create_shipments({'fedex': [{'order_id': order_id, 'address': 'Ташкент'}]})
+    breaker = logistics.carrier_dispatcher.get_stats()['fedex']
+    logging.info(
+        f"Служба недоступна: выключатель {breaker['breaker']}, отклонено без запроса {breaker['rejected']} из 20"
+    )
+
+    logistics.carrier_dispatcher.close()
+    legacy.close()
+
+    return {
+        'batch_s': batch_s,
+        'legacy_estimate_s': legacy_per_order * orders,
+        'created': len(result['created']),
+        'requests': stats['requests']
+    }
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
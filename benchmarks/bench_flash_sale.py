@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк флеш-распродажи: параллельные захваты токенов без перепродажи
+"""
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы логов и базы создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from database import DatabaseManager
+from inventory_management import InventoryManager
+from flash_sales import FlashSaleEngine
+
+def run_benchmark(threads=32, claims_per_thread=5000, units=500, users=20000, per_user_limit=2):
+    """Захваты, отказы и возвраты из многих потоков; проверка инвариантов после записи"""
+    db = DatabaseManager(os.path.join(os.getcwd(), 'bench.db'))
+    product_ids = [row[0] for row in db.execute_query('SELECT id FROM products WHERE is_active = 1 LIMIT 3')]
+    db.execute_query(
+        f"UPDATE products SET stock = ? WHERE id IN ({','.join('?' * len(product_ids))})",
+        (units * 2, *product_ids)
+    )
+
+    inventory = InventoryManager(db)
+    engine = FlashSaleEngine(db, inventory.stock_history, inventory.cost_ledger)
+    allocated = engine.start_sale(1, {product_id: units for product_id in product_ids}, per_user_limit)
+    results = {'claimed': 0, 'queued': 0, 'limit': 0, 'released': 0, 'confirmed': 0}
+    results_lock = threading.Lock()
+
+    def buyer(seed):
+        rng = random.Random(seed)
+        local = dict.fromkeys(results, 0)
+        for _ in range(claims_per_thread):
+            result = engine.claim(1, rng.choice(product_ids), rng.randint(1, users))
+            if result['status'] == 'claimed':
+                local['claimed'] += 1
+                # Часть покупателей бросает заявку - токен уходит очереди ожидания
+                if rng.random() < 0.3:
+                    engine.release(result['claim_id'])
+                    local['released'] += 1
+                elif engine.confirm(result['claim_id']):
+                    local['confirmed'] += 1
+            elif result['status'] in local:
+                local[result['status']] += 1
+        with results_lock:
+            for key, value in local.items():
+                results[key] += value
+
+    workers = [threading.Thread(target=buyer, args=(seed,)) for seed in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    duration = time.perf_counter() - started
+
+    stats = engine.get_sale_stats(1)
+    queue_confirmed = 0
+    for claim_id in list(engine.claims):
+        if engine.confirm(claim_id):
+            queue_confirmed += 1
+    engine.log_writer.flush()
+
+    total_attempts = threads * claims_per_thread
+    sold = sum(engine.get_sale_stats(1)['sold'].values())
+    persisted = db.execute_query(
+        "SELECT IFNULL(SUM(quantity), 0) FROM flash_sale_claims WHERE promo_code_id = 1 AND status = 'purchased'"
+    )[0][0]
+    over_limit = db.execute_query('''
+        SELECT COUNT(*) FROM (
+            SELECT user_id FROM flash_sale_claims
+            WHERE promo_code_id = 1 AND status = 'purchased'
+            GROUP BY user_id HAVING SUM(quantity) > ?
+        )
+    ''', (per_user_limit,))[0][0]
+
+    logging.info(f"Потоков: {threads}, попыток: {total_attempts}, выделено: {sum(allocated.values())} шт.")
+    logging.info(f"Время: {duration:.2f} с, {total_attempts / duration:,.0f} операций/с")
+    logging.info(
+        f"Захвачено {results['claimed']} (из очереди {stats['from_queue']}), возвращено {results['released']}, "
+        f"в очереди {results['queued']}, отказ по лимиту {results['limit']}"
+    )
+    logging.info(f"Продано: {sold} шт. (в базе {persisted}), выделено {sum(allocated.values())}")
+    logging.info(f"Превышений лимита на покупателя: {over_limit}")
+
+    oversold = sold > sum(allocated.values()) or persisted != sold
+    logging.info("Перепродажа: " + ("ОБНАРУЖЕНА" if oversold else "нет"))
+
+    result = engine.end_sale(1)
+    drift = inventory.stock_history.detect_drift()
+    logging.info(f"Возвращено на склад: {sum(result['returned'].values())} шт., расхождение журнала: {len(drift)}")
+
+    return {'ops_per_second': total_attempts / duration, 'oversold': oversold, 'over_limit': over_limit}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
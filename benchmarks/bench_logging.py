@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк накладных расходов логирования на вызывающем потоке
+"""
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы глобального логгера создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from logger import JsonFormatter, LazyQueueHandler, SamplingFilter
+
+def build_logger(name, handler):
+    """Изолированный логгер с одним обработчиком"""
+    bench_logger = logging.getLogger(name)
+    bench_logger.handlers.clear()
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    bench_logger.addHandler(handler)
+    return bench_logger
+
+def file_handler(filename):
+    """Файловый обработчик с JSON-форматом"""
+    handler = logging.handlers.RotatingFileHandler(filename, maxBytes=50 * 1024 * 1024, backupCount=1, encoding='utf-8')
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+def measure(bench_logger, count, level=logging.INFO):
+    """Средняя стоимость одного вызова в микросекундах"""
+    started = time.perf_counter()
+    for i in range(count):
+        bench_logger.log(level, "Сообщение от %s: %.50s", i, 'Подскажите, есть ли iPhone 14 в наличии?')
+    return (time.perf_counter() - started) / count * 1_000_000
+
+def run_benchmark(count=100000):
+    """Сравнение синхронной записи и очереди с фоновым потоком"""
+    sync_logger = build_logger('bench.sync', file_handler('sync.log'))
+    sync_us = measure(sync_logger, count)
+
+    log_queue = queue.Queue(maxsize=count)
+    listener = logging.handlers.QueueListener(log_queue, file_handler('async.log'))
+    listener.start()
+    async_logger = build_logger('bench.async', LazyQueueHandler(log_queue))
+    async_us = measure(async_logger, count)
+    drain_started = time.perf_counter()
+    listener.stop()
+    drain_s = time.perf_counter() - drain_started
+
+    sampled_handler = LazyQueueHandler(queue.Queue())
+    sampled_handler.addFilter(SamplingFilter({'bench.sampled': 0.1}, {'bench.sampled': 20}))
+    sampled_logger = build_logger('bench.sampled', sampled_handler)
+    sampled_us = measure(sampled_logger, count)
+
+    disabled_us = measure(async_logger, count, logging.DEBUG)
+
+    logging.info(f"Записей: {count}")
+    logging.info(f"Синхронный файл: {sync_us:.2f} мкс/вызов")
+    logging.info(f"Очередь + фоновый поток: {async_us:.2f} мкс/вызов (дозапись {drain_s:.2f} с)")
+    logging.info(f"С выборкой и лимитом: {sampled_us:.2f} мкс/вызов")
+    logging.info(f"Отключенный уровень: {disabled_us:.3f} мкс/вызов")
+
+    return {
+        'sync_us': sync_us,
+        'async_us': async_us,
+        'sampled_us': sampled_us,
+        'disabled_us': disabled_us
+    }
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
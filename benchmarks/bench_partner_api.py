@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк API для партнеров: синхронизация каталога несколькими маркетплейсами, кэш ответов, ETag и gzip
+"""
+import gzip
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы логов и базы создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from config import API_CONFIG
+from database import DatabaseManager
+from partner_api import APIManager
+
+def seed_catalog(db_path, products, partners):
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        'INSERT INTO products (name, description, price, category_id, brand, stock) VALUES (?, ?, ?, ?, ?, ?)',
+        ((f'Товар {i}', 'Описание товара ' * 8, random.randint(10, 900), 1 + i % 8, f'Бренд {i % 50}', 100)
+         for i in range(products))
+    )
+    conn.executemany(
+        'INSERT INTO api_keys (key_name, api_key) VALUES (?, ?)',
+        ((f'partner{i}', f'key-{i}') for i in range(partners))
+    )
+    conn.commit()
+    conn.close()
+
+def sync_catalog(api, api_key, etags, limit=200):
+    """Полный проход по страницам товаров; (запросов, байт, 304)"""
+    requests = transferred = not_modified = 0
+    after = 0
+    while True:
+        headers = {'Accept-Encoding': 'gzip'}
+        if (after, limit) in etags:
+            headers['If-None-Match'] = etags[(after, limit)][0]
+
+        response = api.handle('GET', 'products', api_key, {'after': str(after), 'limit': str(limit)}, headers=headers)
+        requests += 1
+        transferred += len(response['body'])
+        if response['status'] == 304:
+            not_modified += 1
+            next_cursor = etags[(after, limit)][1]
+        else:
+            body = response['body']
+            if response['headers'].get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            next_cursor = json.loads(body)['next_cursor']
+            etags[(after, limit)] = (response['headers']['ETag'], next_cursor)
+
+        if not next_cursor:
+            return requests, transferred, not_modified
+        after = int(next_cursor)
+
+def run_partners(api, partners, rounds):
+    """partners потоков, каждый синхронизирует каталог rounds раз"""
+    totals = {'requests': 0, 'bytes': 0, 'not_modified': 0}
+    lock = threading.Lock()
+
+    def partner(index):
+        etags = {}
+        for _ in range(rounds):
+            requests, transferred, not_modified = sync_catalog(api, f'key-{index}', etags)
+            with lock:
+                totals['requests'] += requests
+                totals['bytes'] += transferred
+                totals['not_modified'] += not_modified
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=partner, args=(i,)) for i in range(partners)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    totals['seconds'] = time.perf_counter() - started
+    return totals
+
+def run_benchmark(products=20000, partners=8, rounds=3):
+    random.seed(42)
+    db = DatabaseManager(os.path.join(os.getcwd(), 'bench.db'))
+    seed_catalog(db.db_path, products, partners)
+    API_CONFIG['rate_limit'] = API_CONFIG['rate_burst'] = 10 ** 6  # Лимит не мешает замеру
+
+    # Без кэша ответов и без ETag: каждая страница - выборка и полный ответ
+    API_CONFIG['products_cache_ttl'] = 0
+    uncached_api = APIManager(db)
+    uncached_api.json_response = lambda cached, headers: {'status': 200, 'headers': {'ETag': cached[0]}, 'body': cached[1]}
+    uncached = run_partners(uncached_api, partners, rounds)
+
+    API_CONFIG['products_cache_ttl'] = 60
+    api = APIManager(db)
+    cached = run_partners(api, partners, rounds)
+    stats = api.get_stats()
+
+    logging.info(f"Товаров: {products}, партнеров: {partners}, проходов по каталогу: {rounds}")
+    for name, result in (('Без кэша', uncached), ('Кэш + ETag + gzip', cached)):
+        logging.info(
+            f"{name}: {result['requests']} запросов за {result['seconds']:.2f} с "
+            f"({result['requests'] / result['seconds']:.0f} в секунду), передано {result['bytes'] / 1024 / 1024:.1f} МБ, "
+            f"304: {result['not_modified']}"
+        )
+    logging.info(f"Обращений к api_keys: {stats['key_lookups']}, ответов из кэша: {stats['cache_hits']}")
+    return {'uncached': uncached, 'cached': cached}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
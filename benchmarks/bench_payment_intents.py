@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк платежных намерений: ответ на нажатие "оплатить" при медленном шлюзе и двойные нажатия
+"""
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы логов и базы создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from database import DatabaseManager
+from payments import PaymentProcessor
+from payment_intents import PaymentIntentService
+from fake_payment_gateway import FakePaymentGateway
+
+def seed_orders(db_path, count):
+    """count неоплаченных заказов"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (telegram_id, name) VALUES (999000, 'Покупатель')")
+    user_id = conn.execute('SELECT id FROM users WHERE telegram_id = 999000').fetchone()[0]
+    conn.executemany(
+        "INSERT INTO orders (user_id, total_amount, delivery_address, payment_method) VALUES (?, ?, 'Ташкент', 'stripe')",
+        ((user_id, random.randint(10, 500)) for _ in range(count))
+    )
+    conn.commit()
+    order_ids = [row[0] for row in conn.execute('SELECT id FROM orders')]
+    conn.close()
+    return order_ids
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+def run_benchmark(orders=400, threads=32, latency=0.3, failure_rate=0.02, legacy_clicks=10):
+    """Прежний синхронный путь на выборке и намерения под параллельными двойными нажатиями"""
+    random.seed(42)
+    db = DatabaseManager(os.path.join(os.getcwd(), 'bench.db'))
+    order_ids = seed_orders(db.db_path, orders)
+    gateway = FakePaymentGateway(latency=latency, failure_rate=failure_rate).start()
+
+    processor = PaymentProcessor()
+    processor.providers['stripe'].base_url = gateway.url
+    user_data = {'telegram_id': 999000, 'name': 'Покупатель'}
+
+    # Прежний путь: ответ пользователю после ответа шлюза
+    legacy = []
+    for order_id in order_ids[:legacy_clicks]:
+        started = time.perf_counter()
+        processor.create_payment('stripe', 10.0, order_id, user_data)
+        legacy.append(time.perf_counter() - started)
+
+    service = PaymentIntentService(db, processor)
+    created_before = gateway.stats['created']
+    replies = []
+    ready = threading.Semaphore(0)
+    replies_lock = threading.Lock()
+
+    def buyer(chunk):
+        local = []
+        for order_id in chunk:
+            # Двойное нажатие: второй запрос не должен дойти до шлюза
+            for _ in range(2):
+                started = time.perf_counter()
+                service.request_payment(order_id, 'stripe', user_data, on_ready=lambda result: ready.release())
+                local.append(time.perf_counter() - started)
+        with replies_lock:
+            replies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=buyer, args=(order_ids[i::threads],)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    for _ in order_ids:
+        ready.acquire()
+    all_ready_s = time.perf_counter() - started
+
+    # Повторный запрос ссылки - из кэша
+    cached = []
+    for order_id in order_ids:
+        started = time.perf_counter()
+        service.request_payment(order_id, 'stripe', user_data)
+        cached.append(time.perf_counter() - started)
+
+    stats = service.get_stats()
+    statuses = dict(db.execute_query('SELECT status, COUNT(*) FROM payment_intents GROUP BY status'))
+
+    logging.info(f"Заказов: {orders}, задержка шлюза {latency * 1000:.0f} мс, отказов {failure_rate:.0%}")
+    logging.info(f"Прежний путь: ответ через {sum(legacy) / len(legacy) * 1000:.0f} мс")
+    logging.info(
+        f"Намерения: ответ p50 {percentile(replies, 0.5) * 1000:.2f} мс, p99 {percentile(replies, 0.99) * 1000:.2f} мс; "
+        f"все ссылки готовы за {all_ready_s:.2f} с"
+    )
+    logging.info(f"Из кэша: p50 {percentile(cached, 0.5) * 1000:.3f} мс")
+    logging.info(
+        f"Нажатий: {len(replies)}, отсеяно повторов {stats['deduplicated']}, запросов к шлюзу {stats['provider_calls']}, "
+        f"создано шлюзом {gateway.stats['created'] - created_before}, повторов с тем же ключом {gateway.stats['replayed']}"
+    )
+    logging.info(f"Намерения в базе: {statuses}")
+
+    gateway.stop()
+    return {
+        'legacy_ms': sum(legacy) / len(legacy) * 1000,
+        'reply_p99_ms': percentile(replies, 0.99) * 1000,
+        'duplicates_created': gateway.stats['created'] - created_before - orders
+    }
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк архивации: размер основной базы и скорость запросов к журналам до и после переноса в помесячные архивы
+"""
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы логов, базы и архива создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from datetime import datetime, timedelta
+from database import DatabaseManager
+from data_retention import RetentionManager
+
+def seed_logs(db_path, rows, days):
+    """rows строк в каждом журнале, равномерно за последние days дней (старые - с меньшими id)"""
+    now = datetime.now()
+    stamps = sorted(
+        (now - timedelta(seconds=random.randint(0, days * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+        for _ in range(rows)
+    )
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        'INSERT INTO security_logs (user_id, activity_type, details, severity, created_at) VALUES (?, ?, ?, ?, ?)',
+        ((random.randint(1, 5000), 'rate_limit_exceeded_search', 'Подробности события ' * 4, 'low', stamp) for stamp in stamps)
+    )
+    conn.executemany(
+        'INSERT INTO user_activity_logs (user_id, action, search_query, created_at) VALUES (?, ?, ?, ?)',
+        ((random.randint(1, 5000), 'search', f'запрос {random.randint(1, 10000)}', stamp) for stamp in stamps)
+    )
+    conn.executemany(
+        'INSERT INTO inventory_movements (product_id, movement_type, quantity_change, reason, created_at) VALUES (?, ?, ?, ?, ?)',
+        ((random.randint(1, 8), random.choice(['inbound', 'sale', 'adjustment']), random.randint(-5, 20), 'Движение', stamp)
+         for stamp in stamps)
+    )
+    conn.commit()
+    conn.close()
+
+def time_queries(db_path, repeats=5):
+    """Типичные выборки без индекса по времени: полный проход по журналу"""
+    conn = sqlite3.connect(db_path)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        conn.execute("SELECT COUNT(*) FROM security_logs WHERE severity = 'high'").fetchone()
+        conn.execute("SELECT strftime('%H', created_at), COUNT(*) FROM user_activity_logs WHERE user_id = 42 GROUP BY 1").fetchall()
+    conn.close()
+    return (time.perf_counter() - started) / repeats
+
+def run_benchmark(rows=200000, days=730):
+    random.seed(42)
+    db = DatabaseManager(os.path.join(os.getcwd(), 'bench.db'))
+    seed_logs(db.db_path, rows, days)
+    retention = RetentionManager(db)
+
+    size_before = os.path.getsize(db.db_path)
+    query_before = time_queries(db.db_path)
+    with retention.history(['inventory_movements']) as conn:
+        movements_before = conn.execute('SELECT COUNT(*) FROM inventory_movements_history').fetchone()[0]
+
+    started = time.perf_counter()
+    moved = retention.run()
+    run_s = time.perf_counter() - started
+
+    size_after = os.path.getsize(db.db_path)
+    query_after = time_queries(db.db_path)
+    with retention.history(['inventory_movements']) as conn:
+        movements_after = conn.execute('SELECT COUNT(*) FROM inventory_movements_history').fetchone()[0]
+    stats = retention.get_stats()
+
+    logging.info(f"Строк в каждом журнале: {rows} за {days} дней")
+    logging.info(f"Перенесено за {run_s:.2f} с: {moved}")
+    logging.info(
+        f"Основная база: {size_before / 1024 / 1024:.1f} МБ -> {size_after / 1024 / 1024:.1f} МБ, "
+        f"архивов: {stats['archive_files']} ({stats['archive_size'] / 1024 / 1024:.1f} МБ)"
+    )
+    logging.info(f"Запросы к журналам: {query_before * 1000:.1f} мс -> {query_after * 1000:.1f} мс")
+    logging.info(
+        f"История движений через представление inventory_movements_history: "
+        f"{movements_before} -> {movements_after}"
+    )
+    return {'size_before': size_before, 'size_after': size_after, 'moved': moved}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
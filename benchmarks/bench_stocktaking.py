@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк массовой инвентаризации: импорт CSV против поштучного подсчета
+"""
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы логов и базы создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from database import DatabaseManager
+from inventory_management import InventoryManager
+
+def seed_products(db_path, count):
+    """Каталог из count товаров со случайными остатками"""
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        'INSERT INTO products (name, price, stock, cost_price, is_active) VALUES (?, ?, ?, ?, 1)',
+        ((f'Товар {i}', 100.0, random.randint(0, 50), 60.0) for i in range(count))
+    )
+    conn.commit()
+    product_ids = [row[0] for row in conn.execute('SELECT id FROM products')]
+    conn.close()
+    return product_ids
+
+def write_scanner_export(filename, product_ids, lines):
+    """Выгрузка сканера: строка на сканирование, часть строк с количеством"""
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        f.write('product_id,quantity\n')
+        for _ in range(lines):
+            product_id = random.choice(product_ids)
+            if random.random() < 0.5:
+                f.write(f'{product_id}\n')
+            else:
+                f.write(f'{product_id},{random.randint(1, 5)}\n')
+
+def run_benchmark(products=20000, lines=100000, legacy_items=2000):
+    """Импорт файла целиком и поштучный путь на выборке с экстраполяцией"""
+    random.seed(42)
+    db = DatabaseManager(os.path.join(os.getcwd(), 'bench.db'))
+    product_ids = seed_products(db.db_path, products)
+    inventory = InventoryManager(db)
+
+    write_scanner_export('scan.csv', product_ids, lines)
+    report = inventory.import_stocktaking('scan.csv')
+
+    # Прежний путь: сессия, подсчет по товару, завершение
+    started = time.perf_counter()
+    session_id = inventory.create_stocktaking_session()
+    for product_id in product_ids[:legacy_items]:
+        inventory.update_stocktaking_count(session_id, product_id, random.randint(0, 50))
+    inventory.complete_stocktaking(session_id)
+    legacy_s = time.perf_counter() - started
+    legacy_per_line_ms = legacy_s / legacy_items * 1000
+
+    logging.info(f"Товаров: {products}, строк в файле: {lines}")
+    logging.info(
+        f"Импорт: {report['duration']:.2f} с, товаров посчитано {report['products_counted']}, "
+        f"расхождений {report['discrepancies_count']}"
+    )
+    logging.info(f"Импорт на строку: {report['duration'] / lines * 1_000_000:.1f} мкс")
+    logging.info(
+        f"Поштучно ({legacy_items} товаров): {legacy_s:.2f} с, {legacy_per_line_ms:.2f} мс/товар, "
+        f"оценка для {products} товаров: {legacy_per_line_ms * products / 1000:.0f} с"
+    )
+
+    drift = inventory.stock_history.detect_drift()
+    logging.info(f"Расхождение с журналом остатков: {len(drift)} товаров")
+
+    return {
+        'import_s': report['duration'],
+        'legacy_ms_per_item': legacy_per_line_ms,
+        'discrepancies': report['discrepancies_count']
+    }
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Сквозной бенчмарк сценариев бота на синтетической базе и имитации Telegram API:
+распределение задержек и пропускная способность сравниваются с сохраненным базовым замером
+"""
+import logging
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Пути из командной строки считаются от директории запуска
+LAUNCH_DIR = os.getcwd()
+sys.path.append(ROOT)
+
+from datetime import datetime
+from config import BENCHMARK_CONFIG, DATA_GENERATOR_CONFIG
+from data_generator import DataGenerator
+from fake_telegram import FakeTelegramAPI
+from query_profiler import profiler
+from logger import logger
+from main import TelegramShopBot
+from admin import EXPORT_REPORTS
+
+ADMIN_TELEGRAM_ID = 5720497431
+BROADCAST_TEXT = '🔥 Акция недели: Скидка 10% на все товары до воскресенья'
+ADDRESS = 'г. Ташкент, ул. Навои, д. 12, кв. 34'
+
+# Сравниваемые метрики: (имя, True - рост плохо, False - падение плохо, хвост распределения)
+CHECKED_METRICS = [('p50_ms', True, False), ('p95_ms', True, True), ('messages_per_second', False, False)]
+
+def message_update(telegram_id, text):
+    return {'message': {'chat': {'id': telegram_id}, 'from': {'id': telegram_id}, 'text': text}}
+
+def callback_update(telegram_id, data):
+    return {'callback_query': {
+        'id': str(telegram_id), 'data': data, 'from': {'id': telegram_id},
+        'message': {'message_id': 1, 'chat': {'id': telegram_id}}
+    }}
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+def prepare_database(path, scale, seed, source=None):
+    """Синтетическая база заданного масштаба или копия готовой базы (сценарии пишут в нее)"""
+    if source:
+        shutil.copyfile(source, path)
+        return
+    DataGenerator(path, scale, seed).generate()
+
+def load_fixtures(db_path, count, seed):
+    """Покупатели, популярные товары и поисковые запросы из базы"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    try:
+        users = conn.execute('''
+            SELECT u.id, u.telegram_id FROM users u
+            WHERE u.is_admin = 0 AND u.language = 'ru'
+            AND EXISTS (SELECT 1 FROM orders o WHERE o.user_id = u.id)
+            ORDER BY u.id
+        ''').fetchall()
+        products = conn.execute('''
+            SELECT p.id, p.name FROM products p
+            JOIN (SELECT product_id, SUM(quantity) AS sold FROM order_items GROUP BY product_id) s ON s.product_id = p.id
+            WHERE p.is_active = 1 AND p.stock > 0
+            ORDER BY s.sold DESC LIMIT 50
+        ''').fetchall()
+        categories = conn.execute(
+            "SELECT emoji || ' ' || name FROM categories WHERE is_active = 1 AND emoji IN ('📱', '👕', '🏠', '⚽', '💄', '📚')"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    rng.shuffle(users)
+    words = sorted({word for _, name in products for word in name.split()[:2]})
+    return {
+        'users': users[:count],
+        'products': products,
+        'categories': [row[0] for row in categories],
+        'queries': [rng.choice(words) for _ in range(count)]
+    }
+
+def measure_round(operations, fake, setup=None, warmup=None):
+    """Один последовательный прогон операций: задержки, SQL и сообщений в Telegram без учета разогрева"""
+    warmup = BENCHMARK_CONFIG['warmup'] if warmup is None else warmup
+    sample = {'latencies': [], 'queries': 0, 'messages': 0}
+    for index, operation in enumerate(operations):
+        if setup:
+            setup(index)
+        sql_before = profiler.get_stats()['calls']
+        sent_before = fake.stats['messages']
+        started = time.perf_counter()
+        operation()
+        elapsed = time.perf_counter() - started
+        if index < warmup:
+            continue
+        sample['latencies'].append(elapsed * 1000)
+        sample['queries'] += profiler.get_stats()['calls'] - sql_before
+        sample['messages'] += fake.stats['messages'] - sent_before
+    return sample
+
+def summarize(name, samples):
+    """Итог по раундам: p50/p95 лучшего раунда для сравнения, хвост и среднее по всем прогонам"""
+    samples = [sample for sample in samples if sample['latencies']]
+    if not samples:
+        return None
+    latencies = [latency for sample in samples for latency in sample['latencies']]
+    runs = len(latencies)
+    result = {
+        'runs': runs,
+        'rounds': len(samples),
+        # Фоновая нагрузка на машине только замедляет: минимум по раундам устойчивее среднего
+        'p50_ms': round(min(percentile(sample['latencies'], 0.5) for sample in samples), 3),
+        'p95_ms': round(min(percentile(sample['latencies'], 0.95) for sample in samples), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / runs, 3),
+        'max_ms': round(max(latencies), 3),
+        'ops_per_second': round(max(len(sample['latencies']) * 1000 / sum(sample['latencies']) for sample in samples), 2),
+        'queries_per_op': round(sum(sample['queries'] for sample in samples) / runs, 1),
+        'messages_per_op': round(sum(sample['messages'] for sample in samples) / runs, 1)
+    }
+    logging.info(
+        f"{name:<36} p50 {result['p50_ms']:>9.2f} мс  p95 {result['p95_ms']:>9.2f} мс  "
+        f"p99 {result['p99_ms']:>9.2f} мс  {result['ops_per_second']:>8.1f} оп/с  "
+        f"SQL {result['queries_per_op']:>5.1f}  сообщ. {result['messages_per_op']:>4.1f}"
+    )
+    return result
+
+def build_scenarios(bot, fixtures, iterations, report_iterations, broadcast_runs, broadcast_stats):
+    """Сценарии пользователя, рассылка, отчеты администратора, рекомендации и RFM: (имя, операции, подготовка)"""
+    users = fixtures['users']
+    products = fixtures['products']
+    categories = fixtures['categories']
+    queries = fixtures['queries']
+    # У каждого пользовательского сценария свои покупатели: частота сообщений не упирается в антиспам
+    groups = [users[offset::4] for offset in range(4)]
+    scenarios = []
+
+    def user_ops(group, flow):
+        return [lambda index=index: flow(group[index % len(group)], index) for index in range(iterations)]
+
+    def browse(user, index):
+        telegram_id = user[1]
+        bot.process_update(message_update(telegram_id, '🛍 Каталог'))
+        bot.process_update(message_update(telegram_id, categories[index % len(categories)]))
+        bot.process_update(message_update(telegram_id, f"🛍 {products[index % len(products)][1]}"))
+
+    def search(user, index):
+        bot.process_update(message_update(user[1], '🔍 Поиск'))
+        bot.process_update(message_update(user[1], queries[index % len(queries)]))
+        bot.message_handler.user_states.pop(user[1], None)
+
+    def add_to_cart(user, index):
+        bot.process_update(callback_update(user[1], f"add_to_cart_{products[index % len(products)][0]}"))
+
+    def fill_cart(index):
+        user_id = groups[3][index % len(groups[3])][0]
+        bot.db.clear_cart(user_id)
+        for offset in range(1 + index % 3):
+            bot.db.add_to_cart(user_id, products[(index + offset * 7) % len(products)][0], 1)
+
+    def checkout(user, index):
+        telegram_id = user[1]
+        bot.process_update(message_update(telegram_id, '📦 Оформить заказ'))
+        bot.process_update(message_update(telegram_id, ADDRESS))
+        bot.process_update(message_update(telegram_id, '💵 Наличными при получении'))
+
+    def broadcast():
+        success, errors = bot.notification_manager.send_promotional_broadcast(BROADCAST_TEXT, 'active')
+        broadcast_stats['recipients'] = success + errors
+
+    scenarios.append(('browse_catalog', user_ops(groups[0], browse), None))
+    scenarios.append(('search', user_ops(groups[1], search), None))
+    scenarios.append(('add_to_cart', user_ops(groups[2], add_to_cart), None))
+    scenarios.append(('checkout', user_ops(groups[3], checkout), fill_cart))
+    scenarios.append(('broadcast_active', [broadcast] * broadcast_runs, None))
+
+    admin_reports = {
+        'admin_panel': message_update(ADMIN_TELEGRAM_ID, '/admin'),
+        'admin_finance': message_update(ADMIN_TELEGRAM_ID, '💰 Финансы'),
+        'admin_inventory': message_update(ADMIN_TELEGRAM_ID, '📦 Склад'),
+        'admin_crm': message_update(ADMIN_TELEGRAM_ID, '👥 CRM'),
+        'admin_security': message_update(ADMIN_TELEGRAM_ID, '🛡 Безопасность'),
+        'admin_analytics_today': callback_update(ADMIN_TELEGRAM_ID, 'period_today'),
+        'admin_analytics_week': callback_update(ADMIN_TELEGRAM_ID, 'period_week'),
+        'admin_analytics_month': callback_update(ADMIN_TELEGRAM_ID, 'period_month')
+    }
+    for name, update in admin_reports.items():
+        scenarios.append((name, [lambda update=update: bot.process_update(update)] * report_iterations, None))
+
+    # Выгрузки в фоне запускает callback; здесь тот же run_export синхронно, чтобы замерить всю выгрузку
+    for source, reports in EXPORT_REPORTS.items():
+        for report_type in reports:
+            scenarios.append((f"export_{source}_{report_type}", [
+                lambda source=source, report_type=report_type:
+                    bot.admin_handler.run_export(ADMIN_TELEGRAM_ID, source, report_type, 'csv')
+            ] * report_iterations, None))
+
+    scenarios.append(('recommendations', [
+        lambda user=user: bot.ai_recommendations.get_personalized_recommendations(user[0])
+        for user in (users * iterations)[:iterations]
+    ], None))
+    scenarios.append(('rfm_segmentation', [bot.crm_manager.segment_customers] * report_iterations, None))
+    return scenarios
+
+def run_scenarios(bot, fake, fixtures, iterations, report_iterations, broadcast_runs, rounds):
+    """Раунды по всем сценариям по очереди: кратковременное замедление машины портит один раунд, а не сценарий"""
+    broadcast_stats = {'recipients': 0}
+    scenarios = build_scenarios(bot, fixtures, iterations, report_iterations, broadcast_runs, broadcast_stats)
+    samples = {name: [] for name, _, _ in scenarios}
+    for round_number in range(rounds):
+        started = time.time()
+        for name, operations, setup in scenarios:
+            # Рассылка - одна долгая операция, разогрев не нужен
+            warmup = 0 if name == 'broadcast_active' else None
+            samples[name].append(measure_round(operations, fake, setup, warmup))
+        logging.info(f"Раунд {round_number + 1}/{rounds}: {time.time() - started:.0f} с")
+
+    results = {}
+    for name, _, _ in scenarios:
+        result = summarize(name, samples[name])
+        if result:
+            results[name] = result
+    if 'broadcast_active' in results:
+        broadcast = results['broadcast_active']
+        broadcast['recipients'] = broadcast_stats['recipients']
+        broadcast['messages_per_second'] = round(broadcast_stats['recipients'] * 1000 / broadcast['p50_ms'], 1)
+    return results
+
+def get_cpu_model():
+    """Модель процессора: /proc/cpuinfo в Linux, иначе platform.processor()"""
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def get_environment():
+    """Окружение замера: базовый замер сравним только с прогоном на таком же железе"""
+    try:
+        memory_mb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        memory_mb = None
+    return {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_model': get_cpu_model(),
+        'cpu_count': os.cpu_count(),
+        'memory_mb': memory_mb
+    }
+
+def get_baseline_path(scale_name, baseline_dir=None):
+    return os.path.join(ROOT, baseline_dir or BENCHMARK_CONFIG['baseline_dir'], f"{scale_name}.json")
+
+def compare_with_baseline(report, baseline, threshold, tail_threshold, min_regression_ms):
+    """Регрессии: рост задержки больше порога и min_regression_ms или падение пропускной способности"""
+    regressions = []
+    for name, current in report['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if not base:
+            logging.info(f"{name}: нет в базовом замере")
+            continue
+        for metric, higher_is_worse, tail in CHECKED_METRICS:
+            if metric not in current or not base.get(metric):
+                continue
+            limit = tail_threshold if tail else threshold
+            change = (current[metric] - base[metric]) / base[metric]
+            if higher_is_worse:
+                regressed = change > limit and current[metric] - base[metric] > min_regression_ms
+            else:
+                regressed = change < -limit
+            if regressed:
+                regressions.append({
+                    'scenario': name, 'metric': metric, 'baseline': base[metric],
+                    'current': current[metric], 'change': round(change, 3)
+                })
+    return regressions
+
+def run_benchmark(scale_name=None, source_db=None, iterations=None, threshold=None, tail_threshold=None,
+                  baseline_path=None, save=False):
+    """Прогон сценариев, сохранение или сравнение с базовым замером. Возвращает отчет со списком регрессий"""
+    scale_name = scale_name or BENCHMARK_CONFIG['scale']
+    iterations = iterations or BENCHMARK_CONFIG['iterations']
+    threshold = BENCHMARK_CONFIG['regression_threshold'] if threshold is None else threshold
+    tail_threshold = BENCHMARK_CONFIG['tail_regression_threshold'] if tail_threshold is None else tail_threshold
+    baseline_path = baseline_path or get_baseline_path(scale_name)
+    scale = DATA_GENERATOR_CONFIG['scales'][scale_name]
+    seed = BENCHMARK_CONFIG['seed']
+    random.seed(seed)
+
+    db_path = os.path.join(os.getcwd(), 'shop_bot.db')
+    started = time.time()
+    prepare_database(db_path, scale, seed, source_db)
+    logging.info(f"База готова за {time.time() - started:.0f} с, {os.path.getsize(db_path) / 1024 / 1024:.0f} МБ")
+
+    fake = FakeTelegramAPI(latency=BENCHMARK_CONFIG['telegram_latency']).start()
+    try:
+        # Тот же бот, что в продакшене, без фоновых потоков, расписаний и сигналов
+        bot = TelegramShopBot('bench', db_path, fake.url, background=False)
+        fixtures = load_fixtures(db_path, iterations * 4, seed)
+        profiler.reset()
+        scenarios = run_scenarios(
+            bot, fake, fixtures, iterations, BENCHMARK_CONFIG['report_iterations'],
+            BENCHMARK_CONFIG['broadcast_runs'], BENCHMARK_CONFIG['rounds']
+        )
+    finally:
+        fake.stop()
+
+    logging.info("Самые затратные запросы за прогон:")
+    for stats in profiler.get_top(5):
+        logging.info(
+            f"  [{stats['id']}] {stats['total_ms'] / 1000:.1f} с, вызовов {stats['calls']}, "
+            f"p95 {stats['p95_ms']:.1f} мс, {stats['sites'][0][0] if stats['sites'] else '?'}: {stats['sql'][:100]}"
+        )
+
+    report = {
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'scale': scale_name,
+        'dataset': dict(scale, seed=seed, source=os.path.basename(source_db) if source_db else 'generated'),
+        'settings': {
+            'iterations': iterations,
+            'report_iterations': BENCHMARK_CONFIG['report_iterations'],
+            'broadcast_runs': BENCHMARK_CONFIG['broadcast_runs'],
+            'rounds': BENCHMARK_CONFIG['rounds'],
+            'telegram_latency': BENCHMARK_CONFIG['telegram_latency']
+        },
+        'environment': get_environment(),
+        'scenarios': scenarios,
+        'regressions': []
+    }
+
+    if save:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump({key: value for key, value in report.items() if key != 'regressions'}, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        logging.info(f"Базовый замер сохранен: {baseline_path}")
+        return report
+
+    if not os.path.exists(baseline_path):
+        logging.info(f"Базового замера нет ({baseline_path}), сохраните его флагом --save")
+        return report
+
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if any(baseline.get(key) != report[key] for key in ('dataset', 'settings', 'environment')):
+        logging.info("⚠️ Базовый замер сделан на другой базе, с другими настройками или в другом окружении, сравнение приблизительное")
+
+    report['regressions'] = compare_with_baseline(
+        report, baseline, threshold, tail_threshold, BENCHMARK_CONFIG['min_regression_ms']
+    )
+    for regression in report['regressions']:
+        logging.info(
+            f"❌ Регрессия {regression['scenario']}.{regression['metric']}: "
+            f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.0%})"
+        )
+    if not report['regressions']:
+        logging.info(
+            f"✅ Регрессий нет (порог p50 {threshold:.0%}, p95 {tail_threshold:.0%}, базовый замер {baseline.get('created_at')})"
+        )
+    return report
+
+def main():
+    # Импорт main уже настроил корневой логгер сообщениями о необязательных модулях
+    logging.basicConfig(level=logging.INFO, format='%(message)s', force=True)
+    # Медленные запросы собирает профилировщик, итог печатается в конце прогона
+    logging.getLogger('shop_bot.database.slow').setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser(description='Сквозной бенчмарк сценариев с проверкой регрессий')
+    parser.add_argument('--scale', default=BENCHMARK_CONFIG['scale'], choices=DATA_GENERATOR_CONFIG['scales'])
+    parser.add_argument('--db', help='готовая база data_generator.py (копируется, исходный файл не меняется)')
+    parser.add_argument('--iterations', type=int, default=BENCHMARK_CONFIG['iterations'])
+    parser.add_argument('--threshold', type=float, default=BENCHMARK_CONFIG['regression_threshold'])
+    parser.add_argument('--tail-threshold', type=float, default=BENCHMARK_CONFIG['tail_regression_threshold'])
+    parser.add_argument('--baseline', help='файл базового замера (по умолчанию baseline_dir/<масштаб>.json)')
+    parser.add_argument('--save', action='store_true', help='сохранить результат как базовый замер')
+    args = parser.parse_args()
+
+    # Логи, база, снимок и выгрузки создаются во временной директории
+    os.chdir(tempfile.mkdtemp())
+    logger.setup_logging()
+
+    report = run_benchmark(
+        args.scale, os.path.join(LAUNCH_DIR, args.db) if args.db else None, args.iterations,
+        args.threshold, args.tail_threshold, os.path.join(LAUNCH_DIR, args.baseline) if args.baseline else None, args.save
+    )
+    sys.exit(1 if report['regressions'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк входящих webhook'ов: время ответа провайдеру, повторы доставки и обработка ровно один раз
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Файлы логов и базы создаются во временной директории
+os.chdir(tempfile.mkdtemp())
+
+from database import DatabaseManager
+from webhooks import WebhookManager
+
+class SlowBot:
+    """Бот с задержкой Telegram API; считает уведомления по получателям"""
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.sent = {}
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        time.sleep(self.latency)
+        with self.lock:
+            self.sent[chat_id] = self.sent.get(chat_id, 0) + 1
+
+def seed_orders(db_path, count):
+    """count неоплаченных заказов разных покупателей с корзинами"""
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        'INSERT INTO users (telegram_id, name) VALUES (?, ?)',
+        ((800000 + i, f'Покупатель {i}') for i in range(count))
+    )
+    conn.execute('''
+        INSERT INTO orders (user_id, total_amount, delivery_address, payment_method)
+        SELECT id, 100, 'Ташкент', 'stripe' FROM users WHERE telegram_id BETWEEN 800000 AND 899999
+    ''')
+    conn.execute('INSERT INTO cart (user_id, product_id, quantity) SELECT id, 1, 1 FROM users WHERE telegram_id BETWEEN 800000 AND 899999')
+    conn.commit()
+    order_ids = [row[0] for row in conn.execute('SELECT id FROM orders ORDER BY id')]
+    conn.close()
+    return order_ids
+
+def stripe_event(order_id, attempt=0):
+    return json.dumps({
+        'id': f'evt_{order_id:08d}',
+        'type': 'payment_intent.succeeded',
+        'attempt': attempt,
+        'data': {'object': {'id': f'pi_{order_id:08d}', 'metadata': {'order_id': str(order_id)}}}
+    })
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+def run_benchmark(orders=600, threads=16, latency=0.05, redeliveries=1, legacy_events=40):
+    """Прежняя обработка в запросе на выборке и очередь под параллельными повторами доставки"""
+    random.seed(42)
+    db = DatabaseManager(os.path.join(os.getcwd(), 'bench.db'))
+    order_ids = seed_orders(db.db_path, orders)
+    bot = SlowBot(latency)
+    manager = WebhookManager(bot, db, None)
+
+    # Прежний путь: ответ провайдеру только после обработки и уведомления
+    legacy = []
+    for order_id in order_ids[:legacy_events]:
+        payload = stripe_event(order_id)
+        started = time.perf_counter()
+        manager.process_event('stripe', 'payment_intent.succeeded', json.loads(payload))
+        legacy.append(time.perf_counter() - started)
+
+    # Каждое событие доставляется 1 + redeliveries раз, повторы перемешаны с новыми
+    deliveries = [order_id for order_id in order_ids[legacy_events:] for _ in range(1 + redeliveries)]
+    random.shuffle(deliveries)
+    acks = []
+    acks_lock = threading.Lock()
+    duplicates = [0]
+
+    def provider(chunk):
+        local = []
+        local_duplicates = 0
+        for order_id in chunk:
+            started = time.perf_counter()
+            response = manager.handle_payment_webhook('stripe', stripe_event(order_id))
+            local.append(time.perf_counter() - started)
+            local_duplicates += bool(response.get('duplicate'))
+        with acks_lock:
+            acks.extend(local)
+            duplicates[0] += local_duplicates
+
+    started = time.perf_counter()
+    senders = [threading.Thread(target=provider, args=(deliveries[i::threads],)) for i in range(threads)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    received_s = time.perf_counter() - started
+    manager.inbox.wait_idle()
+    drained_s = time.perf_counter() - started
+
+    paid = db.execute_query("SELECT COUNT(*) FROM orders WHERE payment_status = 'paid'")[0][0]
+    carts = db.execute_query('SELECT COUNT(*) FROM cart')[0][0]
+    notified_twice = sum(1 for count in bot.sent.values() if count > 1)
+    stats = manager.inbox.get_stats()
+
+    logging.info(f"Заказов: {orders}, доставок webhook'ов: {len(deliveries)}, задержка Telegram {latency * 1000:.0f} мс")
+    logging.info(f"Прежний путь: ответ провайдеру через {sum(legacy) / len(legacy) * 1000:.1f} мс")
+    logging.info(
+        f"Очередь: ответ p50 {percentile(acks, 0.5) * 1000:.2f} мс, p99 {percentile(acks, 0.99) * 1000:.2f} мс; "
+        f"все приняты за {received_s:.2f} с, обработаны за {drained_s:.2f} с"
+    )
+    logging.info(f"Повторов отсеяно: {duplicates[0]}, события по статусам: {stats['by_status']}")
+    logging.info(
+        f"Оплачено заказов: {paid} из {orders}, уведомлений: {sum(bot.sent.values())}, "
+        f"повторных уведомлений: {notified_twice}, корзин осталось: {carts}"
+    )
+
+    manager.inbox.stop()
+    return {
+        'legacy_ms': sum(legacy) / len(legacy) * 1000,
+        'ack_p99_ms': percentile(acks, 0.99) * 1000,
+        'paid': paid,
+        'notifications': sum(bot.sent.values())
+    }
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark()
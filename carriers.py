@@ -0,0 +1,411 @@
+"""
+Асинхронные адаптеры служб доставки: пакетное создание отправлений, постоянные соединения,
+таймауты, повторы и отключение недоступной службы
+"""
+import logging
+import asyncio
+import hashlib
+import json
+import random
+import ssl
+import threading
+import time
+
+from urllib.parse import urlsplit
+from config import CARRIER_CONFIG
+
+class CarrierError(Exception):
+    """Ошибка запроса к службе доставки"""
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class CircuitBreaker:
+    """Отключение службы после серии ошибок и пробный запрос по истечении паузы"""
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Можно ли отправить запрос; в полуоткрытом состоянии - только один пробный"""
+        if self.opened_at is None:
+            return True
+        if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        # Неудачный пробный запрос снова отключает службу на полную паузу
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+class ConnectionPool:
+    """Постоянные HTTP/1.1 соединения (keep-alive) с одной службой"""
+    def __init__(self, base_url, max_connections, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.path_prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.idle = []  # Свободные (reader, writer)
+        self.stats = {'connections': 0, 'requests': 0}
+
+    async def request(self, method, path, payload, headers):
+        """JSON-запрос через свободное соединение; возвращает (статус, заголовки, тело)"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+        async with self.semaphore:
+            # Сервер мог закрыть простаивающее соединение - тогда одна попытка на новом
+            while True:
+                connection = self.idle.pop() if self.idle else None
+                reused = connection is not None
+                try:
+                    if connection is None:
+                        connection = await asyncio.wait_for(
+                            asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+                            self.timeout
+                        )
+                        self.stats['connections'] += 1
+
+                    status, response_headers, data = await asyncio.wait_for(
+                        self.exchange(connection, method, path, body, headers),
+                        self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.close_connection(connection)
+                    raise CarrierError(f"таймаут {self.timeout} с")
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    self.close_connection(connection)
+                    if reused:
+                        continue
+                    raise CarrierError(f"сетевая ошибка: {e}")
+                except (OSError, ValueError) as e:
+                    self.close_connection(connection)
+                    raise CarrierError(f"ошибка обмена: {e}")
+
+                self.stats['requests'] += 1
+                if response_headers.get('connection', '').lower() == 'close':
+                    self.close_connection(connection)
+                else:
+                    self.idle.append(connection)
+
+                return status, response_headers, data
+
+    async def exchange(self, connection, method, path, body, headers):
+        """Один обмен запрос-ответ по открытому соединению"""
+        reader, writer = connection
+        lines = [
+            f"{method} {self.path_prefix}{path} HTTP/1.1",
+            f"Host: {self.host}",
+            'Content-Type: application/json',
+            f"Content-Length: {len(body)}",
+            'Connection: keep-alive'
+        ]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('соединение закрыто сервером')
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in response_headers:
+            data = await reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b''.join(chunks)
+        else:
+            data = await reader.read()
+            response_headers['connection'] = 'close'
+
+        return status, response_headers, json.loads(data) if data else {}
+
+    def close_connection(self, connection):
+        if connection:
+            connection[1].close()
+
+    def close(self):
+        """Закрытие всех свободных соединений"""
+        while self.idle:
+            self.close_connection(self.idle.pop())
+
+class CarrierAdapter:
+    """Пакетное создание и отслеживание отправлений в одной службе с повторами и отключением"""
+    batch_path = '/shipments/batch'
+    tracking_path = '/tracking/batch'
+    status_map = {}  # Коды статусов службы -> статусы отправлений магазина
+
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = settings
+        self.batch_size = settings.get('batch_size', 50)
+        self.tracking_batch_size = settings.get('tracking_batch_size', 100)
+        self.pool = ConnectionPool(settings['base_url'], CARRIER_CONFIG['max_connections'], CARRIER_CONFIG['timeout'])
+        self.breaker = CircuitBreaker(CARRIER_CONFIG['breaker_failures'], CARRIER_CONFIG['breaker_reset'])
+        self.stats = {'batches': 0, 'retries': 0, 'created': 0, 'failed': 0, 'rejected': 0, 'tracked': 0}
+
+    def get_auth_headers(self):
+        return {'Authorization': f"Bearer {self.settings.get('api_key', '')}"}
+
+    def get_headers(self, orders):
+        """Авторизация и ключ идемпотентности: повтор пакета не создаст отправления дважды"""
+        key = hashlib.sha256(f"{self.name}:{','.join(str(order['order_id']) for order in orders)}".encode()).hexdigest()
+        return {**self.get_auth_headers(), 'Idempotency-Key': key}
+
+    def build_item(self, order):
+        """Заказ в формате службы"""
+        return {
+            'reference': str(order['order_id']),
+            'service': order.get('service', 'standard'),
+            'recipient': {
+                'name': order.get('name'),
+                'phone': order.get('phone'),
+                'address': order.get('address')
+            },
+            'parcel': {'items': order.get('items', 1), 'declared_value': order.get('total_amount', 0)}
+        }
+
+    def build_payload(self, orders):
+        return {'shipments': [self.build_item(order) for order in orders]}
+
+    def parse_response(self, orders, data):
+        """Результаты по заказам пакета; заказ без ответа считается неудачным"""
+        results = {}
+        for item in data.get('results', []):
+            results[int(item['reference'])] = {
+                'tracking_number': item.get('tracking_number'),
+                'label_url': item.get('label_url'),
+                'cost': item.get('cost'),
+                'estimated_delivery': item.get('estimated_delivery'),
+                'error': item.get('error') or (None if item.get('tracking_number') else 'нет трек-номера')
+            }
+
+        for order in orders:
+            results.setdefault(order['order_id'], {'error': 'нет в ответе службы'})
+        return results
+
+    async def call(self, path, payload, headers, count):
+        """Запрос с повторами и растущей паузой; при отключенной службе - отказ без запроса"""
+        for attempt in range(CARRIER_CONFIG['retries'] + 1):
+            if not self.breaker.allow():
+                self.stats['rejected'] += count
+                raise CarrierError(f"служба {self.name} временно отключена", retryable=False)
+
+            try:
+                status, response_headers, data = await self.pool.request('POST', path, payload, headers)
+                if status == 429 or status >= 500:
+                    raise CarrierError(f"HTTP {status}")
+                if status >= 400:
+                    raise CarrierError(f"HTTP {status}: {data.get('error', '')}", retryable=False)
+            except CarrierError as e:
+                # Ошибки в данных (4xx) не говорят о недоступности службы: служба ответила,
+                # пробный запрос полуоткрытого состояния завершен успешно
+                if e.retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if not e.retryable or attempt == CARRIER_CONFIG['retries']:
+                    raise
+            except Exception:
+                # Пробный запрос не должен остаться незавершенным
+                self.breaker.record_failure()
+                raise
+
+                self.stats['retries'] += 1
+                await asyncio.sleep(CARRIER_CONFIG['backoff'] * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+
+            self.breaker.record_success()
+            self.stats['batches'] += 1
+            return data
+
+    async def send_batch(self, orders):
+        """Один пакет заказов; ошибка запроса переходит на каждый заказ пакета"""
+        try:
+            data = await self.call(self.batch_path, self.build_payload(orders), self.get_headers(orders), len(orders))
+        except CarrierError as e:
+            logging.info(f"Ошибка создания отправлений {self.name}: {e}")
+            return {order['order_id']: {'error': str(e)} for order in orders}
+
+        return self.parse_response(orders, data)
+
+    async def create_shipments(self, orders):
+        """Все заказы службы пакетами параллельно (в пределах пула соединений)"""
+        batches = [orders[start:start + self.batch_size] for start in range(0, len(orders), self.batch_size)]
+        results = {}
+        for batch_results in await asyncio.gather(*(self.send_batch(batch) for batch in batches)):
+            results.update(batch_results)
+
+        for result in results.values():
+            self.stats['failed' if result.get('error') else 'created'] += 1
+        return results
+
+    def parse_tracking(self, tracking_numbers, data):
+        """События по трек-номерам в статусах магазина"""
+        results = {}
+        for item in data.get('results', []):
+            results[item['tracking_number']] = {
+                'events': [
+                    {
+                        'status': self.status_map.get(event['status'], event['status']),
+                        'description': event.get('description'),
+                        'location': event.get('location'),
+                        'timestamp': event['timestamp']
+                    }
+                    for event in item.get('events', [])
+                ],
+                'error': item.get('error')
+            }
+
+        for tracking_number in tracking_numbers:
+            results.setdefault(tracking_number, {'events': [], 'error': 'нет в ответе службы'})
+        return results
+
+    async def track_batch(self, tracking_numbers):
+        try:
+            data = await self.call(
+                self.tracking_path, {'tracking_numbers': tracking_numbers},
+                self.get_auth_headers(), len(tracking_numbers)
+            )
+        except CarrierError as e:
+            logging.info(f"Ошибка запроса статусов {self.name}: {e}")
+            return {tracking_number: {'events': [], 'error': str(e)} for tracking_number in tracking_numbers}
+
+        return self.parse_tracking(tracking_numbers, data)
+
+    async def track(self, tracking_numbers):
+        """Статусы отправлений службы пакетами параллельно"""
+        batches = [
+            tracking_numbers[start:start + self.tracking_batch_size]
+            for start in range(0, len(tracking_numbers), self.tracking_batch_size)
+        ]
+        results = {}
+        for batch_results in await asyncio.gather(*(self.track_batch(batch) for batch in batches)):
+            results.update(batch_results)
+
+        self.stats['tracked'] += len(tracking_numbers)
+        return results
+
+class DHLAdapter(CarrierAdapter):
+    def get_auth_headers(self):
+        return {'DHL-API-Key': self.settings.get('api_key', '')}
+
+class FedExAdapter(CarrierAdapter):
+    pass
+
+class UPSAdapter(CarrierAdapter):
+    pass
+
+class LocalCourierAdapter(CarrierAdapter):
+    pass
+
+class PostAdapter(CarrierAdapter):
+    pass
+
+CARRIER_ADAPTERS = {
+    'dhl': DHLAdapter,
+    'fedex': FedExAdapter,
+    'ups': UPSAdapter,
+    'local_courier': LocalCourierAdapter,
+    'post': PostAdapter
+}
+
+class CarrierDispatcher:
+    """Адаптеры служб в собственном цикле событий фонового потока: соединения живут между вызовами"""
+    def __init__(self, carriers=None):
+        self.carriers = carriers or CARRIER_CONFIG['carriers']
+        self.adapters = {}
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+
+    def get_adapter(self, carrier):
+        """Адаптер создается в цикле событий, которому принадлежат его соединения"""
+        if carrier not in self.adapters:
+            self.adapters[carrier] = CARRIER_ADAPTERS.get(carrier, CarrierAdapter)(carrier, self.carriers[carrier])
+        return self.adapters[carrier]
+
+    async def dispatch(self, operation, items_by_carrier):
+        """Операция адаптеров всех служб одновременно"""
+        carriers = [carrier for carrier in items_by_carrier if carrier in self.carriers]
+        results = {}
+        for carrier_results in await asyncio.gather(
+            *(getattr(self.get_adapter(carrier), operation)(items_by_carrier[carrier]) for carrier in carriers)
+        ):
+            results.update(carrier_results)
+        return results
+
+    def run(self, operation, items_by_carrier):
+        return asyncio.run_coroutine_threadsafe(self.dispatch(operation, items_by_carrier), self.loop).result()
+
+    def create_shipments(self, orders_by_carrier):
+        """Синхронный вход: {служба: [заказы]} -> {order_id: результат}"""
+        results = self.run('create_shipments', orders_by_carrier)
+        for carrier, orders in orders_by_carrier.items():
+            if carrier not in self.carriers:
+                results.update({order['order_id']: {'error': f"неизвестная служба {carrier}"} for order in orders})
+        return results
+
+    def track_shipments(self, tracking_by_carrier):
+        """Синхронный вход: {служба: [трек-номера]} -> {трек-номер: события}"""
+        results = self.run('track', tracking_by_carrier)
+        for carrier, tracking_numbers in tracking_by_carrier.items():
+            if carrier not in self.carriers:
+                results.update({
+                    tracking_number: {'events': [], 'error': f"неизвестная служба {carrier}"}
+                    for tracking_number in tracking_numbers
+                })
+        return results
+
+    def has_carrier(self, carrier):
+        return carrier in self.carriers
+
+    def get_stats(self):
+        return {
+            carrier: {**adapter.stats, **adapter.pool.stats, 'breaker': adapter.breaker.state}
+            for carrier, adapter in self.adapters.items()
+        }
+
+    def close(self):
+        """Закрытие соединений и остановка цикла событий"""
+        for adapter in self.adapters.values():
+            self.loop.call_soon_threadsafe(adapter.pool.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join(timeout=5)
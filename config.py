@@ -23,12 +23,313 @@ SECURITY_CONFIG = {
     'encryption_key': os.getenv('ENCRYPTION_KEY', 'your-encryption-key')
 }
 
+# Настройки антиспам-фильтра
+SPAM_FILTER_CONFIG = {
+    'window_seconds': 10,  # Окно для подсчета частоты сообщений
+    'max_messages_per_window': 8,
+    'history_size': 20,  # Сообщений в истории пользователя
+    'max_tracked_users': 50000,  # Ограничение памяти на историю
+    'duplicate_min_length': 20,  # Короче - кнопки меню, дубли не считаем
+    'spam_decay_seconds': 3600,  # Спам-сообщения старше не учитываются для черного списка
+    'blacklist_hours': 24  # Срок попадания в черный список
+}
+
+# Настройки фоновой записи журналов в базу
+LOG_WRITER_CONFIG = {
+    'batch_size': 500,  # Строк в одной транзакции
+    'flush_interval': 1.0,  # Секунд до принудительной записи пакета
+    'max_queue_size': 20000,
+    'put_timeout': 2.0  # Ожидание при переполненной очереди
+}
+
+# Настройки учета себестоимости
+COST_LEDGER_CONFIG = {
+    'cogs_method': 'fifo'  # fifo, lifo или average - метод себестоимости в P&L
+}
+
+# Настройки автопополнения
+REORDER_CONFIG = {
+    'rules_reload_interval': 60,  # Секунд между перечитыванием правил из базы
+    'open_po_statuses': ('pending', 'sent'),  # Заказ поставщику еще не получен
+    'safety_scan_hours': 6  # Полная проверка остатков на случай пропущенных событий
+}
+
+# Настройки резервов товара под заказы
+RESERVATION_CONFIG = {
+    'ttl_minutes': {  # Срок резерва до оплаты по способу оплаты
+        'online': 30,
+        'payme': 30,
+        'click': 30,
+        'stripe': 30,
+        'paypal': 30,
+        'zoodpay': 30,
+        'cash': 24 * 60
+    },
+    'default_ttl_minutes': 24 * 60,
+    'sweep_interval': 60,  # Секунд между снятием просроченных резервов
+    'batch_size': 500  # Резервов в одной транзакции
+}
+
+# Настройки промокодов
+PROMO_CONFIG = {
+    'cache_ttl': 300,  # Секунд до перечитывания действующих промокодов из базы
+    'max_cached_users': 50000  # Пользователей с набором использованных промокодов в памяти
+}
+
+# Настройки флеш-распродаж
+FLASH_SALE_CONFIG = {
+    'per_user_limit': 1,  # Единиц товара на покупателя
+    'hold_minutes': 10,  # Срок оплаты захваченного товара
+    'max_waiting': 10000,  # Мест в очереди ожидания на товар
+    'units_per_product': 20,  # Единиц товара в сезонной распродаже
+    'sweep_interval': 5  # Секунд между возвратом просроченных заявок
+}
+
+# Настройки программы лояльности
+LOYALTY_CONFIG = {
+    'points_rate': 0.05,  # Баллов за единицу суммы доставленного заказа
+    'points_ttl_days': 365,  # Срок жизни начисленных баллов
+    'accrual_interval': 300,  # Секунд между пакетными начислениями
+    'batch_size': 1000,  # Заказов в одной транзакции начисления
+    'tiers': [  # Уровни по текущим баллам, по возрастанию порога
+        ('Bronze', 0),
+        ('Silver', 100),
+        ('Gold', 500),
+        ('Platinum', 1500),
+        ('Diamond', 5000)
+    ]
+}
+
+# Настройки платежных намерений
+PAYMENT_CONFIG = {
+    'workers': 8,  # Потоков для запросов к платежным системам
+    'max_queue_size': 1000,  # Запросов в очереди; при переполнении - отказ без ожидания
+    'provider_timeout': 10,  # Секунд на запрос к платежной системе
+    'retries': 1,  # Повторов с тем же ключом идемпотентности
+    'retry_delay': 0.5,
+    'link_ttl_minutes': 25,  # Срок ссылки на оплату (меньше срока резерва)
+    'max_cached_links': 10000,
+    'breaker_failures': 5,  # Ошибок подряд до отключения платежной системы
+    'breaker_reset': 30  # Секунд до пробного запроса
+}
+
+# Настройки входящих webhook'ов
+WEBHOOK_INBOX_CONFIG = {
+    'workers': 4,  # Потоков обработки; события одного заказа - в одном потоке по порядку
+    'max_attempts': 8,  # Попыток до переноса в dead-letter
+    'backoff': 5,  # Секунд до первого повтора, далее удваивается
+    'max_backoff': 3600,
+    'sweep_interval': 2,  # Секунд между выбором событий на повтор
+    'stale_after': 300,  # Секунд до повторной постановки события, не взятого в работу
+    'batch_size': 500
+}
+
+# Настройки API для партнеров (маркетплейсов)
+API_CONFIG = {
+    'key_cache_ttl': 60,  # Секунд хранения проверенного ключа в памяти
+    'invalid_key_cache_ttl': 10,  # Неверный ключ тоже кэшируется: перебор не доходит до базы
+    'rate_limit': 20,  # Запросов в секунду на ключ
+    'rate_burst': 40,
+    'page_size': 100,
+    'max_page_size': 500,
+    'products_cache_ttl': 30,  # Секунд жизни готового ответа со страницей товаров
+    'orders_cache_ttl': 5,
+    'max_cached_responses': 1000,
+    'gzip_min_size': 1024,  # Байт, с которых ответ сжимается
+    'catalog_chunk_size': 1000,  # Строк на одну выборку при потоковой выгрузке каталога
+    'max_bulk_orders': 100
+}
+
+# Настройки ленты уведомлений
+NOTIFICATION_INBOX_CONFIG = {
+    'page_size': 10,  # Уведомлений в одном сообщении-сводке
+    'max_text_length': 300  # Длинный текст уведомления в сводке обрезается (лимит сообщения - 4096)
+}
+
+# Настройки хранения и архивации растущих таблиц
+RETENTION_CONFIG = {
+    'archive_dir': 'archive',  # Помесячные файлы архива рядом с основной базой
+    'chunk_size': 5000,  # Строк за одну транзакцию переноса
+    'pause': 0.05,  # Секунд между порциями: запись бота не ждет весь перенос
+    'run_interval_hours': 24,
+    'first_run_delay': 300,  # Секунд после запуска до первой архивации
+    'vacuum_pages': 5000,  # Страниц, возвращаемых incremental_vacuum после переноса таблицы
+    # Таблица: столбец времени, сколько дней держать в основной базе, дополнительное условие
+    'policies': {
+        'notifications': {'column': 'created_at', 'keep_days': 90, 'where': 'is_read = 1'},
+        'user_activity_logs': {'column': 'created_at', 'keep_days': 90},
+        'security_logs': {'column': 'created_at', 'keep_days': 180},
+        'webhook_logs': {'column': 'created_at', 'keep_days': 90},
+        'automation_executions': {'column': 'executed_at', 'keep_days': 180},
+        'post_statistics': {'column': 'sent_at', 'keep_days': 365},
+        'inventory_movements': {'column': 'created_at', 'keep_days': 365}
+    }
+}
+
+# Снимок базы для тяжелых отчетов (analytics_snapshot.py)
+ANALYTICS_SNAPSHOT_CONFIG = {
+    'file_suffix': '_analytics',  # shop_bot.db -> shop_bot_analytics.db рядом с основной базой
+    'refresh_interval': 300,  # Секунд между обновлениями снимка
+    'max_staleness': 900,  # Снимок старше обновляется в фоне при обращении отчета
+    'backup_pages': -1,  # Страниц за шаг backup; -1 - весь файл одним шагом
+    'backup_sleep': 0.05  # Пауза между шагами при пошаговой копии
+}
+
+# Подбор индексов по планам запросов (index_advisor.py)
+INDEX_ADVISOR_CONFIG = {
+    'paths': ['*.py', 'web_admin/*.py'],  # Исходники, из которых собираются SQL-запросы
+    'exclude': ['index_advisor.py', 'fix_database.py', 'test_bot.py', 'compile_project.py'],
+    # Справочники на десятки строк: полный проход по ним дешевле индекса
+    'small_tables': ['categories', 'subcategories', 'suppliers', 'api_keys', 'automation_rules', 'scheduled_posts'],
+    'min_rows': 1000,  # Таблицы меньше этого на копии базы не индексируются
+    'max_index_columns': 4,  # Столбцов в составном индексе
+    'max_covering_columns': 3,  # Покрывающий вариант - только если укладывается в это число столбцов
+    'min_speedup': 2,  # Во сколько раз должен ускориться SELECT на копии, чтобы индекс был предложен
+    'noise_ms': 1.0,  # Разница времени меньше этого - погрешность замера, а не замедление
+    'timing_repeats': 3  # Повторов замера, берется лучшее время
+}
+
+# Настройки профилировщика SQL
+QUERY_PROFILER_CONFIG = {
+    'enabled': os.getenv('QUERY_PROFILER', 'true').lower() == 'true',
+    'slow_ms': int(os.getenv('SLOW_QUERY_MS', '200')),  # Порог журнала медленных запросов
+    'explain_interval': 300,  # Не чаще одного EXPLAIN на запрос за столько секунд
+    'samples': 1000,  # Последних задержек на запрос для перцентилей
+    'max_statements': 2000,
+    'max_sites': 10,  # Мест вызова на запрос
+    'top_n': 10
+}
+
+# Настройки генератора синтетических данных (data_generator.py)
+DATA_GENERATOR_CONFIG = {
+    'db_path': 'synthetic_shop.db',
+    'seed': 42,
+    'default_scale': 'small',
+    'scales': {
+        'small': {'users': 10000, 'products': 1000, 'orders': 50000, 'days': 365},
+        'medium': {'users': 100000, 'products': 10000, 'orders': 1000000, 'days': 730},
+        'large': {'users': 1000000, 'products': 100000, 'orders': 10000000, 'days': 730}
+    },
+    'batch_size': 50000,  # Строк в одном executemany
+    'commit_rows': 2000000,  # Строк в одной транзакции
+    'uz_share': 0.35,  # Доля пользователей с узбекским языком
+    'popularity_exponent': 1.1,  # Популярность товара ~ 1 / ранг^s
+    'user_activity_alpha': 1.6,  # Активность покупателя ~ распределение Парето
+    'growth': 3.0,  # Заказов в день в конце периода во столько раз больше, чем в начале
+    'month_weights': [0.9, 0.85, 1.0, 1.0, 1.0, 0.95, 0.9, 0.95, 1.0, 1.05, 1.4, 1.6],
+    'weekday_weights': [1.0, 1.0, 1.0, 1.05, 1.15, 1.3, 1.2],
+    'hour_weights': [1, 0.5, 0.3, 0.2, 0.2, 0.3, 0.8, 1.5, 2.5, 3.5, 4, 4.5,
+                     5, 5, 4.5, 4.5, 5, 5.5, 6.5, 7.5, 8, 7, 5, 2.5],
+    'items_per_order': [(1, 50), (2, 25), (3, 13), (4, 7), (5, 5)],
+    'online_share': 0.6,
+    'cancel_share': 0.08,
+    'promo_share': 0.1,
+    'partner_share': 0.02,  # Заказы через API партнеров
+    'cart_share': 0.15,  # Доля пользователей с брошенной корзиной
+    'favorites_share': 0.3,
+    'review_share': 0.05,  # Доля доставленных позиций с отзывом
+    'activity_per_order': 1.5,  # Поисков и просмотров на заказ
+    'webhook_log_share': 0.2,  # Доля онлайн-оплат с записью вебхука
+    'history_days': 30,  # События доставки хранятся только для последних дней
+    'channels': [('organic', 45), ('instagram', 20), ('telegram_ads', 15), ('referral', 12), ('google', 8)]
+}
+
+# Сквозные бенчмарки сценариев (benchmarks/bench_suite.py)
+BENCHMARK_CONFIG = {
+    'scale': 'small',  # Масштаб DATA_GENERATOR_CONFIG['scales']
+    'seed': 42,
+    'iterations': 200,  # Прогонов пользовательского сценария за раунд
+    'report_iterations': 10,  # Прогонов тяжелых отчетов, RFM и выгрузок за раунд
+    'broadcast_runs': 1,
+    'rounds': 3,  # Раунды по всем сценариям; для сравнения берется лучший раунд
+    'warmup': 3,  # Первые прогоны не учитываются
+    'telegram_latency': 0.0,  # Задержка ответа fake_telegram.py, секунд
+    'baseline_dir': 'benchmarks/baselines',  # Относительно корня репозитория, файл <масштаб>.json
+    'regression_threshold': 0.25,  # Допустимый рост p50 и падение пропускной способности рассылки
+    'tail_regression_threshold': 0.5,  # Допустимый рост p95: хвост шумнее из-за fsync и соседей по машине
+    'min_regression_ms': 5.0  # Разница меньше этой не считается регрессией (шум таймера)
+}
+
+# Настройки API служб доставки
+CARRIER_CONFIG = {
+    'timeout': 10,  # Секунд на один запрос к службе
+    'retries': 3,  # Повторов при сетевой ошибке, 429 и 5xx
+    'backoff': 0.5,  # Пауза перед первым повтором, далее удваивается
+    'max_connections': 4,  # Постоянных соединений на службу
+    'breaker_failures': 5,  # Ошибок подряд до отключения службы
+    'breaker_reset': 30,  # Секунд до пробного запроса к отключенной службе
+    'orders_per_query': 500,  # Заказов, выбираемых из базы за один запрос
+    'default_carrier': os.getenv('DEFAULT_CARRIER', 'local_courier'),  # Служба для отправки из админ-панели
+    'default_option': 'standard',  # Вариант доставки для отправки из админ-панели
+    'carriers': {  # base_url можно направить на fake_carrier.py для проверки
+        'dhl': {
+            'base_url': os.getenv('DHL_API_URL', 'https://api.dhl.com'),
+            'api_key': os.getenv('DHL_API_KEY', ''),
+            'batch_size': 50  # Заказов в одном запросе
+        },
+        'fedex': {
+            'base_url': os.getenv('FEDEX_API_URL', 'https://api.fedex.com'),
+            'api_key': os.getenv('FEDEX_API_KEY', ''),
+            'batch_size': 30
+        },
+        'ups': {
+            'base_url': os.getenv('UPS_API_URL', 'https://api.ups.com'),
+            'api_key': os.getenv('UPS_API_KEY', ''),
+            'batch_size': 50
+        },
+        'local_courier': {
+            'base_url': os.getenv('LOCAL_COURIER_API_URL', 'http://localhost:8085/local_courier'),
+            'api_key': os.getenv('LOCAL_COURIER_API_KEY', ''),
+            'batch_size': 100
+        },
+        'post': {
+            'base_url': os.getenv('POST_API_URL', 'https://api.pochta.uz'),
+            'api_key': os.getenv('POST_API_KEY', ''),
+            'batch_size': 100
+        }
+    }
+}
+
+# Настройки отслеживания отправлений
+TRACKING_CONFIG = {
+    'poll_interval': 60,  # Секунд между проходами опроса
+    'batch_size': 500,  # Отправлений за один проход
+    'status_intervals': {  # Минут до следующего опроса по текущему статусу
+        'created': 60,
+        'scheduled': 60,
+        'picked_up': 120,
+        'in_transit': 180,
+        'out_for_delivery': 15
+    },
+    'default_interval': 120,
+    'slow_after_days': 7,  # Отправления старше опрашиваются реже
+    'slow_factor': 4,
+    'stop_after_days': 45,  # Отправления старше больше не опрашиваются
+    'final_statuses': ('delivered', 'returned', 'cancelled', 'lost')
+}
+
+# Настройки истории остатков
+STOCK_HISTORY_CONFIG = {
+    'snapshot_interval_hours': 24,
+    'snapshots_to_keep': 90
+}
+
 # Настройки логирования
 LOGGING_CONFIG = {
     'level': os.getenv('LOG_LEVEL', 'INFO'),
     'file': os.getenv('LOG_FILE', 'bot.log'),
     'max_size': 10 * 1024 * 1024,  # 10MB
-    'backup_count': 5
+    'backup_count': 5,
+    'structured': os.getenv('LOG_STRUCTURED', 'true').lower() == 'true',  # JSON в файлах
+    'queue_size': 10000,  # При переполнении записи отбрасываются
+    'module_levels': os.getenv('LOG_MODULE_LEVELS', ''),  # "updates=DEBUG,database=WARNING"
+    'sampling': {  # Доля сохраняемых записей ниже WARNING
+        'shop_bot.updates': 0.1
+    },
+    'rate_limits': {  # Записей в секунду ниже WARNING
+        'shop_bot.updates': 20,
+        'shop_bot.database': 50
+    }
 }
 
 # Настройки Redis (для кэширования)
@@ -59,6 +360,8 @@ BOT_CONFIG = {
     'webhook_secret': os.getenv('WEBHOOK_SECRET'),
     'max_message_length': 4096,
     'request_timeout': 30,
+    # Адрес Bot API; бенчмарки подставляют локальный fake_telegram.py
+    'api_url': os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/'),
     'admin_telegram_id': os.getenv('ADMIN_TELEGRAM_ID', '5720497431'),
     'admin_name': os.getenv('ADMIN_NAME', 'Admin')
 }
@@ -0,0 +1,284 @@
+"""
+Учет себестоимости по слоям поступлений (FIFO, LIFO, средневзвешенная)
+"""
+import logging
+
+from datetime import datetime
+
+VALUATION_METHODS = ('fifo', 'lifo', 'average')
+
+class CostLedger:
+    def __init__(self, db, reports_db=None):
+        self.db = db
+        self.reports_db = reports_db or db  # Оценка и себестоимость периода - со снимка для отчетов
+        self.ensure_opening_balances()
+
+    def ensure_opening_balances(self):
+        """Начальные слои для товаров, которых еще нет в учете (по cost_price)"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with self.db.transaction() as conn:
+                conn.execute('''
+                    INSERT INTO cost_layers (
+                        product_id, quantity, unit_cost, fifo_remaining, lifo_remaining, source, created_at
+                    )
+                    SELECT p.id, p.stock, IFNULL(p.cost_price, 0), p.stock, p.stock, 'opening', ?
+                    FROM products p
+                    WHERE p.stock > 0
+                    AND NOT EXISTS (SELECT 1 FROM product_cost_balances b WHERE b.product_id = p.id)
+                ''', (now,))
+                conn.execute('''
+                    INSERT INTO product_cost_balances (
+                        product_id, quantity, fifo_value, lifo_value, avg_value, updated_at
+                    )
+                    SELECT
+                        p.id, MAX(p.stock, 0),
+                        MAX(p.stock, 0) * IFNULL(p.cost_price, 0),
+                        MAX(p.stock, 0) * IFNULL(p.cost_price, 0),
+                        MAX(p.stock, 0) * IFNULL(p.cost_price, 0),
+                        ?
+                    FROM products p
+                    WHERE NOT EXISTS (SELECT 1 FROM product_cost_balances b WHERE b.product_id = p.id)
+                ''', (now,))
+        except Exception as e:
+            logging.info(f"Ошибка создания начальных слоев себестоимости: {e}")
+
+    def get_balance(self, conn, product_id):
+        """Текущий баланс товара (создается пустым при первом обращении)"""
+        balance = conn.execute(
+            'SELECT quantity, fifo_value, lifo_value, avg_value FROM product_cost_balances WHERE product_id = ?',
+            (product_id,)
+        ).fetchone()
+
+        if balance:
+            return balance
+
+        conn.execute(
+            'INSERT INTO product_cost_balances (product_id, quantity, fifo_value, lifo_value, avg_value) VALUES (?, 0, 0, 0, 0)',
+            (product_id,)
+        )
+        return (0, 0.0, 0.0, 0.0)
+
+    def save_balance(self, conn, product_id, quantity, fifo_value, lifo_value, avg_value):
+        """Сохранение баланса товара"""
+        conn.execute('''
+            UPDATE product_cost_balances
+            SET quantity = ?, fifo_value = ?, lifo_value = ?, avg_value = ?, updated_at = ?
+            WHERE product_id = ?
+        ''', (
+            quantity, round(fifo_value, 6), round(lifo_value, 6), round(avg_value, 6),
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'), product_id
+        ))
+
+    def run(self, operation, conn=None):
+        """Выполнение операции в переданной транзакции или в собственной"""
+        if conn is not None:
+            return operation(conn)
+        with self.db.transaction() as own_conn:
+            return operation(own_conn)
+
+    def record_receipt(self, product_id, quantity, unit_cost, source='receipt', reference_id=None, conn=None):
+        """Поступление: новый слой и рост стоимости запасов"""
+        if quantity <= 0:
+            return None
+
+        def operation(conn):
+            cost = unit_cost
+            if cost is None:
+                cost = self.get_fallback_cost(conn, product_id)
+
+            quantity_before, fifo_value, lifo_value, avg_value = self.get_balance(conn, product_id)
+            layer_id = self.insert_layer(conn, product_id, quantity, cost, quantity, quantity, source, reference_id)
+            self.save_balance(
+                conn, product_id, quantity_before + quantity,
+                fifo_value + quantity * cost, lifo_value + quantity * cost, avg_value + quantity * cost
+            )
+            return layer_id
+
+        return self.run(operation, conn)
+
+    def insert_layer(self, conn, product_id, quantity, unit_cost, fifo_remaining, lifo_remaining, source, reference_id):
+        """Запись слоя себестоимости"""
+        cursor = conn.execute('''
+            INSERT INTO cost_layers (
+                product_id, quantity, unit_cost, fifo_remaining, lifo_remaining,
+                source, reference_id, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            product_id, quantity, unit_cost, fifo_remaining, lifo_remaining,
+            source, reference_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        ))
+        return cursor.lastrowid
+
+    def consume_layers(self, conn, product_id, quantity, column, order):
+        """Списание из открытых слоев в заданном порядке, возвращает стоимость списанного"""
+        cost = 0.0
+        remaining = quantity
+        last_unit_cost = None
+
+        layers = conn.execute(f'''
+            SELECT id, {column}, unit_cost FROM cost_layers
+            WHERE product_id = ? AND {column} > 0
+            ORDER BY id {order}
+        ''', (product_id,))
+
+        updates = []
+        for layer_id, available, unit_cost in layers:
+            taken = min(available, remaining)
+            cost += taken * unit_cost
+            remaining -= taken
+            last_unit_cost = unit_cost
+            updates.append((available - taken, layer_id))
+            if remaining == 0:
+                break
+
+        conn.executemany(f'UPDATE cost_layers SET {column} = ? WHERE id = ?', updates)
+        return cost, remaining, last_unit_cost
+
+    def consume(self, product_id, quantity, reference_type='sale', reference_id=None, conn=None):
+        """Списание: продажа или уменьшение остатка, расчет себестоимости тремя методами"""
+        if quantity <= 0:
+            return None
+
+        def operation(conn):
+            quantity_before, fifo_value, lifo_value, avg_value = self.get_balance(conn, product_id)
+            average_unit = avg_value / quantity_before if quantity_before > 0 else self.get_fallback_cost(conn, product_id)
+
+            fifo_cost, fifo_short, fifo_last = self.consume_layers(conn, product_id, quantity, 'fifo_remaining', 'ASC')
+            lifo_cost, lifo_short, lifo_last = self.consume_layers(conn, product_id, quantity, 'lifo_remaining', 'DESC')
+
+            # Списание сверх учтенных слоев (остаток велся вне учета) - по последней известной цене
+            if fifo_short or lifo_short:
+                fallback = self.get_fallback_cost(conn, product_id)
+                fifo_cost += fifo_short * (fifo_last if fifo_last is not None else fallback)
+                lifo_cost += lifo_short * (lifo_last if lifo_last is not None else fallback)
+                logging.info(f"Списание товара {product_id} сверх слоев себестоимости: {max(fifo_short, lifo_short)} шт.")
+
+            covered = min(quantity, max(quantity_before, 0))
+            avg_cost = quantity * average_unit
+
+            self.save_balance(
+                conn, product_id, max(quantity_before - quantity, 0),
+                max(fifo_value - fifo_cost, 0), max(lifo_value - lifo_cost, 0),
+                max(avg_value - covered * average_unit, 0)
+            )
+
+            conn.execute('''
+                INSERT INTO cost_consumptions (
+                    product_id, quantity, fifo_cost, lifo_cost, avg_cost,
+                    reference_type, reference_id, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                product_id, quantity, round(fifo_cost, 6), round(lifo_cost, 6), round(avg_cost, 6),
+                reference_type, reference_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ))
+
+            return {'fifo': fifo_cost, 'lifo': lifo_cost, 'average': avg_cost}
+
+        return self.run(operation, conn)
+
+    def return_units(self, product_id, quantity, reference_type='sale', reference_id=None, conn=None):
+        """Возврат ранее списанного (отмена заказа) по себестоимости списания"""
+        if quantity <= 0:
+            return None
+
+        def operation(conn):
+            consumed = conn.execute('''
+                SELECT SUM(quantity), SUM(fifo_cost), SUM(lifo_cost), SUM(avg_cost)
+                FROM cost_consumptions
+                WHERE product_id = ? AND reference_type = ? AND reference_id IS ?
+            ''', (product_id, reference_type, reference_id)).fetchone()
+
+            if not consumed or not consumed[0] or consumed[0] <= 0:
+                # Списания не было - возвращаем как поступление по текущей цене
+                return self.record_receipt(product_id, quantity, None, 'return', reference_id, conn)
+
+            units = min(quantity, consumed[0])
+            fifo_unit = consumed[1] / consumed[0]
+            lifo_unit = consumed[2] / consumed[0]
+            avg_unit = consumed[3] / consumed[0]
+
+            # Для каждого метода свой слой по его себестоимости списания
+            self.insert_layer(conn, product_id, units, fifo_unit, units, 0, 'return', reference_id)
+            self.insert_layer(conn, product_id, units, lifo_unit, 0, units, 'return', reference_id)
+
+            quantity_before, fifo_value, lifo_value, avg_value = self.get_balance(conn, product_id)
+            self.save_balance(
+                conn, product_id, quantity_before + units,
+                fifo_value + units * fifo_unit, lifo_value + units * lifo_unit, avg_value + units * avg_unit
+            )
+
+            conn.execute('''
+                INSERT INTO cost_consumptions (
+                    product_id, quantity, fifo_cost, lifo_cost, avg_cost,
+                    reference_type, reference_id, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                product_id, -units, -units * fifo_unit, -units * lifo_unit, -units * avg_unit,
+                reference_type, reference_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ))
+            return units
+
+        return self.run(operation, conn)
+
+    def adjust(self, product_id, quantity_change, reference_type='adjustment', reference_id=None, conn=None):
+        """Корректировка остатка: излишек - слой по средней цене, недостача - списание"""
+        if quantity_change > 0:
+            def operation(conn):
+                quantity_before, _, _, avg_value = self.get_balance(conn, product_id)
+                unit_cost = avg_value / quantity_before if quantity_before > 0 else None
+                return self.record_receipt(product_id, quantity_change, unit_cost, reference_type, reference_id, conn)
+            return self.run(operation, conn)
+
+        if quantity_change < 0:
+            return self.consume(product_id, -quantity_change, reference_type, reference_id, conn)
+
+        return None
+
+    def get_fallback_cost(self, conn, product_id):
+        """Цена для операций без слоев: последний слой или cost_price товара"""
+        layer = conn.execute(
+            'SELECT unit_cost FROM cost_layers WHERE product_id = ? ORDER BY id DESC LIMIT 1',
+            (product_id,)
+        ).fetchone()
+        if layer:
+            return layer[0]
+
+        product = conn.execute('SELECT IFNULL(cost_price, 0) FROM products WHERE id = ?', (product_id,)).fetchone()
+        return product[0] if product else 0.0
+
+    def get_valuation(self, method='fifo'):
+        """Стоимость запасов по товарам из текущих балансов (без обхода истории)"""
+        if method not in VALUATION_METHODS:
+            raise ValueError(f"Неизвестный метод оценки: {method}")
+
+        value_column = {'fifo': 'b.fifo_value', 'lifo': 'b.lifo_value', 'average': 'b.avg_value'}[method]
+
+        return self.reports_db.execute_query(f'''
+            SELECT
+                p.id, p.name, b.quantity,
+                CASE WHEN b.quantity > 0 THEN {value_column} / b.quantity ELSE 0 END as unit_cost,
+                {value_column} as inventory_value
+            FROM product_cost_balances b
+            JOIN products p ON p.id = b.product_id
+            WHERE p.is_active = 1 AND b.quantity > 0
+            ORDER BY inventory_value DESC
+        ''') or []
+
+    def get_orders_cogs(self, start_date, end_date, statuses, method='fifo'):
+        """Себестоимость продаж по заказам периода: (сумма по учету, id заказов с учетом)"""
+        if method not in VALUATION_METHODS:
+            raise ValueError(f"Неизвестный метод оценки: {method}")
+
+        cost_column = {'fifo': 'c.fifo_cost', 'lifo': 'c.lifo_cost', 'average': 'c.avg_cost'}[method]
+        placeholders = ','.join('?' * len(statuses))
+
+        result = self.reports_db.execute_query(f'''
+            SELECT IFNULL(SUM({cost_column}), 0), COUNT(DISTINCT o.id)
+            FROM orders o
+            JOIN cost_consumptions c ON c.reference_type = 'sale' AND c.reference_id = o.id
+            WHERE DATE(o.created_at) BETWEEN ? AND ?
+            AND o.status IN ({placeholders})
+        ''', (start_date, end_date, *statuses))
+
+        return result[0] if result else (0, 0)
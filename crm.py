@@ -6,12 +6,13 @@ from datetime import datetime
 from utils import format_price, format_date
 
 class CRMManager:
-    def __init__(self, db):
+    def __init__(self, db, reports_db=None):
         self.db = db
+        self.reports_db = reports_db or db  # Выборки для сегментов и профилей - со снимка; запись - в основную базу
     
     def segment_customers(self):
         """Сегментация клиентов по RFM анализу"""
-        customers = self.db.execute_query('''
+        customers = self.reports_db.execute_query('''
             SELECT 
                 u.id,
                 u.name,
@@ -114,13 +115,13 @@ class CRMManager:
     def get_customer_profile(self, user_id):
         """Получение полного профиля клиента"""
         # Основная информация
-        user_info = self.db.execute_query(
+        user_info = self.reports_db.execute_query(
             'SELECT * FROM users WHERE id = ?',
             (user_id,)
         )[0]
         
         # Статистика заказов
-        order_stats = self.db.execute_query('''
+        order_stats = self.reports_db.execute_query('''
             SELECT 
                 COUNT(*) as total_orders,
                 SUM(total_amount) as total_spent,
@@ -132,7 +133,7 @@ class CRMManager:
         ''', (user_id,))[0]
         
         # Любимые категории
-        favorite_categories = self.db.execute_query('''
+        favorite_categories = self.reports_db.execute_query('''
             SELECT 
                 c.name,
                 c.emoji,
@@ -149,7 +150,7 @@ class CRMManager:
         ''', (user_id,))
         
         # Любимые товары
-        favorite_products = self.db.execute_query('''
+        favorite_products = self.reports_db.execute_query('''
             SELECT 
                 p.name,
                 SUM(oi.quantity) as total_bought,
@@ -164,7 +165,7 @@ class CRMManager:
         ''', (user_id,))
         
         # Баллы лояльности
-        loyalty_data = self.db.get_user_loyalty_points(user_id)
+        loyalty_data = self.reports_db.get_user_loyalty_points(user_id)
         
         return {
             'user_info': user_info,
@@ -231,7 +232,7 @@ class CRMManager:
         events = []
         
         # Регистрация
-        user = self.db.execute_query('SELECT created_at FROM users WHERE id = ?', (user_id,))[0]
+        user = self.reports_db.execute_query('SELECT created_at FROM users WHERE id = ?', (user_id,))[0]
         events.append({
             'type': 'registration',
             'date': user[0],
@@ -239,7 +240,7 @@ class CRMManager:
         })
         
         # Первый просмотр товара
-        first_view = self.db.execute_query('''
+        first_view = self.reports_db.execute_query('''
             SELECT MIN(created_at) FROM cart WHERE user_id = ?
         ''', (user_id,))[0]
         
@@ -251,7 +252,7 @@ class CRMManager:
             })
         
         # Первое добавление в корзину
-        first_cart = self.db.execute_query('''
+        first_cart = self.reports_db.execute_query('''
             SELECT MIN(created_at) FROM cart WHERE user_id = ?
         ''', (user_id,))[0]
         
@@ -263,7 +264,7 @@ class CRMManager:
             })
         
         # Заказы
-        orders = self.db.execute_query('''
+        orders = self.reports_db.execute_query('''
             SELECT created_at, total_amount, status FROM orders 
             WHERE user_id = ? 
             ORDER BY created_at
@@ -283,7 +284,7 @@ class CRMManager:
     
     def get_churn_risk_customers(self):
         """Получение клиентов с риском оттока"""
-        at_risk_customers = self.db.execute_query('''
+        at_risk_customers = self.reports_db.execute_query('''
             SELECT 
                 u.id,
                 u.name,
@@ -314,7 +315,7 @@ class CRMManager:
             personal_promo = promo_manager.generate_personal_promo(customer_id, 'return')
             
             # Получаем данные клиента
-            customer = self.db.execute_query(
+            customer = self.reports_db.execute_query(
                 'SELECT telegram_id, name, language FROM users WHERE id = ?',
                 (customer_id,)
             )[0]
@@ -343,7 +344,7 @@ class CRMManager:
     def analyze_customer_behavior(self, user_id):
         """Анализ поведения конкретного клиента"""
         # Паттерны покупок
-        purchase_patterns = self.db.execute_query('''
+        purchase_patterns = self.reports_db.execute_query('''
             SELECT 
                 strftime('%w', created_at) as day_of_week,
                 strftime('%H', created_at) as hour_of_day,
@@ -355,7 +356,7 @@ class CRMManager:
         ''', (user_id,))
         
         # Сезонность покупок
-        seasonal_patterns = self.db.execute_query('''
+        seasonal_patterns = self.reports_db.execute_query('''
             SELECT 
                 strftime('%m', created_at) as month,
                 COUNT(*) as orders_count,
@@ -367,7 +368,7 @@ class CRMManager:
         ''', (user_id,))
         
         # Средний интервал между покупками
-        purchase_intervals = self.db.execute_query('''
+        purchase_intervals = self.reports_db.execute_query('''
             SELECT 
                 julianday(created_at) - julianday(LAG(created_at) OVER (ORDER BY created_at)) as days_between
             FROM orders
@@ -382,7 +383,7 @@ class CRMManager:
                 avg_interval = sum(intervals) / len(intervals)
         
         # Предпочтения по ценовым сегментам
-        price_preferences = self.db.execute_query('''
+        price_preferences = self.reports_db.execute_query('''
             SELECT 
                 CASE 
                     WHEN oi.price < 25 THEN 'Бюджетные'
@@ -409,7 +410,7 @@ class CRMManager:
     def get_customer_recommendations(self, user_id):
         """Получение рекомендаций для клиента"""
         # Анализируем историю покупок
-        purchase_history = self.db.execute_query('''
+        purchase_history = self.reports_db.execute_query('''
             SELECT DISTINCT p.category_id
             FROM order_items oi
             JOIN products p ON oi.product_id = p.id
@@ -419,7 +420,7 @@ class CRMManager:
         
         if not purchase_history:
             # Для новых клиентов - популярные товары
-            recommendations = self.db.execute_query('''
+            recommendations = self.reports_db.execute_query('''
                 SELECT p.*, c.name as category_name
                 FROM products p
                 JOIN categories c ON p.category_id = c.id
@@ -432,7 +433,7 @@ class CRMManager:
             category_ids = [cat[0] for cat in purchase_history]
             placeholders = ','.join('?' * len(category_ids))
             
-            recommendations = self.db.execute_query(f'''
+            recommendations = self.reports_db.execute_query(f'''
                 SELECT p.*, c.name as category_name
                 FROM products p
                 JOIN categories c ON p.category_id = c.id
@@ -496,7 +497,7 @@ class CRMManager:
     def get_customer_lifetime_value_prediction(self, user_id):
         """Прогноз жизненной ценности клиента"""
         # Получаем историю покупок
-        orders = self.db.execute_query('''
+        orders = self.reports_db.execute_query('''
             SELECT total_amount, created_at
             FROM orders
             WHERE user_id = ? AND status != 'cancelled'
@@ -581,7 +582,7 @@ class CRMManager:
     def get_customer_interaction_history(self, user_id):
         """История взаимодействий с клиентом"""
         # Заказы
-        orders = self.db.execute_query('''
+        orders = self.reports_db.execute_query('''
             SELECT 'order' as type, created_at, 
                    'Заказ #' || id || ' на ' || total_amount || '$' as description
             FROM orders
@@ -589,7 +590,7 @@ class CRMManager:
         ''', (user_id,))
         
         # Уведомления
-        notifications = self.db.execute_query('''
+        notifications = self.reports_db.execute_query('''
             SELECT 'notification' as type, created_at, 
                    title || ': ' || message as description
             FROM notifications
@@ -597,7 +598,7 @@ class CRMManager:
         ''', (user_id,))
         
         # Отзывы
-        reviews = self.db.execute_query('''
+        reviews = self.reports_db.execute_query('''
             SELECT 'review' as type, r.created_at,
                    'Отзыв на ' || p.name || ' (' || r.rating || '/5)' as description
             FROM reviews r
@@ -614,13 +615,13 @@ class CRMManager:
     def calculate_customer_satisfaction_score(self, user_id):
         """Расчет индекса удовлетворенности клиента"""
         # Средняя оценка в отзывах
-        avg_rating = self.db.execute_query(
+        avg_rating = self.reports_db.execute_query(
             'SELECT AVG(rating) FROM reviews WHERE user_id = ?',
             (user_id,)
         )[0][0]
         
         # Процент завершенных заказов
-        order_completion = self.db.execute_query('''
+        order_completion = self.reports_db.execute_query('''
             SELECT 
                 COUNT(CASE WHEN status = 'delivered' THEN 1 END) * 100.0 / COUNT(*) as completion_rate
             FROM orders
@@ -628,7 +629,7 @@ class CRMManager:
         ''', (user_id,))[0][0]
         
         # Частота повторных покупок
-        repeat_purchase_rate = self.db.execute_query('''
+        repeat_purchase_rate = self.reports_db.execute_query('''
             SELECT COUNT(*) FROM orders WHERE user_id = ? AND status != 'cancelled'
         ''', (user_id,))[0][0]
         
@@ -669,7 +670,7 @@ class CRMManager:
     def get_cross_sell_opportunities(self, user_id):
         """Поиск возможностей для кросс-продаж"""
         # Анализируем что покупал клиент
-        purchased_categories = self.db.execute_query('''
+        purchased_categories = self.reports_db.execute_query('''
             SELECT DISTINCT p.category_id, c.name
             FROM order_items oi
             JOIN products p ON oi.product_id = p.id
@@ -701,7 +702,7 @@ class CRMManager:
         # Получаем товары из рекомендуемых категорий
         if recommended_categories:
             placeholders = ','.join('?' * len(recommended_categories))
-            cross_sell_products = self.db.execute_query(f'''
+            cross_sell_products = self.reports_db.execute_query(f'''
                 SELECT p.*, c.name as category_name
                 FROM products p
                 JOIN categories c ON p.category_id = c.id
@@ -751,7 +752,7 @@ class CRMManager:
     
     def analyze_cart_abandonment_patterns(self):
         """Анализ паттернов брошенных корзин"""
-        abandonment_data = self.db.execute_query('''
+        abandonment_data = self.reports_db.execute_query('''
             SELECT 
                 u.id,
                 u.name,
@@ -0,0 +1,112 @@
+"""
+Потоковая выгрузка отчетов в CSV/NDJSON с gzip-сжатием
+"""
+import logging
+
+import csv
+import gzip
+import json
+import os
+import tempfile
+import time
+import zlib
+
+EXPORT_FORMATS = {
+    'csv': {'extension': 'csv', 'mimetype': 'text/csv'},
+    'ndjson': {'extension': 'ndjson', 'mimetype': 'application/x-ndjson'}
+}
+
+class EchoBuffer:
+    """Файловый объект для csv.writer: возвращает строку вместо записи"""
+    def write(self, value):
+        return value
+
+class DataExporter:
+    def __init__(self, chunk_size=64 * 1024, progress_every=5000):
+        self.chunk_size = chunk_size
+        self.progress_every = progress_every
+
+    def iter_lines(self, header, rows, fmt='csv'):
+        """Строки выгрузки по одной: память не зависит от объема"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+        if fmt == 'csv':
+            writer = csv.writer(EchoBuffer())
+            yield writer.writerow(header)
+            for row in rows:
+                yield writer.writerow(row)
+        else:
+            for row in rows:
+                yield json.dumps(dict(zip(header, row)), ensure_ascii=False, default=str) + '\n'
+
+    def iter_chunks(self, header, rows, fmt='csv', compress=True, progress_callback=None):
+        """Порции байтов для HTTP-ответа (gzip-поток при compress=True)"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        buffer = []
+        buffered = 0
+
+        for line in self.count_progress(self.iter_lines(header, rows, fmt), progress_callback):
+            data = line.encode('utf-8')
+            buffer.append(data)
+            buffered += len(data)
+
+            if buffered >= self.chunk_size:
+                chunk = b''.join(buffer)
+                buffer, buffered = [], 0
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+
+        chunk = b''.join(buffer)
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+    def export_to_file(self, header, rows, fmt='csv', compress=True, name='export', progress_callback=None):
+        """Выгрузка во временный файл; вызывающий удаляет файл после отправки"""
+        extension = EXPORT_FORMATS[fmt]['extension'] + ('.gz' if compress else '')
+        fd, path = tempfile.mkstemp(prefix=f"{name}_", suffix=f".{extension}")
+        os.close(fd)
+
+        started = time.time()
+        rows_written = 0
+        try:
+            opener = gzip.open if compress else open
+            with opener(path, 'wt', encoding='utf-8', newline='') as output:
+                for line in self.count_progress(self.iter_lines(header, rows, fmt), progress_callback):
+                    output.write(line)
+                    rows_written += 1
+        except Exception:
+            os.remove(path)
+            raise
+
+        if fmt == 'csv':
+            rows_written -= 1  # Заголовок
+
+        result = {
+            'path': path,
+            'filename': f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.{extension}",
+            'rows': rows_written,
+            'size': os.path.getsize(path),
+            'duration': time.time() - started
+        }
+
+        if progress_callback:
+            progress_callback(rows_written, True)
+
+        logging.info(f"Выгрузка {result['filename']}: {rows_written} строк, {result['size']} байт")
+        return result
+
+    def count_progress(self, lines, progress_callback):
+        """Вызов progress_callback(строк, завершено) каждые progress_every строк"""
+        if not progress_callback:
+            yield from lines
+            return
+
+        for count, line in enumerate(lines, 1):
+            yield line
+            if count % self.progress_every == 0:
+                progress_callback(count, False)
@@ -0,0 +1,661 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетической базы в масштабе продакшена: детерминированный по seed, с популярностью товаров
+по степенному закону, сезонностью, брошенными корзинами и смесью ru/uz пользователей
+"""
+import logging
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+from bisect import bisect
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from config import DATA_GENERATOR_CONFIG, LOYALTY_CONFIG, CARRIER_CONFIG
+from database import DatabaseManager
+
+# Категория, эмодзи, подкатегории, бренды, базовая цена
+CATALOG = [
+    ('Электроника', '📱', ['Смартфоны', 'Ноутбуки', 'Наушники', 'Планшеты', 'Умные часы'],
+     ['Apple', 'Samsung', 'Xiaomi', 'Huawei', 'Lenovo', 'Sony'], 400),
+    ('Одежда', '👕', ['Футболки', 'Джинсы', 'Куртки', 'Платья', 'Обувь'],
+     ['Nike', 'Adidas', "Levi's", 'Zara', 'H&M', 'Puma'], 60),
+    ('Дом и сад', '🏠', ['Посуда', 'Текстиль', 'Освещение', 'Инструменты', 'Сад'],
+     ['IKEA', 'Tefal', 'Bosch', 'Philips', 'Generic'], 80),
+    ('Спорт', '⚽', ['Тренажеры', 'Велосипеды', 'Туризм', 'Единоборства', 'Плавание'],
+     ['Adidas', 'Nike', 'Decathlon', 'Reebok', 'Generic'], 120),
+    ('Красота', '💄', ['Уход за лицом', 'Парфюмерия', 'Макияж', 'Уход за волосами'],
+     ['Chanel', "L'Oreal", 'Nivea', 'Garnier', 'Generic'], 40),
+    ('Книги', '📚', ['Художественная литература', 'Учебники', 'Детские книги', 'Бизнес'],
+     ['Эксмо', 'АСТ', 'Манн, Иванов и Фербер', 'Generic'], 15),
+    ('Детские товары', '🧸', ['Игрушки', 'Коляски', 'Детская одежда', 'Детское питание'],
+     ['LEGO', 'Hasbro', 'Chicco', 'Generic'], 50),
+    ('Продукты', '🍎', ['Чай и кофе', 'Сладости', 'Бакалея', 'Напитки'],
+     ['Nestle', 'Ahmad Tea', 'Coca-Cola', 'Generic'], 10),
+    ('Бытовая техника', '🔌', ['Кухонная техника', 'Пылесосы', 'Стиральные машины', 'Климат'],
+     ['Bosch', 'Samsung', 'LG', 'Artel', 'Philips'], 250),
+    ('Автотовары', '🚗', ['Аксессуары', 'Масла', 'Шины', 'Автоэлектроника'],
+     ['Bosch', 'Michelin', 'Castrol', 'Generic'], 90)
+]
+
+NAMES = {
+    'ru': ['Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей', 'Иван', 'Елена',
+           'Ольга', 'Наталья', 'Анна', 'Мария', 'Татьяна', 'Екатерина', 'Виктория', 'Павел'],
+    'uz': ['Азиз', 'Бобур', 'Жасур', 'Шерзод', 'Улугбек', 'Рустам', 'Фаррух', 'Дилноза',
+           'Нилуфар', 'Гулнора', 'Мадина', 'Шахноза', 'Севара', 'Камола', 'Отабек', 'Сардор']
+}
+INITIALS = 'АБВГДЕЖИКЛМНОПРСТУФХШЮЯ'
+CITIES = [('Ташкент', 45), ('Самарканд', 12), ('Бухара', 8), ('Наманган', 8), ('Андижан', 8),
+          ('Фергана', 7), ('Карши', 5), ('Нукус', 4), ('Ургенч', 3)]
+STREETS = ['ул. Навои', 'ул. Амира Темура', 'ул. Бабура', 'ул. Мустакиллик', 'ул. Шота Руставели', 'ул. Беруни']
+ORDER_NOTIFICATIONS = {
+    'pending': 'Заказ принят',
+    'confirmed': 'Заказ подтвержден',
+    'shipped': 'Заказ отправлен',
+    'delivered': 'Заказ доставлен',
+    'cancelled': 'Заказ отменен'
+}
+EXPENSE_SHARES = [('marketing', 0.08), ('salaries', 0.12), ('logistics', 0.05), ('rent', 0.03), ('utilities', 0.01)]
+SECURITY_EVENTS = [('rate_limit_exceeded', 'medium', 60), ('suspicious_search_patterns', 'medium', 20),
+                   ('multiple_failed_payments', 'high', 10), ('bot_behavior', 'high', 5), ('invalid_input', 'low', 5)]
+
+INSERTS = {
+    'categories': 'INSERT INTO categories (id, name, description, emoji, created_at) VALUES (?, ?, ?, ?, ?)',
+    'subcategories': 'INSERT INTO subcategories (id, name, category_id, emoji, created_at) VALUES (?, ?, ?, ?, ?)',
+    'products': '''INSERT INTO products (id, name, description, price, category_id, subcategory_id, brand, image_url,
+                   stock, is_active, cost_price, original_price, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'product_images': 'INSERT INTO product_images (product_id, image_url, sort_order, created_at) VALUES (?, ?, ?, ?)',
+    'suppliers': '''INSERT INTO suppliers (id, name, contact_email, phone, address, payment_terms, cost_per_unit, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+    'inventory_rules': '''INSERT INTO inventory_rules (product_id, reorder_point, reorder_quantity, supplier_id, created_at)
+                          VALUES (?, ?, ?, ?, ?)''',
+    'purchase_orders': '''INSERT INTO purchase_orders (product_id, supplier_id, quantity, cost_per_unit, total_amount, status,
+                          received_quantity, delivered_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'inventory_movements': '''INSERT INTO inventory_movements (product_id, movement_type, quantity_change, old_quantity,
+                              new_quantity, supplier_id, cost_per_unit, reason, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'users': '''INSERT INTO users (id, telegram_id, name, phone, email, language, created_at, acquisition_channel)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+    'promo_codes': '''INSERT INTO promo_codes (id, code, discount_type, discount_value, min_order_amount, expires_at,
+                      description, is_active, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'promo_uses': 'INSERT INTO promo_uses (promo_code_id, user_id, order_id, discount_amount, created_at) VALUES (?, ?, ?, ?, ?)',
+    'promo_usage_counters': 'INSERT OR REPLACE INTO promo_usage_counters (promo_code_id, uses_count) VALUES (?, ?)',
+    'api_keys': 'INSERT INTO api_keys (id, key_name, api_key, permissions, created_at) VALUES (?, ?, ?, ?, ?)',
+    'api_orders': 'INSERT INTO api_orders (api_key_id, external_id, order_id, created_at) VALUES (?, ?, ?, ?)',
+    'orders': '''INSERT INTO orders (id, user_id, total_amount, status, delivery_address, payment_method, payment_status,
+                 promo_discount, delivery_cost, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'order_items': 'INSERT INTO order_items (order_id, product_id, quantity, price, created_at) VALUES (?, ?, ?, ?, ?)',
+    'payment_intents': '''INSERT INTO payment_intents (order_id, provider, idempotency_key, amount, status, provider_reference,
+                          attempts, expires_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?)''',
+    'webhook_logs': 'INSERT INTO webhook_logs (provider, order_id, user_id, status, created_at) VALUES (?, ?, ?, ?, ?)',
+    'shipments': '''INSERT INTO shipments (id, order_id, tracking_number, delivery_provider, delivery_option, status,
+                    estimated_delivery, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+    'shipment_status_history': '''INSERT INTO shipment_status_history (shipment_id, status, description, location, event_time, created_at)
+                                  VALUES (?, ?, ?, ?, ?, ?)''',
+    'shipment_tracking': 'INSERT INTO shipment_tracking (shipment_id, last_event_at, last_checked_at, next_check_at) VALUES (?, ?, ?, ?)',
+    'notifications': 'INSERT INTO notifications (user_id, title, message, type, is_read, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+    'notification_counters': 'INSERT OR REPLACE INTO notification_counters (user_id, unread) VALUES (?, ?)',
+    'loyalty_transactions': '''INSERT INTO loyalty_transactions (user_id, points, kind, order_id, expires_at, created_at)
+                               VALUES (?, ?, ?, ?, ?, ?)''',
+    'loyalty_points': '''INSERT OR REPLACE INTO loyalty_points (user_id, current_points, total_earned, current_tier, created_at, updated_at)
+                         VALUES (?, ?, ?, ?, ?, ?)''',
+    'loyalty_tier_events': 'INSERT INTO loyalty_tier_events (user_id, old_tier, new_tier, notified, created_at) VALUES (?, ?, ?, 1, ?)',
+    'reviews': 'INSERT INTO reviews (user_id, product_id, rating, comment, created_at) VALUES (?, ?, ?, ?, ?)',
+    'user_activity_logs': 'INSERT INTO user_activity_logs (user_id, action, search_query, created_at) VALUES (?, ?, ?, ?)',
+    'cart': 'INSERT INTO cart (user_id, product_id, quantity, created_at) VALUES (?, ?, ?, ?)',
+    'favorites': 'INSERT INTO favorites (user_id, product_id, created_at) VALUES (?, ?, ?)',
+    'security_logs': 'INSERT INTO security_logs (user_id, activity_type, details, severity, created_at) VALUES (?, ?, ?, ?, ?)',
+    'security_blocks': 'INSERT INTO security_blocks (user_id, reason, blocked_until, created_at) VALUES (?, ?, ?, ?)',
+    'automation_rules': 'INSERT INTO automation_rules (id, name, trigger_type, conditions, actions, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+    'automation_executions': 'INSERT INTO automation_executions (rule_id, user_id, rule_type, executed_at) VALUES (?, ?, ?, ?)',
+    'marketing_campaigns': 'INSERT INTO marketing_campaigns (name, segment, campaign_type, target_count, created_at) VALUES (?, ?, ?, ?, ?)',
+    'business_expenses': 'INSERT INTO business_expenses (expense_type, amount, description, expense_date, created_at) VALUES (?, ?, ?, ?, ?)',
+    'scheduled_posts': '''INSERT INTO scheduled_posts (id, title, content, time_morning, time_afternoon, time_evening, created_at, updated_at)
+                          VALUES (?, ?, ?, '09:00', '14:00', '20:00', ?, ?)''',
+    'post_statistics': 'INSERT INTO post_statistics (post_id, time_period, sent_count, error_count, sent_at) VALUES (?, ?, ?, ?, ?)'
+}
+
+# Таблицы, строки которых ссылаются на сгенерированные id: нумерация продолжается после существующих
+ID_TABLES = ['categories', 'subcategories', 'products', 'suppliers', 'users', 'promo_codes', 'api_keys',
+             'orders', 'shipments', 'automation_rules', 'scheduled_posts']
+
+class DataGenerator:
+    def __init__(self, db_path=None, scale=None, seed=None, end_date=None):
+        self.db_path = db_path or DATA_GENERATOR_CONFIG['db_path']
+        self.scale = {
+            **DATA_GENERATOR_CONFIG['scales'][DATA_GENERATOR_CONFIG['default_scale']],
+            **(scale or {})
+        }
+        self.random = random.Random(DATA_GENERATOR_CONFIG['seed'] if seed is None else seed)
+        # Даты отсчитываются от end_date, а не от часов: тот же seed и end_date дают ту же базу
+        self.end_date = end_date or date.today()
+        self.dates = [self.end_date - timedelta(days=self.scale['days'] - i) for i in range(self.scale['days'])]
+        self.day_weights = self.get_day_weights()
+        # Отметка для справочников, чтобы не зависеть от CURRENT_TIMESTAMP
+        self.started_at = f"{self.dates[0]} 00:00:00"
+        self.hour_cum = list(accumulate(DATA_GENERATOR_CONFIG['hour_weights']))
+        self.conn = None
+        self.buffers = {table: [] for table in INSERTS}
+        self.counts = {table: 0 for table in INSERTS}
+        self.pending = 0
+
+    def get_day_weights(self):
+        """Вес дня: рост магазина к концу периода, сезонность по месяцам и дням недели"""
+        growth = DATA_GENERATOR_CONFIG['growth']
+        last = max(len(self.dates) - 1, 1)
+        return [
+            (1 + (growth - 1) * index / last)
+            * DATA_GENERATOR_CONFIG['month_weights'][day.month - 1]
+            * DATA_GENERATOR_CONFIG['weekday_weights'][day.weekday()]
+            for index, day in enumerate(self.dates)
+        ]
+
+    def split(self, total, weights):
+        """Целые количества по весам с переносом остатка: сумма ровно total"""
+        ratio = total / sum(weights)
+        counts = []
+        carry = 0.0
+        for weight in weights:
+            exact = weight * ratio + carry
+            counts.append(int(exact))
+            carry = exact - int(exact)
+        counts[-1] += total - sum(counts)
+        return counts
+
+    def get_times(self, day, count):
+        """count отметок времени за день по возрастанию, с вечерним пиком"""
+        hours = self.random.choices(range(24), cum_weights=self.hour_cum, k=count)
+        seconds = sorted(hour * 3600 + self.random.randrange(3600) for hour in hours)
+        return [f"{day} {second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}" for second in seconds]
+
+    def pick(self, items, cum):
+        return items[bisect(cum, self.random.random() * cum[-1])]
+
+    def add(self, table, row):
+        buffer = self.buffers[table]
+        buffer.append(row)
+        if len(buffer) >= DATA_GENERATOR_CONFIG['batch_size']:
+            self.flush(table)
+
+    def flush(self, table):
+        """Пакетная запись буфера; фиксация раз в commit_rows строк"""
+        rows = self.buffers[table]
+        if not rows:
+            return
+        self.conn.executemany(INSERTS[table], rows)
+        self.counts[table] += len(rows)
+        self.pending += len(rows)
+        self.buffers[table] = []
+        if self.pending >= DATA_GENERATOR_CONFIG['commit_rows']:
+            self.conn.commit()
+            self.pending = 0
+
+    def flush_all(self):
+        for table in INSERTS:
+            self.flush(table)
+
+    def generate(self):
+        """Новая база: схема приложения, затем все таблицы. Возвращает число записанных строк по таблицам"""
+        if os.path.exists(self.db_path):
+            raise FileExistsError(f"{self.db_path} уже существует")
+
+        started = time.time()
+        DatabaseManager(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        try:
+            # Файл создается с нуля: при сбое его удаляют, поэтому журнал и fsync не нужны
+            self.conn.execute('PRAGMA journal_mode = OFF')
+            self.conn.execute('PRAGMA synchronous = OFF')
+            self.conn.execute('PRAGMA cache_size = -262144')
+            indexes = self.drop_indexes()
+            self.offsets = {
+                table: self.conn.execute(f'SELECT IFNULL(MAX(id), 0) FROM {table}').fetchone()[0]
+                for table in ID_TABLES
+            }
+
+            self.generate_catalog()
+            self.generate_supply()
+            self.generate_users()
+            self.generate_promotions()
+            self.generate_orders()
+            self.generate_carts()
+            self.generate_operations()
+            self.generate_balances()
+            self.flush_all()
+
+            self.conn.commit()
+            logging.info(f"Строки записаны за {time.time() - started:.0f} с, построение индексов")
+            for sql in indexes:
+                self.conn.execute(sql)
+            self.conn.execute('ANALYZE')
+            self.conn.commit()
+        except Exception:
+            self.conn.close()
+            os.remove(self.db_path)
+            raise
+        self.conn.close()
+
+        logging.info(
+            f"База {self.db_path}: {sum(self.counts.values())} строк за {time.time() - started:.0f} с, "
+            f"{os.path.getsize(self.db_path) / 1024 / 1024:.0f} МБ"
+        )
+        return self.counts
+
+    def drop_indexes(self):
+        """Вторичные индексы удаляются на время загрузки и строятся заново одним проходом"""
+        indexes = self.conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+        ).fetchall()
+        for name, _ in indexes:
+            self.conn.execute(f'DROP INDEX {name}')
+        return [sql for _, sql in indexes]
+
+    def generate_catalog(self):
+        """Категории, подкатегории и товары; популярность товара ~ 1 / ранг^s в случайном порядке"""
+        rng = self.random
+        categories = dict(self.conn.execute('SELECT name, id FROM categories'))
+        subcategories = {(name, category_id): subcategory_id for subcategory_id, name, category_id
+                         in self.conn.execute('SELECT id, name, category_id FROM subcategories')}
+        category_id = self.offsets['categories']
+        subcategory_id = self.offsets['subcategories']
+        groups = []
+        for name, emoji, subs, brands, base_price in CATALOG:
+            if name not in categories:
+                category_id += 1
+                categories[name] = category_id
+                self.add('categories', (category_id, name, ', '.join(subs), emoji, self.started_at))
+            for sub in subs:
+                if (sub, categories[name]) not in subcategories:
+                    subcategory_id += 1
+                    subcategories[(sub, categories[name])] = subcategory_id
+                    self.add('subcategories', (subcategory_id, sub, categories[name], emoji, self.started_at))
+                groups.append((categories[name], subcategories[(sub, categories[name])], sub, brands, base_price))
+
+        self.prices = {}
+        self.product_names = {}
+        self.active_products = []
+        product_id = self.offsets['products']
+        for _ in range(self.scale['products']):
+            product_id += 1
+            category, subcategory, sub, brands, base_price = rng.choice(groups)
+            brand = rng.choice(brands)
+            name = f"{sub} {brand} {rng.choice(INITIALS)}{rng.randint(10, 9999)}"
+            price = max(round(base_price * rng.lognormvariate(0, 0.6)), 2) - 0.01
+            image_url = f"https://cdn.example.com/products/{product_id}/1.jpg"
+            active = rng.random() < 0.97
+            created_at = f"{self.dates[0] - timedelta(days=rng.randint(1, 365))} 10:00:00"
+            self.add('products', (
+                product_id, name, f"{sub}: {brand}, модель {name.rsplit(' ', 1)[1]}", price, category, subcategory, brand,
+                image_url, 0 if rng.random() < 0.05 else rng.randint(1, 500), 1 if active else 0,
+                round(price * rng.uniform(0.45, 0.75), 2), round(price * 1.2, 2) if rng.random() < 0.2 else None,
+                created_at, created_at
+            ))
+            for sort_order in range(rng.randint(1, 3)):
+                self.add('product_images', (
+                    product_id, f"https://cdn.example.com/products/{product_id}/{sort_order + 1}.jpg", sort_order, created_at
+                ))
+            self.prices[product_id] = price
+            self.product_names[product_id] = (sub, brand)
+            if active:
+                self.active_products.append(product_id)
+
+        ranked = list(self.prices)
+        rng.shuffle(ranked)
+        exponent = DATA_GENERATOR_CONFIG['popularity_exponent']
+        self.popular_ids = ranked
+        self.popular_cum = list(accumulate(1 / (rank + 1) ** exponent for rank in range(len(ranked))))
+        self.sales = dict.fromkeys(ranked, 0)
+
+    def generate_supply(self):
+        """Поставщики, правила пополнения, закупки и приходы на склад"""
+        rng = self.random
+        supplier_ids = []
+        supplier_id = self.offsets['suppliers']
+        for index in range(max(5, self.scale['products'] // 500)):
+            supplier_id += 1
+            supplier_ids.append(supplier_id)
+            self.add('suppliers', (
+                supplier_id, f"Поставщик {index + 1}", f"supplier{supplier_id}@example.com",
+                f"+99871{rng.randrange(10 ** 7):07d}", f"{rng.choice(CITIES)[0]}, склад {index + 1}",
+                rng.choice(['prepaid', 'net15', 'net30']), 0, self.started_at
+            ))
+
+        for product_id, price in self.prices.items():
+            supplier = rng.choice(supplier_ids)
+            cost = round(price * rng.uniform(0.45, 0.75), 2)
+            if rng.random() < 0.3:
+                self.add('inventory_rules', (product_id, rng.randint(5, 30), rng.randint(50, 300), supplier, self.started_at))
+            level = rng.randint(0, 50)
+            for day in sorted(rng.sample(self.dates, min(rng.randint(0, 3), len(self.dates)))):
+                quantity = rng.randint(20, 300)
+                created_at = f"{day} {rng.randint(8, 18):02d}:00:00"
+                if day >= self.end_date - timedelta(days=7):
+                    self.add('purchase_orders', (product_id, supplier, quantity, cost, round(quantity * cost, 2),
+                                                 'pending', 0, None, created_at))
+                    continue
+                delivered_at = f"{day + timedelta(days=rng.randint(2, 7))} 12:00:00"
+                self.add('purchase_orders', (product_id, supplier, quantity, cost, round(quantity * cost, 2),
+                                             'delivered', quantity, delivered_at, created_at))
+                self.add('inventory_movements', (product_id, 'inbound', quantity, level, level + quantity,
+                                                 supplier, cost, 'Поступление от поставщика', delivered_at))
+                level = max(level + quantity - rng.randint(0, quantity), 0)
+            if rng.random() < 0.1:
+                change = -rng.randint(1, 5)
+                self.add('inventory_movements', (product_id, 'adjustment', change, level, max(level + change, 0),
+                                                 None, None, 'Инвентаризация', f"{rng.choice(self.dates)} 19:00:00"))
+
+    def generate_users(self):
+        """Регистрации по дням с ростом; активность покупателя по распределению Парето"""
+        rng = self.random
+        channels, channel_weights = zip(*DATA_GENERATOR_CONFIG['channels'])
+        channel_cum = list(accumulate(channel_weights))
+        uz_share = DATA_GENERATOR_CONFIG['uz_share']
+        alpha = DATA_GENERATOR_CONFIG['user_activity_alpha']
+
+        self.user_cum = []
+        self.users_by_day = []
+        user_id = self.offsets['users']
+        weight = 0
+        for day, count in zip(self.dates, self.split(self.scale['users'], self.day_weights)):
+            for created_at in self.get_times(day, count):
+                user_id += 1
+                language = 'uz' if rng.random() < uz_share else 'ru'
+                self.add('users', (
+                    user_id, 7000000000 + user_id, f"{rng.choice(NAMES[language])} {rng.choice(INITIALS)}.",
+                    f"+998{rng.choice(['90', '91', '93', '94', '97', '99'])}{rng.randrange(10 ** 7):07d}"
+                    if rng.random() < 0.7 else None,
+                    f"user{user_id}@example.com" if rng.random() < 0.2 else None,
+                    language, created_at, self.pick(channels, channel_cum)
+                ))
+                # Редкие покупатели с большим числом заказов; потолок не дает одному забрать все заказы
+                weight += min(rng.paretovariate(alpha), 50)
+                self.user_cum.append(weight)
+            self.users_by_day.append(user_id - self.offsets['users'])
+
+    def generate_promotions(self):
+        """Промокоды, ключи партнеров, правила автоматизации и запланированные посты"""
+        rng = self.random
+        self.promos = []
+        promo_id = self.offsets['promo_codes']
+        for index in range(20 + self.scale['orders'] // 100000):
+            promo_id += 1
+            percent = rng.choice([5, 10, 15, 20, 25, 30])
+            min_amount = rng.choice([0, 50, 100, 200])
+            created = rng.choice(self.dates)
+            self.add('promo_codes', (
+                promo_id, f"SYN{index + 1:04d}", 'percentage', percent, min_amount,
+                f"{created + timedelta(days=rng.randint(14, 180))} 23:59:59", f"Скидка {percent}%", 1, f"{created} 09:00:00"
+            ))
+            self.promos.append((promo_id, percent, min_amount))
+        self.promo_uses = dict.fromkeys((promo[0] for promo in self.promos), 0)
+
+        self.api_keys = []
+        key_id = self.offsets['api_keys']
+        for name in ('marketplace_one', 'marketplace_two', 'b2b_partner'):
+            key_id += 1
+            self.api_keys.append(key_id)
+            self.add('api_keys', (key_id, name, f"sk_synthetic_{rng.getrandbits(64):016x}", 'products:read,orders:write',
+                                  self.started_at))
+
+        self.rules = []
+        rule_id = self.offsets['automation_rules']
+        for name, trigger in (('Брошенная корзина 24ч', 'cart_abandonment'), ('Юбилейный заказ', 'customer_milestone'),
+                              ('Снова в наличии', 'product_restock'), ('Сезонная распродажа', 'seasonal')):
+            rule_id += 1
+            self.rules.append((rule_id, trigger))
+            self.add('automation_rules', (rule_id, name, trigger, '{}', '{"send_message": true}', self.started_at))
+
+        self.posts = []
+        post_id = self.offsets['scheduled_posts']
+        for title in ('Новинки недели', 'Скидки дня', 'Подборка для дома'):
+            post_id += 1
+            self.posts.append(post_id)
+            self.add('scheduled_posts', (post_id, title, f"{title}: лучшие предложения магазина", self.started_at, self.started_at))
+
+    def generate_orders(self):
+        """Заказы по дням со всеми зависимыми строками: позиции, промокоды, оплаты, доставка,
+        уведомления, баллы, отзывы и поиски; статус зависит от возраста заказа
+        """
+        cfg = DATA_GENERATOR_CONFIG
+        rng = self.random
+        add = self.add
+        item_counts, item_weights = zip(*cfg['items_per_order'])
+        item_cum = list(accumulate(item_weights))
+        cities, city_weights = zip(*CITIES)
+        city_cum = list(accumulate(city_weights))
+        carriers = list(CARRIER_CONFIG['carriers'])
+        popular_ids, popular_cum = self.popular_ids, self.popular_cum
+        popular_total = popular_cum[-1]
+        user_cum = self.user_cum
+        prices = self.prices
+        sales = self.sales
+        points_rate = LOYALTY_CONFIG['points_rate']
+        activity_whole = int(cfg['activity_per_order'])
+        activity_part = cfg['activity_per_order'] - activity_whole
+        security_cum = list(accumulate(event[2] for event in SECURITY_EVENTS))
+
+        self.balances = {}
+        self.unread = {}
+        self.revenue = {}
+        order_id = self.offsets['orders']
+        shipment_id = self.offsets['shipments']
+        counts = self.split(self.scale['orders'], self.day_weights)
+        for index, (day, count) in enumerate(zip(self.dates, counts)):
+            age = len(self.dates) - index
+            signed_up = max(self.users_by_day[index], 1)
+            user_weight = user_cum[signed_up - 1]
+            points_expire = f"{day + timedelta(days=LOYALTY_CONFIG['points_ttl_days'])} 00:00:00"
+            delivered_day = day + timedelta(days=rng.randint(1, 5))
+            month = str(day)[:7]
+
+            for created_at in self.get_times(day, count):
+                order_id += 1
+                user_id = self.offsets['users'] + 1 + bisect(user_cum, rng.random() * user_weight, 0, signed_up - 1)
+
+                items = {}
+                for _ in range(item_counts[bisect(item_cum, rng.random() * item_cum[-1])]):
+                    product_id = popular_ids[bisect(popular_cum, rng.random() * popular_total)]
+                    items[product_id] = items.get(product_id, 0) + (1 if rng.random() < 0.85 else rng.randint(2, 3))
+                subtotal = round(sum(prices[product_id] * quantity for product_id, quantity in items.items()), 2)
+
+                if rng.random() < cfg['cancel_share']:
+                    status = 'cancelled'
+                elif age > 10:
+                    status = 'delivered'
+                elif age > 3:
+                    status = 'delivered' if rng.random() < 0.5 else 'shipped'
+                elif age > 1:
+                    status = 'shipped' if rng.random() < 0.5 else 'confirmed'
+                else:
+                    status = 'pending' if rng.random() < 0.6 else 'confirmed'
+                online = rng.random() < cfg['online_share']
+                if status == 'cancelled':
+                    payment_status = 'failed' if online else 'pending'
+                elif status == 'delivered' or online and status != 'pending':
+                    payment_status = 'paid'
+                else:
+                    payment_status = 'pending'
+
+                discount = 0
+                if rng.random() < cfg['promo_share']:
+                    promo_id, percent, min_amount = self.promos[int(len(self.promos) * rng.random() ** 2)]
+                    if subtotal >= min_amount:
+                        discount = round(subtotal * percent / 100, 2)
+                        add('promo_uses', (promo_id, user_id, order_id, discount, created_at))
+                        self.promo_uses[promo_id] += 1
+                delivery_cost = 0 if subtotal >= 100 else 5.0
+                total = round(subtotal - discount + delivery_cost, 2)
+                city = cities[bisect(city_cum, rng.random() * city_cum[-1])]
+
+                add('orders', (
+                    order_id, user_id, total, status, f"{city}, {rng.choice(STREETS)}, {rng.randint(1, 150)}",
+                    'online' if online else 'cash', payment_status, discount, delivery_cost, created_at
+                ))
+                for product_id, quantity in items.items():
+                    add('order_items', (order_id, product_id, quantity, prices[product_id], created_at))
+                    if status != 'cancelled':
+                        sales[product_id] += quantity
+                    if status == 'delivered' and rng.random() < cfg['review_share']:
+                        rating = 5 if rng.random() < 0.55 else rng.choice([1, 2, 3, 4, 4, 4])
+                        add('reviews', (user_id, product_id, rating, 'Отличный товар' if rating >= 4 else 'Ожидал большего',
+                                        f"{delivered_day} 20:00:00"))
+                if status != 'cancelled':
+                    self.revenue[month] = self.revenue.get(month, 0) + total
+
+                if online:
+                    provider = 'payme' if rng.random() < 0.55 else 'click'
+                    paid = payment_status == 'paid'
+                    add('payment_intents', (
+                        order_id, provider, f"order-{order_id}-{provider}", total,
+                        'paid' if paid else payment_status, f"syn-{order_id}" if paid else None,
+                        f"{day} 23:59:59", created_at, created_at
+                    ))
+                    if paid and rng.random() < cfg['webhook_log_share']:
+                        add('webhook_logs', (provider, order_id, user_id, 'success', created_at))
+
+                if status in ('shipped', 'delivered'):
+                    shipment_id += 1
+                    add('shipments', (
+                        shipment_id, order_id, f"SYN{order_id:010d}", rng.choice(carriers),
+                        'express' if rng.random() < 0.2 else 'standard', status, f"{delivered_day} 18:00:00", created_at
+                    ))
+                    if age <= cfg['history_days']:
+                        add('shipment_status_history', (shipment_id, 'shipped', 'Передано в службу доставки', city,
+                                                        created_at, created_at))
+                        if status == 'delivered':
+                            add('shipment_status_history', (shipment_id, 'delivered', 'Вручено получателю', city,
+                                                            f"{delivered_day} 15:00:00", f"{delivered_day} 15:00:00"))
+                    if status == 'shipped':
+                        add('shipment_tracking', (shipment_id, created_at, created_at, f"{self.end_date} 12:00:00"))
+
+                if rng.random() < cfg['partner_share']:
+                    add('api_orders', (rng.choice(self.api_keys), f"EXT-{order_id}", order_id, created_at))
+
+                read = age > 7 or rng.random() < 0.5
+                add('notifications', (user_id, ORDER_NOTIFICATIONS[status], f"Заказ #{order_id} на сумму {total}",
+                                      'order', 1 if read else 0, created_at))
+                if not read:
+                    self.unread[user_id] = self.unread.get(user_id, 0) + 1
+
+                if status == 'delivered':
+                    balance = self.balances.get(user_id, (0, 0))
+                    points = int(total * points_rate)
+                    if points:
+                        add('loyalty_transactions', (user_id, points, 'accrual', order_id, points_expire, created_at))
+                        balance = (balance[0] + points, balance[1] + points)
+                    if balance[0] >= 200 and rng.random() < 0.2:
+                        add('loyalty_transactions', (user_id, -(balance[0] // 2), 'redeem', order_id, None, created_at))
+                        balance = (balance[0] - balance[0] // 2, balance[1])
+                    self.balances[user_id] = balance
+
+                for _ in range(activity_whole + (rng.random() < activity_part)):
+                    sub, brand = self.product_names[popular_ids[bisect(popular_cum, rng.random() * popular_total)]]
+                    if rng.random() < 0.6:
+                        add('user_activity_logs', (user_id, 'search', (sub if rng.random() < 0.5 else brand).lower(), created_at))
+                    else:
+                        add('user_activity_logs', (user_id, 'view_product', None, created_at))
+
+            # Журнал безопасности и рассылки постов - пропорционально аудитории на этот день
+            for created_at in self.get_times(day, signed_up // 2000 + rng.randint(0, 2)):
+                activity, severity, _ = self.pick(SECURITY_EVENTS, security_cum)
+                add('security_logs', (self.offsets['users'] + 1 + rng.randrange(signed_up), activity,
+                                      'Сгенерированное событие', severity, created_at))
+            for post_id in self.posts:
+                for period, hour in (('morning', '09'), ('afternoon', '14'), ('evening', '20')):
+                    errors = rng.randint(0, signed_up // 500 + 1)
+                    add('post_statistics', (post_id, period, signed_up - errors, errors, f"{day} {hour}:00:00"))
+
+    def generate_carts(self):
+        """Брошенные корзины (чаще недавние) и избранное активных товаров"""
+        rng = self.random
+        cfg = DATA_GENERATOR_CONFIG
+        users = self.scale['users']
+        end = datetime.combine(self.end_date, datetime.min.time())
+        cart_rule = next(rule_id for rule_id, trigger in self.rules if trigger == 'cart_abandonment')
+        # Те же ранги популярности, но только по активным товарам
+        active = set(self.active_products)
+        active_ids = [product_id for product_id in self.popular_ids if product_id in active]
+        active_cum = list(accumulate(1 / (rank + 1) ** cfg['popularity_exponent'] for rank in range(len(active_ids))))
+
+        for index in sorted(rng.sample(range(users), int(users * cfg['cart_share']))):
+            user_id = self.offsets['users'] + 1 + index
+            created_at = (end - timedelta(hours=int(1440 * rng.random() ** 2) + 1)).strftime('%Y-%m-%d %H:%M:%S')
+            for product_id in sorted({self.pick(active_ids, active_cum) for _ in range(rng.randint(1, 4))}):
+                self.add('cart', (user_id, product_id, 1 if rng.random() < 0.8 else 2, created_at))
+            if rng.random() < 0.3:
+                self.add('automation_executions', (cart_rule, user_id, 'cart_abandonment_24', created_at))
+
+        for index in sorted(rng.sample(range(users), int(users * cfg['favorites_share']))):
+            user_id = self.offsets['users'] + 1 + index
+            created_at = f"{rng.choice(self.dates)} 12:00:00"
+            for product_id in sorted({self.pick(active_ids, active_cum) for _ in range(rng.randint(1, 8))}):
+                self.add('favorites', (user_id, product_id, created_at))
+
+    def generate_operations(self):
+        """Расходы и кампании по месяцам от выручки, блокировки пользователей"""
+        rng = self.random
+        for month, revenue in sorted(self.revenue.items()):
+            for expense_type, share in EXPENSE_SHARES:
+                self.add('business_expenses', (
+                    expense_type, round(revenue * share * rng.uniform(0.8, 1.2), 2), f"{expense_type} за {month}",
+                    f"{month}-01", f"{month}-01 10:00:00"
+                ))
+            for segment, campaign_type in (('champions', 'loyalty'), ('at_risk', 'win_back')):
+                self.add('marketing_campaigns', (f"{campaign_type.title()} для {segment}", segment, campaign_type,
+                                                 rng.randint(100, 5000), f"{month}-05 10:00:00"))
+
+        for index in rng.sample(range(self.scale['users']), self.scale['users'] // 1000):
+            created = rng.choice(self.dates)
+            self.add('security_blocks', (self.offsets['users'] + 1 + index, rng.choice(['spam', 'rate_limit', 'fraud']),
+                                         f"{created + timedelta(days=1)} 00:00:00", f"{created} 12:00:00"))
+
+    def generate_balances(self):
+        """Итоги, которые приложение ведет счетчиками: баллы и уровни, непрочитанные, промокоды, продажи"""
+        tiers = sorted(LOYALTY_CONFIG['tiers'], key=lambda tier: -tier[1])
+        now = f"{self.end_date} 00:00:00"
+        for user_id, (points, earned) in sorted(self.balances.items()):
+            tier = next(name for name, threshold in tiers if points >= threshold)
+            self.add('loyalty_points', (user_id, points, earned, tier, now, now))
+            if tier != LOYALTY_CONFIG['tiers'][0][0]:
+                self.add('loyalty_tier_events', (user_id, LOYALTY_CONFIG['tiers'][0][0], tier, now))
+        for user_id, unread in sorted(self.unread.items()):
+            self.add('notification_counters', (user_id, unread))
+        for promo_id, uses in self.promo_uses.items():
+            self.add('promo_usage_counters', (promo_id, uses))
+
+        self.flush_all()
+        rng = self.random
+        self.conn.executemany(
+            'UPDATE products SET sales_count = ?, views = ? WHERE id = ?',
+            ((sold, sold * rng.randint(10, 40) + rng.randint(0, 100), product_id) for product_id, sold in self.sales.items())
+        )
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Генерация синтетической базы магазина заданного масштаба')
+    parser.add_argument('--db', default=DATA_GENERATOR_CONFIG['db_path'])
+    parser.add_argument('--scale', default=DATA_GENERATOR_CONFIG['default_scale'], choices=DATA_GENERATOR_CONFIG['scales'])
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--products', type=int)
+    parser.add_argument('--orders', type=int)
+    parser.add_argument('--days', type=int)
+    parser.add_argument('--seed', type=int, default=DATA_GENERATOR_CONFIG['seed'])
+    parser.add_argument('--end-date', help='последний день данных YYYY-MM-DD (по умолчанию сегодня)')
+    parser.add_argument('--force', action='store_true', help='перезаписать существующий файл')
+    args = parser.parse_args()
+
+    if os.path.abspath(args.db) == os.path.abspath('shop_bot.db'):
+        parser.error('рабочая база shop_bot.db не перезаписывается')
+    if args.force and os.path.exists(args.db):
+        os.remove(args.db)
+
+    scale = dict(DATA_GENERATOR_CONFIG['scales'][args.scale])
+    scale.update({key: getattr(args, key) for key in ('users', 'products', 'orders', 'days') if getattr(args, key)})
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d').date() if args.end_date else None
+
+    counts = DataGenerator(args.db, scale, args.seed, end_date).generate()
+    for table, count in sorted(counts.items(), key=lambda item: -item[1]):
+        if count:
+            logging.info(f"  {table}: {count}")
@@ -0,0 +1,295 @@
+"""
+Хранение растущих таблиц: перенос старых строк в помесячные файлы архива, представления с историей и освобождение места
+"""
+import logging
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from config import RETENTION_CONFIG
+
+class RetentionManager:
+    def __init__(self, db):
+        self.db = db
+        self.archive_dir = os.path.join(os.path.dirname(os.path.abspath(db.db_path)), RETENTION_CONFIG['archive_dir'])
+        self.archive_prefix = os.path.splitext(os.path.basename(db.db_path))[0]
+        self.metrics = {'runs': 0, 'moved': {}, 'freed_pages': 0, 'last_run': None, 'last_duration': None}
+        self.stop_event = threading.Event()
+        self.scheduler_thread = None
+
+    def get_archive_path(self, month):
+        """Файл архива месяца: <база>_YYYY_MM.db"""
+        return os.path.join(self.archive_dir, f"{self.archive_prefix}_{month.replace('-', '_')}.db")
+
+    def get_archive_files(self, since=None):
+        """[(месяц YYYY-MM, путь)] по возрастанию; since - дата, с месяца которой нужна история"""
+        pattern = re.compile(re.escape(self.archive_prefix) + r'_(\d{4})_(\d{2})\.db$')
+        files = []
+        for path in glob.glob(os.path.join(self.archive_dir, f"{self.archive_prefix}_*.db")):
+            match = pattern.search(os.path.basename(path))
+            if match:
+                month = f"{match.group(1)}-{match.group(2)}"
+                if not since or month >= since[:7]:
+                    files.append((month, path))
+        return sorted(files)
+
+    def get_columns(self, conn, schema, table):
+        return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+    def ensure_archive_table(self, conn, alias, table):
+        """Таблица в архиве по схеме основной; столбцы, добавленные позже, дописываются"""
+        sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        conn.execute(re.sub(r'^CREATE TABLE\s+("?)' + table + r'\1', f'CREATE TABLE IF NOT EXISTS {alias}.{table}', sql, count=1))
+
+        archived = set(self.get_columns(conn, alias, table))
+        for column in self.get_columns(conn, 'main', table):
+            if column not in archived:
+                conn.execute(f'ALTER TABLE {alias}.{table} ADD COLUMN {column}')
+
+        column = RETENTION_CONFIG['policies'][table]['column']
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {alias}.idx_{table}_{column} ON {table}({column})')
+
+    def archive_table(self, conn, table, policy, now):
+        """Перенос строк старше keep_days порциями; каждая порция - одна транзакция на основную базу и архив"""
+        cutoff = (now - timedelta(days=policy['keep_days'])).strftime('%Y-%m-%d %H:%M:%S')
+        column = policy['column']
+        condition = f"{column} < ?" + (f" AND ({policy['where']})" if policy.get('where') else '')
+        columns = ', '.join(self.get_columns(conn, 'main', table))
+        # Основная база занимает одно место из лимита присоединенных
+        max_months = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - 1 if hasattr(conn, 'getlimit') else 9
+        moved = 0
+
+        while not self.stop_event.is_set():
+            # Старые строки в начале таблицы: выборка по id останавливается после chunk_size совпадений
+            rows = conn.execute(f'''
+                SELECT id, substr({column}, 1, 7) FROM {table}
+                WHERE {condition}
+                ORDER BY id
+                LIMIT ?
+            ''', (cutoff, RETENTION_CONFIG['chunk_size'])).fetchall()
+            if not rows:
+                break
+
+            months = {}
+            for row_id, month in rows:
+                months.setdefault(month, []).append(row_id)
+            months = dict(sorted(months.items())[:max_months])
+
+            # ATTACH невозможен внутри транзакции
+            os.makedirs(self.archive_dir, exist_ok=True)
+            aliases = {}
+            for month in months:
+                alias = f"archive_{month.replace('-', '_')}"
+                conn.execute('ATTACH DATABASE ? AS ' + alias, (self.get_archive_path(month),))
+                aliases[month] = alias
+
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    for month, ids in months.items():
+                        alias = aliases[month]
+                        self.ensure_archive_table(conn, alias, table)
+                        conn.execute('DELETE FROM temp.retention_ids')
+                        conn.executemany('INSERT INTO temp.retention_ids (id) VALUES (?)', ((row_id,) for row_id in ids))
+                        conn.execute(f'''
+                            INSERT OR IGNORE INTO {alias}.{table} ({columns})
+                            SELECT {columns} FROM main.{table}
+                            WHERE id IN (SELECT id FROM temp.retention_ids) AND {condition}
+                        ''', (cutoff,))
+                        # Удаляется только то, что уже лежит в архиве (в том числе после прерванного переноса)
+                        moved += conn.execute(f'''
+                            DELETE FROM main.{table}
+                            WHERE id IN (
+                                SELECT id FROM {alias}.{table} WHERE id IN (SELECT id FROM temp.retention_ids)
+                            )
+                        ''').rowcount
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            finally:
+                for alias in aliases.values():
+                    conn.execute('DETACH DATABASE ' + alias)
+
+            time.sleep(RETENTION_CONFIG['pause'])
+
+        return moved
+
+    def enable_incremental_vacuum(self):
+        """Базе, созданной без auto_vacuum, режим включается одним полным VACUUM.
+        Обслуживание при остановленном боте: python data_retention.py --enable-incremental-vacuum
+        """
+        conn = sqlite3.connect(self.db.db_path, timeout=30, isolation_level=None)
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return False
+
+            logging.info("Включение incremental auto_vacuum: однократный VACUUM основной базы")
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            return True
+        finally:
+            conn.close()
+
+    def vacuum(self, conn):
+        """Возврат свободных страниц файлу порциями по vacuum_pages, без блокировки на весь VACUUM"""
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        remaining = free_pages
+        while remaining and not self.stop_event.is_set():
+            # executescript выполняет PRAGMA до конца; execute освободил бы одну страницу
+            conn.executescript(f"PRAGMA incremental_vacuum({RETENTION_CONFIG['vacuum_pages']});")
+            remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            time.sleep(RETENTION_CONFIG['pause'])
+        return free_pages - remaining
+
+    def run(self, tables=None):
+        """Архивация таблиц по политикам. Возвращает {таблица: перенесено строк}"""
+        started = time.time()
+        now = datetime.now()
+        result = {}
+
+        # Транзакции управляются явно: ATTACH и VACUUM недопустимы внутри транзакции
+        conn = sqlite3.connect(self.db.db_path, timeout=30, isolation_level=None)
+        try:
+            # Полный VACUUM по расписанию не запускается: он блокирует базу на все время перестройки
+            incremental = conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+            if not incremental and not self.metrics['runs']:
+                logging.info("База без incremental auto_vacuum: место после архивации не освобождается, "
+                             "выполните python data_retention.py --enable-incremental-vacuum при остановленном боте")
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS retention_ids (id INTEGER PRIMARY KEY)')
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+            for table, policy in RETENTION_CONFIG['policies'].items():
+                if (tables and table not in tables) or table not in existing or self.stop_event.is_set():
+                    continue
+                try:
+                    result[table] = self.archive_table(conn, table, policy, now)
+                    if result[table] and incremental:
+                        self.metrics['freed_pages'] += self.vacuum(conn)
+                        self.metrics['moved'][table] = self.metrics['moved'].get(table, 0) + result[table]
+                except Exception as e:
+                    logging.info(f"Ошибка архивации {table}: {e}")
+        finally:
+            conn.close()
+
+        self.metrics['runs'] += 1
+        self.metrics['last_run'] = now.strftime('%Y-%m-%d %H:%M:%S')
+        self.metrics['last_duration'] = round(time.time() - started, 2)
+
+        if any(result.values()):
+            logging.info(f"Архивация: {', '.join(f'{table} {count}' for table, count in result.items() if count)}")
+        return result
+
+    def attach_archives(self, conn, files):
+        aliases = []
+        for month, path in files:
+            alias = f"archive_{month.replace('-', '_')}"
+            conn.execute('ATTACH DATABASE ? AS ' + alias, (path,))
+            aliases.append(alias)
+        return aliases
+
+    def archived_tables(self, conn, aliases, table):
+        return [
+            alias for alias in aliases
+            if conn.execute(f"SELECT 1 FROM {alias}.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        ]
+
+    @contextmanager
+    def history(self, tables, since=None):
+        """Соединение с временными представлениями <таблица>_history: основная база + архивы.
+        since - дата, с месяца которой нужны архивы. Архивы сверх лимита присоединенных баз
+        (10 в стандартной сборке SQLite) копируются во временные таблицы соединения.
+        """
+        conn = sqlite3.connect(self.db.db_path, timeout=30)
+        try:
+            max_months = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - 1 if hasattr(conn, 'getlimit') else 9
+            files = self.get_archive_files(since)
+            overflow, files = files[:-max_months] if len(files) > max_months else [], files[-max_months:]
+            columns = {table: ', '.join(self.get_columns(conn, 'main', table)) for table in tables}
+
+            for start in range(0, len(overflow), max_months):
+                aliases = self.attach_archives(conn, overflow[start:start + max_months])
+                for table in tables:
+                    conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {table}_archived AS SELECT {columns[table]} FROM main.{table} WHERE 0')
+                    for alias in self.archived_tables(conn, aliases, table):
+                        conn.execute(f'INSERT INTO temp.{table}_archived SELECT {columns[table]} FROM {alias}.{table}')
+                conn.commit()
+                for alias in aliases:
+                    conn.execute('DETACH DATABASE ' + alias)
+
+            aliases = self.attach_archives(conn, files)
+            for table in tables:
+                parts = [f'SELECT {columns[table]} FROM main.{table}']
+                if overflow:
+                    parts.append(f'SELECT {columns[table]} FROM temp.{table}_archived')
+                parts.extend(f'SELECT {columns[table]} FROM {alias}.{table}' for alias in self.archived_tables(conn, aliases, table))
+                conn.execute(f'CREATE TEMP VIEW {table}_history AS ' + ' UNION ALL '.join(parts))
+
+            yield conn
+        finally:
+            conn.close()
+
+    def iterate_history(self, tables, query, params=None, since=None, chunk_size=1000):
+        """Построчная выборка по представлениям *_history (как DatabaseManager.iterate_query)"""
+        with self.history(tables, since) as conn:
+            cursor = conn.execute(query, params or ())
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+
+    def get_stats(self):
+        """Метрики архивации и размеры файлов"""
+        files = self.get_archive_files()
+        return {
+            **self.metrics,
+            'database_size': os.path.getsize(self.db.db_path) if os.path.exists(self.db.db_path) else 0,
+            'archive_files': len(files),
+            'archive_size': sum(os.path.getsize(path) for _, path in files)
+        }
+
+    def start_scheduler(self):
+        """Фоновая архивация: первая после first_run_delay, далее раз в run_interval_hours"""
+        if self.scheduler_thread and self.scheduler_thread.is_alive():
+            return
+
+        def retention_worker():
+            delay = RETENTION_CONFIG['first_run_delay']
+            while not self.stop_event.wait(delay):
+                try:
+                    self.run()
+                except Exception as e:
+                    logging.info(f"Ошибка архивации: {e}")
+                delay = RETENTION_CONFIG['run_interval_hours'] * 3600
+
+        self.stop_event.clear()
+        self.scheduler_thread = threading.Thread(target=retention_worker, daemon=True)
+        self.scheduler_thread.start()
+
+    def stop_scheduler(self):
+        self.stop_event.set()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Архивация растущих таблиц и обслуживание файла базы')
+    parser.add_argument('--db', default='shop_bot.db')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='однократный полный VACUUM для включения incremental auto_vacuum (бот должен быть остановлен)')
+    parser.add_argument('--run', action='store_true', help='выполнить архивацию сейчас')
+    args = parser.parse_args()
+
+    from database import DatabaseManager
+
+    manager = RetentionManager(DatabaseManager(args.db))
+    if args.enable_incremental_vacuum and not manager.enable_incremental_vacuum():
+        logging.info("incremental auto_vacuum уже включен")
+    if args.run:
+        manager.run()
+    logging.info(manager.get_stats())
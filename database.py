@@ -4,10 +4,19 @@
 import logging
 
 import sqlite3
+import time
+from contextlib import contextmanager
+from migrations import apply_migrations
+from query_profiler import profiler, ProfiledConnection
+
+# Отладочные записи горячих путей, включаются через LOG_MODULE_LEVELS=database=DEBUG
+db_logger = logging.getLogger('shop_bot.database')
 
 class DatabaseManager:
     def __init__(self, db_path='shop_bot.db'):
         self.db_path = db_path
+        self.loyalty_manager = None  # Общий LoyaltyManager бота (main.py), иначе создается при первом обращении
+        self.reservations = None  # ReservationManager склада (InventoryManager): отмена возвращает резерв
         self.init_database()
 
     def init_database(self):
@@ -16,9 +25,17 @@ class DatabaseManager:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
+            # Новая база освобождает место порциями после архивации (data_retention.py)
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            # Чтение (снимок для отчетов, выгрузки) не блокирует запись; режим сохраняется в файле базы
+            cursor.execute('PRAGMA journal_mode = WAL')
+            
             # Создаем все таблицы
             self.create_tables(cursor)
             
+            # Изменения схемы для уже работающих баз
+            apply_migrations(cursor)
+            
             # Создаем тестовые данные если база пустая
             if self.is_database_empty(cursor):
                 self.create_test_data(cursor)
@@ -145,6 +162,27 @@ CREATE TABLE IF NOT EXISTS order_items (
 )
         ''')
         
+        # Платежные намерения: один платеж на заказ и платежную систему
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS payment_intents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    provider TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    amount REAL NOT NULL,
+    status TEXT DEFAULT 'pending',
+    payment_url TEXT,
+    provider_reference TEXT,
+    error TEXT,
+    attempts INTEGER DEFAULT 0,
+    expires_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP,
+    UNIQUE (order_id, provider),
+    FOREIGN KEY (order_id) REFERENCES orders (id)
+)
+        ''')
+        
         # Подкатегории/бренды
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS subcategories (
@@ -199,6 +237,15 @@ CREATE TABLE IF NOT EXISTS notifications (
 )
         ''')
         
+        # Счетчики непрочитанных уведомлений: обновляются при записи, бейдж не сканирует notifications
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS notification_counters (
+    user_id INTEGER PRIMARY KEY,
+    unread INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+)
+        ''')
+        
         # Баллы лояльности
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS loyalty_points (
@@ -213,6 +260,34 @@ CREATE TABLE IF NOT EXISTS loyalty_points (
 )
         ''')
         
+        # Журнал операций с баллами (только добавление)
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS loyalty_transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    order_id INTEGER,
+    expires_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    FOREIGN KEY (order_id) REFERENCES orders (id)
+)
+        ''')
+        
+        # Смены уровня лояльности для уведомлений
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS loyalty_tier_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    old_tier TEXT,
+    new_tier TEXT NOT NULL,
+    notified INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+)
+        ''')
+        
         # Промокоды
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS promo_codes (
@@ -244,6 +319,15 @@ CREATE TABLE IF NOT EXISTS promo_uses (
 )
         ''')
         
+        # Счетчики использований промокодов
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS promo_usage_counters (
+    promo_code_id INTEGER PRIMARY KEY,
+    uses_count INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (promo_code_id) REFERENCES promo_codes (id)
+)
+        ''')
+        
         # Отгрузки
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS shipments (
@@ -261,6 +345,32 @@ CREATE TABLE IF NOT EXISTS shipments (
 )
         ''')
         
+        # История статусов отправлений от служб доставки
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS shipment_status_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    shipment_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    description TEXT,
+    location TEXT,
+    event_time TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (shipment_id, event_time, status),
+    FOREIGN KEY (shipment_id) REFERENCES shipments (id)
+)
+        ''')
+        
+        # Расписание опроса служб по отправлениям в пути
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS shipment_tracking (
+    shipment_id INTEGER PRIMARY KEY,
+    last_event_at TIMESTAMP,
+    last_checked_at TIMESTAMP,
+    next_check_at TIMESTAMP,
+    FOREIGN KEY (shipment_id) REFERENCES shipments (id)
+)
+        ''')
+        
         # Бизнес расходы
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS business_expenses (
@@ -402,6 +512,20 @@ CREATE TABLE IF NOT EXISTS api_keys (
 )
         ''')
         
+        # Заказы, созданные через API партнеров: внешний номер уникален для ключа
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS api_orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    api_key_id INTEGER NOT NULL,
+    external_id TEXT NOT NULL,
+    order_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(api_key_id, external_id),
+    FOREIGN KEY (api_key_id) REFERENCES api_keys (id),
+    FOREIGN KEY (order_id) REFERENCES orders (id)
+)
+        ''')
+        
         # Логи webhook'ов
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS webhook_logs (
@@ -418,6 +542,25 @@ CREATE TABLE IF NOT EXISTS webhook_logs (
 )
         ''')
         
+        # Входящие webhook'и: исходное событие до обработки, повторы и dead-letter
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    provider TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    event_type TEXT,
+    order_id INTEGER,
+    payload TEXT NOT NULL,
+    status TEXT DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at TIMESTAMP,
+    last_error TEXT,
+    received_at TIMESTAMP,
+    processed_at TIMESTAMP,
+    UNIQUE (provider, event_id)
+)
+        ''')
+        
         # Маркетинговые кампании
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS marketing_campaigns (
@@ -494,6 +637,49 @@ CREATE TABLE IF NOT EXISTS flash_sale_products (
 )
         ''')
         
+        # Флеш-распродажи с выделенным товаром
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS flash_sales (
+    promo_code_id INTEGER PRIMARY KEY,
+    per_user_limit INTEGER NOT NULL,
+    hold_minutes INTEGER NOT NULL,
+    status TEXT DEFAULT 'active',
+    started_at TIMESTAMP,
+    ends_at TIMESTAMP,
+    ended_at TIMESTAMP,
+    FOREIGN KEY (promo_code_id) REFERENCES promo_codes (id)
+)
+        ''')
+        
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS flash_sale_allocations (
+    promo_code_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    allocated INTEGER NOT NULL,
+    PRIMARY KEY (promo_code_id, product_id),
+    FOREIGN KEY (promo_code_id) REFERENCES promo_codes (id),
+    FOREIGN KEY (product_id) REFERENCES products (id)
+)
+        ''')
+        
+        # Заявки покупателей флеш-распродаж
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS flash_sale_claims (
+    claim_id TEXT PRIMARY KEY,
+    promo_code_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    order_id INTEGER,
+    expires_at TIMESTAMP,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    FOREIGN KEY (promo_code_id) REFERENCES promo_codes (id),
+    FOREIGN KEY (product_id) REFERENCES products (id)
+)
+        ''')
+        
         # Запланированные посты
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS scheduled_posts (
@@ -514,6 +700,76 @@ CREATE TABLE IF NOT EXISTS scheduled_posts (
 )
         ''')
         
+        # Слои себестоимости: каждое поступление - отдельный слой
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS cost_layers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_cost REAL NOT NULL,
+    fifo_remaining INTEGER NOT NULL,
+    lifo_remaining INTEGER NOT NULL,
+    source TEXT,
+    reference_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products (id)
+)
+        ''')
+        
+        # Списания себестоимости (продажи, корректировки, возвраты со знаком минус)
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS cost_consumptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    fifo_cost REAL NOT NULL,
+    lifo_cost REAL NOT NULL,
+    avg_cost REAL NOT NULL,
+    reference_type TEXT,
+    reference_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products (id)
+)
+        ''')
+        
+        # Текущие остатки и стоимость запасов по товару для каждого метода
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS product_cost_balances (
+    product_id INTEGER PRIMARY KEY,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    fifo_value REAL NOT NULL DEFAULT 0,
+    lifo_value REAL NOT NULL DEFAULT 0,
+    avg_value REAL NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products (id)
+)
+        ''')
+        
+        # Журнал изменений остатков (только добавление)
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS stock_deltas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    delta INTEGER NOT NULL,
+    stock_after INTEGER NOT NULL,
+    movement_type TEXT,
+    reference_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products (id)
+)
+        ''')
+        
+        # Снимки остатков
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    snapshot_at TIMESTAMP NOT NULL,
+    product_id INTEGER NOT NULL,
+    stock INTEGER NOT NULL,
+    last_delta_id INTEGER NOT NULL,
+    PRIMARY KEY (snapshot_at, product_id)
+) WITHOUT ROWID
+        ''')
+        
         # Статистика постов
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS post_statistics (
@@ -527,6 +783,16 @@ CREATE TABLE IF NOT EXISTS post_statistics (
 )
         ''')
         
+        # Примененные версионные миграции (migrations.py)
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    statements TEXT,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+        ''')
+        
         # Создаем индексы для оптимизации
         self.create_indexes(cursor)
     
@@ -537,12 +803,45 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             'CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id)',
             'CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)',
             'CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)',
-            'CREATE INDEX IF NOT EXISTS idx_cart_user ON cart(user_id)',
             'CREATE INDEX IF NOT EXISTS idx_reviews_product ON reviews(product_id)',
             'CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id)',
+            'CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications(user_id) WHERE is_read = 0',
             'CREATE INDEX IF NOT EXISTS idx_inventory_movements_product ON inventory_movements(product_id)',
             'CREATE INDEX IF NOT EXISTS idx_security_logs_user ON security_logs(user_id)',
-            'CREATE INDEX IF NOT EXISTS idx_automation_executions_user ON automation_executions(user_id)'
+            'CREATE INDEX IF NOT EXISTS idx_automation_executions_user ON automation_executions(user_id)',
+            # Постраничные списки веб-админки: фильтр + ключ сортировки (rowid добавляется неявно)
+            'CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_orders_amount ON orders(total_amount)',
+            'CREATE INDEX IF NOT EXISTS idx_orders_status_amount ON orders(status, total_amount)',
+            'CREATE INDEX IF NOT EXISTS idx_orders_user_amount ON orders(user_id, total_amount)',
+            'CREATE INDEX IF NOT EXISTS idx_products_created ON products(created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_products_category_created ON products(category_id, created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_products_price ON products(price)',
+            'CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock)',
+            'CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)',
+            # Открытые слои себестоимости в порядке списания
+            'CREATE INDEX IF NOT EXISTS idx_cost_layers_fifo ON cost_layers(product_id, id) WHERE fifo_remaining > 0',
+            'CREATE INDEX IF NOT EXISTS idx_cost_layers_lifo ON cost_layers(product_id, id) WHERE lifo_remaining > 0',
+            'CREATE INDEX IF NOT EXISTS idx_cost_consumptions_reference ON cost_consumptions(reference_type, reference_id)',
+            'CREATE INDEX IF NOT EXISTS idx_cost_consumptions_created ON cost_consumptions(created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_stock_deltas_product ON stock_deltas(product_id, id)',
+            'CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires ON stock_reservations(expires_at) WHERE expires_at IS NOT NULL',
+            'CREATE INDEX IF NOT EXISTS idx_stock_reservations_order ON stock_reservations(order_id)',
+            'CREATE INDEX IF NOT EXISTS idx_promo_uses_user ON promo_uses(user_id, promo_code_id)',
+            'CREATE INDEX IF NOT EXISTS idx_flash_sale_claims_sale ON flash_sale_claims(promo_code_id, status)',
+            'CREATE INDEX IF NOT EXISTS idx_loyalty_transactions_user ON loyalty_transactions(user_id)',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_loyalty_transactions_accrual ON loyalty_transactions(order_id) WHERE kind = \'accrual\'',
+            'CREATE INDEX IF NOT EXISTS idx_loyalty_transactions_expires ON loyalty_transactions(expires_at) WHERE kind = \'accrual\'',
+            'CREATE INDEX IF NOT EXISTS idx_loyalty_tier_events_pending ON loyalty_tier_events(id) WHERE notified = 0',
+            'CREATE INDEX IF NOT EXISTS idx_shipments_order ON shipments(order_id)',
+            'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)',
+            'CREATE INDEX IF NOT EXISTS idx_shipment_tracking_due ON shipment_tracking(next_check_at) WHERE next_check_at IS NOT NULL',
+            'CREATE INDEX IF NOT EXISTS idx_webhook_events_pending ON webhook_events(next_attempt_at) WHERE status = \'pending\'',
+            'CREATE INDEX IF NOT EXISTS idx_webhook_events_order ON webhook_events(order_id, id) WHERE status = \'pending\'',
+            'CREATE INDEX IF NOT EXISTS idx_webhook_events_dead ON webhook_events(id) WHERE status = \'dead\'',
+            'CREATE INDEX IF NOT EXISTS idx_api_orders_key_order ON api_orders(api_key_id, order_id)',
+            'CREATE INDEX IF NOT EXISTS idx_products_updated ON products(updated_at)'
         ]
         
         for index_sql in indexes:
@@ -664,6 +963,9 @@ CREATE TABLE IF NOT EXISTS post_statistics (
         INSERT -> lastrowid (int)
         UPDATE/DELETE -> rowcount (int)
         """
+        started = time.perf_counter()
+        rows = None
+        error = None
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
@@ -674,8 +976,10 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             q = query.strip().upper()
             if q.startswith('SELECT'):
                 result = cursor.fetchall()
+                rows = len(result)
             else:
                 conn.commit()
+                rows = max(cursor.rowcount, 0)
                 op = q.split()[0]
                 if op == 'INSERT':
                     result = cursor.lastrowid
@@ -683,11 +987,58 @@ CREATE TABLE IF NOT EXISTS post_statistics (
                     result = cursor.rowcount
             return result
         except Exception as e:
+            error = e
             logging.info(f"Ошибка выполнения запроса: {e}")
             return None
         finally:
             if 'conn' in locals():
                 conn.close()
+            profiler.record(self.db_path, query, params, time.perf_counter() - started, rows, error)
+
+    @contextmanager
+    def transaction(self):
+        """Соединение с одной транзакцией: commit при успехе, rollback и проброс ошибки при сбое"""
+        conn = sqlite3.connect(self.db_path, timeout=30, factory=ProfiledConnection)
+        conn.db_path = self.db_path
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def iterate_query(self, query, params=None, chunk_size=1000):
+        """Построчная выборка SELECT порциями по chunk_size без загрузки всего результата.
+        Ошибка пробрасывается вызывающему, чтобы выгрузка не обрывалась молча.
+        """
+        conn = sqlite3.connect(self.db_path)
+        # В профиль идет время execute и fetchmany, без обработки строк вызывающим
+        elapsed = 0
+        count = 0
+        error = None
+        try:
+            cursor = conn.cursor()
+            started = time.perf_counter()
+            cursor.execute(query, params or ())
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                elapsed += time.perf_counter() - started
+                if not rows:
+                    break
+                count += len(rows)
+                for row in rows:
+                    yield row
+                started = time.perf_counter()
+        except Exception as e:
+            error = e
+            logging.info(f"Ошибка построчной выборки: {e}")
+            raise
+        finally:
+            conn.close()
+            profiler.record(self.db_path, query, params, elapsed, count, error)
 
     def get_user_by_telegram_id(self, telegram_id):
         """Получение пользователя по telegram_id"""
@@ -757,9 +1108,9 @@ CREATE TABLE IF NOT EXISTS post_statistics (
         )
         return result[0] if result else None
     
-    def add_to_cart(self, user_id, product_id, quantity=1):
-        """Добавление товара в корзину"""
-        logging.info(f"DEBUG: add_to_cart вызван с user_id={user_id}, product_id={product_id}, quantity={quantity}")
+    def add_to_cart(self, user_id, product_id, quantity=1, claimed=0):
+        """Добавление товара в корзину. claimed - единиц в корзине, захваченных во флеш-распродаже (не из остатка)"""
+        db_logger.debug("add_to_cart: user_id=%s, product_id=%s, quantity=%s", user_id, product_id, quantity)
         
         # Проверяем наличие товара
         product = self.execute_query(
@@ -767,10 +1118,10 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             (product_id,)
         )
         
-        logging.info(f"DEBUG: Товар в базе: {product}")
+        db_logger.debug("Товар в базе: %s", product)
         
-        if not product or product[0][0] < quantity:
-            logging.info(f"DEBUG: Товар недоступен или недостаточно на складе")
+        if not product or product[0][0] < quantity - claimed:
+            db_logger.debug("Товар недоступен или недостаточно на складе")
             return None
         
         # Проверяем, есть ли уже товар в корзине
@@ -779,14 +1130,14 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             (user_id, product_id)
         )
         
-        logging.info(f"DEBUG: Существующий товар в корзине: {existing}")
+        db_logger.debug("Существующий товар в корзине: %s", existing)
         
         if existing:
             # Обновляем количество
             new_quantity = existing[0][1] + quantity
             # Проверяем не превышает ли новое количество остаток
-            if new_quantity > product[0][0]:
-                logging.info(f"DEBUG: Новое количество {new_quantity} превышает остаток {product[0][0]}")
+            if new_quantity - claimed > product[0][0]:
+                db_logger.debug("Новое количество %s превышает остаток %s", new_quantity, product[0][0])
                 return None
             
             # Обновляем количество и время
@@ -794,7 +1145,7 @@ CREATE TABLE IF NOT EXISTS post_statistics (
                 'UPDATE cart SET quantity = ?, created_at = CURRENT_TIMESTAMP WHERE id = ?',
                 (new_quantity, existing[0][0])
             )
-            logging.info(f"DEBUG: Обновление количества в корзине: {result}")
+            db_logger.debug("Обновление количества в корзине: %s", result)
             return existing[0][0]  # Возвращаем ID записи корзины
         else:
             # Добавляем новый товар
@@ -802,7 +1153,7 @@ CREATE TABLE IF NOT EXISTS post_statistics (
                 'INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)',
                 (user_id, product_id, quantity)
             )
-            logging.info(f"DEBUG: Добавление нового товара в корзину: {result}")
+            db_logger.debug("Добавление нового товара в корзину: %s", result)
             return result
     
     def get_cart_items(self, user_id):
@@ -866,12 +1217,42 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             }
         return None
     
-    def update_order_status(self, order_id, status):
-        """Обновление статуса заказа"""
-        return self.execute_query(
-            'UPDATE orders SET status = ? WHERE id = ?',
-            (status, order_id)
+    def update_order_status(self, order_id, status, only_if_unpaid=False):
+        """Обновление статуса заказа; вне pending резерв товара больше не истекает, отмена его возвращает.
+        only_if_unpaid - только заказ в pending без оплаты (снятие просроченных резервов).
+        """
+        try:
+            with self.transaction() as conn:
+                query = 'UPDATE orders SET status = ? WHERE id = ?'
+                if only_if_unpaid:
+                    query += " AND status = 'pending' AND IFNULL(payment_status, 'pending') != 'paid'"
+                updated = conn.execute(query, (status, order_id)).rowcount
+                
+                if updated and status == 'cancelled':
+                    if self.reservations:
+                        self.reservations.release(order_id, conn)
+                    self.release_order_promos(conn, order_id)
+                elif updated and status != 'pending':
+                    conn.execute(
+                        'UPDATE stock_reservations SET expires_at = NULL WHERE order_id = ? AND expires_at IS NOT NULL',
+                        (order_id,)
+                    )
+            return updated
+        except Exception as e:
+            logging.info(f"Ошибка обновления статуса заказа: {e}")
+            return None
+    
+    def release_order_promos(self, conn, order_id):
+        """Использования промокодов отмененным заказом возвращаются в лимит"""
+        uses = conn.execute(
+            'SELECT promo_code_id, COUNT(*) FROM promo_uses WHERE order_id = ? GROUP BY promo_code_id',
+            (order_id,)
+        ).fetchall()
+        conn.executemany(
+            'UPDATE promo_usage_counters SET uses_count = MAX(uses_count - ?, 0) WHERE promo_code_id = ?',
+            ((count, promo_code_id) for promo_code_id, count in uses)
         )
+        conn.execute('DELETE FROM promo_uses WHERE order_id = ?', (order_id,))
     
     def search_products(self, query, limit=10):
         """Поиск товаров"""
@@ -923,11 +1304,29 @@ CREATE TABLE IF NOT EXISTS post_statistics (
         ''', (user_id,))
     
     def add_notification(self, user_id, title, message, notification_type='info'):
-        """Добавление уведомления"""
-        return self.execute_query('''
-            INSERT INTO notifications (user_id, title, message, type)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, title, message, notification_type))
+        """Добавление уведомления вместе со счетчиком непрочитанных"""
+        try:
+            with self.transaction() as conn:
+                notification_id = conn.execute('''
+                    INSERT INTO notifications (user_id, title, message, type)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, title, message, notification_type)).lastrowid
+                conn.execute('''
+                    INSERT INTO notification_counters (user_id, unread) VALUES (?, 1)
+                    ON CONFLICT(user_id) DO UPDATE SET unread = unread + 1
+                ''', (user_id,))
+            return notification_id
+        except Exception as e:
+            logging.info(f"Ошибка добавления уведомления: {e}")
+            return None
+    
+    def get_unread_notifications_count(self, user_id):
+        """Число непрочитанных уведомлений из счетчика"""
+        result = self.execute_query(
+            'SELECT unread FROM notification_counters WHERE user_id = ?',
+            (user_id,)
+        )
+        return result[0][0] if result else 0
     
     def get_unread_notifications(self, user_id):
         """Получение непрочитанных уведомлений"""
@@ -939,37 +1338,53 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     
     def mark_notification_read(self, notification_id):
         """Отметка уведомления как прочитанного"""
-        return self.execute_query(
-            'UPDATE notifications SET is_read = 1 WHERE id = ?',
-            (notification_id,)
-        )
+        user = self.execute_query('SELECT user_id FROM notifications WHERE id = ?', (notification_id,))
+        if not user:
+            return 0
+        return self.mark_notifications_read(user[0][0], [notification_id])
+    
+    def mark_notifications_read(self, user_id, notification_ids=None):
+        """Отметка прочитанными одним запросом: переданных уведомлений или всех (notification_ids=None)"""
+        if notification_ids is not None and not notification_ids:
+            return 0
+        
+        query = 'UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0'
+        params = [user_id]
+        if notification_ids is not None:
+            query += f" AND id IN ({','.join('?' * len(notification_ids))})"
+            params.extend(notification_ids)
+        
+        try:
+            with self.transaction() as conn:
+                changed = conn.execute(query, params).rowcount
+                if changed:
+                    conn.execute(
+                        'UPDATE notification_counters SET unread = MAX(unread - ?, 0) WHERE user_id = ?',
+                        (changed, user_id)
+                    )
+            return changed
+        except Exception as e:
+            logging.info(f"Ошибка отметки уведомлений: {e}")
+            return 0
     
     def get_user_loyalty_points(self, user_id):
-        """Получение баллов лояльности"""
+        """Получение баллов лояльности (запись создается журналом при первой операции)"""
         result = self.execute_query(
             'SELECT * FROM loyalty_points WHERE user_id = ?',
             (user_id,)
         )
         
         if not result:
-            # Создаем запись если её нет
-            self.execute_query(
-                'INSERT INTO loyalty_points (user_id) VALUES (?)',
-                (user_id,)
-            )
-            return self.get_user_loyalty_points(user_id)
+            return (None, user_id, 0, 0, 'Bronze', None, None)
         
         return result[0]
     
     def update_loyalty_points(self, user_id, points_to_add):
-        """Обновление баллов лояльности"""
-        return self.execute_query('''
-            UPDATE loyalty_points 
-            SET current_points = current_points + ?,
-                total_earned = total_earned + ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-        ''', (points_to_add, points_to_add, user_id))
+        """Обновление баллов лояльности через журнал операций"""
+        if self.loyalty_manager is None:
+            from loyalty import LoyaltyManager
+            self.loyalty_manager = LoyaltyManager(self)
+        return self.loyalty_manager.add_points(user_id, points_to_add, 'accrual' if points_to_add > 0 else 'adjust')
     
     def remove_from_cart(self, cart_item_id):
         """Удаление товара из корзины"""
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Локальная имитация API служб доставки для проверки адаптеров carriers.py
+Служба определяется первым сегментом пути: /dhl/shipments/batch, /post/tracking/batch
+"""
+import logging
+import argparse
+import json
+import random
+import threading
+import time
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRACKING_PREFIXES = {'dhl': 'DHL', 'fedex': 'FX', 'ups': 'UPS', 'local_courier': 'LC', 'post': 'UZ'}
+
+# Этапы доставки после создания отправления
+TRACKING_STAGES = [
+    ('picked_up', 'Заказ забран курьером', 'Сортировочный центр'),
+    ('in_transit', 'В пути', 'Транспортный узел'),
+    ('out_for_delivery', 'Передан курьеру для доставки', 'Город получателя'),
+    ('delivered', 'Доставлено', 'Адрес получателя')
+]
+
+class FakeCarrierServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, stage_seconds=3600):
+        self.latency = latency  # Секунд на обработку запроса
+        self.failure_rate = failure_rate  # Доля запросов с ответом 503
+        self.stage_seconds = stage_seconds  # Секунд между этапами доставки
+        self.lock = threading.Lock()
+        self.responses = {}  # Idempotency-Key -> ответ
+        self.shipments = {}  # Трек-номер -> время создания
+        self.stats = {'requests': 0, 'connections': 0, 'shipments': 0, 'failures': 0, 'replayed': 0}
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def url(self, carrier):
+        """base_url для CARRIER_CONFIG"""
+        return f"http://{self.server.server_address[0]}:{self.port}/{carrier}"
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.stats['connections'] += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, data):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                carrier, _, path = self.path.strip('/').partition('/')
+                with fake.lock:
+                    fake.stats['requests'] += 1
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                if path not in ('shipments/batch', 'tracking/batch') or carrier not in TRACKING_PREFIXES:
+                    self.send_json(404, {'error': 'not found'})
+                    return
+
+                if random.random() < fake.failure_rate:
+                    with fake.lock:
+                        fake.stats['failures'] += 1
+                    self.send_json(503, {'error': 'service unavailable'})
+                    return
+
+                if path == 'tracking/batch':
+                    self.send_json(200, fake.track_shipments(payload.get('tracking_numbers', [])))
+                    return
+
+                key = self.headers.get('Idempotency-Key')
+                with fake.lock:
+                    if key and key in fake.responses:
+                        fake.stats['replayed'] += 1
+                        response = fake.responses[key]
+                    else:
+                        response = fake.create_shipments(carrier, payload.get('shipments', []))
+                        if key:
+                            fake.responses[key] = response
+
+                self.send_json(200, response)
+
+        return Handler
+
+    def create_shipments(self, carrier, shipments):
+        """Ответ службы: трек-номер и этикетка на каждый заказ, ошибка при пустом адресе"""
+        results = []
+        now = datetime.now()
+        estimated_delivery = (now + timedelta(seconds=self.stage_seconds * len(TRACKING_STAGES))).strftime('%Y-%m-%d %H:%M:%S')
+        for shipment in shipments:
+            if not (shipment.get('recipient') or {}).get('address'):
+                results.append({'reference': shipment['reference'], 'error': 'recipient address is required'})
+                continue
+
+            self.stats['shipments'] += 1
+            tracking_number = f"{TRACKING_PREFIXES[carrier]}{self.stats['shipments']:010d}"
+            self.shipments[tracking_number] = now
+            results.append({
+                'reference': shipment['reference'],
+                'tracking_number': tracking_number,
+                'label_url': f"/labels/{tracking_number}.pdf",
+                'cost': 5.0,
+                'estimated_delivery': estimated_delivery
+            })
+        return {'results': results}
+
+    def track_shipments(self, tracking_numbers):
+        """События по трек-номерам: этапы, время которых уже наступило"""
+        results = []
+        now = datetime.now()
+        for tracking_number in tracking_numbers:
+            created_at = self.shipments.get(tracking_number)
+            if created_at is None:
+                results.append({'tracking_number': tracking_number, 'error': 'tracking number not found'})
+                continue
+
+            events = [{
+                'status': 'created',
+                'description': 'Заказ создан',
+                'location': 'Склад',
+                'timestamp': created_at.strftime('%Y-%m-%d %H:%M:%S')
+            }]
+            passed = min(int((now - created_at).total_seconds() // self.stage_seconds), len(TRACKING_STAGES))
+            for stage, (status, description, location) in enumerate(TRACKING_STAGES[:passed], 1):
+                events.append({
+                    'status': status,
+                    'description': description,
+                    'location': location,
+                    'timestamp': (created_at + timedelta(seconds=self.stage_seconds * stage)).strftime('%Y-%m-%d %H:%M:%S')
+                })
+            results.append({'tracking_number': tracking_number, 'events': events})
+        return {'results': results}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Имитация API служб доставки')
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--stage-seconds', type=float, default=3600)
+    args = parser.parse_args()
+
+    fake = FakeCarrierServer(
+        port=args.port, latency=args.latency, failure_rate=args.failure_rate, stage_seconds=args.stage_seconds
+    )
+    logging.info(f"Имитация служб доставки: {fake.url('<служба>')}")
+    fake.server.serve_forever()
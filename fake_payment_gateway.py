@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Локальная имитация платежного шлюза (Stripe Payment Intents) для нагрузочной проверки payment_intents.py
+"""
+import logging
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakePaymentGateway:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0):
+        self.latency = latency  # Секунд на создание платежа
+        self.failure_rate = failure_rate  # Доля запросов с ответом 503
+        self.lock = threading.Lock()
+        self.intents = {}  # Idempotency-Key -> ответ
+        self.stats = {'requests': 0, 'created': 0, 'replayed': 0, 'failures': 0}
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """base_url для StripeProvider"""
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/v1"
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+                with fake.lock:
+                    fake.stats['requests'] += 1
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                if self.path != '/v1/payment_intents':
+                    self.send_json(404, {'error': {'message': 'not found'}})
+                    return
+
+                if random.random() < fake.failure_rate:
+                    with fake.lock:
+                        fake.stats['failures'] += 1
+                    self.send_json(503, {'error': {'message': 'service unavailable'}})
+                    return
+
+                key = self.headers.get('Idempotency-Key')
+                with fake.lock:
+                    if key and key in fake.intents:
+                        fake.stats['replayed'] += 1
+                        response = fake.intents[key]
+                    else:
+                        fake.stats['created'] += 1
+                        intent_id = f"pi_{fake.stats['created']:012d}"
+                        response = {
+                            'id': intent_id,
+                            'client_secret': f"{intent_id}_secret",
+                            'amount': int(form.get('amount', ['0'])[0]),
+                            'metadata': {'order_id': form.get('metadata[order_id]', [''])[0]},
+                            'status': 'requires_payment_method'
+                        }
+                        if key:
+                            fake.intents[key] = response
+
+                self.send_json(200, response)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Имитация платежного шлюза')
+    parser.add_argument('--port', type=int, default=8086)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakePaymentGateway(port=args.port, latency=args.latency, failure_rate=args.failure_rate)
+    logging.info(f"Имитация платежного шлюза: {fake.url}")
+    fake.server.serve_forever()
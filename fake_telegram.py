@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Локальная имитация Telegram Bot API для сквозных бенчмарков: принимает исходящие сообщения бота и считает их
+"""
+import logging
+import argparse
+import json
+import threading
+import time
+import urllib.parse
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Методы, на которые бот ждет в ответ отправленное сообщение
+MESSAGE_METHODS = {'sendMessage', 'sendPhoto', 'sendDocument', 'editMessageText', 'editMessageReplyMarkup'}
+
+class FakeTelegramAPI:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency  # Секунд на ответ, как сетевая задержка до api.telegram.org
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'messages': 0, 'bytes': 0, 'unknown': 0}
+        self.methods = Counter()
+        self.chats = Counter()  # chat_id -> число сообщений
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """BOT_CONFIG['api_url'] для TelegramShopBot"""
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+    def reset(self):
+        with self.lock:
+            self.stats = {key: 0 for key in self.stats}
+            self.methods.clear()
+            self.chats.clear()
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def handle_method(self, form, size):
+                # /bot<token>/<method>
+                parts = urllib.parse.urlparse(self.path).path.strip('/').split('/')
+                method = parts[1] if len(parts) == 2 and parts[0].startswith('bot') else None
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                with fake.lock:
+                    fake.stats['requests'] += 1
+                    fake.stats['bytes'] += size
+                    if method is None:
+                        fake.stats['unknown'] += 1
+                    else:
+                        fake.methods[method] += 1
+
+                if method is None:
+                    self.send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                    return
+                if method == 'getUpdates':
+                    self.send_json(200, {'ok': True, 'result': []})
+                    return
+                if method not in MESSAGE_METHODS:
+                    self.send_json(200, {'ok': True, 'result': True})
+                    return
+
+                chat_id = form.get('chat_id', ['0'])[0]
+                with fake.lock:
+                    fake.stats['messages'] += 1
+                    fake.chats[chat_id] += 1
+                    message_id = fake.stats['messages']
+                self.send_json(200, {'ok': True, 'result': {
+                    'message_id': int(form.get('message_id', [message_id])[0]),
+                    'chat': {'id': int(chat_id) if chat_id.lstrip('-').isdigit() else 0},
+                    'date': int(time.time())
+                }})
+
+            def do_GET(self):
+                self.handle_method(urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query), 0)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                form = {}
+                # multipart (sendDocument) не разбирается: важен только факт отправки
+                if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    form = urllib.parse.parse_qs(body.decode('utf-8'))
+                self.handle_method(form, len(body))
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Имитация Telegram Bot API')
+    parser.add_argument('--port', type=int, default=8087)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    fake = FakeTelegramAPI(port=args.port, latency=args.latency)
+    logging.info(f"Имитация Telegram Bot API: {fake.url} (TELEGRAM_API_URL)")
+    fake.server.serve_forever()
@@ -4,10 +4,14 @@
 
 from datetime import datetime, timedelta
 from utils import format_price
+from cost_ledger import CostLedger
+from config import COST_LEDGER_CONFIG
 
 class FinancialReportsManager:
-    def __init__(self, db):
+    def __init__(self, db, reports_db=None):
         self.db = db
+        self.reports_db = reports_db or db  # Все запросы отчетов - к снимку (analytics_snapshot.py)
+        self.cost_ledger = CostLedger(db, self.reports_db)
         self.tax_rate = 0.12  # НДС 12% для Узбекистана
         self.currency_rates = {
             'USD': 1.0,
@@ -19,7 +23,7 @@ class FinancialReportsManager:
     def generate_profit_loss_report(self, start_date, end_date):
         """Отчет о прибылях и убытках"""
         # Доходы
-        revenue_data = self.db.execute_query('''
+        revenue_data = self.reports_db.execute_query('''
             SELECT 
                 SUM(total_amount) as gross_revenue,
                 SUM(promo_discount) as total_discounts,
@@ -30,18 +34,25 @@ class FinancialReportsManager:
             AND status IN ('confirmed', 'shipped', 'delivered')
         ''', (start_date, end_date))
         
-        # Себестоимость товаров
-        cogs_data = self.db.execute_query('''
+        # Себестоимость товаров: по слоям учета, для заказов без списаний - по cost_price
+        ledger_cogs, _ = self.cost_ledger.get_orders_cogs(
+            start_date, end_date, ('confirmed', 'shipped', 'delivered'), COST_LEDGER_CONFIG['cogs_method']
+        )
+        cogs_data = self.reports_db.execute_query('''
             SELECT SUM(oi.quantity * p.cost_price) as total_cogs
             FROM order_items oi
             JOIN products p ON oi.product_id = p.id
             JOIN orders o ON oi.order_id = o.id
             WHERE DATE(o.created_at) BETWEEN ? AND ?
             AND o.status IN ('confirmed', 'shipped', 'delivered')
+            AND NOT EXISTS (
+                SELECT 1 FROM cost_consumptions c
+                WHERE c.reference_type = 'sale' AND c.reference_id = o.id
+            )
         ''', (start_date, end_date))
         
         # Операционные расходы
-        expenses_data = self.db.execute_query('''
+        expenses_data = self.reports_db.execute_query('''
             SELECT 
                 expense_type,
                 SUM(amount) as total_amount
@@ -56,7 +67,7 @@ class FinancialReportsManager:
         delivery_revenue = revenue_data[0][3] or 0
         net_revenue = gross_revenue - total_discounts
         
-        total_cogs = cogs_data[0][0] or 0
+        total_cogs = (cogs_data[0][0] or 0) + ledger_cogs
         gross_profit = net_revenue - total_cogs
         gross_margin = (gross_profit / net_revenue * 100) if net_revenue > 0 else 0
         
@@ -74,6 +85,7 @@ class FinancialReportsManager:
             'discounts': total_discounts,
             'net_revenue': net_revenue,
             'cogs': total_cogs,
+            'cogs_method': COST_LEDGER_CONFIG['cogs_method'],
             'gross_profit': gross_profit,
             'gross_margin': gross_margin,
             'operating_expenses': operating_expenses,
@@ -87,7 +99,7 @@ class FinancialReportsManager:
     def generate_cash_flow_report(self, start_date, end_date):
         """Отчет о движении денежных средств"""
         # Поступления
-        cash_inflows = self.db.execute_query('''
+        cash_inflows = self.reports_db.execute_query('''
             SELECT 
                 DATE(created_at) as date,
                 SUM(total_amount - COALESCE(promo_discount, 0)) as daily_revenue
@@ -99,7 +111,7 @@ class FinancialReportsManager:
         ''', (start_date, end_date))
         
         # Расходы
-        cash_outflows = self.db.execute_query('''
+        cash_outflows = self.reports_db.execute_query('''
             SELECT 
                 DATE(expense_date) as date,
                 SUM(amount) as daily_expenses
@@ -110,7 +122,7 @@ class FinancialReportsManager:
         ''', (start_date, end_date))
         
         # Закупки товаров
-        inventory_purchases = self.db.execute_query('''
+        inventory_purchases = self.reports_db.execute_query('''
             SELECT 
                 DATE(created_at) as date,
                 SUM(total_amount) as daily_purchases
@@ -167,7 +179,7 @@ class FinancialReportsManager:
     def generate_tax_report(self, start_date, end_date):
         """Налоговый отчет"""
         # Налогооблагаемые доходы
-        taxable_income = self.db.execute_query('''
+        taxable_income = self.reports_db.execute_query('''
             SELECT 
                 SUM(total_amount - COALESCE(promo_discount, 0)) as net_revenue,
                 SUM(total_amount - COALESCE(promo_discount, 0)) * ? as vat_amount
@@ -177,7 +189,7 @@ class FinancialReportsManager:
         ''', (self.tax_rate, start_date, end_date))
         
         # Расходы, уменьшающие налогооблагаемую базу
-        deductible_expenses = self.db.execute_query('''
+        deductible_expenses = self.reports_db.execute_query('''
             SELECT 
                 expense_type,
                 SUM(amount) as total_amount
@@ -208,7 +220,7 @@ class FinancialReportsManager:
     def generate_roi_analysis(self):
         """Анализ рентабельности инвестиций"""
         # ROI по каналам привлечения
-        channel_roi = self.db.execute_query('''
+        channel_roi = self.reports_db.execute_query('''
             SELECT 
                 acquisition_channel,
                 COUNT(DISTINCT u.id) as users_acquired,
@@ -221,7 +233,7 @@ class FinancialReportsManager:
         ''')
         
         # ROI по товарам
-        product_roi = self.db.execute_query('''
+        product_roi = self.reports_db.execute_query('''
             SELECT 
                 p.name,
                 SUM(oi.quantity * oi.price) as revenue,
@@ -239,7 +251,7 @@ class FinancialReportsManager:
         ''')
         
         # ROI по категориям
-        category_roi = self.db.execute_query('''
+        category_roi = self.reports_db.execute_query('''
             SELECT 
                 c.name,
                 c.emoji,
@@ -330,23 +342,18 @@ class FinancialReportsManager:
         
         return "❌ Неизвестный тип отчета"
     
-    def export_financial_data_csv(self, report_type, start_date, end_date):
-        """Экспорт финансовых данных в CSV"""
-        import csv
-        import io
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
+    def get_export_rows(self, report_type, start_date, end_date):
+        """Заголовок и построчный генератор финансовой выгрузки"""
         if report_type == 'transactions':
             # Экспорт всех транзакций
-            transactions = self.db.execute_query('''
+            header = ['Order ID', 'Date', 'Customer', 'Amount', 'Discount', 'Payment Method', 'Status']
+            rows = self.reports_db.iterate_query('''
                 SELECT 
                     o.id,
                     o.created_at,
                     u.name,
-                    o.total_amount,
-                    o.promo_discount,
+                    ROUND(o.total_amount, 2),
+                    ROUND(IFNULL(o.promo_discount, 0), 2),
                     o.payment_method,
                     o.status
                 FROM orders o
@@ -354,24 +361,17 @@ class FinancialReportsManager:
                 WHERE DATE(o.created_at) BETWEEN ? AND ?
                 ORDER BY o.created_at DESC
             ''', (start_date, end_date))
-            
-            writer.writerow(['Order ID', 'Date', 'Customer', 'Amount', 'Discount', 'Payment Method', 'Status'])
-            for transaction in transactions:
-                writer.writerow([
-                    transaction[0], transaction[1], transaction[2],
-                    f"${transaction[3]:.2f}", f"${transaction[4] or 0:.2f}",
-                    transaction[5], transaction[6]
-                ])
         
         elif report_type == 'products_performance':
             # Экспорт эффективности товаров
-            products = self.db.execute_query('''
+            header = ['Product', 'Units Sold', 'Revenue', 'Cost', 'Profit', 'Stock', 'Views']
+            rows = self.reports_db.iterate_query('''
                 SELECT 
                     p.name,
-                    SUM(oi.quantity) as units_sold,
-                    SUM(oi.quantity * oi.price) as revenue,
-                    SUM(oi.quantity * p.cost_price) as cost,
-                    SUM(oi.quantity * oi.price) - SUM(oi.quantity * p.cost_price) as profit,
+                    IFNULL(SUM(oi.quantity), 0) as units_sold,
+                    ROUND(IFNULL(SUM(oi.quantity * oi.price), 0), 2) as revenue,
+                    ROUND(IFNULL(SUM(oi.quantity * p.cost_price), 0), 2) as cost,
+                    ROUND(IFNULL(SUM(oi.quantity * oi.price) - SUM(oi.quantity * p.cost_price), 0), 2) as profit,
                     p.stock,
                     p.views
                 FROM products p
@@ -382,16 +382,30 @@ class FinancialReportsManager:
                 GROUP BY p.id, p.name, p.stock, p.views
                 ORDER BY profit DESC
             ''', (start_date, end_date))
-            
-            writer.writerow(['Product', 'Units Sold', 'Revenue', 'Cost', 'Profit', 'Stock', 'Views'])
-            for product in products:
-                writer.writerow([
-                    product[0], product[1] or 0, f"${product[2] or 0:.2f}",
-                    f"${product[3] or 0:.2f}", f"${product[4] or 0:.2f}",
-                    product[5], product[6]
-                ])
-        
-        return output.getvalue()
+        
+        else:
+            raise ValueError(f"Неизвестный тип финансовой выгрузки: {report_type}")
+        
+        return header, rows
+    
+    def export_financial_data_csv(self, report_type, start_date, end_date):
+        """Экспорт финансовых данных в CSV (строкой, для небольших отчетов); неизвестный тип - пустая строка"""
+        from data_export import DataExporter
+        
+        try:
+            header, rows = self.get_export_rows(report_type, start_date, end_date)
+        except ValueError:
+            return ''
+        return ''.join(DataExporter().iter_lines(header, rows, 'csv'))
+    
+    def export_financial_file(self, report_type, start_date, end_date, fmt='csv', progress_callback=None):
+        """Потоковая выгрузка финансовых данных в сжатый временный файл"""
+        from data_export import DataExporter
+        
+        header, rows = self.get_export_rows(report_type, start_date, end_date)
+        return DataExporter().export_to_file(
+            header, rows, fmt, name=f"finance_{report_type}", progress_callback=progress_callback
+        )
     
     def calculate_business_metrics(self):
         """Расчет ключевых бизнес-метрик"""
@@ -400,13 +414,13 @@ class FinancialReportsManager:
         start_date = end_date - timedelta(days=30)
         
         # Customer Acquisition Cost (CAC)
-        marketing_spend = self.db.execute_query('''
+        marketing_spend = self.reports_db.execute_query('''
             SELECT SUM(amount) FROM business_expenses
             WHERE expense_type = 'marketing'
             AND DATE(expense_date) >= ?
         ''', (start_date.strftime('%Y-%m-%d'),))[0][0] or 0
         
-        new_customers = self.db.execute_query('''
+        new_customers = self.reports_db.execute_query('''
             SELECT COUNT(*) FROM users
             WHERE DATE(created_at) >= ?
             AND is_admin = 0
@@ -415,7 +429,7 @@ class FinancialReportsManager:
         cac = marketing_spend / new_customers if new_customers > 0 else 0
         
         # Customer Lifetime Value (CLV)
-        clv_data = self.db.execute_query('''
+        clv_data = self.reports_db.execute_query('''
             SELECT 
                 AVG(total_spent) as avg_ltv,
                 AVG(orders_count) as avg_orders,
@@ -438,7 +452,7 @@ class FinancialReportsManager:
         avg_order_value = clv_data[2] or 0
         
         # Churn Rate (отток клиентов)
-        active_customers_30_days_ago = self.db.execute_query('''
+        active_customers_30_days_ago = self.reports_db.execute_query('''
             SELECT COUNT(DISTINCT user_id) FROM orders
             WHERE DATE(created_at) BETWEEN ? AND ?
             AND status != 'cancelled'
@@ -447,7 +461,7 @@ class FinancialReportsManager:
             start_date.strftime('%Y-%m-%d')
         ))[0][0]
         
-        active_customers_now = self.db.execute_query('''
+        active_customers_now = self.reports_db.execute_query('''
             SELECT COUNT(DISTINCT user_id) FROM orders
             WHERE DATE(created_at) >= ?
             AND status != 'cancelled'
@@ -457,7 +471,7 @@ class FinancialReportsManager:
                      active_customers_30_days_ago * 100) if active_customers_30_days_ago > 0 else 0
         
         # Monthly Recurring Revenue (MRR) - для подписочных товаров
-        mrr = self.db.execute_query('''
+        mrr = self.reports_db.execute_query('''
             SELECT SUM(total_amount) / 30 as daily_revenue
             FROM orders
             WHERE DATE(created_at) >= ?
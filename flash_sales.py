@@ -0,0 +1,422 @@
+"""
+Флеш-распродажи: заранее выделенные токены товара в памяти, очередь ожидания и отложенная запись
+"""
+import logging
+import threading
+import uuid
+
+from collections import deque
+from datetime import datetime, timedelta
+from config import FLASH_SALE_CONFIG
+from log_writer import get_log_writer
+
+class FlashSaleEngine:
+    def __init__(self, db, stock_history, cost_ledger):
+        self.db = db
+        self.stock_history = stock_history
+        self.cost_ledger = cost_ledger
+        self.log_writer = get_log_writer(db.db_path)
+        self.sales = {}  # promo_code_id -> состояние распродажи
+        self.claims = {}  # claim_id -> заявка
+        self.notifier = None  # Вызывается с заявкой, выданной из очереди ожидания
+        self.stop_event = threading.Event()
+        self.sweeper_thread = None
+        self.load_active_sales()
+
+    def start_sale(self, promo_code_id, allocations, per_user_limit=None, hold_minutes=None, ends_at=None):
+        """Запуск распродажи: товар списывается со склада в токены одной транзакцией"""
+        per_user_limit = per_user_limit or FLASH_SALE_CONFIG['per_user_limit']
+        hold_minutes = hold_minutes or FLASH_SALE_CONFIG['hold_minutes']
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        allocated = {}
+        with self.db.transaction() as conn:
+            for product_id, quantity in allocations.items():
+                stock = conn.execute('SELECT IFNULL(stock, 0) FROM products WHERE id = ?', (product_id,)).fetchone()
+                units = min(quantity, stock[0]) if stock else 0
+                if units <= 0:
+                    continue
+
+                self.stock_history.apply_change(
+                    conn, product_id, quantity_change=-units,
+                    movement_type='flash_sale', reference_id=promo_code_id
+                )
+                allocated[product_id] = units
+
+            conn.execute('''
+                INSERT INTO flash_sales (
+                    promo_code_id, per_user_limit, hold_minutes, status, started_at, ends_at
+                ) VALUES (?, ?, ?, 'active', ?, ?)
+            ''', (promo_code_id, per_user_limit, hold_minutes, now, ends_at))
+            conn.executemany(
+                'INSERT INTO flash_sale_allocations (promo_code_id, product_id, allocated) VALUES (?, ?, ?)',
+                ((promo_code_id, product_id, units) for product_id, units in allocated.items())
+            )
+
+        self.sales[promo_code_id] = self.build_sale(per_user_limit, hold_minutes, allocated, ends_at)
+        logging.info(f"Флеш-распродажа {promo_code_id} запущена: {sum(allocated.values())} шт. на {len(allocated)} товаров")
+        return allocated
+
+    def build_sale(self, per_user_limit, hold_minutes, allocated, ends_at=None):
+        """Состояние распродажи в памяти"""
+        return {
+            'lock': threading.Lock(),
+            'per_user_limit': per_user_limit,
+            'hold_minutes': hold_minutes,
+            'ends_at': ends_at,
+            'allocated': dict(allocated),
+            'tokens': dict(allocated),
+            'sold': {product_id: 0 for product_id in allocated},
+            'user_units': {},
+            'waiting': {product_id: deque() for product_id in allocated},
+            'tickets': {},  # (product_id, user_id) -> номер в очереди
+            'queue_issued': dict.fromkeys(allocated, 0),
+            'queue_served': dict.fromkeys(allocated, 0),
+            'stats': {'claims': 0, 'rejected': 0, 'queued': 0, 'released': 0, 'expired': 0, 'from_queue': 0}
+        }
+
+    def load_active_sales(self):
+        """Восстановление активных распродаж после перезапуска"""
+        sales = self.db.execute_query(
+            "SELECT promo_code_id, per_user_limit, hold_minutes, ends_at FROM flash_sales WHERE status = 'active'"
+        ) or []
+
+        for promo_code_id, per_user_limit, hold_minutes, ends_at in sales:
+            allocations = self.db.execute_query(
+                'SELECT product_id, allocated FROM flash_sale_allocations WHERE promo_code_id = ?',
+                (promo_code_id,)
+            ) or []
+            sale = self.build_sale(per_user_limit, hold_minutes, dict(allocations), ends_at)
+
+            claims = self.db.execute_query('''
+                SELECT claim_id, product_id, user_id, quantity, status, order_id, expires_at
+                FROM flash_sale_claims
+                WHERE promo_code_id = ? AND status IN ('held', 'purchased')
+            ''', (promo_code_id,)) or []
+
+            for claim_id, product_id, user_id, quantity, status, order_id, expires_at in claims:
+                sale['tokens'][product_id] -= quantity
+                sale['user_units'][user_id] = sale['user_units'].get(user_id, 0) + quantity
+                if status == 'purchased':
+                    sale['sold'][product_id] += quantity
+                else:
+                    self.claims[claim_id] = {
+                        'claim_id': claim_id, 'sale_id': promo_code_id, 'product_id': product_id,
+                        'user_id': user_id, 'quantity': quantity, 'status': status,
+                        'order_id': order_id, 'expires_at': expires_at
+                    }
+
+            self.sales[promo_code_id] = sale
+
+    def claim(self, sale_id, product_id, user_id, quantity=1):
+        """Атомарный захват токенов: заявка, место в очереди или отказ"""
+        sale = self.sales.get(sale_id)
+        if not sale or product_id not in sale['tokens']:
+            return {'status': 'closed'}
+
+        with sale['lock']:
+            if sale['user_units'].get(user_id, 0) + quantity > sale['per_user_limit']:
+                sale['stats']['rejected'] += 1
+                return {'status': 'limit', 'limit': sale['per_user_limit']}
+
+            if sale['tokens'][product_id] < quantity:
+                return self.enqueue(sale, product_id, user_id, quantity)
+
+            claim = self.take_tokens(sale, sale_id, product_id, user_id, quantity)
+
+        self.persist(claim)
+        return {'status': 'claimed', 'claim_id': claim['claim_id'], 'expires_at': claim['expires_at']}
+
+    def get_product_sale(self, product_id):
+        """Активная распродажа с токенами товара; None - товар продается обычным порядком"""
+        for sale_id, sale in list(self.sales.items()):
+            if product_id in sale['allocated']:
+                return sale_id
+        return None
+
+    def get_held_units(self, sale_id, product_id, user_id):
+        """Единицы товара, захваченные покупателем и еще не привязанные к заказу"""
+        return sum(
+            claim['quantity'] for claim in list(self.claims.values())
+            if claim['sale_id'] == sale_id and claim['product_id'] == product_id
+            and claim['user_id'] == user_id and not claim.get('order_id')
+        )
+
+    def ensure_claim(self, sale_id, product_id, user_id, quantity):
+        """Добор заявки до нужного количества: уже захваченные единицы повторно не берутся"""
+        missing = quantity - self.get_held_units(sale_id, product_id, user_id)
+        if missing <= 0:
+            return {'status': 'claimed'}
+        return self.claim(sale_id, product_id, user_id, missing)
+
+    def take_tokens(self, sale, sale_id, product_id, user_id, quantity):
+        """Выдача токенов под блокировкой распродажи"""
+        sale['tokens'][product_id] -= quantity
+        sale['user_units'][user_id] = sale['user_units'].get(user_id, 0) + quantity
+        sale['stats']['claims'] += 1
+
+        claim = {
+            'claim_id': uuid.uuid4().hex,
+            'sale_id': sale_id,
+            'product_id': product_id,
+            'user_id': user_id,
+            'quantity': quantity,
+            'status': 'held',
+            'expires_at': (datetime.now() + timedelta(minutes=sale['hold_minutes'])).strftime('%Y-%m-%d %H:%M:%S')
+        }
+        self.claims[claim['claim_id']] = claim
+        return claim
+
+    def enqueue(self, sale, product_id, user_id, quantity):
+        """Виртуальная очередь ожидания распроданного товара"""
+        waiting = sale['waiting'][product_id]
+        key = (product_id, user_id)
+
+        ticket = sale['tickets'].get(key)
+        if ticket is None:
+            if len(waiting) >= FLASH_SALE_CONFIG['max_waiting']:
+                return {'status': 'sold_out'}
+            sale['queue_issued'][product_id] += 1
+            ticket = sale['queue_issued'][product_id]
+            waiting.append((user_id, quantity))
+            sale['tickets'][key] = ticket
+            sale['stats']['queued'] += 1
+
+        # Позиция по номеру билета без обхода очереди
+        return {'status': 'queued', 'position': ticket - sale['queue_served'][product_id]}
+
+    def release(self, claim_id, status='released'):
+        """Возврат токенов заявки; освободившиеся токены получает очередь ожидания"""
+        claim = self.claims.get(claim_id)
+        if not claim:
+            return False
+
+        sale = self.sales.get(claim['sale_id'])
+        if not sale:
+            return False
+
+        assigned = []
+        with sale['lock']:
+            if claim['status'] != 'held':
+                return False
+
+            claim['status'] = status
+            del self.claims[claim_id]
+            sale['tokens'][claim['product_id']] += claim['quantity']
+            sale['user_units'][claim['user_id']] -= claim['quantity']
+            sale['stats'][status] += 1
+
+            assigned = self.serve_waiting(sale, claim['sale_id'], claim['product_id'])
+
+        self.persist(claim)
+        for waiting_claim in assigned:
+            self.persist(waiting_claim)
+            if self.notifier:
+                try:
+                    self.notifier(waiting_claim)
+                except Exception as e:
+                    logging.info(f"Ошибка уведомления из очереди флеш-распродажи: {e}")
+
+        return True
+
+    def serve_waiting(self, sale, sale_id, product_id):
+        """Выдача освободившихся токенов по очереди (под блокировкой распродажи)"""
+        waiting = sale['waiting'][product_id]
+        assigned = []
+
+        while waiting and sale['tokens'][product_id] > 0:
+            user_id, quantity = waiting[0]
+            if sale['tokens'][product_id] < quantity:
+                break
+
+            waiting.popleft()
+            sale['queue_served'][product_id] += 1
+            sale['tickets'].pop((product_id, user_id), None)
+
+            if sale['user_units'].get(user_id, 0) + quantity > sale['per_user_limit']:
+                continue
+
+            assigned.append(self.take_tokens(sale, sale_id, product_id, user_id, quantity))
+            sale['stats']['from_queue'] += 1
+
+        return assigned
+
+    def confirm(self, claim_id, order_id=None):
+        """Оплата заявки: токены окончательно проданы"""
+        claim = self.claims.get(claim_id)
+        if not claim:
+            return False
+
+        sale = self.sales.get(claim['sale_id'])
+        if not sale:
+            return False
+
+        with sale['lock']:
+            if claim['status'] != 'held':
+                return False
+            claim['status'] = 'purchased'
+            claim['order_id'] = order_id
+            del self.claims[claim_id]
+            sale['sold'][claim['product_id']] += claim['quantity']
+
+        self.persist(claim)
+        return True
+
+    def attach_order(self, user_id, order_id):
+        """Привязка захваченных покупателем единиц к оформленному заказу"""
+        attached = []
+        for claim in list(self.claims.values()):
+            sale = self.sales.get(claim['sale_id'])
+            if not sale or claim['user_id'] != user_id:
+                continue
+            with sale['lock']:
+                if claim['status'] != 'held' or claim.get('order_id'):
+                    continue
+                claim['order_id'] = order_id
+            self.persist(claim)
+            attached.append(claim)
+        return attached
+
+    def confirm_order(self, order_id):
+        """Оплата заказа: проданы все его заявки"""
+        order_id = int(order_id)
+        claim_ids = [claim_id for claim_id, claim in list(self.claims.items()) if claim.get('order_id') == order_id]
+        return sum(1 for claim_id in claim_ids if self.confirm(claim_id, order_id))
+
+    def release_order(self, order_id):
+        """Отмена заказа: его заявки возвращают токены распродаже"""
+        order_id = int(order_id)
+        claim_ids = [claim_id for claim_id, claim in list(self.claims.items()) if claim.get('order_id') == order_id]
+        return sum(1 for claim_id in claim_ids if self.release(claim_id))
+
+    def persist(self, claim):
+        """Отложенная пакетная запись заявки; один запрос сохраняет порядок записи"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.log_writer.write('''
+            INSERT INTO flash_sale_claims (
+                claim_id, promo_code_id, product_id, user_id, quantity,
+                status, order_id, expires_at, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(claim_id) DO UPDATE SET
+                status = excluded.status, order_id = excluded.order_id, updated_at = excluded.updated_at
+        ''', (
+            claim['claim_id'], claim['sale_id'], claim['product_id'], claim['user_id'], claim['quantity'],
+            claim['status'], claim.get('order_id'), claim['expires_at'], now, now
+        ))
+
+    def expire_holds(self):
+        """Возврат токенов из неоплаченных заявок с истекшим сроком; заявка заказа живет вместе с заказом"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        expired = [
+            claim_id for claim_id, claim in list(self.claims.items())
+            if not claim.get('order_id') and claim['expires_at'] <= now
+        ]
+
+        for claim_id in expired:
+            self.release(claim_id, 'expired')
+
+        self.settle_orders()
+        return len(expired)
+
+    def settle_orders(self):
+        """Заявки заказов по статусу заказа: отмененный (в том числе в веб-админке) возвращает токены,
+        оплаченный или принятый в работу - продан
+        """
+        order_ids = {claim['order_id'] for claim in list(self.claims.values()) if claim.get('order_id')}
+        if not order_ids:
+            return
+
+        rows = self.db.execute_query(
+            f"SELECT id, status, payment_status FROM orders WHERE id IN ({','.join('?' * len(order_ids))})",
+            tuple(order_ids)
+        )
+        if rows is None:
+            return
+
+        # Удаленный заказ - как отмененный
+        orders = {order_id: (status, payment_status) for order_id, status, payment_status in rows}
+        for order_id in order_ids:
+            status, payment_status = orders.get(order_id, ('cancelled', None))
+            if status == 'cancelled':
+                self.release_order(order_id)
+            elif payment_status == 'paid' or status in ('confirmed', 'shipped', 'delivered'):
+                self.confirm_order(order_id)
+
+    def end_expired_sales(self):
+        """Завершение распродаж, срок которых истек"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        expired = [sale_id for sale_id, sale in list(self.sales.items()) if sale['ends_at'] and sale['ends_at'] <= now]
+
+        for sale_id in expired:
+            self.end_sale(sale_id)
+
+        return len(expired)
+
+    def end_sale(self, sale_id):
+        """Завершение: непроданные токены возвращаются на склад, проданные списываются в себестоимость"""
+        sale = self.sales.get(sale_id)
+        if not sale:
+            return None
+
+        with sale['lock']:
+            for claim_id in [claim_id for claim_id, claim in self.claims.items() if claim['sale_id'] == sale_id]:
+                claim = self.claims.pop(claim_id)
+                claim['status'] = 'expired'
+                sale['tokens'][claim['product_id']] += claim['quantity']
+                self.persist(claim)
+            del self.sales[sale_id]
+
+        self.log_writer.flush()
+
+        with self.db.transaction() as conn:
+            for product_id, unsold in sale['tokens'].items():
+                if unsold > 0:
+                    self.stock_history.apply_change(
+                        conn, product_id, quantity_change=unsold,
+                        movement_type='flash_sale_return', reference_id=sale_id
+                    )
+                self.cost_ledger.consume(product_id, sale['sold'][product_id], 'flash_sale', sale_id, conn)
+
+            conn.execute(
+                "UPDATE flash_sales SET status = 'ended', ended_at = ? WHERE promo_code_id = ?",
+                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), sale_id)
+            )
+
+        return {'sold': dict(sale['sold']), 'returned': dict(sale['tokens'])}
+
+    def get_sale_stats(self, sale_id):
+        """Состояние распродажи из памяти"""
+        sale = self.sales.get(sale_id)
+        if not sale:
+            return None
+
+        with sale['lock']:
+            return {
+                'allocated': dict(sale['allocated']),
+                'available': dict(sale['tokens']),
+                'sold': dict(sale['sold']),
+                'held': sum(claim['quantity'] for claim in self.claims.values() if claim['sale_id'] == sale_id),
+                'waiting': {product_id: len(waiting) for product_id, waiting in sale['waiting'].items()},
+                **sale['stats']
+            }
+
+    def start_sweeper(self):
+        """Фоновый возврат просроченных заявок и завершение истекших распродаж"""
+        if self.sweeper_thread and self.sweeper_thread.is_alive():
+            return
+
+        def sweeper_worker():
+            while not self.stop_event.wait(FLASH_SALE_CONFIG['sweep_interval']):
+                try:
+                    self.expire_holds()
+                    self.end_expired_sales()
+                except Exception as e:
+                    logging.info(f"Ошибка возврата заявок флеш-распродажи: {e}")
+
+        self.stop_event.clear()
+        self.sweeper_thread = threading.Thread(target=sweeper_worker, daemon=True)
+        self.sweeper_thread.start()
+
+    def stop_sweeper(self):
+        """Остановка фонового возврата"""
+        self.stop_event.set()
@@ -739,6 +739,11 @@ class MessageHandler:
             self.bot.send_message(chat_id, "❌ Выберите способ оплаты из предложенных")
             return
         
+        # Единицы флеш-распродажи, чей захват истек, захватываются заново до создания заказа;
+        # не хватило токенов - остальное продается из обычного остатка
+        for item in cart_items:
+            self.claim_flash_sale_units(user_id, item[5], item[3])
+        
         # Создаем заказ
         total_amount = calculate_cart_total(cart_items)
         order_data = getattr(self, 'order_data', {}).get(telegram_id, {})
@@ -750,6 +755,13 @@ class MessageHandler:
             # Добавляем товары в заказ
             self.db.add_order_items(order_id, cart_items)
             
+            # Заявки флеш-распродажи переходят к заказу; наличные - продажа сразу, онлайн - после оплаты
+            flash_sale_engine = getattr(self.bot, 'flash_sale_engine', None)
+            if flash_sale_engine:
+                flash_sale_engine.attach_order(user_id, order_id)
+                if payment_method == 'cash':
+                    flash_sale_engine.confirm_order(order_id)
+            
             # Очищаем корзину
             self.db.clear_cart(user_id)
             
@@ -807,9 +819,9 @@ class MessageHandler:
         loyalty_data = self.db.get_user_loyalty_points(user_id)
         
         loyalty_text = f"⭐ <b>Программа лояльности</b>\n\n"
-        loyalty_text += f"💎 Ваш уровень: <b>{loyalty_data[3]}</b>\n"
-        loyalty_text += f"🏆 Текущие баллы: {loyalty_data[1]}\n"
-        loyalty_text += f"📊 Всего заработано: {loyalty_data[2]}\n\n"
+        loyalty_text += f"💎 Ваш уровень: <b>{loyalty_data[4]}</b>\n"
+        loyalty_text += f"🏆 Текущие баллы: {loyalty_data[2]}\n"
+        loyalty_text += f"📊 Всего заработано: {loyalty_data[3]}\n\n"
         
         # Показываем уровни
         loyalty_text += f"🏅 <b>Уровни лояльности:</b>\n"
@@ -823,6 +835,15 @@ class MessageHandler:
         
         self.bot.send_message(chat_id, loyalty_text, create_back_keyboard())
     
+    def get_promotion_manager(self):
+        """Общий менеджер промокодов бота: кэш и счетчики живут между запросами"""
+        promo_manager = getattr(self.bot, 'promotion_manager', None)
+        if promo_manager is None:
+            from promotions import PromotionManager
+            promo_manager = PromotionManager(self.db)
+            self.bot.promotion_manager = promo_manager
+        return promo_manager
+    
     def show_available_promos(self, message):
         """Показ доступных промокодов"""
         chat_id = message['chat']['id']
@@ -835,8 +856,7 @@ class MessageHandler:
         user_id = user_data[0][0]
         
         try:
-            from promotions import PromotionManager
-            promo_manager = PromotionManager(self.db)
+            promo_manager = self.get_promotion_manager()
             available_promos = promo_manager.get_user_available_promos(user_id)
             
             if available_promos:
@@ -1018,8 +1038,7 @@ class MessageHandler:
             cart_total = calculate_cart_total(cart_items)
             
             # Проверяем промокод
-            from promotions import PromotionManager
-            promo_manager = PromotionManager(self.db)
+            promo_manager = self.get_promotion_manager()
             validation = promo_manager.validate_promo_code(promo_code, user_id, cart_total)
             
             if validation['valid']:
@@ -1065,31 +1084,11 @@ class MessageHandler:
         if not user_data:
             return
         
-        user_id = user_data[0][0]
-        notifications = self.db.get_unread_notifications(user_id)
-        
-        if not notifications:
-            self.bot.send_message(chat_id, "🔔 У вас нет новых уведомлений")
+        if not self.notification_manager:
             return
         
-        # Показываем все уведомления
-        for notif in notifications:
-            type_emoji = {
-                'order': '📦',
-                'order_status': '📋',
-                'promotion': '🎁',
-                'system': '⚙️',
-                'info': 'ℹ️'
-            }.get(notif[4], 'ℹ️')
-            
-            notif_text = f"{type_emoji} <b>{notif[2]}</b>\n\n"
-            notif_text += f"{notif[3]}\n\n"
-            notif_text += f"📅 {format_date(notif[6])}"
-            
-            self.bot.send_message(chat_id, notif_text)
-            
-            # Отмечаем как прочитанное
-            self.db.mark_notification_read(notif[0])
+        # Одно сообщение-сводка с листанием вместо сообщения на каждое уведомление
+        self.notification_manager.show_inbox(chat_id, user_data[0][0])
     
     def handle_callback_query(self, callback_query):
         """Обработка callback запросов"""
@@ -1163,6 +1162,10 @@ class MessageHandler:
                 self.handle_payment_selection(callback_query)
             elif data == 'cancel_payment':
                 self.bot.send_message(chat_id, "❌ Оплата отменена")
+            elif data.startswith('notif_') and self.notification_manager:
+                user_data = self.db.get_user_by_telegram_id(telegram_id)
+                if user_data:
+                    self.notification_manager.handle_inbox_callback(callback_query, user_data[0][0])
             
         except Exception as e:
             logger.error(f"Ошибка обработки callback: {e}")
@@ -1182,12 +1185,23 @@ class MessageHandler:
             
             user_id = user_data[0][0]
             
-            # Добавляем в корзину
-            result = self.db.add_to_cart(user_id, product_id, 1)
+            # Товар флеш-распродажи сначала захватывается из токенов
+            in_cart = self.db.execute_query(
+                'SELECT quantity FROM cart WHERE user_id = ? AND product_id = ?',
+                (user_id, product_id)
+            )
+            flash_sale_units, flash_sale_notice = self.claim_flash_sale_units(
+                user_id, product_id, (in_cart[0][0] if in_cart else 0) + 1
+            )
+            
+            # Добавляем в корзину: сверх захваченного во флеш-распродаже - из обычного остатка
+            result = self.db.add_to_cart(user_id, product_id, 1, claimed=flash_sale_units)
             
             if result:
                 product = self.db.get_product_by_id(product_id)
                 success_text = f"✅ <b>{product[1]}</b> добавлен в корзину!"
+                if flash_sale_notice:
+                    success_text += f"\n\nℹ️ {flash_sale_notice}. Товар добавлен из обычного наличия"
                 
                 # Показываем кнопку перехода в корзину
                 cart_keyboard = {
@@ -1201,12 +1215,36 @@ class MessageHandler:
                 
                 self.bot.send_message(chat_id, success_text, cart_keyboard)
             else:
-                self.bot.send_message(chat_id, "❌ Товар недоступен или закончился")
+                self.bot.send_message(chat_id, f"❌ {flash_sale_notice or 'Товар недоступен или закончился'}")
                 
         except (ValueError, IndexError) as e:
             logger.error(f"Ошибка добавления в корзину: {e}")
             self.bot.send_message(chat_id, "❌ Ошибка добавления товара")
     
+    def claim_flash_sale_units(self, user_id, product_id, quantity):
+        """Захват единиц товара флеш-распродажи: (захвачено единиц, почему захвачены не все).
+        Лимит распродажи ограничивает только ее токены - остальное продается из обычного остатка.
+        """
+        flash_sale_engine = getattr(self.bot, 'flash_sale_engine', None)
+        sale_id = flash_sale_engine.get_product_sale(product_id) if flash_sale_engine else None
+        if not sale_id:
+            return 0, None
+        
+        result = flash_sale_engine.ensure_claim(sale_id, product_id, user_id, quantity)
+        if result['status'] == 'claimed':
+            return quantity, None
+        
+        held = flash_sale_engine.get_held_units(sale_id, product_id, user_id)
+        if result['status'] == 'limit':
+            return held, f"Во флеш-распродаже не больше {result['limit']} шт. на покупателя"
+        if result['status'] == 'queued':
+            return held, f"Товар флеш-распродажи разобран, вы в очереди: {result['position']}-й"
+        if result['status'] == 'sold_out':
+            return held, "Товар флеш-распродажи закончился"
+        
+        # Распродажа завершилась - товар продается обычным порядком
+        return 0, None
+    
     def handle_add_to_favorites(self, callback_query):
         """Добавление в избранное"""
         data = callback_query['data']
@@ -1383,14 +1421,29 @@ class MessageHandler:
                 amount = float(parts[3])
                 
                 user_data = self.db.get_user_by_telegram_id(telegram_id)
-                payment_result = self.payment_processor.create_payment(
-                    provider, amount, order_id, {
-                        'telegram_id': telegram_id,
-                        'name': user_data[0][2] if user_data else '',
-                        'phone': user_data[0][3] if user_data else '',
-                        'email': user_data[0][4] if user_data else ''
-                    }
-                )
+                payment_user = {
+                    'telegram_id': telegram_id,
+                    'name': user_data[0][2] if user_data else '',
+                    'phone': user_data[0][3] if user_data else '',
+                    'email': user_data[0][4] if user_data else ''
+                }
+                
+                # Ссылка создается в фоне: ответ не ждет платежную систему
+                if hasattr(self.bot, 'payment_intents'):
+                    intent = self.bot.payment_intents.request_payment(
+                        order_id, provider, payment_user,
+                        on_ready=lambda result: self.send_payment_result(chat_id, result)
+                    )
+                    if intent['status'] == 'pending':
+                        if intent.get('duplicate'):
+                            self.bot.send_message(chat_id, "⏳ Ссылка на оплату уже готовится")
+                        else:
+                            self.bot.send_message(chat_id, "⏳ Готовим ссылку на оплату...")
+                    else:
+                        self.send_payment_result(chat_id, intent)
+                    return
+                
+                payment_result = self.payment_processor.create_payment(provider, amount, order_id, payment_user)
                 
                 if payment_result:
                     payment_info = format_payment_info(payment_result)
@@ -1402,6 +1455,15 @@ class MessageHandler:
             logger.error(f"Ошибка обработки платежа: {e}")
             self.bot.send_message(chat_id, "❌ Ошибка обработки платежа")
     
+    def send_payment_result(self, chat_id, result):
+        """Ссылка на оплату или причина отказа"""
+        if result['status'] == 'ready':
+            self.bot.send_message(chat_id, format_payment_info(result))
+        elif result['status'] == 'paid':
+            self.bot.send_message(chat_id, f"✅ Заказ #{result['order_id']} уже оплачен")
+        else:
+            self.bot.send_message(chat_id, "❌ Ошибка создания платежа")
+    
     def handle_unknown_command(self, message, language='ru'):
         """Обработка неизвестной команды"""
         chat_id = message['chat']['id']
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Советник по индексам: EXPLAIN QUERY PLAN для SQL-запросов приложения, проверка составных индексов на копии базы
+и версионная миграция из подтвердившихся
+"""
+import logging
+import argparse
+import ast
+import glob
+import os
+import re
+import sqlite3
+import time
+
+from datetime import datetime
+from config import INDEX_ADVISOR_CONFIG
+from migrations import apply_migrations
+
+SQL_START = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+TABLE_REF = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+COLUMN_REF = r'(?:\b(\w+)\.)?\b(\w+)\b'
+SQL_KEYWORDS = {
+    'where', 'on', 'join', 'left', 'right', 'inner', 'outer', 'cross', 'group', 'order', 'limit', 'set',
+    'values', 'select', 'using', 'union', 'having', 'as', 'natural', 'default', 'returning'
+}
+
+class IndexAdvisor:
+    def __init__(self, db):
+        self.db = db
+        self.root = os.path.dirname(os.path.abspath(__file__))
+
+    def collect_statements(self):
+        """SQL-литералы из исходников: [(файл:строка, запрос)] без повторов.
+        В f-строках подставляемые части заменяются на ? (обычно это списки плейсхолдеров IN)
+        """
+        statements = {}
+        for pattern in INDEX_ADVISOR_CONFIG['paths']:
+            for path in sorted(glob.glob(os.path.join(self.root, pattern))):
+                relative = os.path.relpath(path, self.root)
+                if any(relative.startswith(prefix) for prefix in INDEX_ADVISOR_CONFIG['exclude']):
+                    continue
+                try:
+                    tree = ast.parse(open(path, encoding='utf-8').read())
+                except SyntaxError as e:
+                    logging.info(f"Ошибка разбора {relative}: {e}")
+                    continue
+
+                for node in ast.walk(tree):
+                    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                        sql = node.value
+                    elif isinstance(node, ast.JoinedStr):
+                        sql = ''.join(part.value if isinstance(part, ast.Constant) else '?' for part in node.values)
+                    else:
+                        continue
+                    if SQL_START.match(sql):
+                        statements.setdefault(' '.join(sql.split()), f"{relative}:{node.lineno}")
+
+        return [(location, sql) for sql, location in statements.items()]
+
+    def get_params(self, sql):
+        """NULL вместо каждого параметра; ? внутри строковых литералов не считаются"""
+        stripped = re.sub(r"'[^']*'", '', sql)
+        named = re.findall(r'[:@$](\w+)', stripped)
+        return {name: None for name in named} if named else [None] * stripped.count('?')
+
+    def explain(self, conn, sql):
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, self.get_params(sql))]
+
+    def get_tables(self, conn, sql):
+        """Псевдоним -> таблица для таблиц запроса"""
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        tables = {}
+        for table, alias in TABLE_REF.findall(sql):
+            if table in existing:
+                tables[table] = table
+                if alias and alias.lower() not in SQL_KEYWORDS:
+                    tables[alias] = table
+        return tables
+
+    def find_issues(self, plan, tables):
+        """Полные проходы по таблицам (кроме маленьких справочников) и временные B-деревья"""
+        issues = []
+        for detail in plan:
+            match = re.match(r'^SCAN (\w+)$', detail)
+            if match and match.group(1) in tables and tables[match.group(1)] not in INDEX_ADVISOR_CONFIG['small_tables']:
+                issues.append(f"SCAN {tables[match.group(1)]}")
+            elif detail.startswith('USE TEMP B-TREE'):
+                issues.append(detail)
+        return issues
+
+    def get_columns(self, conn, table):
+        return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+    def resolve(self, conn, tables, alias, column):
+        """Таблица столбца: по псевдониму или единственная таблица запроса с таким столбцом"""
+        if alias:
+            table = tables.get(alias)
+            return table if table and column in self.get_columns(conn, table) else None
+        owners = {table for table in tables.values() if column in self.get_columns(conn, table)}
+        return owners.pop() if len(owners) == 1 else None
+
+    def get_candidates(self, conn, sql, tables, table):
+        """Индексы-кандидаты для таблицы: равенства (сначала с параметрами, затем условия соединения),
+        один диапазон, затем столбцы ORDER BY / GROUP BY; вариант с покрытием столбцов выборки
+        """
+        where = re.split(r'\bWHERE\b', sql, maxsplit=1, flags=re.IGNORECASE)
+        filters = where[1] if len(where) > 1 else ''
+        joins = ' '.join(re.findall(r'\bON\b(.*?)(?=\bWHERE\b|\bJOIN\b|\bLEFT\b|\bGROUP\b|\bORDER\b|$)', sql, re.IGNORECASE))
+        filters = re.split(r'\b(?:GROUP|ORDER)\s+BY\b|\bLIMIT\b', filters, flags=re.IGNORECASE)[0]
+
+        def columns(text, pattern):
+            found = []
+            for alias, column in re.findall(COLUMN_REF + pattern, text, re.IGNORECASE):
+                if self.resolve(conn, tables, alias, column) == table and column not in found:
+                    found.append(column)
+            return found
+
+        equality = columns(filters, r'\s*(?:=|\bIN\b|\bIS\b)')
+        joined = columns(joins, r'\s*=') + [
+            column for alias, column in re.findall(r'=\s*' + COLUMN_REF, joins)
+            if self.resolve(conn, tables, alias, column) == table
+        ]
+        ranged = columns(filters, r'\s*(?:>=|<=|>|<|\bBETWEEN\b)')
+        sort_clause = re.findall(r'\b(?:GROUP|ORDER)\s+BY\b(.*?)(?=\bLIMIT\b|\bHAVING\b|\bORDER\b|$)', sql, re.IGNORECASE)
+        ordered = [column for column in columns(' '.join(sort_clause), r'') if column != 'id']
+
+        key = []
+        for column in equality + joined:
+            if column not in key and column != 'id':
+                key.append(column)
+        ranged = [column for column in ranged if column not in key and column != 'id']
+        if ranged:
+            key.append(ranged[0])
+        else:
+            key.extend(column for column in ordered if column not in key)
+        key = key[:INDEX_ADVISOR_CONFIG['max_index_columns']]
+        if not key:
+            return []
+
+        candidates = [key]
+        select_list = re.split(r'\bFROM\b', sql, maxsplit=1, flags=re.IGNORECASE)[0]
+        covering = key + [column for column in columns(select_list, r'') if column not in key and column != 'id']
+        if len(key) < len(covering) <= INDEX_ADVISOR_CONFIG['max_covering_columns']:
+            candidates.insert(0, covering)
+        return candidates
+
+    def get_indexes(self, conn):
+        """Существующие индексы: {имя: (таблица, [столбцы])}"""
+        return {
+            name: (table, [row[2] for row in conn.execute(f'PRAGMA index_info({name})')])
+            for name, table in conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'").fetchall()
+        }
+
+    def time_query(self, conn, sql):
+        """Лучшее из timing_repeats время выполнения SELECT на копии, мс; None - запрос не выполняется с NULL"""
+        best = None
+        for _ in range(INDEX_ADVISOR_CONFIG['timing_repeats']):
+            started = time.perf_counter()
+            try:
+                conn.execute(sql, self.get_params(sql)).fetchall()
+            except sqlite3.Error:
+                # Например, LIMIT ? с NULL
+                return None
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return round(best, 3)
+
+    def is_regression(self, result):
+        """Замедление в min_speedup раз и больше, чем на погрешность замера"""
+        before, after = result.get('ms_before'), result.get('ms_after')
+        return (
+            before is not None and after is not None
+            and after > before * INDEX_ADVISOR_CONFIG['min_speedup']
+            and after - before > INDEX_ADVISOR_CONFIG['noise_ms']
+        )
+
+    def analyze(self, statements=None):
+        """Планы до и после подобранных индексов. Все проверки - на копии базы в памяти.
+        Возвращает {'results': [...], 'indexes': [SQL индексов], 'errors': [...]}
+        """
+        statements = statements if statements is not None else self.collect_statements()
+        conn = sqlite3.connect(':memory:')
+        source = sqlite3.connect(self.db.db_path)
+        try:
+            source.backup(conn)
+        finally:
+            source.close()
+        # Статистика распределения: без нее планировщик берет индекс и по столбцу с двумя значениями
+        conn.execute('ANALYZE')
+        rows = {}
+
+        results = []
+        errors = []
+        for location, sql in statements:
+            try:
+                tables = self.get_tables(conn, sql)
+                plan = self.explain(conn, sql)
+            except sqlite3.Error as e:
+                errors.append({'location': location, 'sql': sql, 'error': str(e)})
+                continue
+            issues = self.find_issues(plan, tables)
+            result = {'location': location, 'sql': sql, 'tables': tables, 'plan_before': plan, 'issues_before': issues}
+            result['is_select'] = SQL_START.match(sql).group(1).upper() in ('SELECT', 'WITH')
+            if issues and result['is_select']:
+                result['ms_before'] = self.time_query(conn, sql)
+            results.append(result)
+
+        created = []
+        for result in results:
+            if not result['issues_before']:
+                continue
+            sql, tables = result['sql'], result['tables']
+            for table in dict.fromkeys(tables.values()):
+                if table not in rows:
+                    rows[table] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                if table in INDEX_ADVISOR_CONFIG['small_tables'] or rows[table] < INDEX_ADVISOR_CONFIG['min_rows']:
+                    continue
+                issues = self.find_issues(self.explain(conn, sql), tables)
+                if not issues:
+                    break
+                ms = self.time_query(conn, sql) if result['is_select'] else None
+                for columns in self.get_candidates(conn, sql, tables, table):
+                    name = f"idx_{table}_{'_'.join(columns)}"
+                    existing = self.get_indexes(conn)
+                    if name in existing or any(
+                        existing_table == table and existing_columns[:len(columns)] == columns
+                        for existing_table, existing_columns in existing.values()
+                    ):
+                        continue
+                    index_sql = f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)})"
+                    conn.execute(index_sql)
+                    conn.execute(f'ANALYZE {name}')
+                    # Индекс остается, если план стал лучше (меньше проходов и временных деревьев)
+                    # и SELECT на копии ускорился не меньше чем в min_speedup раз
+                    improved = len(self.find_issues(self.explain(conn, sql), tables)) < len(issues)
+                    if improved and ms is not None:
+                        ms_after = self.time_query(conn, sql)
+                        improved = ms_after is not None and ms_after * INDEX_ADVISOR_CONFIG['min_speedup'] <= ms
+                    if improved:
+                        created.append(index_sql)
+                        break
+                    conn.execute(f'DROP INDEX {name}')
+
+        # Индекс, столбцы которого - начало другого предложенного индекса той же таблицы, лишний
+        indexes = self.get_indexes(conn)
+        for index_sql in list(created):
+            name = index_sql.split()[5]
+            table, columns = indexes[name]
+            if any(
+                other != name and other_table == table and other_columns[:len(columns)] == columns
+                for other, (other_table, other_columns) in indexes.items()
+            ):
+                conn.execute(f'DROP INDEX {name}')
+                created.remove(index_sql)
+
+        # Новый индекс может увести планировщик от лучшего плана другого запроса:
+        # индексы, на которых запрос замедлился, убираются, пока замедлений не останется
+        while True:
+            regressions = set()
+            for result in results:
+                if not result['issues_before']:
+                    continue
+                result['plan_after'] = self.explain(conn, result['sql'])
+                result['issues_after'] = self.find_issues(result['plan_after'], result['tables'])
+                if result.get('ms_before') is None:
+                    continue
+                result['ms_after'] = self.time_query(conn, result['sql'])
+                if self.is_regression(result):
+                    used = set(re.findall(r'USING (?:COVERING )?INDEX (\w+)', ' '.join(result['plan_after'])))
+                    regressions.update(index_sql for index_sql in created if index_sql.split()[5] in used)
+            if not regressions:
+                break
+            logging.debug(f"Индексы с замедлением других запросов: {regressions}")
+            for index_sql in regressions:
+                conn.execute(f'DROP INDEX {index_sql.split()[5]}')
+                created.remove(index_sql)
+
+        conn.close()
+        return {'results': results, 'indexes': created, 'errors': errors}
+
+    def format_report(self, report):
+        """Текст отчета: запросы с проблемами в плане, план до/после и время"""
+        lines = []
+        flagged = [result for result in report['results'] if result['issues_before']]
+        for result in flagged:
+            lines.append(f"{result['location']}: {result['sql'][:120]}")
+            lines.append(f"  до:    {' | '.join(result['plan_before'])}")
+            lines.append(f"  после: {' | '.join(result['plan_after'])}")
+            if result.get('ms_before') is not None:
+                lines.append(f"  время: {result['ms_before']:.2f} мс -> {result['ms_after']:.2f} мс")
+
+        fixed = sum(1 for result in flagged if len(result['issues_after']) < len(result['issues_before']))
+        # Новый индекс может увести планировщик и от лучшего плана другого запроса
+        regressed = [result for result in flagged if self.is_regression(result)]
+        lines.append(
+            f"Запросов: {len(report['results'])}, с полным проходом или временным B-деревом: {len(flagged)}, "
+            f"улучшено: {fixed}, замедлилось: {len(regressed)}, не разобрано: {len(report['errors'])}"
+        )
+        lines.extend(
+            f"  замедление {result['location']}: {result['ms_before']:.2f} мс -> {result['ms_after']:.2f} мс"
+            for result in regressed
+        )
+        lines.append(f"Индексов предложено: {len(report['indexes'])}")
+        lines.extend(f"  {index_sql}" for index_sql in report['indexes'])
+        return '\n'.join(lines)
+
+    def generate_migration(self, report, name=None):
+        """Версионная миграция из подтвердившихся индексов: (версия, описание, SQL)"""
+        if not report['indexes']:
+            return None
+        return (
+            int(datetime.now().strftime('%Y%m%d%H%M')),
+            name or 'Индексы по планам запросов (index_advisor.py)',
+            report['indexes']
+        )
+
+    def format_migration(self, migration):
+        """Запись для MIGRATIONS в migrations.py"""
+        version, name, statements = migration
+        body = ''.join(f"        '{sql}',\n" for sql in statements).rstrip(',\n') + '\n'
+        return f"    ({version}, '{name}', [\n{body}    ])"
+
+    def apply(self, migration):
+        """Применение миграции к базе с записью версии в schema_migrations"""
+        with self.db.transaction() as conn:
+            return apply_migrations(conn.cursor(), [migration])
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Подбор индексов по планам SQL-запросов приложения')
+    parser.add_argument('--db', default='shop_bot.db')
+    parser.add_argument('--apply', action='store_true', help='применить подобранные индексы как миграцию')
+    args = parser.parse_args()
+
+    from database import DatabaseManager
+
+    advisor = IndexAdvisor(DatabaseManager(args.db))
+    report = advisor.analyze()
+    logging.info(advisor.format_report(report))
+
+    migration = advisor.generate_migration(report)
+    if migration:
+        logging.info("Миграция для migrations.py:\n" + advisor.format_migration(migration))
+        if args.apply:
+            advisor.apply(migration)
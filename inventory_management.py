@@ -1,32 +1,92 @@
 """
 Модуль управления складом и инвентаризацией
 """
+import csv
+import itertools
 import logging
+import threading
+import time
 
 from datetime import datetime, timedelta
 from utils import format_price, format_date
+from cost_ledger import CostLedger, VALUATION_METHODS
+from stock_history import StockHistory
+from reservations import ReservationManager
+from data_retention import RetentionManager
+from config import REORDER_CONFIG
+
+# Названия колонок в файлах инвентаризации
+STOCKTAKING_PRODUCT_COLUMNS = ('product_id', 'id', 'товар', 'код')
+STOCKTAKING_QUANTITY_COLUMNS = ('quantity', 'counted_quantity', 'count', 'qty', 'количество')
+STOCKTAKING_ERRORS_LIMIT = 100  # Ошибочных строк в отчете
 
 class InventoryManager:
-    def __init__(self, db):
+    def __init__(self, db, reports_db=None):
         self.db = db
+        self.reports_db = reports_db or db  # Отчеты (ABC, оборачиваемость, поставщики, выгрузки) - со снимка
         self.reorder_rules = {}
+        self.open_reorders = set()  # Товары с открытым заказом поставщику
+        self.rules_loaded_at = 0
+        self.reorder_lock = threading.Lock()
         self.suppliers = {}
+        self.cost_ledger = CostLedger(db, self.reports_db)
+        self.stock_history = StockHistory(db)
+        self.reservations = ReservationManager(db, self.stock_history, self.cost_ledger)
+        db.reservations = self.reservations  # Отмена заказа через update_order_status возвращает резерв
+        self.retention = RetentionManager(db)
         self.load_reorder_rules()
     
     def load_reorder_rules(self):
-        """Загрузка правил автопополнения"""
+        """Загрузка правил автопополнения и открытых заказов поставщикам"""
         rules = self.db.execute_query('''
             SELECT product_id, reorder_point, reorder_quantity, supplier_id
             FROM inventory_rules
             WHERE is_active = 1
+            ORDER BY id
         ''')
         
+        if rules is None:
+            return
+        
+        reorder_rules = {}
         for rule in rules:
-            self.reorder_rules[rule[0]] = {
+            reorder_rules[rule[0]] = {
                 'reorder_point': rule[1],
                 'reorder_quantity': rule[2],
                 'supplier_id': rule[3]
             }
+        
+        statuses = REORDER_CONFIG['open_po_statuses']
+        open_orders = self.db.execute_query(
+            f"SELECT DISTINCT product_id FROM purchase_orders WHERE status IN ({','.join('?' * len(statuses))})",
+            statuses
+        ) or []
+        
+        # Подмена целиком: проверки остатков читают словари без блокировки
+        self.reorder_rules = reorder_rules
+        self.open_reorders = {row[0] for row in open_orders}
+        self.rules_loaded_at = time.monotonic()
+    
+    def refresh_reorder_rules(self):
+        """Перечитывание правил, измененных другим процессом (веб-админка)"""
+        if time.monotonic() - self.rules_loaded_at >= REORDER_CONFIG['rules_reload_interval']:
+            self.load_reorder_rules()
+    
+    def check_reorder_threshold(self, product_id, old_quantity, new_quantity):
+        """Проверка порога пополнения при каждом снижении остатка"""
+        if new_quantity >= old_quantity:
+            return False
+        
+        self.refresh_reorder_rules()
+        
+        rule = self.reorder_rules.get(product_id)
+        if not rule or new_quantity > rule['reorder_point'] or product_id in self.open_reorders:
+            return False
+        
+        if old_quantity > rule['reorder_point']:
+            logging.info(f"Товар {product_id} опустился до порога пополнения: {new_quantity} шт.")
+        
+        return self.trigger_automatic_reorder(product_id)
     
     def check_stock_levels(self):
         """Проверка уровней остатков"""
@@ -54,150 +114,139 @@ class InventoryManager:
     
     def update_stock(self, product_id, new_quantity, movement_type='manual', reason=""):
         """Обновление остатков товара"""
-        # Получаем текущий остаток
-        current_stock = self.db.execute_query(
-            'SELECT stock FROM products WHERE id = ?',
-            (product_id,)
-        )
-        
-        if not current_stock:
+        try:
+            # Остаток, журнал, движение и себестоимость - одной транзакцией
+            with self.db.transaction() as conn:
+                change = self.stock_history.apply_change(
+                    conn, product_id, new_quantity=new_quantity, movement_type=movement_type
+                )
+                if not change:
+                    return False
+                
+                old_quantity = change[0]
+                quantity_change = new_quantity - old_quantity
+                
+                self.record_movement(conn, product_id, movement_type, old_quantity, new_quantity, reason)
+                
+                # Учет себестоимости: рост - слой по средней цене, снижение - списание
+                self.cost_ledger.adjust(product_id, quantity_change, movement_type, conn=conn)
+        except Exception as e:
+            logging.info(f"Ошибка обновления остатка товара {product_id}: {e}")
             return False
         
-        old_quantity = current_stock[0][0]
-        quantity_change = new_quantity - old_quantity
-        
-        # Обновляем остаток
-        self.db.execute_query(
-            'UPDATE products SET stock = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-            (new_quantity, product_id)
-        )
-        
-        # Записываем движение
-        self.db.execute_query('''
-            INSERT INTO inventory_movements (
-                product_id, movement_type, quantity_change, 
-                old_quantity, new_quantity, reason, created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            product_id, movement_type, quantity_change,
-            old_quantity, new_quantity, reason,
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ))
-        
         # Проверяем правила автопополнения
-        if new_quantity <= self.reorder_rules.get(product_id, {}).get('reorder_point', 0):
-            self.trigger_automatic_reorder(product_id)
+        self.check_reorder_threshold(product_id, old_quantity, new_quantity)
         
         return True
     
     def add_stock(self, product_id, quantity, supplier_id=None, cost_per_unit=None, reason="Поступление"):
         """Добавление товара на склад"""
-        current_stock = self.db.execute_query(
-            'SELECT stock FROM products WHERE id = ?',
-            (product_id,)
-        )[0][0]
-        
-        new_stock = current_stock + quantity
-        
-        # Обновляем остаток
-        self.db.execute_query(
-            'UPDATE products SET stock = ? WHERE id = ?',
-            (new_stock, product_id)
-        )
-        
-        # Записываем поступление
-        self.db.execute_query('''
-            INSERT INTO inventory_movements (
-                product_id, movement_type, quantity_change,
-                old_quantity, new_quantity, supplier_id, cost_per_unit, reason, created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            product_id, 'inbound', quantity,
-            current_stock, new_stock, supplier_id, cost_per_unit, reason,
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ))
+        try:
+            with self.db.transaction() as conn:
+                change = self.stock_history.apply_change(
+                    conn, product_id, quantity_change=quantity,
+                    movement_type='inbound', reference_id=supplier_id
+                )
+                if not change:
+                    return None
+                
+                current_stock, new_stock = change
+                
+                # Записываем поступление
+                self.record_movement(
+                    conn, product_id, 'inbound', current_stock, new_stock, reason,
+                    supplier_id=supplier_id, cost_per_unit=cost_per_unit
+                )
+                
+                # Новый слой себестоимости
+                self.cost_ledger.record_receipt(product_id, quantity, cost_per_unit, 'inbound', supplier_id, conn)
+        except Exception as e:
+            logging.info(f"Ошибка поступления товара {product_id}: {e}")
+            return None
         
         # Уведомляем о поступлении
         self.notify_restock(product_id)
         
         return new_stock
     
-    def reserve_stock(self, product_id, quantity, order_id):
-        """Резервирование товара для заказа"""
-        current_stock = self.db.execute_query(
-            'SELECT stock FROM products WHERE id = ?',
-            (product_id,)
-        )[0][0]
-        
-        if current_stock < quantity:
+    def reserve_stock(self, product_id, quantity, order_id, payment_method=None):
+        """Резервирование товара для заказа (срок резерва зависит от способа оплаты)"""
+        try:
+            change = self.reservations.reserve(product_id, quantity, order_id, payment_method)
+        except Exception as e:
+            logging.info(f"Ошибка резервирования товара {product_id}: {e}")
+            return False, "Ошибка резервирования"
+        
+        if not change:
             return False, "Недостаточно товара на складе"
         
-        # Создаем резерв
-        self.db.execute_query('''
-            INSERT INTO stock_reservations (
-                product_id, order_id, quantity, expires_at, created_at
-            ) VALUES (?, ?, ?, ?, ?)
-        ''', (
-            product_id, order_id, quantity,
-            (datetime.now() + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S'),
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ))
-        
-        # Уменьшаем доступный остаток
-        self.db.execute_query(
-            'UPDATE products SET stock = stock - ? WHERE id = ?',
-            (quantity, product_id)
-        )
+        self.check_reorder_threshold(product_id, *change)
         
         return True, "Товар зарезервирован"
     
     def release_reservation(self, order_id):
         """Освобождение резерва при отмене заказа"""
-        reservations = self.db.execute_query(
-            'SELECT product_id, quantity FROM stock_reservations WHERE order_id = ?',
-            (order_id,)
-        )
-        
-        for reservation in reservations:
-            product_id, quantity = reservation
-            
-            # Возвращаем товар на склад
-            self.db.execute_query(
-                'UPDATE products SET stock = stock + ? WHERE id = ?',
-                (quantity, product_id)
-            )
-        
-        # Удаляем резервы
-        self.db.execute_query(
-            'DELETE FROM stock_reservations WHERE order_id = ?',
-            (order_id,)
-        )
+        try:
+            return self.reservations.release(order_id)
+        except Exception as e:
+            logging.info(f"Ошибка освобождения резерва заказа {order_id}: {e}")
+    
+    def record_movement(self, conn, product_id, movement_type, old_quantity, new_quantity, reason,
+                        supplier_id=None, cost_per_unit=None):
+        """Запись движения товара в транзакции вызывающего"""
+        conn.execute('''
+            INSERT INTO inventory_movements (
+                product_id, movement_type, quantity_change,
+                old_quantity, new_quantity, supplier_id, cost_per_unit, reason, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            product_id, movement_type, new_quantity - old_quantity,
+            old_quantity, new_quantity, supplier_id, cost_per_unit, reason,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        ))
     
     def trigger_automatic_reorder(self, product_id):
         """Автоматическое пополнение товара"""
-        if product_id not in self.reorder_rules:
+        rule = self.reorder_rules.get(product_id)
+        if not rule:
             return False
         
-        rule = self.reorder_rules[product_id]
-        
-        # Проверяем, не было ли недавнего заказа
-        recent_order = self.db.execute_query('''
-            SELECT id FROM purchase_orders
-            WHERE product_id = ? AND created_at >= datetime('now', '-7 days')
-        ''', (product_id,))
-        
-        if recent_order:
-            return False  # Уже заказывали недавно
+        statuses = REORDER_CONFIG['open_po_statuses']
         
-        # Создаем заказ поставщику
-        purchase_order_id = self.create_purchase_order(
-            product_id,
-            rule['reorder_quantity'],
-            rule['supplier_id']
-        )
+        # Блокировка исключает два заказа при одновременных продажах
+        with self.reorder_lock:
+            if product_id in self.open_reorders:
+                return False
+            
+            # Открытый заказ мог создать другой процесс
+            open_order = self.db.execute_query(f'''
+                SELECT id FROM purchase_orders
+                WHERE product_id = ? AND status IN ({','.join('?' * len(statuses))})
+                LIMIT 1
+            ''', (product_id, *statuses))
+            
+            if open_order:
+                self.open_reorders.add(product_id)
+                return False  # Уже заказано, ждем поставку
+            
+            # Создаем заказ поставщику
+            purchase_order_id = self.create_purchase_order(
+                product_id,
+                rule['reorder_quantity'],
+                rule['supplier_id']
+            )
+            
+            if not purchase_order_id:
+                return False
+            
+            self.open_reorders.add(product_id)
         
-        # Уведомляем админов
-        self.notify_automatic_reorder(product_id, rule['reorder_quantity'], purchase_order_id)
+        # Уведомляем админов в фоне, чтобы не задерживать продажу
+        threading.Thread(
+            target=self.notify_automatic_reorder,
+            args=(product_id, rule['reorder_quantity'], purchase_order_id),
+            daemon=True
+        ).start()
         
         return purchase_order_id
     
@@ -297,7 +346,7 @@ class InventoryManager:
     
     def get_inventory_summary(self):
         """Сводка по складу"""
-        summary = self.db.execute_query('''
+        summary = self.reports_db.execute_query('''
             SELECT 
                 COUNT(*) as total_products,
                 SUM(stock) as total_units,
@@ -309,7 +358,7 @@ class InventoryManager:
         ''')[0]
         
         # Топ товары по стоимости запасов
-        top_value_products = self.db.execute_query('''
+        top_value_products = self.reports_db.execute_query('''
             SELECT name, stock, price, (stock * price) as inventory_value
             FROM products
             WHERE is_active = 1 AND stock > 0
@@ -330,7 +379,7 @@ class InventoryManager:
         """Отчет по движениям товаров"""
         start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
         
-        movements = self.db.execute_query('''
+        movements = self.reports_db.execute_query('''
             SELECT 
                 im.created_at,
                 p.name,
@@ -346,7 +395,7 @@ class InventoryManager:
         ''', (start_date,))
         
         # Статистика движений
-        movement_stats = self.db.execute_query('''
+        movement_stats = self.reports_db.execute_query('''
             SELECT 
                 movement_type,
                 COUNT(*) as count,
@@ -364,7 +413,7 @@ class InventoryManager:
     
     def get_abc_inventory_analysis(self):
         """ABC анализ товаров по стоимости запасов"""
-        inventory_data = self.db.execute_query('''
+        inventory_data = self.reports_db.execute_query('''
             SELECT 
                 id, name, stock, price, (stock * price) as inventory_value
             FROM products
@@ -410,7 +459,7 @@ class InventoryManager:
         """Анализ оборачиваемости товаров"""
         start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
         
-        turnover_data = self.db.execute_query('''
+        turnover_data = self.reports_db.execute_query('''
             SELECT 
                 p.id,
                 p.name,
@@ -506,8 +555,13 @@ class InventoryManager:
         }
     
     def create_reorder_rule(self, product_id, reorder_point, reorder_quantity, supplier_id):
-        """Создание правила автопополнения"""
-        return self.db.execute_query('''
+        """Создание правила автопополнения (заменяет действующее правило товара)"""
+        self.db.execute_query(
+            'UPDATE inventory_rules SET is_active = 0 WHERE product_id = ? AND is_active = 1',
+            (product_id,)
+        )
+        
+        rule_id = self.db.execute_query('''
             INSERT INTO inventory_rules (
                 product_id, reorder_point, reorder_quantity, supplier_id, is_active, created_at
             ) VALUES (?, ?, ?, ?, 1, ?)
@@ -515,6 +569,19 @@ class InventoryManager:
             product_id, reorder_point, reorder_quantity, supplier_id,
             datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         ))
+        
+        self.load_reorder_rules()
+        return rule_id
+    
+    def deactivate_reorder_rule(self, product_id):
+        """Отключение правила автопополнения"""
+        result = self.db.execute_query(
+            'UPDATE inventory_rules SET is_active = 0 WHERE product_id = ? AND is_active = 1',
+            (product_id,)
+        )
+        
+        self.load_reorder_rules()
+        return result
     
     def add_supplier(self, name, contact_email, phone, address, payment_terms):
         """Добавление поставщика"""
@@ -558,63 +625,55 @@ class InventoryManager:
             (new_status, received_quantity, purchase_order_id)
         )
         
+        # Поставка закрыла заказ - следующее снижение до порога создаст новый
+        self.open_reorders.discard(product_id)
+        
         return True
     
     def check_reorder_alerts(self):
-        """Проверка товаров требующих пополнения"""
-        alerts = []
-        
-        for product_id, rule in self.reorder_rules.items():
-            current_stock = self.db.execute_query(
-                'SELECT stock, name FROM products WHERE id = ?',
-                (product_id,)
-            )
-            
-            if current_stock and current_stock[0][0] <= rule['reorder_point']:
-                alerts.append({
-                    'product_id': product_id,
-                    'product_name': current_stock[0][1],
-                    'current_stock': current_stock[0][0],
-                    'reorder_point': rule['reorder_point'],
-                    'recommended_quantity': rule['reorder_quantity']
-                })
-        
-        return alerts
+        """Проверка товаров требующих пополнения одним запросом по правилам"""
+        alerts = self.db.execute_query('''
+            SELECT p.id, p.name, p.stock, r.reorder_point, r.reorder_quantity
+            FROM inventory_rules r
+            JOIN products p ON p.id = r.product_id
+            WHERE r.is_active = 1 AND p.stock <= r.reorder_point
+            ORDER BY p.stock ASC
+        ''') or []
+        
+        return [
+            {
+                'product_id': alert[0],
+                'product_name': alert[1],
+                'current_stock': alert[2],
+                'reorder_point': alert[3],
+                'recommended_quantity': alert[4]
+            }
+            for alert in alerts
+        ]
     
     def process_automatic_reorders(self):
-        """Обработка автоматических заказов"""
-        alerts = self.check_reorder_alerts()
+        """Страховочная проверка: пропущенные событийной проверкой пополнения"""
+        self.load_reorder_rules()
         
-        for alert in alerts:
-            # Проверяем, не заказывали ли уже
-            recent_order = self.db.execute_query('''
-                SELECT id FROM purchase_orders
-                WHERE product_id = ? AND created_at >= datetime('now', '-7 days')
-                AND status IN ('pending', 'sent')
-            ''', (alert['product_id'],))
+        created = 0
+        for alert in self.check_reorder_alerts():
+            if alert['product_id'] in self.open_reorders:
+                continue
             
-            if not recent_order:
-                # Создаем автоматический заказ
-                rule = self.reorder_rules[alert['product_id']]
-                purchase_order_id = self.create_purchase_order(
-                    alert['product_id'],
-                    rule['reorder_quantity'],
-                    rule['supplier_id']
-                )
-                
-                if purchase_order_id:
-                    self.notify_automatic_reorder(
-                        alert['product_id'],
-                        rule['reorder_quantity'],
-                        purchase_order_id
-                    )
+            if self.trigger_automatic_reorder(alert['product_id']):
+                created += 1
+        
+        if created:
+            logging.info(f"Страховочная проверка склада создала заказов поставщикам: {created}")
+        
+        return created
     
     def get_supplier_performance(self, supplier_id=None, days=90):
         """Анализ эффективности поставщиков"""
         start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
         
         if supplier_id:
-            suppliers_data = self.db.execute_query('''
+            suppliers_data = self.reports_db.execute_query('''
                 SELECT 
                     s.id, s.name,
                     COUNT(po.id) as total_orders,
@@ -628,7 +687,7 @@ class InventoryManager:
                 GROUP BY s.id, s.name
             ''', (start_date, supplier_id))
         else:
-            suppliers_data = self.db.execute_query('''
+            suppliers_data = self.reports_db.execute_query('''
                 SELECT 
                     s.id, s.name,
                     COUNT(po.id) as total_orders,
@@ -693,17 +752,13 @@ class InventoryManager:
             ) VALUES (?, 'active', ?, 1)
         ''', (location, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
         
-        # Создаем записи для всех товаров
-        products = self.db.execute_query(
-            'SELECT id, stock FROM products WHERE is_active = 1'
-        )
-        
-        for product in products:
-            self.db.execute_query('''
-                INSERT INTO stocktaking_items (
-                    session_id, product_id, system_quantity, counted_quantity
-                ) VALUES (?, ?, ?, NULL)
-            ''', (session_id, product[0], product[1]))
+        # Создаем записи для всех товаров одним запросом
+        self.db.execute_query('''
+            INSERT INTO stocktaking_items (
+                session_id, product_id, system_quantity, counted_quantity
+            )
+            SELECT ?, id, IFNULL(stock, 0), NULL FROM products WHERE is_active = 1
+        ''', (session_id,))
         
         return session_id
     
@@ -721,78 +776,215 @@ class InventoryManager:
     
     def complete_stocktaking(self, session_id):
         """Завершение инвентаризации"""
-        # Получаем расхождения
-        discrepancies = self.db.execute_query('''
+        try:
+            with self.db.transaction() as conn:
+                discrepancies = self.apply_stocktaking(conn, session_id)
+        except Exception as e:
+            logging.info(f"Ошибка завершения инвентаризации #{session_id}: {e}")
+            return None
+        
+        for product_id, name, old_quantity, new_quantity, difference in discrepancies:
+            self.check_reorder_threshold(product_id, old_quantity, new_quantity)
+        
+        return {
+            'discrepancies_count': len(discrepancies),
+            'discrepancies': discrepancies
+        }
+    
+    def apply_stocktaking(self, conn, session_id):
+        """Расхождения подсчета с текущими остатками одним запросом и их применение.
+        Остаток мог измениться с начала инвентаризации - расхождение считается от текущего.
+        """
+        discrepancies = conn.execute('''
             SELECT 
-                si.product_id, p.name, si.system_quantity, si.counted_quantity,
-                (si.counted_quantity - si.system_quantity) as difference
+                si.product_id, p.name, IFNULL(p.stock, 0), si.counted_quantity,
+                (si.counted_quantity - IFNULL(p.stock, 0)) as difference
             FROM stocktaking_items si
             JOIN products p ON si.product_id = p.id
             WHERE si.session_id = ? AND si.counted_quantity IS NOT NULL
-            AND si.counted_quantity != si.system_quantity
-        ''', (session_id,))
+            AND si.counted_quantity != IFNULL(p.stock, 0)
+        ''', (session_id,)).fetchall()
         
-        # Применяем корректировки
-        for discrepancy in discrepancies:
-            product_id, name, system_qty, counted_qty, difference = discrepancy
-            
-            # Обновляем остаток
-            self.db.execute_query(
-                'UPDATE products SET stock = ? WHERE id = ?',
-                (counted_qty, product_id)
-            )
-            
-            # Записываем движение
-            self.db.execute_query('''
-                INSERT INTO inventory_movements (
-                    product_id, movement_type, quantity_change,
-                    old_quantity, new_quantity, reason, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                product_id, 'adjustment', difference,
-                system_qty, counted_qty, f'Инвентаризация #{session_id}',
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            ))
-        
-        # Закрываем сессию
-        self.db.execute_query('''
+        self.stock_history.apply_bulk_changes(
+            conn, [(row[0], row[2], row[3]) for row in discrepancies], 'stocktaking', session_id
+        )
+        
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany('''
+            INSERT INTO inventory_movements (
+                product_id, movement_type, quantity_change,
+                old_quantity, new_quantity, reason, created_at
+            ) VALUES (?, 'adjustment', ?, ?, ?, ?, ?)
+        ''', (
+            (product_id, difference, old_quantity, new_quantity, f'Инвентаризация #{session_id}', now)
+            for product_id, name, old_quantity, new_quantity, difference in discrepancies
+        ))
+        
+        for product_id, name, old_quantity, new_quantity, difference in discrepancies:
+            self.cost_ledger.adjust(product_id, difference, 'stocktaking', session_id, conn)
+        
+        conn.execute('''
             UPDATE stocktaking_sessions 
             SET status = 'completed', completed_at = ?
             WHERE id = ?
-        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), session_id))
+        ''', (now, session_id))
+        
+        return discrepancies
+    
+    def parse_stocktaking_rows(self, source, errors):
+        """Потоковый разбор CSV или выгрузки сканера: "товар[,количество]" на строку.
+        Строка без количества - одно сканирование (1 шт.). Ошибочные строки попадают в errors.
+        """
+        sample = source.readline()
+        delimiter = ';' if sample.count(';') > sample.count(',') else '\t' if '\t' in sample else ','
+        reader = csv.reader(itertools.chain([sample], source), delimiter=delimiter)
+        
+        product_column, quantity_column = 0, 1
+        for line_number, row in enumerate(reader, 1):
+            if not row or not row[0].strip():
+                continue
+            
+            # Заголовок: колонки по названию
+            if line_number == 1 and not row[0].strip().lstrip('-').isdigit():
+                names = [name.strip().lower() for name in row]
+                product_column = next((names.index(name) for name in STOCKTAKING_PRODUCT_COLUMNS if name in names), 0)
+                quantity_column = next((names.index(name) for name in STOCKTAKING_QUANTITY_COLUMNS if name in names), 1)
+                continue
+            
+            try:
+                product_id = int(row[product_column])
+                quantity = int(float(row[quantity_column])) if len(row) > quantity_column and row[quantity_column].strip() else 1
+                if quantity < 0:
+                    raise ValueError("отрицательное количество")
+            except (ValueError, IndexError) as e:
+                errors.append((line_number, ';'.join(row)[:100], str(e)))
+                continue
+            
+            yield product_id, quantity
+    
+    def import_stocktaking(self, source, location="Основной склад", full_count=False, apply=True):
+        """Массовая инвентаризация из CSV (путь или файловый объект).
+        Строки потоково загружаются в временную таблицу executemany, суммируются по товару,
+        расхождения считаются одним запросом и применяются в той же транзакции.
+        full_count - непосчитанные активные товары считаются отсутствующими (0 шт.).
+        apply=False - только отчет, сессия остается активной для проверки.
+        """
+        started = time.perf_counter()
+        errors = []
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        own_file = isinstance(source, str)
+        if own_file:
+            source = open(source, 'r', encoding='utf-8-sig', newline='')
+        
+        try:
+            with self.db.transaction() as conn:
+                conn.execute('''
+                    CREATE TEMP TABLE IF NOT EXISTS stocktaking_import (
+                        product_id INTEGER NOT NULL,
+                        quantity INTEGER NOT NULL
+                    )
+                ''')
+                conn.execute('DELETE FROM stocktaking_import')
+                
+                conn.executemany(
+                    'INSERT INTO stocktaking_import (product_id, quantity) VALUES (?, ?)',
+                    self.parse_stocktaking_rows(source, errors)
+                )
+                lines = conn.execute('SELECT COUNT(*) FROM stocktaking_import').fetchone()[0]
+                
+                unknown = [row[0] for row in conn.execute('''
+                    SELECT DISTINCT i.product_id FROM stocktaking_import i
+                    WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.id = i.product_id)
+                ''')]
+                
+                session_id = conn.execute('''
+                    INSERT INTO stocktaking_sessions (
+                        location, status, started_at, created_by
+                    ) VALUES (?, 'active', ?, 1)
+                ''', (location, now)).lastrowid
+                
+                # Подсчет по товару; остаток фиксируется внутри транзакции и не расходится с текущим
+                conn.execute('''
+                    INSERT INTO stocktaking_items (
+                        session_id, product_id, system_quantity, counted_quantity, counted_at
+                    )
+                    SELECT ?, p.id, IFNULL(p.stock, 0), c.quantity, ?
+                    FROM (
+                        SELECT product_id, SUM(quantity) as quantity
+                        FROM stocktaking_import GROUP BY product_id
+                    ) c
+                    JOIN products p ON p.id = c.product_id
+                ''', (session_id, now))
+                
+                if full_count:
+                    conn.execute('''
+                        INSERT INTO stocktaking_items (
+                            session_id, product_id, system_quantity, counted_quantity, counted_at
+                        )
+                        SELECT ?, p.id, IFNULL(p.stock, 0), 0, ?
+                        FROM products p
+                        WHERE p.is_active = 1
+                        AND NOT EXISTS (SELECT 1 FROM stocktaking_import i WHERE i.product_id = p.id)
+                    ''', (session_id, now))
+                
+                products_counted = conn.execute(
+                    'SELECT COUNT(*) FROM stocktaking_items WHERE session_id = ?', (session_id,)
+                ).fetchone()[0]
+                
+                if apply:
+                    discrepancies = self.apply_stocktaking(conn, session_id)
+                else:
+                    discrepancies = conn.execute('''
+                        SELECT 
+                            si.product_id, p.name, si.system_quantity, si.counted_quantity,
+                            (si.counted_quantity - si.system_quantity) as difference
+                        FROM stocktaking_items si
+                        JOIN products p ON si.product_id = p.id
+                        WHERE si.session_id = ? AND si.counted_quantity != si.system_quantity
+                    ''', (session_id,)).fetchall()
+                
+                conn.execute('DROP TABLE stocktaking_import')
+        except Exception as e:
+            logging.info(f"Ошибка импорта инвентаризации: {e}")
+            return None
+        finally:
+            if own_file:
+                source.close()
+        
+        if apply:
+            for product_id, name, old_quantity, new_quantity, difference in discrepancies:
+                self.check_reorder_threshold(product_id, old_quantity, new_quantity)
         
         return {
+            'session_id': session_id,
+            'applied': apply,
+            'lines': lines,
+            'products_counted': products_counted,
+            'unknown_products': unknown,
+            'invalid_lines': len(errors),
+            'errors': errors[:STOCKTAKING_ERRORS_LIMIT],
             'discrepancies_count': len(discrepancies),
-            'discrepancies': discrepancies
+            'surplus': sum(row[4] for row in discrepancies if row[4] > 0),
+            'shortage': -sum(row[4] for row in discrepancies if row[4] < 0),
+            'discrepancies': discrepancies,
+            'duration': round(time.perf_counter() - started, 3)
         }
     
     def get_inventory_valuation(self, method='fifo'):
-        """Оценка стоимости запасов"""
-        if method == 'fifo':
-            # FIFO - первый пришел, первый ушел
-            valuation = self.db.execute_query('''
-                SELECT 
-                    p.id, p.name, p.stock,
-                    AVG(im.cost_per_unit) as avg_cost,
-                    p.stock * AVG(im.cost_per_unit) as inventory_value
-                FROM products p
-                LEFT JOIN inventory_movements im ON p.id = im.product_id
-                    AND im.movement_type = 'inbound'
-                    AND im.cost_per_unit IS NOT NULL
-                WHERE p.is_active = 1 AND p.stock > 0
-                GROUP BY p.id, p.name, p.stock
-                ORDER BY inventory_value DESC
-            ''')
+        """Оценка стоимости запасов: fifo, lifo, average - по слоям себестоимости, иначе по цене продажи"""
+        if method in VALUATION_METHODS:
+            valuation = self.cost_ledger.get_valuation(method)
         else:
             # Текущая цена
-            valuation = self.db.execute_query('''
+            valuation = self.reports_db.execute_query('''
                 SELECT 
                     id, name, stock, price as avg_cost,
                     stock * price as inventory_value
                 FROM products
                 WHERE is_active = 1 AND stock > 0
                 ORDER BY inventory_value DESC
-            ''')
+            ''') or []
         
         total_value = sum(item[4] for item in valuation if item[4])
         
@@ -900,50 +1092,67 @@ Email: {order[8]}
         
         return "❌ Неизвестный тип отчета"
     
-    def export_inventory_csv(self, report_type):
-        """Экспорт данных склада в CSV"""
-        import csv
-        import io
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
+    def get_export_rows(self, report_type):
+        """Заголовок и построчный генератор выгрузки склада"""
         if report_type == 'stock_levels':
-            products = self.db.execute_query('''
+            header = ['ID', 'Название', 'Остаток', 'Цена', 'Стоимость запасов', 'Категория']
+            rows = self.reports_db.iterate_query('''
                 SELECT 
-                    p.id, p.name, p.stock, p.price,
-                    (p.stock * p.price) as inventory_value,
+                    p.id, p.name, p.stock, ROUND(p.price, 2),
+                    ROUND(p.stock * p.price, 2) as inventory_value,
                     c.name as category
                 FROM products p
                 JOIN categories c ON p.category_id = c.id
                 WHERE p.is_active = 1
                 ORDER BY inventory_value DESC
             ''')
-            
-            writer.writerow(['ID', 'Название', 'Остаток', 'Цена', 'Стоимость запасов', 'Категория'])
-            for product in products:
-                writer.writerow([
-                    product[0], product[1], product[2], f"${product[3]:.2f}",
-                    f"${product[4]:.2f}", product[5]
-                ])
         
         elif report_type == 'movements':
-            movements = self.db.execute_query('''
+            header = ['Дата', 'Товар', 'Тип', 'Изменение', 'Причина', 'Поставщик']
+            rows = self.reports_db.iterate_query('''
                 SELECT 
                     im.created_at, p.name, im.movement_type,
-                    im.quantity_change, im.reason, s.name
+                    im.quantity_change, im.reason, IFNULL(s.name, '')
                 FROM inventory_movements im
                 JOIN products p ON im.product_id = p.id
                 LEFT JOIN suppliers s ON im.supplier_id = s.id
-                WHERE DATE(im.created_at) >= date('now', '-30 days')
+                WHERE im.created_at >= date('now', '-30 days')
                 ORDER BY im.created_at DESC
             ''')
-            
-            writer.writerow(['Дата', 'Товар', 'Тип', 'Изменение', 'Причина', 'Поставщик'])
-            for movement in movements:
-                writer.writerow([
-                    movement[0], movement[1], movement[2],
-                    movement[3], movement[4], movement[5] or ''
-                ])
-        
-        return output.getvalue()
\ No newline at end of file
+        
+        elif report_type == 'movements_history':
+            header = ['Дата', 'Товар', 'Тип', 'Изменение', 'Причина', 'Поставщик']
+            # Вся история: основная база вместе с помесячными архивами
+            rows = self.retention.iterate_history(['inventory_movements'], '''
+                SELECT 
+                    im.created_at, p.name, im.movement_type,
+                    im.quantity_change, im.reason, IFNULL(s.name, '')
+                FROM inventory_movements_history im
+                JOIN products p ON im.product_id = p.id
+                LEFT JOIN suppliers s ON im.supplier_id = s.id
+                ORDER BY im.created_at DESC
+            ''')
+        
+        else:
+            raise ValueError(f"Неизвестный тип выгрузки склада: {report_type}")
+        
+        return header, rows
+    
+    def export_inventory_csv(self, report_type):
+        """Экспорт данных склада в CSV (строкой, для небольших отчетов); неизвестный тип - пустая строка"""
+        from data_export import DataExporter
+        
+        try:
+            header, rows = self.get_export_rows(report_type)
+        except ValueError:
+            return ''
+        return ''.join(DataExporter().iter_lines(header, rows, 'csv'))
+    
+    def export_inventory_file(self, report_type, fmt='csv', progress_callback=None):
+        """Потоковая выгрузка склада в сжатый временный файл"""
+        from data_export import DataExporter
+        
+        header, rows = self.get_export_rows(report_type)
+        return DataExporter().export_to_file(
+            header, rows, fmt, name=f"inventory_{report_type}", progress_callback=progress_callback
+        )
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+Фоновая пакетная запись журналов (безопасность, активность, webhook'и, автоматизация)
+"""
+import logging
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from config import LOG_WRITER_CONFIG
+
+class LogWriter:
+    def __init__(self, db_path, batch_size=None, flush_interval=None, max_queue_size=None):
+        self.db_path = db_path
+        self.batch_size = batch_size or LOG_WRITER_CONFIG['batch_size']
+        self.flush_interval = flush_interval or LOG_WRITER_CONFIG['flush_interval']
+        self.put_timeout = LOG_WRITER_CONFIG['put_timeout']
+        self.queue = queue.Queue(maxsize=max_queue_size or LOG_WRITER_CONFIG['max_queue_size'])
+        self.stop_event = threading.Event()
+        # Счетчики обновляют писатель и вызывающие потоки (синхронная запись)
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'written': 0,
+            'batches': 0,
+            'sync_fallbacks': 0,
+            'failed': 0
+        }
+        self.connection = None
+        self.start_writer()
+
+    def start_writer(self):
+        """Запуск фонового писателя"""
+        self.writer_thread = threading.Thread(target=self.writer_worker, daemon=True)
+        self.writer_thread.start()
+
+    def write(self, query, params):
+        """Постановка строки журнала в очередь записи"""
+        if self.stop_event.is_set():
+            self.write_batch([(query, params)])
+            return
+
+        try:
+            # Очередь ограничена: при переполнении вызывающий поток ждет (backpressure)
+            self.queue.put((query, params), timeout=self.put_timeout)
+        except queue.Full:
+            # Писатель не успевает - пишем синхронно, чтобы не терять записи
+            self.count('sync_fallbacks')
+            self.write_batch([(query, params)])
+
+    def writer_worker(self):
+        """Цикл фонового писателя"""
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self.collect_batch()
+            if not batch:
+                continue
+
+            try:
+                self.write_batch(batch, self.get_connection())
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def collect_batch(self):
+        """Сбор пакета: по размеру или по истечении интервала"""
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            try:
+                if self.stop_event.is_set():
+                    batch.append(self.queue.get_nowait())
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def get_connection(self):
+        """Постоянное соединение потока-писателя"""
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_path, timeout=30)
+        return self.connection
+
+    def write_batch(self, batch, conn=None):
+        """Запись пакета одной транзакцией через executemany"""
+        # Группируем строки по запросу, сохраняя порядок появления
+        grouped = {}
+        for query, params in batch:
+            grouped.setdefault(query, []).append(params)
+
+        own_connection = conn is None
+        if own_connection:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+
+        try:
+            with conn:
+                for query, rows in grouped.items():
+                    conn.executemany(query, rows)
+            self.count('written', len(batch))
+            self.count('batches')
+        except Exception as e:
+            logging.info(f"Ошибка пакетной записи журнала: {e}")
+            # Пишем построчно, чтобы одна битая строка не потеряла весь пакет
+            for query, params in batch:
+                try:
+                    with conn:
+                        conn.execute(query, params)
+                    self.count('written')
+                except Exception as row_error:
+                    self.count('failed')
+                    logging.info(f"Ошибка записи строки журнала: {row_error}")
+        finally:
+            if own_connection:
+                conn.close()
+
+    def count(self, key, value=1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def flush(self):
+        """Ожидание записи всех строк из очереди; после остановки писателя остаток пишется сразу"""
+        if self.stop_event.is_set() and not self.writer_thread.is_alive():
+            self.drain()
+            return
+        self.queue.join()
+
+    def drain(self):
+        """Синхронная запись того, что осталось в очереди"""
+        remaining = []
+        while True:
+            try:
+                remaining.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not remaining:
+            return
+
+        try:
+            self.write_batch(remaining)
+        finally:
+            for _ in remaining:
+                self.queue.task_done()
+
+    def stop(self, timeout=10):
+        """Остановка писателя с записью оставшихся строк"""
+        if self.stop_event.is_set():
+            return
+
+        self.stop_event.set()
+        self.writer_thread.join(timeout)
+
+        # Если поток не успел - дописываем остаток синхронно
+        self.drain()
+
+    def get_stats(self):
+        """Статистика писателя"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['queued'] = self.queue.qsize()
+        return stats
+
+# Общие писатели по пути к базе
+log_writers = {}
+log_writers_lock = threading.Lock()
+
+def get_log_writer(db_path):
+    """Получение общего писателя журналов для базы"""
+    with log_writers_lock:
+        writer = log_writers.get(db_path)
+        if writer is None:
+            writer = LogWriter(db_path)
+            log_writers[db_path] = writer
+        return writer
+
+def shutdown_log_writers():
+    """Запись оставшихся строк и остановка всех писателей"""
+    with log_writers_lock:
+        writers = list(log_writers.values())
+        log_writers.clear()
+
+    for writer in writers:
+        writer.stop()
+
+atexit.register(shutdown_log_writers)
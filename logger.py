@@ -6,36 +6,127 @@ import logging
 import logging.handlers
 import os
 import sys
+import json
+import queue
+import random
+import threading
+import time
+import atexit
+from collections import defaultdict
 from datetime import datetime
 from config import LOGGING_CONFIG
 
+class JsonFormatter(logging.Formatter):
+    """Структурированные записи в формате JSON"""
+    RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+
+        # Поля из extra попадают в запись как есть
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Выборка и ограничение частоты записей по логгерам"""
+    def __init__(self, sampling=None, rate_limits=None):
+        super().__init__()
+        self.sampling = dict(sampling or {})
+        self.rate_limits = dict(rate_limits or {})
+        self.buckets = {}
+        self.dropped = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        # Предупреждения и ошибки не отбрасываем никогда
+        if record.levelno >= logging.WARNING:
+            return True
+
+        name = record.name
+        rate = self.sampling.get(name)
+        if rate is not None and random.random() >= rate:
+            self.dropped[name] += 1
+            return False
+
+        limit = self.rate_limits.get(name)
+        if limit is not None and not self.take_token(name, limit):
+            self.dropped[name] += 1
+            return False
+
+        return True
+
+    def take_token(self, name, limit):
+        """Token bucket: не больше limit записей в секунду"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(name, (limit, now))
+            tokens = min(limit, tokens + (now - last) * limit)
+            if tokens < 1:
+                self.buckets[name] = (tokens, now)
+                return False
+            self.buckets[name] = (tokens - 1, now)
+            return True
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Постановка записи в очередь без форматирования в вызывающем потоке"""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Сообщение и трассировку форматирует фоновый поток
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Вызывающий поток не ждет записи на диск
+            self.dropped += 1
+
 class ProductionLogger:
     def __init__(self):
+        self.listener = None
         self.setup_logging()
-    
+        atexit.register(self.stop)
+
     def setup_logging(self):
         """Настройка системы логирования"""
         # Создаем директорию для логов
         log_dir = os.path.dirname(LOGGING_CONFIG['file']) or 'logs'
         os.makedirs(log_dir, exist_ok=True)
-        
+
         # Основной логгер
         self.logger = logging.getLogger('shop_bot')
         self.logger.setLevel(getattr(logging, LOGGING_CONFIG['level']))
-        
+
         # Очищаем существующие обработчики
         self.logger.handlers.clear()
-        
+
         # Форматтер
         formatter = logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
         )
-        
+        file_formatter = JsonFormatter() if LOGGING_CONFIG['structured'] else formatter
+
         # Консольный вывод
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(formatter)
-        self.logger.addHandler(console_handler)
-        
+
         # Файловый вывод с ротацией
         file_handler = logging.handlers.RotatingFileHandler(
             LOGGING_CONFIG['file'],
@@ -43,9 +134,8 @@ class ProductionLogger:
             backupCount=LOGGING_CONFIG['backup_count'],
             encoding='utf-8'
         )
-        file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
-        
+        file_handler.setFormatter(file_formatter)
+
         # Отдельный файл для ошибок
         error_handler = logging.handlers.RotatingFileHandler(
             LOGGING_CONFIG['file'].replace('.log', '_errors.log'),
@@ -54,37 +144,97 @@ class ProductionLogger:
             encoding='utf-8'
         )
         error_handler.setLevel(logging.ERROR)
-        error_handler.setFormatter(formatter)
-        self.logger.addHandler(error_handler)
-        
+        error_handler.setFormatter(file_formatter)
+
         # Логгер для безопасности
         self.security_logger = logging.getLogger('shop_bot.security')
+        self.security_logger.handlers.clear()
         security_handler = logging.handlers.RotatingFileHandler(
             'logs/security.log',
             maxBytes=LOGGING_CONFIG['max_size'],
             backupCount=LOGGING_CONFIG['backup_count'],
             encoding='utf-8'
         )
-        security_handler.setFormatter(formatter)
-        self.security_logger.addHandler(security_handler)
+        security_handler.setFormatter(file_formatter)
+        security_handler.addFilter(logging.Filter('shop_bot.security'))
         self.security_logger.setLevel(logging.INFO)
-    
-    def info(self, message, extra=None):
+
+        # Запись на диск и в консоль выполняет фоновый поток
+        self.log_queue = queue.Queue(maxsize=LOGGING_CONFIG['queue_size'])
+        self.queue_handler = LazyQueueHandler(self.log_queue)
+        self.sampling_filter = SamplingFilter(LOGGING_CONFIG['sampling'], LOGGING_CONFIG['rate_limits'])
+        self.queue_handler.addFilter(self.sampling_filter)
+        self.logger.addHandler(self.queue_handler)
+
+        self.stop()
+        self.listener = logging.handlers.QueueListener(
+            self.log_queue,
+            console_handler, file_handler, error_handler, security_handler,
+            respect_handler_level=True
+        )
+        self.listener.start()
+
+        # Уровни модулей из окружения: "updates=DEBUG,database=WARNING"
+        for item in LOGGING_CONFIG['module_levels'].split(','):
+            if '=' in item:
+                module, level = item.split('=', 1)
+                self.set_level(module.strip(), level.strip())
+
+    def get_logger(self, module):
+        """Дочерний логгер модуля (shop_bot.<module>)"""
+        return logging.getLogger(f'shop_bot.{module}')
+
+    def set_level(self, module, level):
+        """Смена уровня логирования модуля во время работы"""
+        name = 'shop_bot' if module in ('', 'shop_bot') else f'shop_bot.{module}'
+        level_value = logging.getLevelName(str(level).upper())
+        if not isinstance(level_value, int):
+            raise ValueError(f"Неизвестный уровень логирования: {level}")
+        logging.getLogger(name).setLevel(level_value)
+        return name
+
+    def get_levels(self):
+        """Текущие уровни логгеров shop_bot"""
+        levels = {'shop_bot': logging.getLevelName(self.logger.level)}
+        for name, item in logging.Logger.manager.loggerDict.items():
+            if name.startswith('shop_bot.') and isinstance(item, logging.Logger) and item.level:
+                levels[name] = logging.getLevelName(item.level)
+        return levels
+
+    def get_stats(self):
+        """Статистика очереди логирования"""
+        return {
+            'queued': self.log_queue.qsize(),
+            'dropped_queue_full': self.queue_handler.dropped,
+            'dropped_sampling': dict(self.sampling_filter.dropped)
+        }
+
+    def stop(self):
+        """Запись оставшихся записей и остановка фонового потока"""
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+    def debug(self, message, *args, extra=None):
+        """Отладочное сообщение"""
+        self.logger.debug(message, *args, extra=extra, stacklevel=2)
+
+    def info(self, message, *args, extra=None):
         """Информационное сообщение"""
-        self.logger.info(message, extra=extra)
-    
-    def warning(self, message, extra=None):
+        self.logger.info(message, *args, extra=extra, stacklevel=2)
+
+    def warning(self, message, *args, extra=None):
         """Предупреждение"""
-        self.logger.warning(message, extra=extra)
-    
-    def error(self, message, exc_info=None, extra=None):
+        self.logger.warning(message, *args, extra=extra, stacklevel=2)
+
+    def error(self, message, *args, exc_info=None, extra=None):
         """Ошибка"""
-        self.logger.error(message, exc_info=exc_info, extra=extra)
-    
-    def critical(self, message, exc_info=None, extra=None):
+        self.logger.error(message, *args, exc_info=exc_info, extra=extra, stacklevel=2)
+
+    def critical(self, message, *args, exc_info=None, extra=None):
         """Критическая ошибка"""
-        self.logger.critical(message, exc_info=exc_info, extra=extra)
-    
+        self.logger.critical(message, *args, exc_info=exc_info, extra=extra, stacklevel=2)
+
     def security(self, message, user_id=None, action=None):
         """Лог безопасности"""
         extra_info = {
@@ -92,14 +242,14 @@ class ProductionLogger:
             'action': action,
             'timestamp': datetime.now().isoformat()
         }
-        self.security_logger.info(f"SECURITY: {message}", extra=extra_info)
-    
+        self.security_logger.info("SECURITY: %s", message, extra=extra_info, stacklevel=2)
+
     def performance(self, operation, duration, details=None):
         """Лог производительности"""
-        perf_message = f"PERFORMANCE: {operation} took {duration:.3f}s"
         if details:
-            perf_message += f" - {details}"
-        self.logger.info(perf_message)
+            self.logger.info("PERFORMANCE: %s took %.3fs - %s", operation, duration, details, stacklevel=2)
+        else:
+            self.logger.info("PERFORMANCE: %s took %.3fs", operation, duration, stacklevel=2)
 
 # Глобальный экземпляр логгера
-logger = ProductionLogger()
\ No newline at end of file
+logger = ProductionLogger()
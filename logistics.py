@@ -1,8 +1,11 @@
 """
 Модуль логистики и доставки
 """
+import logging
 
 from datetime import datetime, timedelta
+from config import CARRIER_CONFIG
+from carriers import CarrierDispatcher
 
 class LogisticsManager:
     def __init__(self, db):
@@ -14,6 +17,8 @@ class LogisticsManager:
             'local_courier': LocalCourierProvider(),
             'post': PostProvider()
         }
+        self.carrier_dispatcher = None
+        self.notification_manager = None
     
     def get_delivery_options(self, address, total_weight=1.0):
         """Получение вариантов доставки"""
@@ -105,6 +110,87 @@ class LogisticsManager:
             'estimated_delivery': self.calculate_estimated_delivery(delivery_option)
         }
     
+    def get_carrier_dispatcher(self):
+        """Адаптеры API служб доставки; создаются при первой пакетной отправке"""
+        if self.carrier_dispatcher is None:
+            self.carrier_dispatcher = CarrierDispatcher()
+        return self.carrier_dispatcher
+    
+    def get_default_delivery_option(self):
+        """Служба и вариант доставки для отправки из админ-панели"""
+        return {'id': CARRIER_CONFIG['default_option'], 'provider': CARRIER_CONFIG['default_carrier']}
+    
+    def create_shipments_batch(self, order_ids, delivery_option, time_slot=None):
+        """Пакетное создание отправлений через API службы: запросы пачками, запись одной транзакцией.
+        Отправляются только подтвержденные заказы, оплаченные или с оплатой при получении.
+        """
+        carrier = delivery_option.get('provider', 'local_courier')
+        orders = []
+        
+        for start in range(0, len(order_ids), CARRIER_CONFIG['orders_per_query']):
+            chunk = tuple(order_ids[start:start + CARRIER_CONFIG['orders_per_query']])
+            rows = self.db.execute_query(f'''
+                SELECT o.id, o.delivery_address, o.total_amount, u.name, u.phone,
+                       (SELECT IFNULL(SUM(oi.quantity), 0) FROM order_items oi WHERE oi.order_id = o.id)
+                FROM orders o
+                LEFT JOIN users u ON o.user_id = u.id
+                WHERE o.id IN ({','.join('?' * len(chunk))})
+                AND o.status = 'confirmed'
+                AND (IFNULL(o.payment_status, '') = 'paid' OR o.payment_method = 'cash')
+                AND NOT EXISTS (SELECT 1 FROM shipments s WHERE s.order_id = o.id)
+            ''', chunk) or []
+            orders.extend({
+                'order_id': order_id,
+                'address': address,
+                'total_amount': total_amount,
+                'name': name,
+                'phone': phone,
+                'items': items,
+                'service': delivery_option['id']
+            } for order_id, address, total_amount, name, phone, items in rows)
+        
+        skipped = sorted(set(order_ids) - {order['order_id'] for order in orders})
+        if not orders:
+            return {'created': [], 'failed': {}, 'skipped': skipped}
+        
+        results = self.get_carrier_dispatcher().create_shipments({carrier: orders})
+        estimated_delivery = self.calculate_estimated_delivery(delivery_option)
+        created = [
+            {
+                'order_id': order_id,
+                'tracking_number': result['tracking_number'],
+                'label_url': result.get('label_url'),
+                'cost': result.get('cost'),
+                'estimated_delivery': result.get('estimated_delivery') or estimated_delivery
+            }
+            for order_id, result in results.items() if not result.get('error')
+        ]
+        failed = {order_id: result['error'] for order_id, result in results.items() if result.get('error')}
+        
+        with self.db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO shipments (
+                    order_id, tracking_number, delivery_provider,
+                    delivery_option, time_slot, status, estimated_delivery
+                ) VALUES (?, ?, ?, ?, ?, 'created', ?)
+            ''', (
+                (shipment['order_id'], shipment['tracking_number'], carrier,
+                 delivery_option['id'], time_slot, shipment['estimated_delivery'])
+                for shipment in created
+            ))
+        
+        # Статус - обычным путем (резервы, учет) и уведомление клиента
+        for shipment in created:
+            self.db.update_order_status(shipment['order_id'], 'shipped')
+            if self.notification_manager:
+                try:
+                    self.notification_manager.send_order_status_notification(shipment['order_id'], 'shipped')
+                except Exception as e:
+                    logging.info(f"Ошибка уведомления об отправке заказа #{shipment['order_id']}: {e}")
+        
+        logging.info(f"Отправления {carrier}: создано {len(created)}, с ошибкой {len(failed)}")
+        return {'created': created, 'failed': failed, 'skipped': skipped}
+    
     def generate_tracking_number(self, order_id):
         """Генерация трек-номера"""
         import random
@@ -133,56 +219,78 @@ class LogisticsManager:
         return estimated_date.strftime('%Y-%m-%d %H:%M:%S')
     
     def track_shipment(self, tracking_number):
-        """Отслеживание посылки"""
-        shipment = self.db.execute_query(
-            'SELECT * FROM shipments WHERE tracking_number = ?',
-            (tracking_number,)
-        )
+        """Отслеживание посылки по сохраненной истории статусов одним чтением по индексам"""
+        rows = self.db.execute_query('''
+            SELECT s.status, s.estimated_delivery, s.created_at,
+                   h.status, h.description, h.location, h.event_time
+            FROM shipments s
+            LEFT JOIN shipment_status_history h ON h.shipment_id = s.id
+            WHERE s.tracking_number = ?
+            ORDER BY h.event_time
+        ''', (tracking_number,))
         
-        if not shipment:
+        if not rows:
             return None
         
-        shipment_data = shipment[0]
-        
-        # Симуляция статусов доставки
+        current_status, estimated_delivery, created_at = rows[0][:3]
         status_history = [
-            {
-                'status': 'created',
-                'description': 'Заказ создан',
-                'timestamp': shipment_data[7],  # created_at
-                'location': 'Склад'
-            },
-            {
-                'status': 'picked_up',
-                'description': 'Заказ забран курьером',
-                'timestamp': self.add_hours_to_date(shipment_data[7], 2),
-                'location': 'Сортировочный центр'
-            },
-            {
-                'status': 'in_transit',
-                'description': 'В пути',
-                'timestamp': self.add_hours_to_date(shipment_data[7], 24),
-                'location': 'Транспортный узел'
-            }
+            {'status': status, 'description': description, 'location': location, 'timestamp': event_time}
+            for _, _, _, status, description, location, event_time in rows if status
         ]
         
-        # Добавляем доставку если время пришло
-        estimated_delivery = datetime.strptime(shipment_data[6], '%Y-%m-%d %H:%M:%S')
-        if datetime.now() >= estimated_delivery:
+        # Служба еще не опрашивалась
+        if not status_history:
             status_history.append({
-                'status': 'delivered',
-                'description': 'Доставлено',
-                'timestamp': shipment_data[6],
-                'location': 'Адрес получателя'
+                'status': 'created',
+                'description': 'Заказ создан',
+                'timestamp': created_at,
+                'location': 'Склад'
             })
         
         return {
             'tracking_number': tracking_number,
-            'current_status': shipment_data[5],
-            'estimated_delivery': shipment_data[6],
+            'current_status': current_status,
+            'estimated_delivery': estimated_delivery,
             'history': status_history
         }
     
+    def simulate_tracking_events(self, created_at, estimated_delivery, now):
+        """События для отправлений без API службы: этапы по времени от создания"""
+        events = [
+            ('created', 'Заказ создан', 'Склад', created_at),
+            ('picked_up', 'Заказ забран курьером', 'Сортировочный центр', self.add_hours_to_date(created_at, 2)),
+            ('in_transit', 'В пути', 'Транспортный узел', self.add_hours_to_date(created_at, 24)),
+            ('delivered', 'Доставлено', 'Адрес получателя', estimated_delivery)
+        ]
+        now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+        
+        return [
+            {'status': status, 'description': description, 'location': location, 'timestamp': timestamp}
+            for status, description, location, timestamp in events if timestamp and timestamp <= now_str
+        ]
+    
+    def fetch_tracking_events(self, shipments, now):
+        """События по отправлениям: службы с API опрашиваются пакетами, остальные - по расписанию этапов"""
+        by_carrier = {}
+        results = {}
+        
+        for _, _, tracking_number, provider, _, created_at, estimated_delivery, _ in shipments:
+            if provider in CARRIER_CONFIG['carriers']:
+                by_carrier.setdefault(provider, []).append(tracking_number)
+            else:
+                try:
+                    results[tracking_number] = {
+                        'events': self.simulate_tracking_events(created_at, estimated_delivery, now),
+                        'error': None
+                    }
+                except (TypeError, ValueError) as e:
+                    results[tracking_number] = {'events': [], 'error': str(e)}
+        
+        if by_carrier:
+            results.update(self.get_carrier_dispatcher().track_shipments(by_carrier))
+        
+        return results
+    
     def add_hours_to_date(self, date_string, hours):
         """Добавление часов к дате"""
         date_obj = datetime.strptime(date_string, '%Y-%m-%d %H:%M:%S')
@@ -225,10 +333,29 @@ class LogisticsManager:
             WHERE order_id = ?
         ''', (delivery_date, time_slot, order_id))
     
+    def build_delivery_update_text(self, order_id, tracking_number, new_status, language):
+        """Текст уведомления о смене статуса доставки"""
+        from localization import t
+        
+        status_messages = {
+            'picked_up': 'delivery_picked_up',
+            'in_transit': 'delivery_in_transit',
+            'out_for_delivery': 'delivery_out_for_delivery',
+            'delivered': 'delivery_delivered'
+        }
+        
+        message_key = status_messages.get(new_status, 'delivery_update')
+        
+        notification_text = f"🚚 <b>{t('delivery_update', language=language)}</b>\n\n"
+        notification_text += f"📦 {t('order', language=language)} #{order_id}\n"
+        notification_text += f"📍 {t('tracking_number', language=language)}: {tracking_number}\n\n"
+        notification_text += f"📋 {t(message_key, language=language)}"
+        return notification_text
+    
     def notify_delivery_update(self, tracking_number, new_status):
         """Уведомление об обновлении доставки"""
         shipment = self.db.execute_query('''
-            SELECT s.order_id, u.telegram_id, u.name, u.language
+            SELECT s.order_id, o.user_id, u.language
             FROM shipments s
             JOIN orders o ON s.order_id = o.id
             JOIN users u ON o.user_id = u.id
@@ -236,30 +363,14 @@ class LogisticsManager:
         ''', (tracking_number,))
         
         if shipment:
-            order_id, telegram_id, user_name, language = shipment[0]
-            
-            from localization import t
-            
-            status_messages = {
-                'picked_up': 'delivery_picked_up',
-                'in_transit': 'delivery_in_transit',
-                'out_for_delivery': 'delivery_out_for_delivery',
-                'delivered': 'delivery_delivered'
-            }
-            
-            message_key = status_messages.get(new_status, 'delivery_update')
-            
-            notification_text = f"🚚 <b>{t('delivery_update', language=language)}</b>\n\n"
-            notification_text += f"📦 {t('order', language=language)} #{order_id}\n"
-            notification_text += f"📍 {t('tracking_number', language=language)}: {tracking_number}\n\n"
-            notification_text += f"📋 {t(message_key, language=language)}"
+            order_id, user_id, language = shipment[0]
             
             # Отправляем через NotificationManager
             if hasattr(self, 'notification_manager'):
                 self.notification_manager.send_instant_push(
-                    shipment[0][0],  # user_id из orders
+                    user_id,
                     'push_delivery_update',
-                    notification_text,
+                    self.build_delivery_update_text(order_id, tracking_number, new_status, language),
                     'delivery'
                 )
 
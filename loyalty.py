@@ -0,0 +1,243 @@
+"""
+Программа лояльности: журнал операций с баллами, материализованные балансы и уровни
+"""
+import logging
+import threading
+import time
+
+from datetime import datetime, timedelta
+from config import LOYALTY_CONFIG
+
+class LoyaltyManager:
+    def __init__(self, db):
+        # Начальные операции для балансов до появления журнала - миграция 202610191300 (migrations.py)
+        self.db = db
+        self.accrual_mark = 0  # Заказы с меньшим id завершены и учтены - начисление их не просматривает
+
+    def get_tier_case(self):
+        """SQL-выражение уровня по текущим баллам"""
+        branches = ' '.join(
+            f"WHEN current_points >= {threshold} THEN '{tier}'"
+            for tier, threshold in sorted(LOYALTY_CONFIG['tiers'], key=lambda tier: -tier[1])
+        )
+        return f"CASE {branches} ELSE '{LOYALTY_CONFIG['tiers'][0][0]}' END"
+
+    def get_balance(self, user_id):
+        """Баланс и уровень пользователя одним чтением по ключу"""
+        balance = self.db.execute_query(
+            'SELECT current_points, total_earned, current_tier FROM loyalty_points WHERE user_id = ?',
+            (user_id,)
+        )
+        if not balance:
+            return {'points': 0, 'total_earned': 0, 'tier': LOYALTY_CONFIG['tiers'][0][0]}
+
+        points, total_earned, tier = balance[0]
+        return {'points': points, 'total_earned': total_earned, 'tier': tier}
+
+    def post(self, conn, entries):
+        """Запись операций [(user_id, points, kind, order_id, expires_at)] и обновление балансов.
+        Возвращает пользователей, у которых изменился уровень.
+        """
+        if not entries:
+            return []
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany('''
+            INSERT INTO loyalty_transactions (user_id, points, kind, order_id, expires_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', ((*entry, now) for entry in entries))
+
+        # Сумма по пользователю - один UPSERT баланса на пользователя
+        deltas = {}
+        for user_id, points, kind, order_id, expires_at in entries:
+            earned = points if points > 0 and kind == 'accrual' else 0
+            current, total = deltas.get(user_id, (0, 0))
+            deltas[user_id] = (current + points, total + earned)
+
+        conn.executemany('''
+            INSERT INTO loyalty_points (user_id, current_points, total_earned, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                current_points = current_points + excluded.current_points,
+                total_earned = total_earned + excluded.total_earned,
+                updated_at = excluded.updated_at
+        ''', ((user_id, current, total, now) for user_id, (current, total) in deltas.items()))
+
+        return self.recompute_tiers(conn, list(deltas))
+
+    def recompute_tiers(self, conn, user_ids):
+        """Пересчет уровня только для пользователей с изменившимся балансом"""
+        changes = []
+        tier_case = self.get_tier_case()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            changes.extend(conn.execute(f'''
+                SELECT user_id, current_tier, {tier_case} FROM loyalty_points
+                WHERE user_id IN ({placeholders}) AND current_tier IS NOT {tier_case}
+            ''', chunk).fetchall())
+
+        conn.executemany(
+            'UPDATE loyalty_points SET current_tier = ? WHERE user_id = ?',
+            ((new_tier, user_id) for user_id, _, new_tier in changes)
+        )
+        conn.executemany('''
+            INSERT INTO loyalty_tier_events (user_id, old_tier, new_tier, created_at)
+            VALUES (?, ?, ?, ?)
+        ''', ((user_id, old_tier, new_tier, now) for user_id, old_tier, new_tier in changes))
+
+        return changes
+
+    def add_points(self, user_id, points, kind='adjust', order_id=None):
+        """Ручное начисление или списание баллов"""
+        expires_at = None
+        if points > 0 and kind == 'accrual':
+            expires_at = (datetime.now() + timedelta(days=LOYALTY_CONFIG['points_ttl_days'])).strftime('%Y-%m-%d %H:%M:%S')
+
+        with self.db.transaction() as conn:
+            return self.post(conn, [(user_id, points, kind, order_id, expires_at)])
+
+    def redeem_points(self, user_id, points, order_id=None):
+        """Списание баллов в оплату; не уходит в минус при параллельных списаниях"""
+        with self.db.transaction() as conn:
+            balance = conn.execute(
+                'SELECT current_points FROM loyalty_points WHERE user_id = ?',
+                (user_id,)
+            ).fetchone()
+            if not balance or balance[0] < points:
+                return False
+
+            self.post(conn, [(user_id, -points, 'redeem', order_id, None)])
+        return True
+
+    def accrue_delivered_orders(self):
+        """Пакетное начисление за доставленные заказы, по которым еще не начисляли.
+        Просматриваются только заказы не ниже accrual_mark, после прохода отметка сдвигается.
+        """
+        expires_at = (datetime.now() + timedelta(days=LOYALTY_CONFIG['points_ttl_days'])).strftime('%Y-%m-%d %H:%M:%S')
+        accrued = 0
+        tier_changes = []
+
+        while True:
+            with self.db.transaction() as conn:
+                orders = conn.execute('''
+                    SELECT o.id, o.user_id, CAST(o.total_amount * ? AS INTEGER)
+                    FROM orders o
+                    WHERE o.id >= ? AND o.status = 'delivered' AND o.user_id IS NOT NULL
+                    AND NOT EXISTS (
+                        SELECT 1 FROM loyalty_transactions t
+                        WHERE t.order_id = o.id AND t.kind = 'accrual'
+                    )
+                    LIMIT ?
+                ''', (LOYALTY_CONFIG['points_rate'], self.accrual_mark, LOYALTY_CONFIG['batch_size'])).fetchall()
+
+                if not orders:
+                    break
+
+                # Заказ с нулевыми баллами тоже отмечается, чтобы не выбираться снова
+                tier_changes.extend(self.post(conn, [
+                    (user_id, points, 'accrual', order_id, expires_at)
+                    for order_id, user_id, points in orders
+                ]))
+                accrued += len(orders)
+
+            if len(orders) < LOYALTY_CONFIG['batch_size']:
+                break
+
+        self.advance_accrual_mark()
+
+        if accrued:
+            logging.info(f"Начислены баллы лояльности за {accrued} заказов")
+
+        return {'orders': accrued, 'tier_changes': tier_changes}
+
+    def advance_accrual_mark(self):
+        """Сдвиг отметки до первого заказа, который еще может получить начисление"""
+        mark = self.db.execute_query('''
+            SELECT IFNULL(MIN(o.id), (SELECT IFNULL(MAX(id), 0) + 1 FROM orders))
+            FROM orders o
+            WHERE o.id >= ? AND o.user_id IS NOT NULL
+            AND IFNULL(o.status, '') NOT IN ('cancelled', 'returned', 'lost')
+            AND NOT EXISTS (
+                SELECT 1 FROM loyalty_transactions t
+                WHERE t.order_id = o.id AND t.kind = 'accrual'
+            )
+        ''', (self.accrual_mark,))
+        if mark:
+            self.accrual_mark = max(self.accrual_mark, mark[0][0])
+
+    def expire_points(self):
+        """Сгорание баллов одним набором. Списания гасят самые старые баллы (FIFO):
+        сначала начальный остаток, затем начисления - сгорает то, что осталось от просроченных.
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        with self.db.transaction() as conn:
+            expiring = conn.execute('''
+                SELECT user_id, expired - MAX(debited - opening, 0) FROM (
+                    SELECT
+                        t.user_id,
+                        SUM(CASE WHEN t.kind = 'accrual' AND t.expires_at <= ? THEN t.points ELSE 0 END) as expired,
+                        SUM(CASE WHEN t.kind = 'opening' AND t.points > 0 THEN t.points ELSE 0 END) as opening,
+                        -SUM(CASE WHEN t.points < 0 THEN t.points ELSE 0 END) as debited
+                    FROM loyalty_transactions t
+                    WHERE t.user_id IN (
+                        SELECT user_id FROM loyalty_transactions
+                        WHERE kind = 'accrual' AND expires_at <= ?
+                    )
+                    AND t.user_id IN (SELECT user_id FROM loyalty_points WHERE current_points > 0)
+                    GROUP BY t.user_id
+                )
+                WHERE expired > MAX(debited - opening, 0)
+            ''', (now, now)).fetchall()
+
+            tier_changes = self.post(conn, [
+                (user_id, -points, 'expire', None, None) for user_id, points in expiring
+            ])
+
+        if expiring:
+            logging.info(f"Сгорели баллы лояльности у {len(expiring)} пользователей")
+
+        return {'users': len(expiring), 'points': sum(points for _, points in expiring), 'tier_changes': tier_changes}
+
+    def get_pending_tier_events(self, limit=500):
+        """Смены уровня, о которых еще не уведомили"""
+        return self.db.execute_query('''
+            SELECT id, user_id, old_tier, new_tier FROM loyalty_tier_events
+            WHERE notified = 0
+            ORDER BY id
+            LIMIT ?
+        ''', (limit,)) or []
+
+    def mark_tier_events_notified(self, event_ids):
+        """Отметка отправленных уведомлений о смене уровня"""
+        with self.db.transaction() as conn:
+            conn.executemany(
+                'UPDATE loyalty_tier_events SET notified = 1 WHERE id = ?',
+                ((event_id,) for event_id in event_ids)
+            )
+
+    def is_upgrade(self, old_tier, new_tier):
+        """Повышение уровня (а не понижение)"""
+        order = [tier for tier, _ in LOYALTY_CONFIG['tiers']]
+        return order.index(new_tier) > order.index(old_tier or order[0])
+
+    def schedule_jobs(self):
+        """Фоновые начисление и сгорание баллов"""
+        def loyalty_worker():
+            expired_at = None
+            while True:
+                try:
+                    self.accrue_delivered_orders()
+                    # Сгорание - раз в сутки
+                    if expired_at is None or datetime.now() - expired_at >= timedelta(days=1):
+                        self.expire_points()
+                        expired_at = datetime.now()
+                except Exception as e:
+                    logging.info(f"Ошибка обработки баллов лояльности: {e}")
+                time.sleep(LOYALTY_CONFIG['accrual_interval'])
+
+        loyalty_thread = threading.Thread(target=loyalty_worker, daemon=True)
+        loyalty_thread.start()
@@ -15,16 +15,25 @@ from datetime import datetime
 from database import DatabaseManager
 from handlers import MessageHandler
 from notifications import NotificationManager
-from utils import format_date
 from payments import PaymentProcessor
+from payment_intents import PaymentIntentService
 from logistics import LogisticsManager
+from shipment_tracking import ShipmentTracker
 from promotions import PromotionManager
 from crm import CRMManager
 from logger import logger
 from health_check import HealthMonitor
 from database_backup import DatabaseBackup
 from scheduled_posts import ScheduledPostsManager
-from config import BOT_CONFIG
+from log_writer import shutdown_log_writers
+from flash_sales import FlashSaleEngine
+from loyalty import LoyaltyManager
+from data_retention import RetentionManager
+from analytics_snapshot import AnalyticsSnapshot
+from config import BOT_CONFIG, REORDER_CONFIG
+
+# Входящие обновления: выборка и лимит частоты задаются в LOGGING_CONFIG
+update_logger = logger.get_logger('updates')
 
 # Импорты с обработкой ошибок
 try:
@@ -34,9 +43,10 @@ except ImportError:
     logging.info("⚠️ AdminHandler не найден, админ-функции недоступны")
 
 try:
-    from security import SecurityManager
+    from security import SecurityManager, AntiSpamFilter
 except ImportError:
     SecurityManager = None
+    AntiSpamFilter = None
     logging.info("⚠️ SecurityManager не найден, функции безопасности ограничены")
 
 try:
@@ -45,6 +55,12 @@ except ImportError:
     WebhookManager = None
     logging.info("⚠️ WebhookManager не найден, webhook'и недоступны")
 
+try:
+    from partner_api import APIManager
+except ImportError:
+    APIManager = None
+    logging.info("⚠️ APIManager не найден, API для партнеров недоступно")
+
 try:
     from analytics import AnalyticsManager
 except ImportError:
@@ -78,9 +94,11 @@ except ImportError:
     logging.info("⚠️ MarketingAutomationManager не найден, автоматизация недоступна")
 
 class TelegramShopBot:
-    def __init__(self, token):
+    def __init__(self, token, db_path='shop_bot.db', api_url=None, background=True):
+        # background=False - те же компоненты и маршрутизация без фоновых потоков, расписаний и сигналов
+        # (бенчмарки, проверки); модули, которые запускают поток в конструкторе, не создаются
         self.token = token
-        self.base_url = f"https://api.telegram.org/bot{token}"
+        self.base_url = f"{api_url or BOT_CONFIG['api_url']}/bot{token}"
         self.offset = 0
         self.running = True
         self.error_count = 0
@@ -89,15 +107,22 @@ class TelegramShopBot:
         self.last_data_reload = time.time()
         
         # Инициализация компонентов
-        self.db = DatabaseManager()
+        self.db = DatabaseManager(db_path)
         self.setup_admin_from_env()
-        self.backup_manager = DatabaseBackup(self.db.db_path)
+        self.backup_manager = DatabaseBackup(self.db.db_path) if background else None
+        # Снимок базы для отчетов: тяжелые выборки не блокируют запись заказов
+        self.analytics_snapshot = AnalyticsSnapshot(self.db)
+        if background:
+            self.analytics_snapshot.start_scheduler()
+        else:
+            self.analytics_snapshot.refresh()
         self.message_handler = MessageHandler(self, self.db)
         self.notification_manager = NotificationManager(self, self.db)
         self.payment_processor = PaymentProcessor()
+        self.payment_intents = PaymentIntentService(self.db, self.payment_processor)
         
         # Система мониторинга
-        self.health_monitor = HealthMonitor(self.db, self)
+        self.health_monitor = HealthMonitor(self.db, self) if background else None
         
         # Инициализация админ-панели
         if AdminHandler:
@@ -108,21 +133,29 @@ class TelegramShopBot:
         # Инициализация бизнес-модулей
         self.logistics_manager = LogisticsManager(self.db)
         self.promotion_manager = PromotionManager(self.db)
-        self.crm_manager = CRMManager(self.db)
+        self.crm_manager = CRMManager(self.db, self.analytics_snapshot.db)
         
         # Связываем компоненты
         self.message_handler.notification_manager = self.notification_manager
         self.admin_handler.notification_manager = self.notification_manager
         self.message_handler.payment_processor = self.payment_processor
+        self.logistics_manager.notification_manager = self.notification_manager
+        
+        # Опрос служб доставки: история статусов и уведомления при смене статуса
+        self.shipment_tracker = ShipmentTracker(self.db, self.logistics_manager, self.notification_manager)
+        if background:
+            self.shipment_tracker.start_poller()
         
         # Инициализируем безопасность
         if SecurityManager:
             self.security_manager = SecurityManager(self.db)
+            self.spam_filter = AntiSpamFilter(self.db)
         else:
             self.security_manager = None
+            self.spam_filter = None
         
         # Инициализируем webhook'и
-        if WebhookManager and self.security_manager:
+        if WebhookManager and self.security_manager and background:
             self.webhook_manager = WebhookManager(self, self.db, self.security_manager)
         else:
             self.webhook_manager = None
@@ -130,22 +163,42 @@ class TelegramShopBot:
         # Запускаем аналитические отчеты
         if AnalyticsManager:
             self.analytics = AnalyticsManager(self.db)
-            self.analytics.schedule_analytics_reports()
+            if background:
+                self.analytics.schedule_analytics_reports()
         else:
             self.analytics = None
         
         # Инициализируем финансовую отчетность
         if FinancialReportsManager:
-            self.financial_reports = FinancialReportsManager(self.db)
+            self.financial_reports = FinancialReportsManager(self.db, self.analytics_snapshot.db)
         else:
             self.financial_reports = None
         
         # Инициализируем управление складом
         if InventoryManager:
-            self.inventory_manager = InventoryManager(self.db)
+            self.inventory_manager = InventoryManager(self.db, self.analytics_snapshot.db)
             self.inventory_manager.bot = self  # Добавляем ссылку на бота
+            self.flash_sale_engine = FlashSaleEngine(
+                self.db, self.inventory_manager.stock_history, self.inventory_manager.cost_ledger
+            )
+            self.flash_sale_engine.notifier = self.notify_flash_sale_claim
         else:
             self.inventory_manager = None
+            self.flash_sale_engine = None
+        
+        # API для партнеров: один экземпляр с кэшем ключей и ответов на все запросы
+        self.api_manager = APIManager(self.db, self.inventory_manager) if APIManager else None
+        
+        # Программа лояльности: начисление за доставленные заказы и сгорание баллов в фоне
+        self.loyalty_manager = LoyaltyManager(self.db)
+        self.db.loyalty_manager = self.loyalty_manager
+        if background:
+            self.loyalty_manager.schedule_jobs()
+        
+        # Перенос старых строк журналов и логов в помесячные архивы
+        self.retention_manager = RetentionManager(self.db)
+        if background:
+            self.retention_manager.start_scheduler()
         
         # Инициализируем AI функции
         if AIRecommendationEngine:
@@ -164,24 +217,41 @@ class TelegramShopBot:
             self.smart_notifications = None
         
         # Инициализируем маркетинговую автоматизацию
-        if MarketingAutomationManager:
-            self.marketing_automation = MarketingAutomationManager(self.db, self.notification_manager)
+        if MarketingAutomationManager and background:
+            self.marketing_automation = MarketingAutomationManager(
+                self.db, self.notification_manager, self.flash_sale_engine, self.loyalty_manager
+            )
         else:
             self.marketing_automation = None
         
         # Инициализируем систему автоматических постов
-        try:
-            from scheduled_posts import ScheduledPostsManager
-            self.scheduled_posts = ScheduledPostsManager(self, self.db)
-            # Передаем ссылку на бота в менеджер постов
-            self.scheduled_posts.bot = self
-            logger.info("✅ Система автоматических постов инициализирована")
-        except Exception as e:
-            logger.warning(f"⚠️ Автопосты недоступны (модуль schedule не установлен): {e}")
-            self.scheduled_posts = None
+        self.scheduled_posts = None
+        if background:
+            try:
+                from scheduled_posts import ScheduledPostsManager
+                self.scheduled_posts = ScheduledPostsManager(self, self.db)
+                # Передаем ссылку на бота в менеджер постов
+                self.scheduled_posts.bot = self
+                logger.info("✅ Система автоматических постов инициализирована")
+            except Exception as e:
+                logger.warning(f"⚠️ Автопосты недоступны (модуль schedule не установлен): {e}")
+                self.scheduled_posts = None
+        
+        if self.inventory_manager:
+            self.inventory_manager.reservations.cancel_order = self.cancel_order
+        
+        if background:
+            self.start_background_jobs()
         
+        logger.info("✅ Бот инициализирован успешно")
+    
+    def start_background_jobs(self):
+        """Расписания, фоновые потоки и сигналы (пропускается при background=False)"""
         # Запускаем автоматические проверки склада ПОСЛЕ инициализации всех компонентов
         self.schedule_inventory_checks()
+        if self.inventory_manager:
+            self.inventory_manager.reservations.start_sweeper()
+            self.flash_sale_engine.start_sweeper()
         
         # Инициализируем автоматизацию маркетинга только если модуль доступен
         if self.marketing_automation:
@@ -193,8 +263,6 @@ class TelegramShopBot:
         
         # Запускаем проверку обновлений данных
         self.start_data_sync_monitor()
-        
-        logger.info("✅ Бот инициализирован успешно")
     
     def start_data_sync_monitor(self):
         """Запуск мониторинга обновлений данных"""
@@ -262,7 +330,7 @@ class TelegramShopBot:
         """Полная перезагрузка всех данных и компонентов"""
         try:
             # Перезагружаем базу данных
-            self.db = DatabaseManager()
+            self.db = DatabaseManager(self.db.db_path)
             
             # Перезагружаем кэш
             self.reload_data_cache()
@@ -380,6 +448,32 @@ class TelegramShopBot:
         self.running = False
         sys.exit(0)
     
+    def cancel_order(self, order_id, only_if_unpaid=False):
+        """Отмена заказа: резерв и промокоды (update_order_status), заявки флеш-распродажи, уведомление клиента"""
+        result = self.db.update_order_status(order_id, 'cancelled', only_if_unpaid)
+        if not result:
+            return result
+        
+        if self.flash_sale_engine:
+            self.flash_sale_engine.release_order(order_id)
+        
+        try:
+            self.notification_manager.send_order_status_notification(order_id, 'cancelled')
+        except Exception as e:
+            logging.info(f"Ошибка уведомления об отмене заказа #{order_id}: {e}")
+        
+        return result
+    
+    def notify_flash_sale_claim(self, claim):
+        """Уведомление покупателя из очереди: товар флеш-распродажи освободился"""
+        user = self.db.execute_query('SELECT telegram_id FROM users WHERE id = ?', (claim['user_id'],))
+        if user:
+            self.send_message(
+                user[0][0],
+                f"🔥 <b>Товар из флеш-распродажи освободился!</b>\n\n"
+                f"Он закреплен за вами до {claim['expires_at']}. Успейте оформить заказ."
+            )
+    
     def schedule_inventory_checks(self):
         """Планирование проверок склада"""
         if not hasattr(self, 'inventory_manager') or not self.inventory_manager:
@@ -391,11 +485,11 @@ class TelegramShopBot:
         def inventory_worker():
             while True:
                 try:
-                    # Проверяем каждые 6 часов
+                    # Пороги проверяются при каждом изменении остатка, здесь - страховка
                     if hasattr(self, 'inventory_manager') and self.inventory_manager:
-                        self.inventory_manager.check_reorder_alerts()
                         self.inventory_manager.process_automatic_reorders()
-                    time.sleep(21600)  # 6 часов
+                        self.inventory_manager.stock_history.take_snapshot_if_due()
+                    time.sleep(REORDER_CONFIG['safety_scan_hours'] * 3600)
                 except Exception as e:
                     logging.info(f"Ошибка проверки склада: {e}")
                     time.sleep(3600)  # Повтор через час при ошибке
@@ -486,6 +580,72 @@ class TelegramShopBot:
             logging.info(f"Ошибка отправки фото: {e}")
             return None
     
+    def send_document(self, chat_id, file_path, filename=None, caption=""):
+        """Отправка файла multipart-запросом, файл читается с диска потоково"""
+        url = f"{self.base_url}/sendDocument"
+        boundary = f"----ShopBot{int(time.time() * 1000)}"
+        filename = filename or os.path.basename(file_path)
+
+        fields = {'chat_id': str(chat_id), 'caption': caption, 'parse_mode': 'HTML'}
+        preamble = ''.join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        )
+        preamble += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="document"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        )
+        preamble = preamble.encode('utf-8')
+        epilogue = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        content_length = len(preamble) + os.path.getsize(file_path) + len(epilogue)
+
+        def body():
+            yield preamble
+            with open(file_path, 'rb') as document:
+                while True:
+                    chunk = document.read(64 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+            yield epilogue
+
+        try:
+            req = urllib.request.Request(url, data=body(), method='POST', headers={
+                'Content-Type': f'multipart/form-data; boundary={boundary}',
+                'Content-Length': str(content_length)
+            })
+            with urllib.request.urlopen(req, timeout=BOT_CONFIG['request_timeout'] * 4) as response:
+                result = json.loads(response.read().decode('utf-8'))
+                if not result.get('ok'):
+                    logging.info(f"Ошибка отправки документа: {result}")
+                return result
+        except Exception as e:
+            logging.info(f"Ошибка отправки документа: {e}")
+            return None
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        """Редактирование текста сообщения"""
+        url = f"{self.base_url}/editMessageText"
+        data = {
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'text': text,
+            'parse_mode': 'HTML'
+        }
+
+        if reply_markup:
+            data['reply_markup'] = json.dumps(reply_markup)
+
+        try:
+            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
+            req = urllib.request.Request(url, data=data_encoded, method='POST')
+            with urllib.request.urlopen(req) as response:
+                result = json.loads(response.read().decode('utf-8'))
+                return result.get('ok', False)
+        except Exception as e:
+            logging.info(f"Ошибка редактирования сообщения: {e}")
+            return False
+
     def get_updates(self):
         """Получение обновлений"""
         url = f"{self.base_url}/getUpdates"
@@ -519,57 +679,7 @@ class TelegramShopBot:
                         try:
                             self.health_monitor.increment_messages()
                             
-                            if 'message' in update:
-                                message = update['message']
-                                text = message.get('text', '')
-                                telegram_id = message['from']['id']
-                                
-                                # Логируем сообщение
-                                logger.info(f"Сообщение от {telegram_id}: {text[:50]}...")
-                                
-                                # Проверяем админ команды
-                                if self.admin_handler and (text.startswith('/admin') or text in ['📊 Статистика', '📦 Заказы', '🛠 Товары', '👥 Пользователи', '🔙 Пользовательский режим']):
-                                    self.admin_handler.handle_admin_command(message)
-                                elif self.admin_handler and text in ['📈 Аналитика', '🛡 Безопасность', '💰 Финансы', '📦 Склад', '🤖 AI', '🎯 Автоматизация', '👥 CRM', '📢 Рассылка']:
-                                    self.admin_handler.handle_admin_command(message)
-                                elif self.admin_handler and text.startswith('/admin_order_'):
-                                    self.admin_handler.handle_order_management(message)
-                                elif self.admin_handler and (text.startswith('/edit_product_') or text.startswith('/delete_product_')):
-                                    self.admin_handler.handle_product_commands(message)
-                                elif self.admin_handler and hasattr(self.admin_handler, 'admin_states') and self.admin_handler.admin_states.get(telegram_id):
-                                    state = self.admin_handler.admin_states.get(telegram_id, '')
-                                    if state.startswith('adding_product_'):
-                                        self.admin_handler.handle_add_product_process(message)
-                                    elif state.startswith('creating_broadcast_'):
-                                        self.admin_handler.handle_broadcast_creation(message)
-                                elif text == '/notifications':
-                                    self.show_user_notifications(message)
-                                else:
-                                    self.message_handler.handle_message(message)
-                            elif 'callback_query' in update:
-                                callback_query = update['callback_query']
-                                data = callback_query['data']
-                                telegram_id = callback_query['from']['id']
-                                
-                                # Проверяем админ callback'и
-                                if self.admin_handler and (data.startswith('admin_') or data.startswith('change_status_') or data.startswith('order_details_')):
-                                    self.admin_handler.handle_callback_query(callback_query)
-                                elif self.admin_handler and (data.startswith('analytics_') or data.startswith('period_')):
-                                    self.admin_handler.handle_analytics_callback(callback_query)
-                                elif self.admin_handler and data.startswith('export_'):
-                                    self.admin_handler.handle_export_callback(callback_query)
-                                elif self.admin_handler and (data.startswith('security_') or data.startswith('unblock_user_')):
-                                    if hasattr(self.admin_handler, 'handle_security_callback'):
-                                        self.admin_handler.handle_security_callback(callback_query)
-                                    else:
-                                        self.admin_handler.handle_callback_query(callback_query)
-                                elif self.admin_handler and data.startswith('broadcast_'):
-                                    if hasattr(self.admin_handler, 'handle_broadcast_callback'):
-                                        self.admin_handler.handle_broadcast_callback(callback_query)
-                                    else:
-                                        self.admin_handler.handle_callback_query(callback_query)
-                                else:
-                                    self.message_handler.handle_callback_query(callback_query)
+                            self.process_update(update)
                         except Exception as e:
                             logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
                             self.health_monitor.increment_errors(str(e))
@@ -589,6 +699,89 @@ class TelegramShopBot:
         finally:
             logger.info("🔄 Закрытие соединений...")
             self.running = False
+            # Дописываем накопленные журналы в базу
+            shutdown_log_writers()
+    
+    def process_update(self, update):
+        """Маршрутизация одного обновления Telegram по обработчикам"""
+        if 'message' in update:
+            message = update['message']
+            text = message.get('text', '')
+            telegram_id = message['from']['id']
+            
+            # Логируем сообщение (форматируется лениво, только если уровень включен)
+            update_logger.debug("Сообщение от %s: %.50s", telegram_id, text)
+            
+            # Антиспам-проверка до маршрутизации
+            if self.spam_filter and self.is_spam_update(telegram_id, text):
+                return
+            
+            # Проверяем админ команды
+            if self.admin_handler and (text.startswith('/admin') or text in ['📊 Статистика', '📦 Заказы', '🛠 Товары', '👥 Пользователи', '🔙 Пользовательский режим']):
+                self.admin_handler.handle_admin_command(message)
+            elif self.admin_handler and text in ['📈 Аналитика', '🛡 Безопасность', '💰 Финансы', '📦 Склад', '🤖 AI', '🎯 Автоматизация', '👥 CRM', '📢 Рассылка']:
+                self.admin_handler.handle_admin_command(message)
+            elif self.admin_handler and text.startswith('/admin_order_'):
+                self.admin_handler.handle_order_management(message)
+            elif self.admin_handler and (text.startswith('/edit_product_') or text.startswith('/delete_product_')):
+                self.admin_handler.handle_product_commands(message)
+            elif self.admin_handler and hasattr(self.admin_handler, 'admin_states') and self.admin_handler.admin_states.get(telegram_id):
+                state = self.admin_handler.admin_states.get(telegram_id, '')
+                if state.startswith('adding_product_'):
+                    self.admin_handler.handle_add_product_process(message)
+                elif state.startswith('creating_broadcast_'):
+                    self.admin_handler.handle_broadcast_creation(message)
+            elif text == '/notifications':
+                self.show_user_notifications(message)
+            else:
+                self.message_handler.handle_message(message)
+        elif 'callback_query' in update:
+            callback_query = update['callback_query']
+            data = callback_query['data']
+            telegram_id = callback_query['from']['id']
+            
+            # Проверяем админ callback'и
+            if self.admin_handler and (data.startswith('admin_') or data.startswith('change_status_') or data.startswith('order_details_')):
+                self.admin_handler.handle_callback_query(callback_query)
+            elif self.admin_handler and (data.startswith('analytics_') or data.startswith('period_')):
+                self.admin_handler.handle_analytics_callback(callback_query)
+            elif self.admin_handler and data.startswith('export_'):
+                self.admin_handler.handle_export_callback(callback_query)
+            elif self.admin_handler and (data.startswith('security_') or data.startswith('unblock_user_')):
+                if hasattr(self.admin_handler, 'handle_security_callback'):
+                    self.admin_handler.handle_security_callback(callback_query)
+                else:
+                    self.admin_handler.handle_callback_query(callback_query)
+            elif self.admin_handler and data.startswith('broadcast_'):
+                if hasattr(self.admin_handler, 'handle_broadcast_callback'):
+                    self.admin_handler.handle_broadcast_callback(callback_query)
+                else:
+                    self.admin_handler.handle_callback_query(callback_query)
+            else:
+                self.message_handler.handle_callback_query(callback_query)
+    
+    def is_spam_update(self, telegram_id, text):
+        """Оценка входящего сообщения антиспам-фильтром"""
+        if self.spam_filter.is_blacklisted(telegram_id):
+            return True
+        
+        if not text or text.startswith('/'):
+            return False
+        
+        verdict = self.spam_filter.score_message(telegram_id, text)
+        if not verdict['is_spam']:
+            return False
+        
+        self.security_manager.log_suspicious_activity(
+            telegram_id, 'spam_message', f"score={verdict['score']}"
+        )
+        
+        # Пользователь систематически шлет спам - в черный список
+        if self.spam_filter.get_spam_count(telegram_id) >= self.security_manager.block_thresholds['spam_messages']:
+            self.spam_filter.add_to_blacklist(telegram_id)
+            self.security_manager.log_security_event(telegram_id, 'spam_blacklisted')
+        
+        return True
     
     def show_user_notifications(self, message):
         """Показ уведомлений пользователя"""
@@ -599,34 +792,8 @@ class TelegramShopBot:
         if not user_data:
             return
         
-        user_id = user_data[0][0]
-        notifications = self.db.get_unread_notifications(user_id)
-        
-        if not notifications:
-            self.send_message(
-                chat_id,
-                "🔔 У вас нет новых уведомлений"
-            )
-            return
-        
-        # Показываем все уведомления
-        for notif in notifications:
-            type_emoji = {
-                'order': '📦',
-                'order_status': '📋',
-                'promotion': '🎁',
-                'system': '⚙️',
-                'info': 'ℹ️'
-            }.get(notif[4], 'ℹ️')
-            
-            notif_text = f"{type_emoji} <b>{notif[2]}</b>\n\n"
-            notif_text += f"{notif[3]}\n\n"
-            notif_text += f"📅 {format_date(notif[6])}"
-            
-            self.send_message(chat_id, notif_text)
-            
-            # Отмечаем как прочитанное
-            self.db.mark_notification_read(notif[0])
+        # Одно сообщение-сводка с листанием вместо сообщения на каждое уведомление
+        self.notification_manager.show_inbox(chat_id, user_data[0][0])
     
     def handle_webhook(self, provider, payload, signature=None):
         """Обработка входящих webhook'ов"""
@@ -636,27 +803,23 @@ class TelegramShopBot:
     
     def get_api_data(self, endpoint, api_key, params=None):
         """Обработка API запросов"""
-        if not self.webhook_manager:
-            return {'error': 'API manager not available'}
-            
-        try:
-            from webhooks import APIManager
-            api_manager = APIManager(self.db, self.security_manager)
-        except ImportError:
+        if not self.api_manager:
             return {'error': 'API manager not available'}
         
         if endpoint == 'products':
-            return api_manager.get_products_api(
+            return self.api_manager.get_products_api(
                 api_key,
                 params.get('category_id') if params else None,
-                params.get('limit', 50) if params else 50
+                params.get('limit', 50) if params else 50,
+                params.get('after', 0) if params else 0
             )
         elif endpoint == 'create_order':
-            return api_manager.create_order_api(
+            return self.api_manager.create_order_api(
                 api_key,
                 params['user_data'],
                 params['items'],
-                params['delivery_address']
+                params['delivery_address'],
+                params.get('external_id')
             )
         else:
             return {'error': 'Unknown endpoint'}
@@ -8,11 +8,17 @@ from utils import format_price, format_date
 import json
 import threading
 import time
+from config import FLASH_SALE_CONFIG
+from log_writer import get_log_writer
+from loyalty import LoyaltyManager
 
 class MarketingAutomationManager:
-    def __init__(self, db, notification_manager):
+    def __init__(self, db, notification_manager, flash_sale_engine=None, loyalty_manager=None):
         self.db = db
         self.notification_manager = notification_manager
+        self.flash_sale_engine = flash_sale_engine  # Общий движок бота: токены, лимиты и очередь распродаж
+        self.loyalty_manager = loyalty_manager or LoyaltyManager(db)
+        self.log_writer = get_log_writer(db.db_path)
         self.automation_rules = {}
         self.start_automation_engine()
     
@@ -170,7 +176,7 @@ class MarketingAutomationManager:
                 self.execute_personalized_offer_action(rule_id, action)
         
         # Записываем выполнение
-        self.db.execute_query('''
+        self.log_writer.write('''
             INSERT INTO automation_executions (rule_id, executed_at)
             VALUES (?, ?)
         ''', (rule_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
@@ -274,7 +280,8 @@ class MarketingAutomationManager:
                 self.db.execute_query('''
                     UPDATE products 
                     SET price = price * (1 - ? / 100.0),
-                        original_price = CASE WHEN original_price IS NULL THEN price ELSE original_price END
+                        original_price = CASE WHEN original_price IS NULL THEN price ELSE original_price END,
+                        updated_at = CURRENT_TIMESTAMP
                     WHERE category_id = ? AND is_active = 1
                 ''', (discount_percentage, category_id))
         
@@ -296,7 +303,7 @@ class MarketingAutomationManager:
                 new_price = current_price * 1.05  # Увеличиваем на 5%
                 
                 self.db.execute_query(
-                    'UPDATE products SET price = ? WHERE id = ?',
+                    'UPDATE products SET price = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
                     (new_price, product_id)
                 )
     
@@ -581,7 +588,9 @@ class MarketingAutomationManager:
                 flash_sale = promo_manager.create_flash_sale(
                     category_products,
                     campaign['discount'],
-                    72  # 3 дня
+                    72,  # 3 дня
+                    flash_sale_engine=self.flash_sale_engine,
+                    units_per_product=FLASH_SALE_CONFIG['units_per_product']
                 )
                 
                 # Уведомляем всех пользователей
@@ -673,7 +682,7 @@ class MarketingAutomationManager:
                         )
                         
                         # Записываем выполнение
-                        self.db.execute_query('''
+                        self.log_writer.write('''
                             INSERT INTO automation_executions (
                                 user_id, rule_type, executed_at
                             ) VALUES (?, ?, ?)
@@ -685,50 +694,23 @@ class MarketingAutomationManager:
                         break
     
     def create_loyalty_upgrade_automation(self):
-        """Автоматизация повышения уровня лояльности"""
-        # Проверяем пользователей, готовых к повышению
-        upgrade_candidates = self.db.execute_query('''
-            SELECT 
-                u.id, u.name, u.telegram_id,
-                lp.current_points, lp.current_tier,
-                SUM(o.total_amount) as total_spent
-            FROM users u
-            JOIN loyalty_points lp ON u.id = lp.user_id
-            LEFT JOIN orders o ON u.id = o.user_id AND o.status != 'cancelled'
-            WHERE u.is_admin = 0
-            GROUP BY u.id, u.name, u.telegram_id, lp.current_points, lp.current_tier
-        ''')
+        """Автоматизация повышения уровня лояльности по событиям смены уровня из журнала баллов"""
+        loyalty = self.loyalty_manager
         
-        tier_thresholds = {
-            'Bronze': 0,
-            'Silver': 100,
-            'Gold': 500,
-            'Platinum': 1500,
-            'Diamond': 5000
-        }
+        # Уровни пересчитываются только при изменении баланса - обходим лишь новые события
+        events = loyalty.get_pending_tier_events()
+        if not events:
+            return
         
-        tier_order = ['Bronze', 'Silver', 'Gold', 'Platinum', 'Diamond']
+        from crm import CRMManager
+        crm = CRMManager(self.db)
         
-        for candidate in upgrade_candidates:
-            user_id, name, telegram_id, points, current_tier, total_spent = candidate
-            
-            # Определяем новый уровень
-            new_tier = current_tier
-            for tier in tier_order:
-                if points >= tier_thresholds[tier]:
-                    new_tier = tier
+        for event_id, user_id, old_tier, new_tier in events:
+            if not loyalty.is_upgrade(old_tier, new_tier):
+                continue
             
-            # Если уровень изменился
-            if new_tier != current_tier:
-                # Обновляем в базе
-                self.db.execute_query(
-                    'UPDATE loyalty_points SET current_tier = ? WHERE user_id = ?',
-                    (new_tier, user_id)
-                )
-                
+            try:
                 # Создаем уведомление
-                from crm import CRMManager
-                crm = CRMManager(self.db)
                 upgrade_notification = crm.create_loyalty_tier_upgrade_notification(user_id, new_tier)
                 
                 # Отправляем уведомление
@@ -736,6 +718,10 @@ class MarketingAutomationManager:
                     user_id, 'Повышение уровня!', 
                     upgrade_notification['message'], 'success'
                 )
+            except Exception as e:
+                logging.info(f"Ошибка уведомления о повышении уровня {user_id}: {e}")
+        
+        loyalty.mark_tier_events_notified([event[0] for event in events])
     
     def analyze_campaign_effectiveness(self, campaign_id):
         """Анализ эффективности кампании"""
@@ -0,0 +1,73 @@
+"""
+Версионные миграции схемы: изменения, которые применяются к уже работающей базе один раз
+"""
+import logging
+
+from datetime import datetime
+
+# (версия YYYYMMDDHHMM, описание, SQL); применяются по возрастанию версии.
+# Индексы подобраны index_advisor.py по планам запросов и проверены на копии базы
+MIGRATIONS = [
+    (202610191200, 'Составные индексы горячих запросов', [
+        'CREATE INDEX IF NOT EXISTS idx_products_subcategory_active_name ON products(subcategory_id, is_active, name)',
+        'CREATE INDEX IF NOT EXISTS idx_products_active_name ON products(is_active, name)',
+        'CREATE INDEX IF NOT EXISTS idx_users_acquisition_channel ON users(acquisition_channel)',
+        'CREATE INDEX IF NOT EXISTS idx_users_admin_telegram ON users(is_admin, telegram_id)',
+        'CREATE INDEX IF NOT EXISTS idx_inventory_movements_type_created ON inventory_movements(movement_type, created_at, product_id)',
+        # Составные заменяют индексы по первому столбцу
+        'CREATE INDEX IF NOT EXISTS idx_cart_user_product ON cart(user_id, product_id)',
+        'DROP INDEX IF EXISTS idx_cart_user',
+        'CREATE INDEX IF NOT EXISTS idx_promo_uses_promo_user ON promo_uses(promo_code_id, user_id)',
+        'DROP INDEX IF EXISTS idx_promo_uses_promo'
+    ]),
+    # Балансы, накопленные до журнала баллов, получают начальную операцию (loyalty.py)
+    (202610191300, 'Начальные операции журнала баллов лояльности', [
+        '''INSERT INTO loyalty_transactions (user_id, points, kind, created_at)
+        SELECT lp.user_id, lp.current_points, 'opening', datetime('now', 'localtime')
+        FROM loyalty_points lp
+        WHERE lp.current_points != 0
+        AND NOT EXISTS (SELECT 1 FROM loyalty_transactions t WHERE t.user_id = lp.user_id)'''
+    ]),
+    # Счетчики непрочитанных для уведомлений, записанных до появления notification_counters
+    (202610191400, 'Начальные счетчики непрочитанных уведомлений', [
+        '''INSERT OR IGNORE INTO notification_counters (user_id, unread)
+        SELECT user_id, COUNT(*) FROM notifications
+        WHERE is_read = 0 AND user_id IS NOT NULL
+        GROUP BY user_id'''
+    ])
+]
+
+def get_applied_versions(cursor):
+    cursor.execute('SELECT version FROM schema_migrations')
+    return {row[0] for row in cursor.fetchall()}
+
+def apply_migration(cursor, version, name, statements):
+    """Одна миграция: все SQL и запись о версии; вызывающий фиксирует транзакцию"""
+    for sql in statements:
+        cursor.execute(sql)
+    cursor.execute(
+        'INSERT INTO schema_migrations (version, name, statements, applied_at) VALUES (?, ?, ?, ?)',
+        (version, name, ';\n'.join(statements), datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    logging.info(f"Миграция {version} применена: {name}")
+
+def apply_migrations(cursor, migrations=None):
+    """Непримененные миграции по возрастанию версии. Возвращает список примененных версий"""
+    applied = get_applied_versions(cursor)
+    done = []
+    for version, name, statements in sorted(migrations if migrations is not None else MIGRATIONS):
+        if version in applied:
+            continue
+        # Точка сохранения: при ошибке откатываются уже выполненные SQL этой миграции, а не вся транзакция
+        cursor.execute(f'SAVEPOINT migration_{version}')
+        try:
+            apply_migration(cursor, version, name, statements)
+        except Exception as e:
+            cursor.execute(f'ROLLBACK TO migration_{version}')
+            cursor.execute(f'RELEASE migration_{version}')
+            # Следующие миграции могут зависеть от этой: повтор при следующем запуске
+            logging.info(f"Ошибка миграции {version} ({name}): {e}")
+            break
+        cursor.execute(f'RELEASE migration_{version}')
+        done.append(version)
+    return done
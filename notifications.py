@@ -5,6 +5,9 @@ import logging
 
 from datetime import datetime, timedelta
 from utils import format_date, format_price
+from config import NOTIFICATION_INBOX_CONFIG
+import html
+import re
 import threading
 import time
 
@@ -237,6 +240,106 @@ class NotificationManager:
         }
         return emojis.get(status, '❓')
     
+    def get_inbox_page(self, user_id, older_than=None, newer_than=None):
+        """Страница ленты уведомлений (новые сверху) по id вместо OFFSET"""
+        page_size = NOTIFICATION_INBOX_CONFIG['page_size']
+        
+        if newer_than:
+            rows = self.db.execute_query('''
+                SELECT id, title, message, type, is_read, created_at FROM notifications
+                WHERE user_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (user_id, newer_than, page_size + 1)) or []
+            has_newer = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            has_older = True
+        else:
+            rows = self.db.execute_query(f'''
+                SELECT id, title, message, type, is_read, created_at FROM notifications
+                WHERE user_id = ? {'AND id < ?' if older_than else ''}
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (user_id, older_than, page_size + 1) if older_than else (user_id, page_size + 1)) or []
+            has_older = len(rows) > page_size
+            rows = rows[:page_size]
+            has_newer = bool(older_than)
+        
+        return {'items': rows, 'has_older': has_older, 'has_newer': has_newer}
+    
+    def render_inbox_page(self, page, unread):
+        """Одно сообщение-сводка со страницей уведомлений и кнопками листания"""
+        type_emojis = {
+            'order': '📦',
+            'order_status': '📋',
+            'payment': '💳',
+            'delivery': '🚚',
+            'promotion': '🎁',
+            'reminder': '⏰',
+            'warning': '⚠️',
+            'success': '✅',
+            'system': '⚙️',
+            'info': 'ℹ️'
+        }
+        
+        text = f"🔔 <b>Уведомления</b> (непрочитанных: {unread})\n"
+        for notification_id, title, message, notification_type, is_read, created_at in page['items']:
+            if len(message) > NOTIFICATION_INBOX_CONFIG['max_text_length']:
+                # Обрезанный HTML мог бы оборвать тег: в сводке - простой текст
+                message = html.escape(re.sub(r'<[^>]+>', '', message)[:NOTIFICATION_INBOX_CONFIG['max_text_length']]) + '…'
+            
+            text += f"\n{'🆕 ' if not is_read else ''}{type_emojis.get(notification_type, 'ℹ️')} <b>{title}</b>\n"
+            text += f"{message}\n"
+            text += f"📅 {format_date(created_at)}\n"
+        
+        navigation = []
+        if page['has_newer']:
+            navigation.append({'text': '◀️ Новее', 'callback_data': f"notif_newer_{page['items'][0][0]}"})
+        if page['has_older']:
+            navigation.append({'text': 'Старее ▶️', 'callback_data': f"notif_older_{page['items'][-1][0]}"})
+        
+        keyboard = [navigation] if navigation else []
+        if unread:
+            keyboard.append([{'text': '✅ Прочитать все', 'callback_data': 'notif_read_all'}])
+        
+        return text, {'inline_keyboard': keyboard} if keyboard else None
+    
+    def show_inbox(self, chat_id, user_id, older_than=None, newer_than=None, message_id=None):
+        """Лента уведомлений одним сообщением; показанные отмечаются прочитанными одним запросом.
+        С message_id страница заменяет текст уже отправленной сводки.
+        """
+        page = self.get_inbox_page(user_id, older_than, newer_than)
+        if not page['items']:
+            if message_id:
+                return None
+            return self.bot.send_message(chat_id, "🔔 У вас нет новых уведомлений")
+        
+        self.db.mark_notifications_read(user_id, [row[0] for row in page['items'] if not row[4]])
+        text, keyboard = self.render_inbox_page(page, self.db.get_unread_notifications_count(user_id))
+        
+        if message_id:
+            return self.bot.edit_message_text(chat_id, message_id, text, keyboard)
+        return self.bot.send_message(chat_id, text, keyboard)
+    
+    def handle_inbox_callback(self, callback_query, user_id):
+        """Кнопки сводки: notif_older_<id>, notif_newer_<id>, notif_read_all"""
+        data = callback_query['data']
+        chat_id = callback_query['message']['chat']['id']
+        message_id = callback_query['message']['message_id']
+        
+        if data == 'notif_read_all':
+            self.db.mark_notifications_read(user_id)
+            return self.show_inbox(chat_id, user_id, message_id=message_id)
+        
+        try:
+            anchor = int(data.rsplit('_', 1)[1])
+        except (IndexError, ValueError):
+            return None
+        
+        if data.startswith('notif_older_'):
+            return self.show_inbox(chat_id, user_id, older_than=anchor, message_id=message_id)
+        return self.show_inbox(chat_id, user_id, newer_than=anchor, message_id=message_id)
+    
     def send_low_stock_alert(self):
         """Уведомление админам о товарах с низким остатком"""
         low_stock_products = self.db.execute_query(
@@ -0,0 +1,437 @@
+"""
+API для партнеров (маркетплейсов): ключи, лимиты, постраничные товары и заказы, пакетное создание заказов
+"""
+import logging
+import gzip
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from datetime import datetime
+from config import API_CONFIG
+from data_export import DataExporter
+
+# Разрешения ключа (api_keys.permissions: JSON-список или через запятую; пусто или '*' - все)
+API_PERMISSIONS = ('products', 'orders', 'orders:write', 'catalog')
+
+PRODUCT_COLUMNS = [
+    'id', 'name', 'description', 'price', 'original_price', 'category_id',
+    'brand', 'image_url', 'stock', 'is_active', 'updated_at'
+]
+ORDER_COLUMNS = ['id', 'external_id', 'status', 'payment_status', 'total_amount', 'delivery_address', 'created_at']
+
+class APIError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+class APIManager:
+    def __init__(self, db, inventory_manager=None):
+        self.db = db
+        self.inventory_manager = inventory_manager
+        self.exporter = DataExporter()
+        self.lock = threading.Lock()
+        self.keys = {}  # api_key -> (ключ или None, срок по monotonic)
+        self.buckets = {}  # id ключа -> [токены, время пополнения]
+        self.responses = OrderedDict()  # (область, endpoint, параметры) -> (etag, тело, gzip-тело, срок)
+        self.metrics = {
+            'requests': 0, 'key_lookups': 0, 'rate_limited': 0,
+            'cache_hits': 0, 'not_modified': 0, 'orders_created': 0
+        }
+
+    def authenticate(self, api_key, permission):
+        """Ключ из кэша или одним запросом к api_keys; APIError при неверном ключе или нехватке прав"""
+        if not api_key:
+            raise APIError(401, 'API key required')
+
+        now = time.monotonic()
+        with self.lock:
+            cached = self.keys.get(api_key)
+
+        if cached and cached[1] > now:
+            key = cached[0]
+        else:
+            rows = self.db.execute_query(
+                'SELECT id, key_name, permissions FROM api_keys WHERE api_key = ? AND is_active = 1',
+                (api_key,)
+            )
+            key = None
+            if rows:
+                key = {'id': rows[0][0], 'name': rows[0][1], 'permissions': self.parse_permissions(rows[0][2])}
+
+            ttl = API_CONFIG['key_cache_ttl'] if key else API_CONFIG['invalid_key_cache_ttl']
+            with self.lock:
+                self.metrics['key_lookups'] += 1
+                self.keys[api_key] = (key, now + ttl)
+
+        if not key:
+            raise APIError(401, 'Invalid API key')
+        if permission not in key['permissions']:
+            raise APIError(403, f'Permission denied: {permission}')
+        return key
+
+    def parse_permissions(self, permissions):
+        if not permissions or permissions.strip() == '*':
+            return set(API_PERMISSIONS)
+        try:
+            values = json.loads(permissions)
+        except ValueError:
+            values = permissions.split(',')
+        return {value.strip() for value in values if value.strip()}
+
+    def invalidate_key(self, api_key):
+        """Сброс кэша ключа после отзыва или смены прав"""
+        with self.lock:
+            self.keys.pop(api_key, None)
+
+    def check_rate_limit(self, key):
+        """Корзина токенов на ключ: rate_limit запросов в секунду, всплеск до rate_burst"""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.setdefault(key['id'], [API_CONFIG['rate_burst'], now])
+            bucket[0] = min(API_CONFIG['rate_burst'], bucket[0] + (now - bucket[1]) * API_CONFIG['rate_limit'])
+            bucket[1] = now
+
+            if bucket[0] < 1:
+                self.metrics['rate_limited'] += 1
+                retry_after = max(1, int((1 - bucket[0]) / API_CONFIG['rate_limit'] + 0.999))
+                raise APIError(429, 'Rate limit exceeded', {'Retry-After': str(retry_after)})
+            bucket[0] -= 1
+
+    def get_page_params(self, params):
+        try:
+            limit = min(max(int(params.get('limit', API_CONFIG['page_size'])), 1), API_CONFIG['max_page_size'])
+            after = int(params.get('after', 0))
+        except (TypeError, ValueError):
+            raise APIError(400, 'limit and after must be integers')
+        return limit, after
+
+    def get_products(self, params):
+        """Страница активных товаров по id (keyset): ?after=<последний id>&limit=&category_id="""
+        limit, after = self.get_page_params(params)
+        where = ['is_active = 1', 'id > ?']
+        query_params = [after]
+
+        if params.get('category_id'):
+            where.append('category_id = ?')
+            query_params.append(params['category_id'])
+
+        rows = self.db.execute_query(f'''
+            SELECT {', '.join(PRODUCT_COLUMNS)} FROM products
+            WHERE {' AND '.join(where)}
+            ORDER BY id
+            LIMIT ?
+        ''', (*query_params, limit + 1)) or []
+
+        return self.build_page(rows, limit, PRODUCT_COLUMNS)
+
+    def get_orders(self, key, params):
+        """Страница заказов, созданных этим ключом, с товарами"""
+        limit, after = self.get_page_params(params)
+        where = ['ao.api_key_id = ?', 'ao.order_id > ?']
+        query_params = [key['id'], after]
+
+        if params.get('status'):
+            where.append('o.status = ?')
+            query_params.append(params['status'])
+
+        rows = self.db.execute_query(f'''
+            SELECT o.id, ao.external_id, o.status, o.payment_status, o.total_amount, o.delivery_address, o.created_at
+            FROM api_orders ao
+            JOIN orders o ON o.id = ao.order_id
+            WHERE {' AND '.join(where)}
+            ORDER BY ao.order_id
+            LIMIT ?
+        ''', (*query_params, limit + 1)) or []
+
+        page = self.build_page(rows, limit, ORDER_COLUMNS)
+        if page['items']:
+            # Товары всех заказов страницы одним запросом
+            order_ids = [order['id'] for order in page['items']]
+            items = {}
+            for order_id, product_id, quantity, price in self.db.execute_query(f'''
+                SELECT order_id, product_id, quantity, price FROM order_items
+                WHERE order_id IN ({','.join('?' * len(order_ids))})
+                ORDER BY id
+            ''', tuple(order_ids)) or []:
+                items.setdefault(order_id, []).append({'product_id': product_id, 'quantity': quantity, 'price': price})
+
+            for order in page['items']:
+                order['items'] = items.get(order['id'], [])
+        return page
+
+    def build_page(self, rows, limit, columns):
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'items': [dict(zip(columns, row)) for row in rows],
+            'next_cursor': str(rows[-1][0]) if has_more and rows else None
+        }
+
+    def create_orders(self, key, orders):
+        """Пакет заказов одной транзакцией: все создаются или ни одного.
+        Повтор с тем же external_id возвращает уже созданный заказ.
+        """
+        if not isinstance(orders, list) or not orders:
+            raise APIError(400, 'orders must be a non-empty list')
+        if len(orders) > API_CONFIG['max_bulk_orders']:
+            raise APIError(400, f"At most {API_CONFIG['max_bulk_orders']} orders per request")
+
+        # Проверка формата до транзакции: ошибки клиента не держат блокировку записи
+        external_ids = []
+        for index, order in enumerate(orders):
+            try:
+                external_id = str(order['external_id'])
+                int(order['user']['telegram_id'])
+                items = [(int(item['product_id']), int(item['quantity'])) for item in order['items']]
+            except (KeyError, TypeError, ValueError):
+                raise APIError(400, f'orders[{index}]: external_id, user.telegram_id and items are required')
+            if not items or any(quantity <= 0 for _, quantity in items):
+                raise APIError(400, f'orders[{index}]: items must have positive quantities')
+            if external_id in external_ids:
+                raise APIError(400, f'orders[{index}]: duplicate external_id {external_id}')
+            external_ids.append(external_id)
+
+        product_ids = sorted({int(item['product_id']) for order in orders for item in order['items']})
+        stock_history = self.inventory_manager.stock_history if self.inventory_manager else None
+        cost_ledger = self.inventory_manager.cost_ledger if self.inventory_manager else None
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        results = []
+        stock_changes = {}
+
+        with self.db.transaction() as conn:
+            existing = {
+                external_id: (order_id, total)
+                for external_id, order_id, total in conn.execute(f'''
+                    SELECT ao.external_id, o.id, o.total_amount FROM api_orders ao
+                    JOIN orders o ON o.id = ao.order_id
+                    WHERE ao.api_key_id = ? AND ao.external_id IN ({','.join('?' * len(external_ids))})
+                ''', (key['id'], *external_ids))
+            }
+            prices = dict(conn.execute(f'''
+                SELECT id, price FROM products
+                WHERE is_active = 1 AND id IN ({','.join('?' * len(product_ids))})
+            ''', tuple(product_ids)).fetchall())
+
+            for index, order in enumerate(orders):
+                external_id = str(order['external_id'])
+                if external_id in existing:
+                    order_id, total = existing[external_id]
+                    results.append({'external_id': external_id, 'order_id': order_id, 'total_amount': total, 'duplicate': True})
+                    continue
+
+                items = [(int(item['product_id']), int(item['quantity'])) for item in order['items']]
+                missing = [product_id for product_id, _ in items if product_id not in prices]
+                if missing:
+                    raise APIError(422, f'orders[{index}]: unknown or inactive products {missing}')
+
+                user = order['user']
+                conn.execute(
+                    'INSERT OR IGNORE INTO users (telegram_id, name, phone, acquisition_channel) VALUES (?, ?, ?, ?)',
+                    (int(user['telegram_id']), user.get('name') or str(user['telegram_id']), user.get('phone'), key['name'])
+                )
+                user_id = conn.execute('SELECT id FROM users WHERE telegram_id = ?', (int(user['telegram_id']),)).fetchone()[0]
+
+                # Цены - из каталога, а не из запроса
+                total = round(sum(prices[product_id] * quantity for product_id, quantity in items), 2)
+                order_id = conn.execute('''
+                    INSERT INTO orders (user_id, total_amount, delivery_address, payment_method, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, total, order.get('delivery_address'), order.get('payment_method', 'marketplace'), now)).lastrowid
+                conn.executemany(
+                    'INSERT INTO order_items (order_id, product_id, quantity, price, created_at) VALUES (?, ?, ?, ?, ?)',
+                    ((order_id, product_id, quantity, prices[product_id], now) for product_id, quantity in items)
+                )
+
+                for product_id, quantity in items:
+                    if stock_history:
+                        changed = stock_history.apply_change(
+                            conn, product_id, quantity_change=-quantity,
+                            movement_type='api_order', reference_id=order_id, min_stock=0
+                        )
+                    else:
+                        changed = conn.execute(
+                            'UPDATE products SET stock = stock - ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND stock >= ?',
+                            (quantity, product_id, quantity)
+                        ).rowcount
+                    if not changed:
+                        raise APIError(409, f'orders[{index}]: insufficient stock for product {product_id}')
+                    if not stock_history:
+                        new_stock = conn.execute('SELECT stock FROM products WHERE id = ?', (product_id,)).fetchone()[0]
+                        changed = (new_stock + quantity, new_stock)
+                    # Для порога пополнения: первый старый и последний новый остаток по товару
+                    stock_changes[product_id] = (stock_changes.get(product_id, changed)[0], changed[1])
+                    if cost_ledger:
+                        cost_ledger.consume(product_id, quantity, 'sale', order_id, conn)
+
+                conn.execute(
+                    'INSERT INTO api_orders (api_key_id, external_id, order_id, created_at) VALUES (?, ?, ?, ?)',
+                    (key['id'], external_id, order_id, now)
+                )
+                results.append({'external_id': external_id, 'order_id': order_id, 'total_amount': total, 'duplicate': False})
+
+        if self.inventory_manager:
+            for product_id, (old_quantity, new_quantity) in stock_changes.items():
+                self.inventory_manager.check_reorder_threshold(product_id, old_quantity, new_quantity)
+
+        created = sum(1 for result in results if not result['duplicate'])
+        if created:
+            # Остатки и список заказов ключа изменились
+            self.invalidate_responses(lambda cache_key: cache_key[0] in ('products', key['id']))
+        with self.lock:
+            self.metrics['orders_created'] += created
+
+        return {'orders': results, 'created': created}
+
+    def iter_catalog_rows(self, params):
+        """Все товары, измененные с updated_since, порциями по ключу (updated_at, id).
+        Каждая порция - отдельный короткий запрос: долгая выгрузка не держит блокировку чтения.
+        """
+        cursor = (params.get('updated_since') or '', '', 0)
+        while True:
+            rows = self.db.execute_query(f'''
+                SELECT {', '.join(PRODUCT_COLUMNS)} FROM products
+                WHERE updated_at > ? OR (updated_at = ? AND id > ?)
+                ORDER BY updated_at, id
+                LIMIT ?
+            ''', (*cursor, API_CONFIG['catalog_chunk_size']))
+            if rows is None:
+                raise APIError(500, 'Catalog read failed')
+
+            yield from rows
+            if len(rows) < API_CONFIG['catalog_chunk_size']:
+                break
+            cursor = (rows[-1][-1], rows[-1][-1], rows[-1][0])
+
+    def get_cached_response(self, cache_key, ttl, build):
+        """Готовый JSON-ответ (etag, тело, gzip-тело): одна выборка на ttl для всех партнеров"""
+        now = time.monotonic()
+        with self.lock:
+            cached = self.responses.get(cache_key)
+            if cached and cached[3] > now:
+                self.responses.move_to_end(cache_key)
+                self.metrics['cache_hits'] += 1
+                return cached
+
+        body = json.dumps(build(), ensure_ascii=False, default=str).encode('utf-8')
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        compressed = gzip.compress(body, 6) if len(body) >= API_CONFIG['gzip_min_size'] else None
+        cached = (etag, body, compressed, now + ttl)
+
+        with self.lock:
+            self.responses[cache_key] = cached
+            self.responses.move_to_end(cache_key)
+            while len(self.responses) > API_CONFIG['max_cached_responses']:
+                self.responses.popitem(last=False)
+        return cached
+
+    def invalidate_responses(self, predicate):
+        with self.lock:
+            for cache_key in [cache_key for cache_key in self.responses if predicate(cache_key)]:
+                del self.responses[cache_key]
+
+    def json_response(self, cached, headers):
+        """304 при совпадении If-None-Match, gzip при Accept-Encoding"""
+        etag, body, compressed, _ = cached
+        response_headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Content-Type': 'application/json'}
+
+        if etag in [value.strip() for value in (headers.get('If-None-Match') or '').split(',')]:
+            with self.lock:
+                self.metrics['not_modified'] += 1
+            return {'status': 304, 'headers': response_headers, 'body': b''}
+
+        if compressed and 'gzip' in (headers.get('Accept-Encoding') or ''):
+            response_headers['Content-Encoding'] = 'gzip'
+            body = compressed
+        return {'status': 200, 'headers': response_headers, 'body': body}
+
+    def error_response(self, error):
+        return {
+            'status': error.status,
+            'headers': {'Content-Type': 'application/json', **error.headers},
+            'body': json.dumps({'error': str(error)}).encode('utf-8')
+        }
+
+    def handle(self, method, endpoint, api_key, params=None, body=None, headers=None):
+        """HTTP-запрос партнера -> {'status', 'headers', 'body'} (body - байты или итератор байтов)"""
+        params = params or {}
+        headers = headers or {}
+        with self.lock:
+            self.metrics['requests'] += 1
+
+        try:
+            if method == 'GET' and endpoint == 'products':
+                self.check_rate_limit(self.authenticate(api_key, 'products'))
+                cache_key = ('products', tuple(sorted((name, params.get(name)) for name in ('after', 'limit', 'category_id'))))
+                return self.json_response(
+                    self.get_cached_response(cache_key, API_CONFIG['products_cache_ttl'], lambda: self.get_products(params)),
+                    headers
+                )
+
+            if method == 'GET' and endpoint == 'orders':
+                key = self.authenticate(api_key, 'orders')
+                self.check_rate_limit(key)
+                cache_key = (key['id'], tuple(sorted((name, params.get(name)) for name in ('after', 'limit', 'status'))))
+                return self.json_response(
+                    self.get_cached_response(cache_key, API_CONFIG['orders_cache_ttl'], lambda: self.get_orders(key, params)),
+                    headers
+                )
+
+            if method == 'POST' and endpoint == 'orders/bulk':
+                key = self.authenticate(api_key, 'orders:write')
+                self.check_rate_limit(key)
+                try:
+                    orders = json.loads(body or b'{}').get('orders')
+                except (ValueError, AttributeError):
+                    raise APIError(400, 'Invalid JSON body')
+                result = self.create_orders(key, orders)
+                return {
+                    'status': 201 if result['created'] else 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps(result).encode('utf-8')
+                }
+
+            if method == 'GET' and endpoint == 'catalog.ndjson':
+                self.check_rate_limit(self.authenticate(api_key, 'catalog'))
+                compress = 'gzip' in (headers.get('Accept-Encoding') or '')
+                response_headers = {'Content-Type': 'application/x-ndjson'}
+                if compress:
+                    response_headers['Content-Encoding'] = 'gzip'
+                return {
+                    'status': 200,
+                    'headers': response_headers,
+                    'body': self.exporter.iter_chunks(PRODUCT_COLUMNS, self.iter_catalog_rows(params), 'ndjson', compress)
+                }
+
+            raise APIError(404, f'Unknown endpoint: {method} {endpoint}')
+
+        except APIError as e:
+            return self.error_response(e)
+        except Exception as e:
+            logging.info(f"Ошибка API партнеров {method} {endpoint}: {e}")
+            return self.error_response(APIError(500, 'Internal error'))
+
+    def get_products_api(self, api_key, category_id=None, limit=50, after=0):
+        """Страница товаров для вызова внутри процесса (TelegramShopBot.get_api_data)"""
+        response = self.handle('GET', 'products', api_key, {'category_id': category_id, 'limit': limit, 'after': after})
+        return json.loads(response['body'])
+
+    def create_order_api(self, api_key, user_data, items, delivery_address, external_id=None):
+        """Один заказ через пакетное создание; без external_id повтор вызова создаст новый заказ"""
+        order = {
+            'external_id': external_id or uuid.uuid4().hex,
+            'user': user_data,
+            'items': items,
+            'delivery_address': delivery_address
+        }
+        response = self.handle('POST', 'orders/bulk', api_key, body=json.dumps({'orders': [order]}))
+        return json.loads(response['body'])
+
+    def get_stats(self):
+        """Метрики API"""
+        with self.lock:
+            return {**self.metrics, 'cached_keys': len(self.keys), 'cached_responses': len(self.responses)}
@@ -0,0 +1,229 @@
+"""
+Платежные намерения: идемпотентное создание платежей, кэш ссылок и фоновые запросы к платежным системам
+"""
+import logging
+import hashlib
+import queue
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from carriers import CircuitBreaker
+from config import PAYMENT_CONFIG
+
+class PaymentIntentService:
+    def __init__(self, db, payment_processor):
+        self.db = db
+        self.payment_processor = payment_processor
+        self.lock = threading.Lock()
+        self.links = OrderedDict()  # (order_id, provider) -> (ответ, срок действия по monotonic)
+        self.inflight = {}  # Ключ идемпотентности -> колбэки ожидающих
+        self.breakers = {
+            provider: CircuitBreaker(PAYMENT_CONFIG['breaker_failures'], PAYMENT_CONFIG['breaker_reset'])
+            for provider in payment_processor.providers
+        }
+        self.queue = queue.Queue(maxsize=PAYMENT_CONFIG['max_queue_size'])
+        self.metrics = {
+            'requests': 0, 'cache_hits': 0, 'deduplicated': 0,
+            'provider_calls': 0, 'created': 0, 'failed': 0, 'rejected': 0
+        }
+        self.start_workers()
+
+    def start_workers(self):
+        """Ограниченный пул потоков для запросов к платежным системам"""
+        for _ in range(PAYMENT_CONFIG['workers']):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def get_idempotency_key(self, order_id, provider, amount):
+        """Ключ идемпотентности: повторное нажатие с той же суммой - тот же платеж"""
+        return hashlib.sha256(f"{order_id}:{provider}:{amount:.2f}".encode()).hexdigest()
+
+    def get_cached_link(self, order_id, provider):
+        with self.lock:
+            cached = self.links.get((order_id, provider))
+            if not cached:
+                return None
+            if cached[1] <= time.monotonic():
+                del self.links[(order_id, provider)]
+                return None
+
+            self.links.move_to_end((order_id, provider))
+            self.metrics['cache_hits'] += 1
+            return cached[0]
+
+    def cache_link(self, result, expires_at):
+        """Ссылка в памяти до истечения срока; самые давние вытесняются"""
+        ttl = (datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S') - datetime.now()).total_seconds()
+        with self.lock:
+            self.links[(result['order_id'], result['provider'])] = (result, time.monotonic() + ttl)
+            self.links.move_to_end((result['order_id'], result['provider']))
+            while len(self.links) > PAYMENT_CONFIG['max_cached_links']:
+                self.links.popitem(last=False)
+
+    def request_payment(self, order_id, provider, user_data, on_ready=None):
+        """Ссылка на оплату без ожидания платежной системы.
+        Возвращает status: ready (ссылка готова), pending (on_ready будет вызван с результатом),
+        paid или failed.
+        """
+        if provider not in self.payment_processor.providers:
+            raise ValueError(f"Неподдерживаемый провайдер: {provider}")
+
+        with self.lock:
+            self.metrics['requests'] += 1
+
+        cached = self.get_cached_link(order_id, provider)
+        if cached:
+            return {**cached, 'status': 'ready'}
+
+        # Заказ и сохраненное намерение одним чтением; сумма берется из заказа, а не из данных кнопки
+        order = self.db.execute_query('''
+            SELECT o.total_amount, o.payment_status,
+                   pi.idempotency_key, pi.status, pi.payment_url, pi.provider_reference, pi.expires_at
+            FROM orders o
+            LEFT JOIN payment_intents pi ON pi.order_id = o.id AND pi.provider = ?
+            WHERE o.id = ?
+        ''', (provider, order_id))
+        if not order:
+            return {'status': 'failed', 'order_id': order_id, 'provider': provider, 'error': 'заказ не найден'}
+
+        amount, payment_status, intent_key, intent_status, url, reference, expires_at = order[0]
+        if payment_status == 'paid':
+            return {'status': 'paid', 'order_id': order_id, 'provider': provider}
+
+        key = self.get_idempotency_key(order_id, provider, amount)
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        # Ссылка уже создана (например, до перезапуска) и еще действует
+        if intent_key == key and intent_status == 'ready' and expires_at and expires_at > now:
+            result = {'url': url, 'provider': provider, 'amount': amount, 'order_id': order_id, 'payment_intent_id': reference}
+            self.cache_link(result, expires_at)
+            return {**result, 'status': 'ready'}
+
+        with self.lock:
+            # Повторное нажатие, пока платеж создается, не вызывает платежную систему еще раз
+            if key in self.inflight:
+                self.metrics['deduplicated'] += 1
+                return {'status': 'pending', 'order_id': order_id, 'provider': provider, 'duplicate': True}
+            self.inflight[key] = [on_ready] if on_ready else []
+
+        try:
+            self.queue.put_nowait((key, order_id, provider, amount, user_data))
+        except queue.Full:
+            with self.lock:
+                self.inflight.pop(key, None)
+                self.metrics['rejected'] += 1
+            return {'status': 'failed', 'order_id': order_id, 'provider': provider, 'error': 'платежные системы перегружены'}
+
+        return {'status': 'pending', 'order_id': order_id, 'provider': provider}
+
+    def worker(self):
+        while True:
+            task = self.queue.get()
+            try:
+                self.process(*task)
+            except Exception as e:
+                logging.info(f"Ошибка создания платежа: {e}")
+                with self.lock:
+                    callbacks = self.inflight.pop(task[0], [])
+                self.notify(callbacks, {'status': 'failed', 'order_id': task[1], 'provider': task[2], 'error': str(e)})
+            finally:
+                self.queue.task_done()
+
+    def process(self, key, order_id, provider, amount, user_data):
+        """Запрос к платежной системе с повторами и отключением при серии ошибок"""
+        # Намерение сохраняется до запроса; при новой сумме или истекшей ссылке строка переиспользуется
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.db.execute_query('''
+            INSERT INTO payment_intents (order_id, provider, idempotency_key, amount, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'pending', ?, ?)
+            ON CONFLICT(order_id, provider) DO UPDATE SET
+                idempotency_key = excluded.idempotency_key,
+                amount = excluded.amount,
+                status = 'pending',
+                error = NULL,
+                updated_at = excluded.updated_at
+        ''', (order_id, provider, key, amount, now, now))
+
+        breaker = self.breakers[provider]
+        with self.lock:
+            allowed = breaker.allow()
+
+        result = None
+        error = f"платежная система {provider} временно недоступна"
+        attempts = 0
+
+        if allowed:
+            error = 'платежная система не ответила'
+            # Повтор безопасен: тот же ключ идемпотентности не создаст второй платеж
+            for attempt in range(PAYMENT_CONFIG['retries'] + 1):
+                if attempt:
+                    time.sleep(PAYMENT_CONFIG['retry_delay'] * attempt)
+                attempts += 1
+                try:
+                    result = self.payment_processor.create_payment(provider, amount, order_id, user_data, key)
+                except Exception as e:
+                    error = str(e)
+                if result:
+                    break
+
+            with self.lock:
+                self.metrics['provider_calls'] += attempts
+                if result:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+
+        now = datetime.now()
+        if result:
+            expires_at = (now + timedelta(minutes=PAYMENT_CONFIG['link_ttl_minutes'])).strftime('%Y-%m-%d %H:%M:%S')
+            self.db.execute_query('''
+                UPDATE payment_intents
+                SET status = 'ready', payment_url = ?, provider_reference = ?, error = NULL,
+                    attempts = attempts + ?, expires_at = ?, updated_at = ?
+                WHERE idempotency_key = ?
+            ''', (result['url'], result.get('payment_intent_id'), attempts, expires_at, now.strftime('%Y-%m-%d %H:%M:%S'), key))
+            self.cache_link(result, expires_at)
+            outcome = {**result, 'status': 'ready'}
+        else:
+            self.db.execute_query('''
+                UPDATE payment_intents SET status = 'failed', error = ?, attempts = attempts + ?, updated_at = ?
+                WHERE idempotency_key = ?
+            ''', (error, attempts, now.strftime('%Y-%m-%d %H:%M:%S'), key))
+            outcome = {'status': 'failed', 'order_id': order_id, 'provider': provider, 'error': error}
+
+        with self.lock:
+            self.metrics['created' if result else 'failed'] += 1
+            callbacks = self.inflight.pop(key, [])
+
+        self.notify(callbacks, outcome)
+
+    def notify(self, callbacks, outcome):
+        for callback in callbacks:
+            try:
+                callback(outcome)
+            except Exception as e:
+                logging.info(f"Ошибка отправки ссылки на оплату: {e}")
+
+    def mark_paid(self, order_id, conn=None):
+        """Оплаченный заказ: ссылки больше не выдаются"""
+        query = "UPDATE payment_intents SET status = 'paid', updated_at = ? WHERE order_id = ?"
+        params = (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), order_id)
+        if conn:
+            conn.execute(query, params)
+        else:
+            self.db.execute_query(query, params)
+        with self.lock:
+            for link_key in [link_key for link_key in self.links if link_key[0] == order_id]:
+                del self.links[link_key]
+
+    def get_stats(self):
+        """Метрики платежных намерений"""
+        with self.lock:
+            return {
+                **self.metrics,
+                'queued': self.queue.qsize(),
+                'in_flight': len(self.inflight),
+                'cached_links': len(self.links),
+                'breakers': {provider: breaker.state for provider, breaker in self.breakers.items()}
+            }
@@ -6,6 +6,7 @@ import logging
 import json
 import urllib.request
 import urllib.parse
+from config import PAYMENT_CONFIG
 
 class PaymentProcessor:
     def __init__(self):
@@ -17,12 +18,12 @@ class PaymentProcessor:
             'zoodpay': ZoodPayProvider()
         }
     
-    def create_payment(self, provider, amount, order_id, user_data):
+    def create_payment(self, provider, amount, order_id, user_data, idempotency_key=None):
         """Создание платежа через выбранного провайдера"""
         if provider not in self.providers:
             raise ValueError(f"Неподдерживаемый провайдер: {provider}")
         
-        return self.providers[provider].create_payment(amount, order_id, user_data)
+        return self.providers[provider].create_payment(amount, order_id, user_data, idempotency_key)
     
     def verify_payment(self, provider, payment_data):
         """Проверка статуса платежа"""
@@ -37,7 +38,7 @@ class PaymeProvider:
         self.secret_key = "PAYME_SECRET_KEY"   # Заменить на реальный
         self.base_url = "https://checkout.paycom.uz"
     
-    def create_payment(self, amount, order_id, user_data):
+    def create_payment(self, amount, order_id, user_data, idempotency_key=None):
         """Создание платежа через Payme"""
         # Конвертируем в тийины (1 сум = 100 тийин)
         amount_tiyin = int(amount * 100 * 100)  # USD -> UZS -> tiyin
@@ -73,7 +74,7 @@ class ClickProvider:
         self.secret_key = "CLICK_SECRET_KEY"
         self.base_url = "https://my.click.uz/services/pay"
     
-    def create_payment(self, amount, order_id, user_data):
+    def create_payment(self, amount, order_id, user_data, idempotency_key=None):
         """Создание платежа через Click"""
         # Конвертируем в сумы
         amount_uzs = int(amount * 12000)  # Примерный курс USD -> UZS
@@ -107,7 +108,7 @@ class StripeProvider:
         self.publishable_key = "STRIPE_PUBLISHABLE_KEY"
         self.base_url = "https://api.stripe.com/v1"
     
-    def create_payment(self, amount, order_id, user_data):
+    def create_payment(self, amount, order_id, user_data, idempotency_key=None):
         """Создание платежа через Stripe"""
         # Stripe работает в центах
         amount_cents = int(amount * 100)
@@ -125,6 +126,10 @@ class StripeProvider:
             'Content-Type': 'application/x-www-form-urlencoded'
         }
         
+        # Повтор с тем же ключом вернет уже созданный Payment Intent
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        
         try:
             data_encoded = urllib.parse.urlencode(data).encode('utf-8')
             req = urllib.request.Request(
@@ -134,7 +139,7 @@ class StripeProvider:
                 method='POST'
             )
             
-            with urllib.request.urlopen(req) as response:
+            with urllib.request.urlopen(req, timeout=PAYMENT_CONFIG['provider_timeout']) as response:
                 result = json.loads(response.read().decode('utf-8'))
                 
                 return {
@@ -159,7 +164,7 @@ class PayPalProvider:
         self.base_url = "https://api.paypal.com"  # Для продакшена
         # self.base_url = "https://api.sandbox.paypal.com"  # Для тестов
     
-    def create_payment(self, amount, order_id, user_data):
+    def create_payment(self, amount, order_id, user_data, idempotency_key=None):
         """Создание платежа через PayPal"""
         payment_data = {
             "intent": "CAPTURE",
@@ -194,7 +199,7 @@ class ZoodPayProvider:
         self.secret_key = "ZOODPAY_SECRET_KEY"
         self.base_url = "https://api.zoodpay.com"
     
-    def create_payment(self, amount, order_id, user_data):
+    def create_payment(self, amount, order_id, user_data, idempotency_key=None):
         """Создание платежа через ZoodPay"""
         payment_data = {
             'merchant_reference': str(order_id),
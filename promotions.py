@@ -1,60 +1,142 @@
 """
 Модуль промокодов и скидок
 """
+import logging
+import threading
+import time
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import random
+from config import PROMO_CONFIG
+from utils import format_price
 
 class PromotionManager:
     def __init__(self, db):
         self.db = db
+        self.lock = threading.Lock()
+        self.promos = {}  # code -> строка promo_codes активного промокода
+        self.uses = {}  # promo_id -> число использований
+        self.user_promos = OrderedDict()  # user_id -> использованные promo_id (LRU)
+        self.loaded_at = 0
+        self.init_counters()
+        self.load_active_promos()
+    
+    def init_counters(self):
+        """Счетчики использований для промокодов, у которых их еще нет"""
+        self.db.execute_query('''
+            INSERT INTO promo_usage_counters (promo_code_id, uses_count)
+            SELECT pc.id, (SELECT COUNT(*) FROM promo_uses pu WHERE pu.promo_code_id = pc.id)
+            FROM promo_codes pc
+            WHERE NOT EXISTS (SELECT 1 FROM promo_usage_counters c WHERE c.promo_code_id = pc.id)
+        ''')
+    
+    def load_active_promos(self):
+        """Загрузка действующих промокодов и их счетчиков в память"""
+        rows = self.db.execute_query('''
+            SELECT pc.id, pc.code, pc.discount_type, pc.discount_value, pc.min_order_amount,
+                   pc.max_uses, pc.expires_at, pc.description, pc.is_active, pc.created_at,
+                   IFNULL(c.uses_count, 0)
+            FROM promo_codes pc
+            LEFT JOIN promo_usage_counters c ON c.promo_code_id = pc.id
+            WHERE pc.is_active = 1
+            AND (pc.expires_at IS NULL OR pc.expires_at > ?)
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+        
+        if rows is None:
+            return
+        
+        with self.lock:
+            self.promos = {row[1].upper(): row[:10] for row in rows}
+            self.uses = {row[0]: row[10] for row in rows}
+            self.loaded_at = time.monotonic()
+    
+    def refresh_if_stale(self):
+        """Промокоды, созданные другим процессом (веб-админка), подхватываются по TTL кэша"""
+        if time.monotonic() - self.loaded_at >= PROMO_CONFIG['cache_ttl']:
+            self.load_active_promos()
+    
+    def get_cached_promo(self, code):
+        """Промокод из кэша; истекший вытесняется при обращении"""
+        self.refresh_if_stale()
+        
+        with self.lock:
+            promo = self.promos.get(code)
+            if promo and self.is_expired(promo):
+                del self.promos[code]
+                self.uses.pop(promo[0], None)
+                return 'expired'
+            return promo
+    
+    def is_expired(self, promo):
+        """Истек ли срок действия промокода"""
+        return bool(promo[6]) and promo[6] <= datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    def get_user_used_promos(self, user_id):
+        """Использованные пользователем промокоды (загружаются один раз на пользователя)"""
+        with self.lock:
+            used = self.user_promos.get(user_id)
+            if used is not None:
+                self.user_promos.move_to_end(user_id)
+                return used
+        
+        rows = self.db.execute_query(
+            'SELECT DISTINCT promo_code_id FROM promo_uses WHERE user_id = ?',
+            (user_id,)
+        ) or []
+        used = {row[0] for row in rows}
+        
+        with self.lock:
+            self.user_promos[user_id] = used
+            if len(self.user_promos) > PROMO_CONFIG['max_cached_users']:
+                self.user_promos.popitem(last=False)
+        
+        return used
     
     def create_promo_code(self, code, discount_type, discount_value, min_order_amount=0, max_uses=None, expires_at=None, description=""):
         """Создание промокода"""
-        return self.db.execute_query('''
+        promo_id = self.db.execute_query('''
             INSERT INTO promo_codes (
                 code, discount_type, discount_value, min_order_amount,
                 max_uses, expires_at, description
             ) VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (code, discount_type, discount_value, min_order_amount, max_uses, expires_at, description))
+        
+        if promo_id:
+            self.db.execute_query(
+                'INSERT OR IGNORE INTO promo_usage_counters (promo_code_id, uses_count) VALUES (?, 0)',
+                (promo_id,)
+            )
+            with self.lock:
+                self.promos[code.upper()] = (
+                    promo_id, code, discount_type, discount_value, min_order_amount,
+                    max_uses, expires_at, description, 1, datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                )
+                self.uses[promo_id] = 0
+        
+        return promo_id
     
     def validate_promo_code(self, code, user_id, order_amount):
-        """Проверка промокода"""
-        promo = self.db.execute_query(
-            'SELECT * FROM promo_codes WHERE code = ? AND is_active = 1',
-            (code.upper(),)
-        )
+        """Проверка промокода без обращения к базе (кэш, счетчики, набор использованных)"""
+        promo_data = self.get_cached_promo(code.upper())
         
-        if not promo:
+        if not promo_data:
             return {'valid': False, 'error': 'Промокод не найден'}
         
-        promo_data = promo[0]
-        
         # Проверка срока действия
-        if promo_data[6] and datetime.now() > datetime.strptime(promo_data[6], '%Y-%m-%d %H:%M:%S'):
+        if promo_data == 'expired':
             return {'valid': False, 'error': 'Промокод истек'}
         
         # Проверка минимальной суммы заказа
         if order_amount < promo_data[4]:
             return {'valid': False, 'error': f'Минимальная сумма заказа: {format_price(promo_data[4])}'}
         
-        # Проверка лимита использований
-        if promo_data[5]:
-            uses_count = self.db.execute_query(
-                'SELECT COUNT(*) FROM promo_uses WHERE promo_code_id = ?',
-                (promo_data[0],)
-            )[0][0]
-            
-            if uses_count >= promo_data[5]:
-                return {'valid': False, 'error': 'Промокод исчерпан'}
+        # Проверка лимита использований (окончательная - условным UPDATE в apply_promo_code)
+        if promo_data[5] and self.uses.get(promo_data[0], 0) >= promo_data[5]:
+            return {'valid': False, 'error': 'Промокод исчерпан'}
         
         # Проверка использования пользователем
-        user_uses = self.db.execute_query(
-            'SELECT COUNT(*) FROM promo_uses WHERE promo_code_id = ? AND user_id = ?',
-            (promo_data[0], user_id)
-        )[0][0]
-        
-        if user_uses > 0:
+        if promo_data[0] in self.get_user_used_promos(user_id):
             return {'valid': False, 'error': 'Промокод уже использован'}
         
         # Рассчитываем скидку
@@ -80,18 +162,49 @@ class PromotionManager:
         return 0
     
     def apply_promo_code(self, promo_id, user_id, order_id, discount_amount):
-        """Применение промокода к заказу"""
-        # Записываем использование
-        self.db.execute_query(
-            'INSERT INTO promo_uses (promo_code_id, user_id, order_id, discount_amount) VALUES (?, ?, ?, ?)',
-            (promo_id, user_id, order_id, discount_amount)
-        )
+        """Применение промокода к заказу. Лимит проверяется и увеличивается одним условным UPDATE,
+        поэтому параллельные применения не превышают max_uses.
+        """
+        try:
+            with self.db.transaction() as conn:
+                if conn.execute(
+                    'SELECT 1 FROM promo_uses WHERE promo_code_id = ? AND user_id = ? LIMIT 1',
+                    (promo_id, user_id)
+                ).fetchone():
+                    return False
+                
+                conn.execute(
+                    'INSERT OR IGNORE INTO promo_usage_counters (promo_code_id, uses_count) VALUES (?, 0)',
+                    (promo_id,)
+                )
+                updated = conn.execute('''
+                    UPDATE promo_usage_counters SET uses_count = uses_count + 1
+                    WHERE promo_code_id = ?
+                    AND uses_count < IFNULL((SELECT max_uses FROM promo_codes WHERE id = ?), uses_count + 1)
+                ''', (promo_id, promo_id)).rowcount
+                
+                if not updated:
+                    return False  # Лимит исчерпан
+                
+                # Записываем использование
+                conn.execute(
+                    'INSERT INTO promo_uses (promo_code_id, user_id, order_id, discount_amount) VALUES (?, ?, ?, ?)',
+                    (promo_id, user_id, order_id, discount_amount)
+                )
+                
+                # Обновляем сумму заказа
+                conn.execute(
+                    'UPDATE orders SET total_amount = total_amount - ?, promo_discount = ? WHERE id = ?',
+                    (discount_amount, discount_amount, order_id)
+                )
+        except Exception as e:
+            logging.info(f"Ошибка применения промокода {promo_id}: {e}")
+            return False
         
-        # Обновляем сумму заказа
-        self.db.execute_query(
-            'UPDATE orders SET total_amount = total_amount - ?, promo_discount = ? WHERE id = ?',
-            (discount_amount, discount_amount, order_id)
-        )
+        with self.lock:
+            self.uses[promo_id] = self.uses.get(promo_id, 0) + 1
+            if user_id in self.user_promos:
+                self.user_promos[user_id].add(promo_id)
         
         return True
     
@@ -130,20 +243,26 @@ class PromotionManager:
             'description': description
         }
     
+    def get_available_promos(self):
+        """Действующие и не исчерпанные промокоды из кэша"""
+        self.refresh_if_stale()
+        
+        with self.lock:
+            return [
+                promo for promo in self.promos.values()
+                if not self.is_expired(promo)
+                and (not promo[5] or self.uses.get(promo[0], 0) < promo[5])
+            ]
+    
     def get_active_promotions(self):
         """Получение активных акций"""
-        return self.db.execute_query('''
-            SELECT * FROM promo_codes 
-            WHERE is_active = 1 
-            AND (expires_at IS NULL OR expires_at > datetime('now'))
-            AND (max_uses IS NULL OR (
-                SELECT COUNT(*) FROM promo_uses WHERE promo_code_id = promo_codes.id
-            ) < max_uses)
-            ORDER BY created_at DESC
-        ''')
+        return sorted(self.get_available_promos(), key=lambda promo: promo[9] or '', reverse=True)
     
-    def create_flash_sale(self, product_ids, discount_percentage, duration_hours=24):
-        """Создание флеш-распродажи"""
+    def create_flash_sale(self, product_ids, discount_percentage, duration_hours=24,
+                          flash_sale_engine=None, units_per_product=None, per_user_limit=None):
+        """Создание флеш-распродажи.
+        С flash_sale_engine и units_per_product товар выделяется в токены (лимит на покупателя, очередь).
+        """
         expires_at = (datetime.now() + timedelta(hours=duration_hours)).strftime('%Y-%m-%d %H:%M:%S')
         
         # Создаем промокод для флеш-распродажи
@@ -166,24 +285,26 @@ class PromotionManager:
                 (promo_id, product_id)
             )
         
+        allocated = None
+        if flash_sale_engine and units_per_product:
+            allocated = flash_sale_engine.start_sale(
+                promo_id, {product_id: units_per_product for product_id in product_ids},
+                per_user_limit, ends_at=expires_at
+            )
+        
         return {
             'code': flash_code,
+            'promo_id': promo_id,
             'discount': discount_percentage,
             'duration': duration_hours,
-            'products_count': len(product_ids)
+            'products_count': len(product_ids),
+            'allocated': allocated
         }
     
     def get_user_available_promos(self, user_id):
         """Получение доступных промокодов для пользователя"""
-        return self.db.execute_query('''
-            SELECT pc.* FROM promo_codes pc
-            WHERE pc.is_active = 1
-            AND (pc.expires_at IS NULL OR pc.expires_at > datetime('now'))
-            AND (pc.max_uses IS NULL OR (
-                SELECT COUNT(*) FROM promo_uses pu WHERE pu.promo_code_id = pc.id
-            ) < pc.max_uses)
-            AND pc.id NOT IN (
-                SELECT promo_code_id FROM promo_uses WHERE user_id = ?
-            )
-            ORDER BY pc.discount_value DESC
-        ''', (user_id,))
\ No newline at end of file
+        used = self.get_user_used_promos(user_id)
+        return sorted(
+            (promo for promo in self.get_available_promos() if promo[0] not in used),
+            key=lambda promo: promo[3], reverse=True
+        )
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+Профилирование SQL: отпечатки запросов, число вызовов, перцентили задержки, места вызова
+и журнал медленных запросов с планом выполнения
+"""
+import logging
+import hashlib
+import itertools
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from collections import deque
+from config import QUERY_PROFILER_CONFIG
+
+slow_logger = logging.getLogger('shop_bot.database.slow')
+
+# Кадры этих файлов пропускаются при поиске места вызова
+INTERNAL_FILES = {'database.py', 'query_profiler.py', 'analytics_snapshot.py', 'contextlib.py'}
+
+def fingerprint(sql):
+    """Нормализованный текст запроса: литералы заменены на ?, списки IN (...) любой длины совпадают"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', 'IN (?, ...)', sql, flags=re.IGNORECASE)
+    return ' '.join(sql.split())
+
+def percentile(values, share):
+    return values[min(int(len(values) * share), len(values) - 1)] if values else 0
+
+class QueryProfiler:
+    def __init__(self):
+        self.enabled = QUERY_PROFILER_CONFIG['enabled']
+        self.lock = threading.Lock()
+        self.statements = {}  # отпечаток -> статистика
+        self.fingerprints = {}  # исходный текст -> (отпечаток, короткий id); строки SQL в коде постоянны
+        self.dropped = 0
+        self.started_at = time.time()
+
+    def get_fingerprint(self, sql):
+        cached = self.fingerprints.get(sql)
+        if cached:
+            return cached
+        text = fingerprint(sql)
+        cached = (text, hashlib.sha1(text.encode()).hexdigest()[:8])
+        if len(self.fingerprints) >= QUERY_PROFILER_CONFIG['max_statements'] * 4:
+            self.fingerprints.clear()
+        self.fingerprints[sql] = cached
+        return cached
+
+    def get_site(self):
+        """Первый кадр вне слоя базы данных: файл:строка функция"""
+        frame = sys._getframe(2)
+        while frame and os.path.basename(frame.f_code.co_filename) in INTERNAL_FILES:
+            frame = frame.f_back
+        if not frame:
+            return '?'
+        return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+
+    def record(self, db_path, sql, params, elapsed, rows=None, error=None, pending=None):
+        """Учет одного выполнения; медленный запрос пишется в журнал с планом (не чаще explain_interval).
+        rows=None - число строк неизвестно. pending - список соединения в транзакции: EXPLAIN
+        и запись в журнал откладываются до ее завершения (explain_pending)
+        """
+        if not self.enabled:
+            return
+
+        ms = elapsed * 1000
+        text, statement_id = self.get_fingerprint(sql)
+        site = self.get_site()
+        now = time.time()
+        slow = ms >= QUERY_PROFILER_CONFIG['slow_ms']
+
+        with self.lock:
+            stats = self.statements.get(text)
+            if stats is None:
+                if len(self.statements) >= QUERY_PROFILER_CONFIG['max_statements']:
+                    self.dropped += 1
+                    return
+                stats = self.statements[text] = {
+                    'id': statement_id, 'sql': text, 'calls': 0, 'errors': 0, 'slow': 0,
+                    'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'counted': 0,
+                    'samples': deque(maxlen=QUERY_PROFILER_CONFIG['samples']),
+                    'sites': {}, 'last_error': None, 'plan': None, 'plan_at': 0
+                }
+            stats['calls'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['samples'].append(ms)
+            if rows is not None:
+                stats['rows'] += rows
+                stats['counted'] += 1
+            if error is not None:
+                stats['errors'] += 1
+                stats['last_error'] = str(error)[:200]
+            if site in stats['sites'] or len(stats['sites']) < QUERY_PROFILER_CONFIG['max_sites']:
+                stats['sites'][site] = stats['sites'].get(site, 0) + 1
+
+            explain = slow and now - stats['plan_at'] >= QUERY_PROFILER_CONFIG['explain_interval']
+            if slow:
+                stats['slow'] += 1
+            if explain:
+                stats['plan_at'] = now
+
+        if slow:
+            entry = (stats, db_path, sql, params, explain, statement_id, ms, site, text)
+            if explain and pending is not None:
+                pending.append(entry)
+            else:
+                self.log_slow(*entry)
+
+    def log_slow(self, stats, db_path, sql, params, explain, statement_id, ms, site, text):
+        plan = self.explain(db_path, sql, params) if explain else None
+        if plan:
+            with self.lock:
+                stats['plan'] = plan
+        slow_logger.warning(
+            "Медленный запрос [%s] %.0f мс, %s: %.200s", statement_id, ms, site, text,
+            extra={'statement_id': statement_id, 'duration_ms': round(ms, 1), 'site': site, 'plan': plan}
+        )
+
+    def explain_pending(self, pending):
+        """Отложенные медленные запросы завершенной транзакции: план и запись в журнал"""
+        while pending:
+            self.log_slow(*pending.pop(0))
+
+    def explain(self, db_path, sql, params):
+        """EXPLAIN QUERY PLAN отдельным соединением; запрос при этом не выполняется"""
+        try:
+            conn = sqlite3.connect(db_path, timeout=1)
+            try:
+                return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params or ())]
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.info(f"Ошибка получения плана запроса: {e}")
+            return None
+
+    def get_top(self, limit=None, order='total_ms'):
+        """Запросы с наибольшим total_ms (или calls, p99_ms, max_ms, errors)"""
+        with self.lock:
+            snapshot = [
+                {**stats, 'samples': sorted(stats['samples']), 'sites': dict(stats['sites'])}
+                for stats in self.statements.values()
+            ]
+
+        top = []
+        for stats in snapshot:
+            samples = stats.pop('samples')
+            sites = sorted(stats.pop('sites').items(), key=lambda item: -item[1])
+            stats.pop('plan_at')
+            counted = stats.pop('counted')
+            top.append({
+                **stats,
+                'total_ms': round(stats['total_ms'], 1),
+                'max_ms': round(stats['max_ms'], 2),
+                'avg_ms': round(stats['total_ms'] / stats['calls'], 3),
+                'p50_ms': round(percentile(samples, 0.5), 3),
+                'p95_ms': round(percentile(samples, 0.95), 3),
+                'p99_ms': round(percentile(samples, 0.99), 3),
+                # Для SELECT внутри транзакции число строк неизвестно: среднее по учтенным вызовам
+                'avg_rows': round(stats['rows'] / counted, 1) if counted else None,
+                'sites': sites[:3]
+            })
+        top.sort(key=lambda item: item[order], reverse=True)
+        return top[:limit or QUERY_PROFILER_CONFIG['top_n']]
+
+    def get_stats(self):
+        """Итоги с момента запуска или сброса"""
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'statements': len(self.statements),
+                'calls': sum(stats['calls'] for stats in self.statements.values()),
+                'total_ms': round(sum(stats['total_ms'] for stats in self.statements.values()), 1),
+                'slow': sum(stats['slow'] for stats in self.statements.values()),
+                'errors': sum(stats['errors'] for stats in self.statements.values()),
+                'dropped': self.dropped,
+                'since': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at))
+            }
+
+    def reset(self):
+        with self.lock:
+            self.statements.clear()
+            self.dropped = 0
+            self.started_at = time.time()
+
+class ProfiledConnection(sqlite3.Connection):
+    """Соединение db.transaction(): каждый execute/executemany учитывается профилировщиком.
+    EXPLAIN медленных запросов выполняется после закрытия соединения, а не внутри транзакции
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending_plans = []
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            cursor = super().execute(sql, parameters)
+        except Exception as e:
+            profiler.record(self.db_path, sql, parameters, time.perf_counter() - started, error=e, pending=self.pending_plans)
+            raise
+        # rowcount у SELECT равен -1: строки читает вызывающий, их число неизвестно
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+        profiler.record(self.db_path, sql, parameters, time.perf_counter() - started, rows, pending=self.pending_plans)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        # Первый набор параметров - для EXPLAIN медленного запроса
+        seq_of_parameters = iter(seq_of_parameters)
+        first = next(seq_of_parameters, None)
+        if first is not None:
+            seq_of_parameters = itertools.chain((first,), seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            cursor = super().executemany(sql, seq_of_parameters)
+        except Exception as e:
+            profiler.record(self.db_path, sql, first, time.perf_counter() - started, error=e, pending=self.pending_plans)
+            raise
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+        profiler.record(self.db_path, sql, first, time.perf_counter() - started, rows, pending=self.pending_plans)
+        return cursor
+
+    def close(self):
+        super().close()
+        profiler.explain_pending(self.pending_plans)
+
+# Один профилировщик на процесс: все экземпляры DatabaseManager пишут в него
+profiler = QueryProfiler()
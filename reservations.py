@@ -0,0 +1,265 @@
+"""
+Резервы товара под заказы: сроки жизни по способу оплаты и фоновое снятие просроченных
+"""
+import logging
+import threading
+
+from datetime import datetime, timedelta
+from config import RESERVATION_CONFIG
+
+class ReservationManager:
+    def __init__(self, db, stock_history, cost_ledger):
+        self.db = db
+        self.stock_history = stock_history
+        self.cost_ledger = cost_ledger
+        self.lock = threading.Lock()
+        self.reserved = {}  # product_id -> зарезервировано
+        self.available = {}  # product_id -> доступный остаток (products.stock)
+        self.metrics = {'reserved': 0, 'released': 0, 'expired': 0, 'sweeps': 0, 'last_sweep': None}
+        self.stop_event = threading.Event()
+        self.sweeper_thread = None
+        self.cancel_order = None  # cancel_order(order_id, only_if_unpaid) - отмена обычным путем бота (main.py)
+        self.refresh_metrics()
+
+    def get_ttl(self, payment_method):
+        """Срок жизни резерва для способа оплаты"""
+        return RESERVATION_CONFIG['ttl_minutes'].get(payment_method, RESERVATION_CONFIG['default_ttl_minutes'])
+
+    def reserve(self, product_id, quantity, order_id, payment_method=None):
+        """Резерв в одной транзакции с проверкой наличия. Возвращает (старый, новый) остаток или None"""
+        now = datetime.now()
+
+        with self.db.transaction() as conn:
+            if payment_method is None:
+                order = conn.execute('SELECT payment_method FROM orders WHERE id = ?', (order_id,)).fetchone()
+                payment_method = order[0] if order else None
+
+            # Проверка наличия и списание атомарны: BEGIN IMMEDIATE блокирует параллельные записи
+            change = self.stock_history.apply_change(
+                conn, product_id, quantity_change=-quantity,
+                movement_type='reservation', reference_id=order_id, min_stock=0
+            )
+            if not change:
+                return None
+
+            conn.execute('''
+                INSERT INTO stock_reservations (
+                    product_id, order_id, quantity, expires_at, created_at
+                ) VALUES (?, ?, ?, ?, ?)
+            ''', (
+                product_id, order_id, quantity,
+                (now + timedelta(minutes=self.get_ttl(payment_method))).strftime('%Y-%m-%d %H:%M:%S'),
+                now.strftime('%Y-%m-%d %H:%M:%S')
+            ))
+
+            # Себестоимость продажи списывается при резервировании под заказ
+            self.cost_ledger.consume(product_id, quantity, 'sale', order_id, conn)
+
+        with self.lock:
+            self.reserved[product_id] = self.reserved.get(product_id, 0) + quantity
+            self.available[product_id] = change[1]
+            self.metrics['reserved'] += quantity
+
+        return change
+
+    def confirm(self, order_id, conn=None):
+        """Оплаченный заказ: резерв больше не истекает"""
+        query = 'UPDATE stock_reservations SET expires_at = NULL WHERE order_id = ?'
+        if conn:
+            return conn.execute(query, (order_id,)).rowcount
+        return self.db.execute_query(query, (order_id,))
+
+    def release(self, order_id, conn=None):
+        """Освобождение резервов заказа (отмена); с conn - в транзакции вызывающего"""
+        if conn is None:
+            with self.db.transaction() as conn:
+                return self.release(order_id, conn)
+
+        reservations = conn.execute(
+            'SELECT id, product_id, order_id, quantity FROM stock_reservations WHERE order_id = ?',
+            (order_id,)
+        ).fetchall()
+        released = self.release_rows(conn, reservations, 'release')
+
+        # Метрики из памяти сверяются с базой в refresh_metrics, откат транзакции их поправит
+        self.apply_released(released, 'released')
+        return released
+
+    def release_rows(self, conn, reservations, movement_type):
+        """Возврат на склад пакета резервов: остатки и удаление набором, себестоимость по заказам"""
+        if not reservations:
+            return {}
+
+        quantities = {}
+        per_order = {}
+        for reservation_id, product_id, order_id, quantity in reservations:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+            per_order[(product_id, order_id)] = per_order.get((product_id, order_id), 0) + quantity
+
+        placeholders = ','.join('?' * len(quantities))
+        stocks = dict(conn.execute(
+            f'SELECT id, IFNULL(stock, 0) FROM products WHERE id IN ({placeholders})',
+            tuple(quantities)
+        ).fetchall())
+
+        changes = [
+            (product_id, stocks[product_id], stocks[product_id] + quantity)
+            for product_id, quantity in quantities.items() if product_id in stocks
+        ]
+        self.stock_history.apply_bulk_changes(conn, changes, movement_type)
+
+        # Возвращаем себестоимость по цене списания
+        for (product_id, order_id), quantity in per_order.items():
+            self.cost_ledger.return_units(product_id, quantity, 'sale', order_id, conn)
+
+        conn.executemany(
+            'DELETE FROM stock_reservations WHERE id = ?',
+            ((reservation[0],) for reservation in reservations)
+        )
+
+        return {product_id: (quantities[product_id], new_quantity) for product_id, _, new_quantity in changes}
+
+    def apply_released(self, released, metric):
+        """Обновление метрик после фиксации транзакции"""
+        with self.lock:
+            for product_id, (quantity, new_quantity) in released.items():
+                self.reserved[product_id] = max(self.reserved.get(product_id, 0) - quantity, 0)
+                self.available[product_id] = new_quantity
+                self.metrics[metric] += quantity
+
+    def expire_batch(self, now):
+        """Один пакет: просроченные заказы в pending без оплаты отменяются обычным путем,
+        резервы уже отмененных заказов и заказов, которых нет, возвращаются на склад.
+        """
+        with self.db.transaction() as conn:
+            # Заказ уже подтвержден, отгружен или оплачен: его резерв больше не истекает
+            conn.execute('''
+                UPDATE stock_reservations SET expires_at = NULL
+                WHERE expires_at IS NOT NULL AND expires_at <= ?
+                AND order_id IN (
+                    SELECT id FROM orders
+                    WHERE status NOT IN ('pending', 'cancelled')
+                    OR (status = 'pending' AND IFNULL(payment_status, 'pending') = 'paid')
+                )
+            ''', (now,))
+
+            orphans = conn.execute('''
+                SELECT r.id, r.product_id, r.order_id, r.quantity
+                FROM stock_reservations r
+                WHERE r.expires_at IS NOT NULL AND r.expires_at <= ?
+                AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.id = r.order_id)
+                LIMIT ?
+            ''', (now, RESERVATION_CONFIG['batch_size'])).fetchall()
+            released = self.release_rows(conn, orphans, 'reservation_expired')
+
+            # Резерв отмененного заказа снимается независимо от срока
+            orders = conn.execute('''
+                SELECT r.order_id, o.status, SUM(r.quantity)
+                FROM stock_reservations r
+                JOIN orders o ON o.id = r.order_id
+                WHERE o.status = 'cancelled'
+                OR (r.expires_at IS NOT NULL AND r.expires_at <= ?
+                    AND o.status = 'pending' AND IFNULL(o.payment_status, 'pending') != 'paid')
+                GROUP BY r.order_id
+                ORDER BY MIN(r.expires_at)
+                LIMIT ?
+            ''', (now, RESERVATION_CONFIG['batch_size'])).fetchall()
+
+        self.apply_released(released, 'expired')
+
+        cancelled = set()
+        for order_id, status, quantity in orders:
+            if status == 'cancelled':
+                self.release(order_id)
+            elif self.cancel_order:
+                # Уведомление клиента, промокод и заявки флеш-распродажи - как при отмене администратором
+                if self.cancel_order(order_id, only_if_unpaid=True):
+                    cancelled.add(order_id)
+            elif self.db.update_order_status(order_id, 'cancelled', only_if_unpaid=True):
+                cancelled.add(order_id)
+
+            if order_id in cancelled:
+                with self.lock:
+                    self.metrics['expired'] += quantity
+
+        return len(orphans) + len(orders), cancelled
+
+    def sweep(self):
+        """Снятие всех просроченных резервов пакетами"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        expired = 0
+        orders = set()
+
+        while True:
+            count, order_ids = self.expire_batch(now)
+            expired += count
+            orders |= order_ids
+            # Пакет без единой отмены (ошибки) не повторяется по кругу - до следующего прохода
+            if count < RESERVATION_CONFIG['batch_size'] or not order_ids:
+                break
+
+        self.metrics['sweeps'] += 1
+        self.metrics['last_sweep'] = now
+
+        if expired:
+            logging.info(f"Снято просроченных резервов: {expired} (заказов: {len(orders)})")
+
+        return {'expired': expired, 'orders': sorted(orders)}
+
+    def refresh_metrics(self):
+        """Полная сверка метрик с базой (изменения остатков в обход резервов)"""
+        reserved = self.db.execute_query(
+            'SELECT product_id, SUM(quantity) FROM stock_reservations GROUP BY product_id'
+        )
+        available = self.db.execute_query('SELECT id, IFNULL(stock, 0) FROM products WHERE is_active = 1')
+
+        if reserved is None or available is None:
+            return
+
+        with self.lock:
+            self.reserved = dict(reserved)
+            self.available = dict(available)
+
+    def get_availability(self, product_id):
+        """Доступно и зарезервировано из памяти; для точной проверки служит reserve()"""
+        with self.lock:
+            if product_id in self.available:
+                return self.available[product_id], self.reserved.get(product_id, 0)
+
+        product = self.db.execute_query('SELECT IFNULL(stock, 0) FROM products WHERE id = ?', (product_id,))
+        return (product[0][0] if product else 0), self.reserved.get(product_id, 0)
+
+    def is_available(self, product_id, quantity=1):
+        """Быстрая проверка наличия при просмотре каталога"""
+        return self.get_availability(product_id)[0] >= quantity
+
+    def get_stats(self):
+        """Метрики резервов"""
+        with self.lock:
+            return {
+                **self.metrics,
+                'reserved_units': sum(self.reserved.values()),
+                'available_units': sum(self.available.values()),
+                'products_with_reserves': sum(1 for quantity in self.reserved.values() if quantity > 0)
+            }
+
+    def start_sweeper(self):
+        """Фоновое снятие просроченных резервов по таймеру"""
+        if self.sweeper_thread and self.sweeper_thread.is_alive():
+            return
+
+        def sweeper_worker():
+            while not self.stop_event.wait(RESERVATION_CONFIG['sweep_interval']):
+                try:
+                    self.sweep()
+                    self.refresh_metrics()
+                except Exception as e:
+                    logging.info(f"Ошибка снятия просроченных резервов: {e}")
+
+        self.stop_event.clear()
+        self.sweeper_thread = threading.Thread(target=sweeper_worker, daemon=True)
+        self.sweeper_thread.start()
+
+    def stop_sweeper(self):
+        """Остановка фонового снятия"""
+        self.stop_event.set()
@@ -9,11 +9,14 @@ import hmac
 import json
 import re
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+from config import SPAM_FILTER_CONFIG
+from log_writer import get_log_writer
 
 class SecurityManager:
     def __init__(self, db):
         self.db = db
+        self.log_writer = get_log_writer(db.db_path)
         self.rate_limits = defaultdict(list)
         self.blocked_users = set()
         self.suspicious_activity = defaultdict(int)
@@ -86,7 +89,7 @@ class SecurityManager:
         
         # Сохраняем в базу
         try:
-            self.db.execute_query('''
+            self.log_writer.write('''
                 INSERT INTO security_logs (user_id, activity_type, details, severity, created_at)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
@@ -116,7 +119,7 @@ class SecurityManager:
         details_json = json.dumps(details) if details else None
         
         try:
-            self.db.execute_query('''
+            self.log_writer.write('''
                 INSERT INTO security_logs (user_id, activity_type, details, severity, created_at)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
@@ -139,43 +142,255 @@ class SecurityManager:
         
         return hmac.compare_digest(signature, expected_signature)
 
+# Спам-паттерны компилируются один раз; каждый ищется отдельно, поэтому пересекающиеся
+# признаки (число внутри URL, спам-слово в упоминании) учитываются все
+SPAM_PATTERNS = {
+    'url': re.compile(r'https?://\S+'),  # URL
+    'mention': re.compile(r'@\w+'),  # Упоминания
+    'long_number': re.compile(r'\b\d{4,}\b'),  # Длинные числа
+    'spam_word': re.compile(r'СКИДКА|АКЦИЯ|БЕСПЛАТНО|FREE', re.IGNORECASE),  # Спам слова
+    'repeat': re.compile(r'(?P<repeat_char>.)(?P=repeat_char){5,}')  # Повторяющиеся символы
+}
+
+# Предварительная проверка одним проходом: у обычного сообщения нет ни одного признака
+SPAM_MATCHER = re.compile('|'.join(f'(?:{pattern.pattern})' for pattern in SPAM_PATTERNS.values()), re.IGNORECASE)
+
+class RuleBasedSpamModel:
+    """Правиловая модель оценки спама (модель по умолчанию)"""
+
+    def __init__(self, threshold=3):
+        self.threshold = threshold
+        self.content_weights = {
+            'url': 1,
+            'mention': 1,
+            'long_number': 1,
+            'spam_word': 1,
+            'repeat': 2,
+            'caps': 1
+        }
+
+    def score(self, features):
+        """Расчет спам-балла по признакам сообщения и истории пользователя"""
+        score = 0
+        for name, weight in self.content_weights.items():
+            if features.get(name):
+                score += weight
+
+        # Поведенческие признаки (есть только при известном пользователе)
+        if features.get('duplicates', 0) >= 2:
+            score += 2
+        if features.get('rate_exceeded'):
+            score += 1
+        if features.get('history_size', 0) >= 3 and features.get('link_ratio', 0) >= 0.5:
+            score += 1
+
+        return score
+
+class UserSpamHistory:
+    """Скользящая история сообщений пользователя фиксированного размера"""
+    __slots__ = ('timestamps', 'hashes', 'hash_counts', 'link_flags', 'links_total', 'spam_times')
+
+    def __init__(self, history_size):
+        self.timestamps = deque(maxlen=history_size)
+        self.hashes = deque(maxlen=history_size)
+        self.hash_counts = {}
+        self.link_flags = deque(maxlen=history_size)
+        self.links_total = 0
+        self.spam_times = deque()  # Отметки спам-сообщений за окно spam_decay_seconds
+
+    def push(self, timestamp, text_hash, has_link):
+        """Добавление сообщения с вытеснением самого старого"""
+        self.timestamps.append(timestamp)
+
+        if text_hash is not None:
+            if len(self.hashes) == self.hashes.maxlen:
+                old_hash = self.hashes[0]
+                count = self.hash_counts[old_hash] - 1
+                if count:
+                    self.hash_counts[old_hash] = count
+                else:
+                    del self.hash_counts[old_hash]
+            self.hashes.append(text_hash)
+            self.hash_counts[text_hash] = self.hash_counts.get(text_hash, 0) + 1
+
+        if len(self.link_flags) == self.link_flags.maxlen:
+            self.links_total -= self.link_flags[0]
+        self.link_flags.append(has_link)
+        self.links_total += has_link
+
 class AntiSpamFilter:
-    def __init__(self, db):
+    def __init__(self, db, model=None):
         self.db = db
-        self.spam_patterns = [
-            r'(https?://[^\s]+)',  # URL
-            r'(@\w+)',  # Упоминания
-            r'(\b\d{4,}\b)',  # Длинные числа
-            r'(СКИДКА|АКЦИЯ|БЕСПЛАТНО|FREE)',  # Спам слова
-        ]
-        self.blacklist = set()
-    
-    def is_spam(self, message):
-        """Проверка сообщения на спам"""
+        self.model = model or RuleBasedSpamModel()
+        self.matcher = SPAM_MATCHER
+        self.blacklist = {}  # user_id -> время окончания блокировки (unix)
+
+        # Настройки скользящих признаков
+        self.window_seconds = SPAM_FILTER_CONFIG['window_seconds']
+        self.max_messages_per_window = SPAM_FILTER_CONFIG['max_messages_per_window']
+        self.history_size = SPAM_FILTER_CONFIG['history_size']
+        self.max_tracked_users = SPAM_FILTER_CONFIG['max_tracked_users']
+        self.duplicate_min_length = SPAM_FILTER_CONFIG['duplicate_min_length']
+        self.spam_decay_seconds = SPAM_FILTER_CONFIG['spam_decay_seconds']
+        self.blacklist_seconds = SPAM_FILTER_CONFIG['blacklist_hours'] * 3600
+
+        # История пользователей (LRU, ограничена по количеству пользователей)
+        self.user_history = OrderedDict()
+
+        self.load_blacklist()
+
+    def extract_content_features(self, message):
+        """Извлечение признаков из текста: общий матчер отсекает чистые сообщения, затем каждый паттерн"""
+        features = {}
+        if self.matcher.search(message):
+            for name, pattern in SPAM_PATTERNS.items():
+                if pattern.search(message):
+                    features[name] = True
+
+        if len(message) > 10 and message.isupper():
+            features['caps'] = True
+
+        return features
+
+    def get_user_history(self, user_id):
+        """Получение истории пользователя с вытеснением давно неактивных"""
+        history = self.user_history.get(user_id)
+        if history is None:
+            history = UserSpamHistory(self.history_size)
+            self.user_history[user_id] = history
+            if len(self.user_history) > self.max_tracked_users:
+                self.user_history.popitem(last=False)
+        else:
+            self.user_history.move_to_end(user_id)
+        return history
+
+    def score_message(self, user_id, message, timestamp=None):
+        """Оценка сообщения с учетом скользящей истории пользователя"""
         if not message:
+            return {'score': 0, 'is_spam': False, 'features': {}}
+
+        features = self.extract_content_features(message)
+
+        if user_id is not None:
+            now = timestamp if timestamp is not None else time.time()
+            history = self.get_user_history(user_id)
+
+            # Дубликаты считаем только для длинных текстов, чтобы не штрафовать кнопки меню
+            text_hash = hash(message) if len(message) >= self.duplicate_min_length else None
+            if text_hash is not None:
+                features['duplicates'] = history.hash_counts.get(text_hash, 0)
+
+            history.push(now, text_hash, 1 if features.get('url') else 0)
+
+            # Частота сообщений в окне
+            window_start = now - self.window_seconds
+            recent = 0
+            for ts in reversed(history.timestamps):
+                if ts < window_start:
+                    break
+                recent += 1
+            features['rate_exceeded'] = recent > self.max_messages_per_window
+            features['history_size'] = len(history.link_flags)
+            features['link_ratio'] = history.links_total / len(history.link_flags)
+
+        score = self.model.score(features)
+        is_spam = score >= self.model.threshold
+
+        if is_spam and user_id is not None:
+            history.spam_times.append(now)
+
+        return {'score': score, 'is_spam': is_spam, 'features': features}
+
+    def score_batch(self, messages):
+        """Пакетная оценка сообщений: [(user_id, text) или (user_id, text, timestamp)]"""
+        results = []
+        for item in messages:
+            results.append(self.score_message(*item))
+        return results
+
+    def get_spam_count(self, user_id, now=None):
+        """Количество спам-сообщений пользователя за последние spam_decay_seconds"""
+        history = self.user_history.get(user_id)
+        if not history:
+            return 0
+        window_start = (now if now is not None else time.time()) - self.spam_decay_seconds
+        while history.spam_times and history.spam_times[0] < window_start:
+            history.spam_times.popleft()
+        return len(history.spam_times)
+
+    def is_spam(self, message):
+        """Проверка сообщения на спам (только по содержимому)"""
+        return self.score_message(None, message)['is_spam']
+
+    def load_blacklist(self):
+        """Загрузка действующих блокировок из базы; старые записи без срока истекают через blacklist_hours"""
+        try:
+            rows = self.db.execute_query('''
+                SELECT user_id, MAX(IFNULL(blocked_until, datetime(created_at, ?)))
+                FROM security_blocks
+                WHERE reason = ?
+                GROUP BY user_id
+            ''', (f"+{self.blacklist_seconds} seconds", 'spam_blacklist'))
+            now = time.time()
+            self.blacklist = {}
+            for user_id, blocked_until in rows or []:
+                until = datetime.strptime(blocked_until, '%Y-%m-%d %H:%M:%S').timestamp()
+                if until > now:
+                    self.blacklist[user_id] = until
+        except Exception as e:
+            logging.info(f"Ошибка загрузки черного списка: {e}")
+
+    def is_blacklisted(self, user_id):
+        """Проверка наличия в черном списке; истекшая блокировка снимается"""
+        until = self.blacklist.get(user_id)
+        if until is None:
             return False
-        
-        message_upper = message.upper()
-        
-        # Проверяем спам-паттерны
-        spam_score = 0
-        for pattern in self.spam_patterns:
-            if re.search(pattern, message_upper):
-                spam_score += 1
-        
-        # Проверяем повторяющиеся символы
-        if re.search(r'(.)\1{5,}', message):
-            spam_score += 2
-        
-        # Проверяем капс
-        if len(message) > 10 and message.isupper():
-            spam_score += 1
-        
-        return spam_score >= 3
-    
+        if until > time.time():
+            return True
+        del self.blacklist[user_id]
+        return False
+
+    def get_blacklist(self):
+        """Действующие блокировки: [(user_id, время окончания unix)]"""
+        now = time.time()
+        return sorted((user_id, until) for user_id, until in self.blacklist.items() if until > now)
+
     def add_to_blacklist(self, user_id):
-        """Добавление в черный список"""
-        self.blacklist.add(user_id)
+        """Добавление в черный список на blacklist_hours"""
+        if self.is_blacklisted(user_id):
+            return
+
+        until = time.time() + self.blacklist_seconds
+        self.blacklist[user_id] = until
+
+        try:
+            self.db.execute_query('''
+                INSERT INTO security_blocks (user_id, reason, blocked_until, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (
+                user_id, 'spam_blacklist',
+                datetime.fromtimestamp(until).strftime('%Y-%m-%d %H:%M:%S'),
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ))
+        except Exception as e:
+            logging.info(f"Ошибка записи черного списка: {e}")
+
+    def remove_from_blacklist(self, user_id):
+        """Снятие блокировки администратором: запись в базе закрывается, счетчик спама сбрасывается"""
+        removed = self.blacklist.pop(user_id, None) is not None
+        history = self.user_history.get(user_id)
+        if history:
+            history.spam_times.clear()
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self.db.execute_query('''
+                UPDATE security_blocks SET blocked_until = ?
+                WHERE user_id = ? AND reason = ? AND (blocked_until IS NULL OR blocked_until > ?)
+            ''', (now, user_id, 'spam_blacklist', now))
+        except Exception as e:
+            logging.info(f"Ошибка снятия блокировки: {e}")
+        return removed
 
 class InputSanitizer:
     @staticmethod
@@ -214,11 +429,12 @@ class InputSanitizer:
 class ActivityLogger:
     def __init__(self, db):
         self.db = db
+        self.log_writer = get_log_writer(db.db_path)
     
     def log_action(self, user_id, action, details=""):
         """Логирование действий пользователя"""
         try:
-            self.db.execute_query('''
+            self.log_writer.write('''
                 INSERT INTO user_activity_logs (user_id, action, search_query, created_at)
                 VALUES (?, ?, ?, ?)
             ''', (
@@ -0,0 +1,189 @@
+"""
+Отслеживание отправлений: пакетный опрос служб доставки, история статусов и уведомления при изменениях
+"""
+import logging
+import threading
+
+from datetime import datetime, timedelta
+from config import TRACKING_CONFIG
+
+class ShipmentTracker:
+    def __init__(self, db, logistics, notification_manager=None):
+        self.db = db
+        self.logistics = logistics
+        self.notification_manager = notification_manager
+        self.metrics = {'polls': 0, 'checked': 0, 'changed': 0, 'events': 0, 'errors': 0, 'last_poll': None}
+        self.stop_event = threading.Event()
+        self.poller_thread = None
+
+    def enroll_new_shipments(self, now):
+        """Новые отправления (id больше последнего в расписании) ставятся на опрос одним запросом"""
+        final_statuses = TRACKING_CONFIG['final_statuses']
+        return self.db.execute_query(f'''
+            INSERT INTO shipment_tracking (shipment_id, next_check_at)
+            SELECT s.id, ? FROM shipments s
+            WHERE s.id > (SELECT IFNULL(MAX(shipment_id), 0) FROM shipment_tracking)
+            AND IFNULL(s.status, 'created') NOT IN ({','.join('?' * len(final_statuses))})
+        ''', (now, *final_statuses))
+
+    def get_next_check(self, status, created_at, now):
+        """Следующий опрос по статусу и возрасту отправления; None - опрос закончен"""
+        if status in TRACKING_CONFIG['final_statuses']:
+            return None
+
+        try:
+            age = now - datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')
+        except (TypeError, ValueError):
+            age = timedelta(0)
+
+        if age >= timedelta(days=TRACKING_CONFIG['stop_after_days']):
+            return None
+
+        minutes = TRACKING_CONFIG['status_intervals'].get(status, TRACKING_CONFIG['default_interval'])
+        if age >= timedelta(days=TRACKING_CONFIG['slow_after_days']):
+            minutes *= TRACKING_CONFIG['slow_factor']
+
+        return (now + timedelta(minutes=minutes)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def poll_batch(self, now):
+        """Пакет отправлений, которым пора: события от служб, запись только новых событий и смен статуса"""
+        now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+        due = self.db.execute_query('''
+            SELECT s.id, s.order_id, s.tracking_number, s.delivery_provider, s.status,
+                   s.created_at, s.estimated_delivery, t.last_event_at
+            FROM shipment_tracking t
+            JOIN shipments s ON s.id = t.shipment_id
+            WHERE t.next_check_at IS NOT NULL AND t.next_check_at <= ?
+            ORDER BY t.next_check_at
+            LIMIT ?
+        ''', (now_str, TRACKING_CONFIG['batch_size'])) or []
+
+        if not due:
+            return 0, []
+
+        tracking = self.logistics.fetch_tracking_events(due, now)
+        history = []
+        schedule = []
+        changes = []
+
+        for shipment_id, order_id, tracking_number, provider, status, created_at, estimated_delivery, last_event_at in due:
+            result = tracking.get(tracking_number) or {'events': [], 'error': 'нет ответа'}
+            if result.get('error'):
+                self.metrics['errors'] += 1
+
+            # Сравнение с сохраненным состоянием: новые только события позже последнего записанного
+            new_events = sorted(
+                (event for event in result['events'] if last_event_at is None or event['timestamp'] > last_event_at),
+                key=lambda event: event['timestamp']
+            )
+            new_status = status
+            if new_events:
+                history.extend(
+                    (shipment_id, event['status'], event['description'], event['location'], event['timestamp'])
+                    for event in new_events
+                )
+                last_event_at = new_events[-1]['timestamp']
+                new_status = new_events[-1]['status']
+
+            if new_status != status:
+                changes.append((shipment_id, order_id, tracking_number, new_status))
+
+            schedule.append((last_event_at, now_str, self.get_next_check(new_status, created_at, now), shipment_id))
+
+        with self.db.transaction() as conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO shipment_status_history (
+                    shipment_id, status, description, location, event_time
+                ) VALUES (?, ?, ?, ?, ?)
+            ''', history)
+            conn.executemany(
+                'UPDATE shipments SET status = ? WHERE id = ?',
+                ((new_status, shipment_id) for shipment_id, _, _, new_status in changes)
+            )
+            conn.executemany(
+                "UPDATE orders SET status = 'delivered' WHERE id = ? AND status = 'shipped'",
+                ((order_id,) for _, order_id, _, new_status in changes if new_status == 'delivered')
+            )
+            conn.executemany('''
+                UPDATE shipment_tracking SET last_event_at = ?, last_checked_at = ?, next_check_at = ?
+                WHERE shipment_id = ?
+            ''', schedule)
+
+        self.metrics['checked'] += len(due)
+        self.metrics['events'] += len(history)
+        self.metrics['changed'] += len(changes)
+        return len(due), changes
+
+    def poll(self):
+        """Все отправления, которым пора, пакетами"""
+        now = datetime.now()
+        self.enroll_new_shipments(now.strftime('%Y-%m-%d %H:%M:%S'))
+        checked = 0
+        changes = []
+
+        while True:
+            count, batch_changes = self.poll_batch(now)
+            checked += count
+            changes.extend(batch_changes)
+            self.notify_changes(batch_changes)
+            if count < TRACKING_CONFIG['batch_size']:
+                break
+
+        self.metrics['polls'] += 1
+        self.metrics['last_poll'] = now.strftime('%Y-%m-%d %H:%M:%S')
+
+        if changes:
+            logging.info(f"Опрошено отправлений: {checked}, изменился статус: {len(changes)}")
+
+        return {'checked': checked, 'changed': len(changes)}
+
+    def notify_changes(self, changes):
+        """Уведомления о смене статуса через очередь push-уведомлений"""
+        if not changes or not self.notification_manager:
+            return
+
+        order_ids = {order_id for _, order_id, _, _ in changes}
+        recipients = {
+            order_id: (user_id, language)
+            for order_id, user_id, language in self.db.execute_query(f'''
+                SELECT o.id, o.user_id, u.language FROM orders o
+                JOIN users u ON o.user_id = u.id
+                WHERE o.id IN ({','.join('?' * len(order_ids))})
+            ''', tuple(order_ids)) or []
+        }
+
+        for _, order_id, tracking_number, new_status in changes:
+            if order_id not in recipients:
+                continue
+
+            user_id, language = recipients[order_id]
+            self.notification_manager.send_instant_push(
+                user_id,
+                'push_delivery_update',
+                self.logistics.build_delivery_update_text(order_id, tracking_number, new_status, language),
+                'delivery'
+            )
+
+    def get_stats(self):
+        """Метрики опроса"""
+        return dict(self.metrics)
+
+    def start_poller(self):
+        """Фоновый опрос служб доставки по таймеру"""
+        if self.poller_thread and self.poller_thread.is_alive():
+            return
+
+        def poller_worker():
+            while not self.stop_event.wait(TRACKING_CONFIG['poll_interval']):
+                try:
+                    self.poll()
+                except Exception as e:
+                    logging.info(f"Ошибка опроса служб доставки: {e}")
+
+        self.stop_event.clear()
+        self.poller_thread = threading.Thread(target=poller_worker, daemon=True)
+        self.poller_thread.start()
+
+    def stop_poller(self):
+        """Остановка фонового опроса"""
+        self.stop_event.set()
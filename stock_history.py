@@ -0,0 +1,216 @@
+"""
+История остатков: журнал изменений и периодические снимки
+"""
+import logging
+
+from datetime import datetime, timedelta
+from config import STOCK_HISTORY_CONFIG
+
+class StockHistory:
+    def __init__(self, db):
+        self.db = db
+        self.ensure_initial_snapshot()
+
+    def ensure_initial_snapshot(self):
+        """Первый снимок - точка отсчета для журнала изменений"""
+        existing = self.db.execute_query('SELECT 1 FROM stock_snapshots LIMIT 1')
+        if existing is not None and not existing:
+            self.take_snapshot()
+
+    def apply_change(self, conn, product_id, quantity_change=None, new_quantity=None,
+                     movement_type='manual', reference_id=None, min_stock=None):
+        """Изменение products.stock с записью в журнал в транзакции вызывающего.
+        Возвращает (старый остаток, новый остаток) или None, если товара нет
+        или остаток стал бы меньше min_stock.
+        """
+        current = conn.execute('SELECT stock FROM products WHERE id = ?', (product_id,)).fetchone()
+        if not current:
+            return None
+
+        old_quantity = current[0] or 0
+        if new_quantity is None:
+            new_quantity = old_quantity + quantity_change
+        delta = new_quantity - old_quantity
+
+        if min_stock is not None and new_quantity < min_stock:
+            return None
+
+        conn.execute(
+            'UPDATE products SET stock = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (new_quantity, product_id)
+        )
+
+        if delta:
+            conn.execute('''
+                INSERT INTO stock_deltas (
+                    product_id, delta, stock_after, movement_type, reference_id, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                product_id, delta, new_quantity, movement_type, reference_id,
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ))
+
+        return old_quantity, new_quantity
+
+    def apply_bulk_changes(self, conn, changes, movement_type='manual', reference_id=None):
+        """Пакетная установка остатков [(product_id, старый, новый)] в транзакции вызывающего"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        changes = [change for change in changes if change[2] != change[1]]
+        
+        conn.executemany(
+            'UPDATE products SET stock = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            ((new_quantity, product_id) for product_id, _, new_quantity in changes)
+        )
+        conn.executemany('''
+            INSERT INTO stock_deltas (
+                product_id, delta, stock_after, movement_type, reference_id, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            (product_id, new_quantity - old_quantity, new_quantity, movement_type, reference_id, now)
+            for product_id, old_quantity, new_quantity in changes
+        ))
+        
+        return changes
+
+    def take_snapshot(self):
+        """Снимок остатков всех товаров одной транзакцией"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with self.db.transaction() as conn:
+                last_delta_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM stock_deltas').fetchone()[0]
+                conn.execute('''
+                    INSERT OR REPLACE INTO stock_snapshots (snapshot_at, product_id, stock, last_delta_id)
+                    SELECT ?, id, IFNULL(stock, 0), ? FROM products
+                ''', (now, last_delta_id))
+
+                # Храним ограниченное число снимков
+                conn.execute('''
+                    DELETE FROM stock_snapshots
+                    WHERE snapshot_at < (
+                        SELECT MIN(snapshot_at) FROM (
+                            SELECT DISTINCT snapshot_at FROM stock_snapshots
+                            ORDER BY snapshot_at DESC LIMIT ?
+                        )
+                    )
+                ''', (STOCK_HISTORY_CONFIG['snapshots_to_keep'],))
+            return now
+        except Exception as e:
+            logging.info(f"Ошибка создания снимка остатков: {e}")
+            return None
+
+    def take_snapshot_if_due(self):
+        """Снимок, если с последнего прошло больше интервала"""
+        last = self.db.execute_query('SELECT MAX(snapshot_at) FROM stock_snapshots')
+        if last and last[0][0]:
+            last_at = datetime.strptime(last[0][0], '%Y-%m-%d %H:%M:%S')
+            if datetime.now() - last_at < timedelta(hours=STOCK_HISTORY_CONFIG['snapshot_interval_hours']):
+                return None
+        return self.take_snapshot()
+
+    def get_stock_levels_at(self, moment, product_id=None):
+        """Остатки на момент времени: ближайший снимок + изменения после него"""
+        if isinstance(moment, datetime):
+            moment = moment.strftime('%Y-%m-%d %H:%M:%S')
+
+        snapshot = self.db.execute_query(
+            'SELECT MAX(snapshot_at) FROM stock_snapshots WHERE snapshot_at <= ?',
+            (moment,)
+        )
+        if not snapshot or not snapshot[0][0]:
+            return {}
+
+        product_filter = 'AND s.product_id = ?' if product_id is not None else ''
+        params = [moment, snapshot[0][0]]
+        if product_id is not None:
+            params.append(product_id)
+
+        rows = self.db.execute_query(f'''
+            SELECT
+                s.product_id,
+                s.stock + IFNULL((
+                    SELECT SUM(d.delta) FROM stock_deltas d
+                    WHERE d.product_id = s.product_id
+                    AND d.id > s.last_delta_id
+                    AND d.created_at <= ?
+                ), 0)
+            FROM stock_snapshots s
+            WHERE s.snapshot_at = ? {product_filter}
+        ''', tuple(params)) or []
+
+        return dict(rows)
+
+    def get_stock_at(self, product_id, moment):
+        """Остаток товара на момент времени (None - раньше первого снимка)"""
+        return self.get_stock_levels_at(moment, product_id).get(product_id)
+
+    def add_missing_baselines(self, conn):
+        """Точка отсчета для товаров, созданных после последнего снимка: текущий остаток и последний id журнала.
+        Без нее такой товар считался бы с ожидаемым остатком 0
+        """
+        return conn.execute('''
+            INSERT INTO stock_snapshots (snapshot_at, product_id, stock, last_delta_id)
+            SELECT latest.snapshot_at, p.id, IFNULL(p.stock, 0), (SELECT IFNULL(MAX(id), 0) FROM stock_deltas)
+            FROM products p
+            JOIN (SELECT MAX(snapshot_at) AS snapshot_at FROM stock_snapshots) latest ON latest.snapshot_at IS NOT NULL
+            WHERE NOT EXISTS (
+                SELECT 1 FROM stock_snapshots s
+                WHERE s.snapshot_at = latest.snapshot_at AND s.product_id = p.id
+            )
+        ''').rowcount
+
+    def get_expected_stock_query(self):
+        """Ожидаемые остатки: последний снимок + все изменения после него (только товары с точкой отсчета)"""
+        return '''
+            SELECT
+                p.id,
+                s.stock + IFNULL((
+                    SELECT SUM(d.delta) FROM stock_deltas d
+                    WHERE d.product_id = p.id AND d.id > s.last_delta_id
+                ), 0) as expected_stock,
+                IFNULL(p.stock, 0) as actual_stock
+            FROM products p
+            JOIN stock_snapshots s
+                ON s.product_id = p.id
+                AND s.snapshot_at = (SELECT MAX(snapshot_at) FROM stock_snapshots)
+        '''
+
+    def detect_drift(self):
+        """Товары, где products.stock разошелся с журналом (запись в обход журнала)"""
+        try:
+            with self.db.transaction() as conn:
+                self.add_missing_baselines(conn)
+        except Exception as e:
+            logging.info(f"Ошибка записи точки отсчета остатков: {e}")
+
+        rows = self.db.execute_query(f'''
+            SELECT id, expected_stock, actual_stock
+            FROM ({self.get_expected_stock_query()})
+            WHERE expected_stock != actual_stock
+        ''') or []
+
+        if rows:
+            logging.info(f"Расхождение остатков с журналом: {len(rows)} товаров")
+
+        return [
+            {'product_id': row[0], 'expected': row[1], 'actual': row[2], 'difference': row[2] - row[1]}
+            for row in rows
+        ]
+
+    def rebuild_stock(self):
+        """Восстановление products.stock из снимка и журнала одним проходом"""
+        with self.db.transaction() as conn:
+            self.add_missing_baselines(conn)
+            drifted = conn.execute(f'''
+                SELECT expected_stock, id
+                FROM ({self.get_expected_stock_query()})
+                WHERE expected_stock != actual_stock
+            ''').fetchall()
+
+            conn.executemany(
+                'UPDATE products SET stock = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                drifted
+            )
+
+        if drifted:
+            logging.info(f"Остатки восстановлены из журнала: {len(drifted)} товаров")
+        return len(drifted)
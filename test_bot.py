@@ -87,6 +87,57 @@ def test_admin_config():
         logging.info(f"❌ Неверный формат ADMIN_TELEGRAM_ID: {admin_id}")
         return False
 
+def test_late_payment_on_cancelled_order():
+    """Оплата отмененного заказа: резерв уже вернулся на склад, событие уходит в dead-letter"""
+    import tempfile
+    from database import DatabaseManager
+    from inventory_management import InventoryManager
+    from webhook_inbox import DeadLetterError
+    from webhooks import WebhookManager
+
+    db = DatabaseManager(os.path.join(tempfile.mkdtemp(), 'shop_bot.db'))
+    bot = type('Bot', (), {})()
+    bot.inventory_manager = InventoryManager(db)
+
+    product_id = db.execute_query(
+        "INSERT INTO products (name, price, stock, category_id, is_active) VALUES ('Тест', 10, 20, 1, 1)"
+    )
+    order_id = db.create_order(1, 20, 'Адрес', 'online')
+    assert bot.inventory_manager.reserve_stock(product_id, 2, order_id)[0]
+    assert db.execute_query('SELECT stock FROM products WHERE id = ?', (product_id,))[0][0] == 18
+
+    db.update_order_status(order_id, 'cancelled')
+
+    webhook_manager = WebhookManager(bot, db, None)
+    try:
+        try:
+            webhook_manager.confirm_payment(order_id, 'stripe')
+            dead_lettered = False
+        except DeadLetterError:
+            dead_lettered = True
+    finally:
+        webhook_manager.inbox.stop()
+
+    assert dead_lettered
+    assert db.execute_query('SELECT stock FROM products WHERE id = ?', (product_id,))[0][0] == 20
+    assert db.execute_query('SELECT COUNT(*) FROM stock_reservations WHERE order_id = ?', (order_id,))[0][0] == 0
+    assert db.execute_query('SELECT status, payment_status FROM orders WHERE id = ?', (order_id,))[0] == ('cancelled', 'pending')
+    logging.info("✅ Оплата отмененного заказа не меняет остаток")
+
+def test_spam_features_overlap():
+    """Пересекающиеся признаки спама учитываются все: число и спам-слово внутри URL"""
+    import tempfile
+    from database import DatabaseManager
+    from security import AntiSpamFilter
+
+    spam_filter = AntiSpamFilter(DatabaseManager(os.path.join(tempfile.mkdtemp(), 'shop_bot.db')))
+
+    features = spam_filter.extract_content_features('http://shop.example/FREE/123456')
+    assert features == {'url': True, 'long_number': True, 'spam_word': True}
+    assert spam_filter.extract_content_features('@user_77777') == {'mention': True}
+    assert spam_filter.extract_content_features('Когда будет доставка?') == {}
+    logging.info("✅ Признаки спама считаются по каждому паттерну")
+
 def fix_common_issues():
     """Исправление частых проблем"""
     logging.info("\n🔧 Исправление частых проблем...")
@@ -1,11 +1,20 @@
 import os
 import sys
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+import threading
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context, abort
 from datetime import datetime, timedelta
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database import DatabaseManager
+from listing import AdminListings
+from data_export import DataExporter, EXPORT_FORMATS
+from inventory_management import InventoryManager
+from financial_reports import FinancialReportsManager
+from webhook_inbox import WebhookInbox
+from partner_api import APIManager
+from analytics_snapshot import AnalyticsSnapshot
+from query_profiler import profiler
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-change-in-production')
@@ -13,6 +22,25 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-change-in-produc
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(BASE_DIR, 'shop_bot.db')
 db = DatabaseManager(DB_PATH)
+listings = AdminListings(db)
+exporter = DataExporter()
+# Снимок ведет процесс бота; панель обновляет его в фоне, только если он старше max_staleness
+analytics_snapshot = AnalyticsSnapshot(db)
+# Только просмотр и возврат событий из dead-letter; обрабатывает их процесс бота
+webhook_inbox = WebhookInbox(db)
+
+# Склад, финансы и API партнеров создаются при первом запросе, а не при импорте модуля
+managers = {}
+managers_lock = threading.Lock()
+
+def get_manager(name):
+    """Общий экземпляр менеджера панели: inventory, finance или api"""
+    with managers_lock:
+        if not managers:
+            managers['inventory'] = InventoryManager(db, analytics_snapshot.db)
+            managers['finance'] = FinancialReportsManager(db, analytics_snapshot.db)
+            managers['api'] = APIManager(db, managers['inventory'])
+        return managers[name]
 
 def login_required(f):
     def decorated_function(*args, **kwargs):
@@ -55,7 +83,7 @@ def dashboard():
         WHERE DATE(created_at) = ?
     ''', (today,)) or [(0, 0)]
 
-    total_stats = db.execute_query('''
+    total_stats = analytics_snapshot.db.execute_query('''
         SELECT
             COUNT(*) as total_orders,
             IFNULL(SUM(total_amount), 0) as total_revenue,
@@ -85,6 +113,7 @@ def dashboard():
                          total_orders=total_stats[0][0],
                          total_revenue=total_stats[0][1],
                          total_customers=total_stats[0][2],
+                         snapshot_taken_at=analytics_snapshot.get_freshness().get('taken_at'),
                          products_count=products_count[0][0],
                          categories_count=categories_count[0][0],
                          recent_orders=recent_orders)
@@ -93,47 +122,21 @@ def dashboard():
 @login_required
 def orders():
     status_filter = request.args.get('status', 'all')
+    page = listings.list_orders(request.args)
 
-    query = '''
-        SELECT
-            o.id,
-            u.name as customer_name,
-            u.phone,
-            o.total_amount,
-            o.status,
-            o.created_at
-        FROM orders o
-        LEFT JOIN users u ON o.user_id = u.id
-    '''
-
-    params = []
-    if status_filter != 'all':
-        query += ' WHERE o.status = ?'
-        params.append(status_filter)
-
-    query += ' ORDER BY o.created_at DESC'
-
-    orders_data = db.execute_query(query, tuple(params)) or []
-
-    return render_template('orders.html', orders=orders_data, status_filter=status_filter)
+    return render_template('orders.html', orders=page['rows'], page=page,
+                         status_filter=status_filter, filters=request.args,
+                         next_url=next_page_url('orders', page))
 
 @app.route('/products')
 @login_required
 def products():
-    products_data = db.execute_query('''
-        SELECT
-            p.id,
-            p.name,
-            p.price,
-            p.stock,
-            c.name as category_name,
-            p.is_active
-        FROM products p
-        LEFT JOIN categories c ON p.category_id = c.id
-        ORDER BY p.created_at DESC
-    ''') or []
+    page = listings.list_products(request.args)
+    categories_data = db.execute_query('SELECT id, name FROM categories ORDER BY name') or []
 
-    return render_template('products.html', products=products_data)
+    return render_template('products.html', products=page['rows'], page=page,
+                         categories=categories_data, filters=request.args,
+                         next_url=next_page_url('products', page))
 
 @app.route('/categories')
 @login_required
@@ -156,23 +159,10 @@ def categories():
 @app.route('/customers')
 @login_required
 def customers():
-    customers_data = db.execute_query('''
-        SELECT
-            u.id,
-            u.telegram_id,
-            u.name,
-            u.phone,
-            u.language,
-            u.created_at,
-            COUNT(o.id) as orders_count,
-            IFNULL(SUM(o.total_amount), 0) as total_spent
-        FROM users u
-        LEFT JOIN orders o ON u.id = o.user_id
-        GROUP BY u.id
-        ORDER BY u.created_at DESC
-    ''') or []
+    page = listings.list_customers(request.args)
 
-    return render_template('customers.html', customers=customers_data)
+    return render_template('customers.html', customers=page['rows'], page=page, filters=request.args,
+                         next_url=next_page_url('customers', page))
 
 @app.route('/update_order_status', methods=['POST'])
 @login_required
@@ -180,10 +170,120 @@ def update_order_status():
     order_id = request.form.get('order_id')
     new_status = request.form.get('status')
 
-    db.execute_query('UPDATE orders SET status = ? WHERE id = ?', (new_status, order_id))
+    # Склад подключает db.reservations: отмена заказа возвращает резерв
+    get_manager('inventory')
+    db.update_order_status(order_id, new_status)
 
     flash('Статус заказа обновлен')
     return redirect(url_for('orders'))
 
+def next_page_url(endpoint, page):
+    """Ссылка на следующую страницу с текущими фильтрами"""
+    if not page['next_cursor']:
+        return None
+    args = request.args.to_dict()
+    args['cursor'] = page['next_cursor']
+    return url_for(endpoint, **args)
+
+def page_response(page):
+    """JSON-ответ со страницей списка"""
+    return jsonify({
+        'items': page['items'],
+        'next_cursor': page['next_cursor'],
+        'count': page['count'],
+        'sort': page['sort'],
+        'order': page['order']
+    })
+
+@app.route('/api/orders')
+@login_required
+def api_orders():
+    return page_response(listings.list_orders(request.args))
+
+@app.route('/api/products')
+@login_required
+def api_products():
+    return page_response(listings.list_products(request.args))
+
+@app.route('/api/customers')
+@login_required
+def api_customers():
+    return page_response(listings.list_customers(request.args))
+
+@app.route('/api/webhooks/dead')
+@login_required
+def api_webhooks_dead():
+    columns = ['id', 'provider', 'event_id', 'event_type', 'order_id', 'attempts', 'last_error', 'received_at']
+    return jsonify({
+        'items': [dict(zip(columns, row)) for row in webhook_inbox.get_dead_letters(request.args.get('limit', 100, type=int))],
+        'stats': webhook_inbox.get_stats()['by_status']
+    })
+
+@app.route('/api/webhooks/dead/<int:event_id>/retry', methods=['POST'])
+@login_required
+def api_webhooks_retry(event_id):
+    return jsonify({'requeued': bool(webhook_inbox.requeue(event_id))})
+
+@app.route('/api/analytics/snapshot', methods=['GET', 'POST'])
+@login_required
+def api_analytics_snapshot():
+    """Актуальность снимка для отчетов; POST - обновить в фоне"""
+    if request.method == 'POST':
+        analytics_snapshot.request_refresh()
+    return jsonify(analytics_snapshot.get_freshness())
+
+@app.route('/api/db/queries', methods=['GET', 'POST'])
+@login_required
+def api_db_queries():
+    """Самые дорогие SQL-запросы панели (у бота свой профиль: /admin_queries); POST - сбросить"""
+    if request.method == 'POST':
+        profiler.reset()
+    order = request.args.get('order', 'total_ms')
+    if order not in ('total_ms', 'calls', 'p99_ms', 'max_ms', 'errors'):
+        abort(400)
+    return jsonify({
+        'stats': profiler.get_stats(),
+        'queries': profiler.get_top(request.args.get('limit', type=int), order)
+    })
+
+@app.route('/partner/v1/<path:endpoint>', methods=['GET', 'POST'])
+def partner_api(endpoint):
+    """API для партнеров: авторизация по заголовку X-API-Key, без сессии админки"""
+    response = get_manager('api').handle(
+        request.method, endpoint, request.headers.get('X-API-Key'),
+        request.args, request.get_data(), request.headers
+    )
+    body = response['body']
+    if not isinstance(body, bytes):
+        body = stream_with_context(body)
+    return Response(body, status=response['status'], headers=response['headers'])
+
+@app.route('/export/<source>/<report_type>')
+@login_required
+def export_report(source, report_type):
+    """Потоковая выгрузка отчета gzip-ответом без сборки файла в памяти"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+
+    try:
+        if source == 'inventory':
+            header, rows = get_manager('inventory').get_export_rows(report_type)
+        elif source == 'finance':
+            start_date = request.args.get('start_date', '1970-01-01')
+            end_date = request.args.get('end_date', datetime.now().strftime('%Y-%m-%d'))
+            header, rows = get_manager('finance').get_export_rows(report_type, start_date, end_date)
+        else:
+            abort(404)
+    except ValueError:
+        abort(404)
+
+    filename = f"{source}_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[fmt]['extension']}.gz"
+    return Response(
+        stream_with_context(exporter.iter_chunks(header, rows, fmt)),
+        mimetype='application/gzip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,217 @@
+"""
+Постраничные списки админ-панели: keyset-пагинация, фильтры и сортировка на сервере
+"""
+import base64
+import json
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+COUNT_CAP = 10000  # Выше этого значения показываем "10000+"
+
+def encode_cursor(values):
+    """Курсор: значения ключа сортировки последней строки"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Разбор курсора, битый курсор означает первую страницу"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if isinstance(values, list) and len(values) == 2:
+            return values
+    except (ValueError, TypeError):
+        pass
+    return None
+
+class AdminListings:
+    # Разрешенные сортировки: у каждой есть индекс с этим столбцом
+    ORDER_SORTS = {
+        'created_at': 'o.created_at',
+        'total_amount': 'o.total_amount'
+    }
+    PRODUCT_SORTS = {
+        'created_at': 'p.created_at',
+        'price': 'p.price',
+        'stock': 'p.stock'
+    }
+    CUSTOMER_SORTS = {
+        'created_at': 'u.created_at'
+    }
+
+    ORDER_COLUMNS = ['id', 'customer_name', 'phone', 'total_amount', 'status', 'created_at']
+    PRODUCT_COLUMNS = ['id', 'name', 'price', 'stock', 'category_name', 'is_active']
+    CUSTOMER_COLUMNS = ['id', 'telegram_id', 'name', 'phone', 'language', 'created_at', 'orders_count', 'total_spent']
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_page_params(self, args, sorts):
+        """Общие параметры страницы из запроса"""
+        sort = args.get('sort', 'created_at')
+        if sort not in sorts:
+            sort = 'created_at'
+
+        try:
+            limit = min(max(int(args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            limit = PAGE_SIZE
+
+        return {
+            'sort': sort,
+            'sort_column': sorts[sort],
+            'descending': args.get('order', 'desc') != 'asc',
+            'cursor': decode_cursor(args.get('cursor')),
+            'limit': limit
+        }
+
+    def fetch_page(self, select_sql, from_sql, id_column, where, params, page):
+        """Выборка страницы по ключу (sort_column, id) вместо OFFSET"""
+        where = list(where)
+        params = list(params)
+        sort_column = page['sort_column']
+        direction = 'DESC' if page['descending'] else 'ASC'
+
+        if page['cursor']:
+            comparison = '<' if page['descending'] else '>'
+            where.append(f'({sort_column}, {id_column}) {comparison} (?, ?)')
+            params.extend(page['cursor'])
+
+        query = f'{select_sql}, {sort_column} {from_sql}'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += f' ORDER BY {sort_column} {direction}, {id_column} {direction} LIMIT ?'
+        params.append(page['limit'] + 1)
+
+        rows = self.db.execute_query(query, tuple(params)) or []
+        has_more = len(rows) > page['limit']
+        rows = rows[:page['limit']]
+
+        next_cursor = None
+        if has_more and rows:
+            next_cursor = encode_cursor([rows[-1][-1], rows[-1][0]])
+
+        # Последний столбец - ключ сортировки, в шаблоны он не нужен
+        return [row[:-1] for row in rows], next_cursor
+
+    def estimate_count(self, table, from_sql, where, params):
+        """Оценка количества строк без полного COUNT(*)"""
+        if not where:
+            # Без фильтров - максимальный rowid (удаленные строки не вычитаются)
+            result = self.db.execute_query(f'SELECT MAX(rowid) FROM {table}')
+            return {'value': (result[0][0] or 0) if result else 0, 'exact': False, 'capped': False}
+
+        query = f'SELECT COUNT(*) FROM (SELECT 1 {from_sql} WHERE {" AND ".join(where)} LIMIT ?)'
+        result = self.db.execute_query(query, tuple(params) + (COUNT_CAP + 1,))
+        count = result[0][0] if result else 0
+        return {'value': min(count, COUNT_CAP), 'exact': count <= COUNT_CAP, 'capped': count > COUNT_CAP}
+
+    def list_orders(self, args):
+        """Страница заказов"""
+        page = self.get_page_params(args, self.ORDER_SORTS)
+        where, params = [], []
+
+        status = args.get('status', 'all')
+        if status and status != 'all':
+            where.append('o.status = ?')
+            params.append(status)
+
+        if args.get('date_from'):
+            where.append('o.created_at >= ?')
+            params.append(args['date_from'])
+        if args.get('date_to'):
+            where.append("o.created_at < date(?, '+1 day')")
+            params.append(args['date_to'])
+
+        search = args.get('q', '').strip()
+        if search.isdigit():
+            where.append('o.id = ?')
+            params.append(int(search))
+        elif search:
+            where.append('o.user_id IN (SELECT id FROM users WHERE name LIKE ? OR phone LIKE ?)')
+            params.extend([f'{search}%', f'%{search}%'])
+
+        select_sql = 'SELECT o.id, u.name, u.phone, o.total_amount, o.status, o.created_at'
+        from_sql = 'FROM orders o LEFT JOIN users u ON o.user_id = u.id'
+        rows, next_cursor = self.fetch_page(select_sql, from_sql, 'o.id', where, params, page)
+
+        return self.build_result(rows, next_cursor, self.ORDER_COLUMNS, page,
+                                 lambda: self.estimate_count('orders', 'FROM orders o', where, params))
+
+    def list_products(self, args):
+        """Страница товаров"""
+        page = self.get_page_params(args, self.PRODUCT_SORTS)
+        where, params = [], []
+
+        if args.get('category_id', '').isdigit():
+            where.append('p.category_id = ?')
+            params.append(int(args['category_id']))
+
+        if args.get('active') in ('0', '1'):
+            where.append('p.is_active = ?')
+            params.append(int(args['active']))
+
+        if args.get('low_stock') == '1':
+            where.append('p.stock < 5')
+
+        search = args.get('q', '').strip()
+        if search:
+            where.append('p.name LIKE ?')
+            params.append(f'%{search}%')
+
+        select_sql = 'SELECT p.id, p.name, p.price, p.stock, c.name, p.is_active'
+        from_sql = 'FROM products p LEFT JOIN categories c ON p.category_id = c.id'
+        rows, next_cursor = self.fetch_page(select_sql, from_sql, 'p.id', where, params, page)
+
+        return self.build_result(rows, next_cursor, self.PRODUCT_COLUMNS, page,
+                                 lambda: self.estimate_count('products', 'FROM products p', where, params))
+
+    def list_customers(self, args):
+        """Страница клиентов с агрегатами заказов только по строкам страницы"""
+        page = self.get_page_params(args, self.CUSTOMER_SORTS)
+        where, params = [], []
+
+        if args.get('language'):
+            where.append('u.language = ?')
+            params.append(args['language'])
+
+        search = args.get('q', '').strip()
+        if search.isdigit():
+            where.append('(u.telegram_id = ? OR u.phone LIKE ?)')
+            params.extend([int(search), f'%{search}%'])
+        elif search:
+            where.append('u.name LIKE ?')
+            params.append(f'{search}%')
+
+        select_sql = 'SELECT u.id, u.telegram_id, u.name, u.phone, u.language, u.created_at'
+        rows, next_cursor = self.fetch_page(select_sql, 'FROM users u', 'u.id', where, params, page)
+
+        # Агрегаты по индексу orders(user_id, total_amount) только для пользователей страницы
+        totals = {}
+        if rows:
+            placeholders = ','.join('?' * len(rows))
+            for user_id, orders_count, total_spent in self.db.execute_query(f'''
+                SELECT user_id, COUNT(*), IFNULL(SUM(total_amount), 0)
+                FROM orders
+                WHERE user_id IN ({placeholders})
+                GROUP BY user_id
+            ''', tuple(row[0] for row in rows)) or []:
+                totals[user_id] = (orders_count, total_spent)
+
+        rows = [row + totals.get(row[0], (0, 0)) for row in rows]
+
+        return self.build_result(rows, next_cursor, self.CUSTOMER_COLUMNS, page,
+                                 lambda: self.estimate_count('users', 'FROM users u', where, params))
+
+    def build_result(self, rows, next_cursor, columns, page, count_func):
+        """Результат страницы; оценка количества только для первой страницы"""
+        return {
+            'rows': rows,
+            'items': [dict(zip(columns, row)) for row in rows],
+            'next_cursor': next_cursor,
+            'count': None if page['cursor'] else count_func(),
+            'sort': page['sort'],
+            'order': 'desc' if page['descending'] else 'asc'
+        }
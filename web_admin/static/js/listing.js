@@ -0,0 +1,44 @@
+// Подгрузка следующих страниц списков через JSON API (keyset-курсор)
+function escapeHtml(value) {
+    if (value === null || value === undefined) {
+        return '';
+    }
+    return String(value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+function setupLoadMore(options) {
+    const button = document.getElementById(options.buttonId || 'load-more');
+    if (!button) {
+        return;
+    }
+    const tbody = document.getElementById(options.tbodyId || 'list-body');
+
+    button.addEventListener('click', function (event) {
+        event.preventDefault();
+        const params = new URLSearchParams(window.location.search);
+        params.set('cursor', button.dataset.cursor);
+        button.classList.add('disabled');
+
+        fetch(options.apiUrl + '?' + params.toString(), {credentials: 'same-origin'})
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                data.items.forEach(function (item) {
+                    tbody.insertAdjacentHTML('beforeend', options.renderRow(item));
+                });
+                if (data.next_cursor) {
+                    button.dataset.cursor = data.next_cursor;
+                    button.classList.remove('disabled');
+                } else {
+                    button.remove();
+                }
+            })
+            .catch(function () {
+                button.classList.remove('disabled');
+            });
+    });
+}
@@ -0,0 +1,231 @@
+"""
+Входящие webhook'и: сохранение события с мгновенным ответом, дедупликация, обработка пулом потоков и dead-letter
+"""
+import logging
+import json
+import queue
+import threading
+import zlib
+
+from datetime import datetime, timedelta
+from config import WEBHOOK_INBOX_CONFIG
+
+class DeadLetterError(Exception):
+    """Событие, которое повтор не исправит: сразу в dead-letter на ручной разбор"""
+
+class WebhookInbox:
+    def __init__(self, db, handler=None):
+        self.db = db
+        self.handler = handler  # handler(provider, event_type, data); исключение - повтор события
+        self.lock = threading.Lock()
+        self.queues = [queue.Queue() for _ in range(WEBHOOK_INBOX_CONFIG['workers'])]
+        self.retrying = {}  # order_id -> события на повторе; новые события заказа ждут их
+        self.metrics = {'received': 0, 'duplicates': 0, 'processed': 0, 'retried': 0, 'dead': 0}
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def receive(self, provider, event_id, event_type, order_id, payload):
+        """Сохранение события до обработки. False - событие уже получено (повтор от провайдера)"""
+        now = datetime.now()
+        with self.lock:
+            deferred = order_id in self.retrying
+
+        # Событие, переданное потоку сразу, подбирается повторно только если его так и не взяли в работу
+        next_attempt_at = now if deferred or not self.threads else now + timedelta(seconds=WEBHOOK_INBOX_CONFIG['stale_after'])
+
+        with self.db.transaction() as conn:
+            cursor = conn.execute('''
+                INSERT INTO webhook_events (
+                    provider, event_id, event_type, order_id, payload, status, next_attempt_at, received_at
+                ) VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
+                ON CONFLICT(provider, event_id) DO NOTHING
+            ''', (
+                provider, event_id, event_type, order_id, payload,
+                next_attempt_at.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S')
+            ))
+            row_id = cursor.lastrowid if cursor.rowcount else None
+
+        with self.lock:
+            self.metrics['duplicates' if row_id is None else 'received'] += 1
+
+        if row_id is None:
+            return False
+
+        if not deferred and self.threads:
+            self.enqueue(row_id, order_id)
+        return True
+
+    def enqueue(self, row_id, order_id):
+        """События одного заказа всегда попадают в один поток - обработка по порядку"""
+        partition_key = str(order_id if order_id is not None else row_id).encode()
+        self.queues[zlib.crc32(partition_key) % len(self.queues)].put((row_id, order_id))
+
+    def claim(self, row_id):
+        """Взятие события в работу; повторно поставленное в очередь событие не обработается дважды"""
+        with self.db.transaction() as conn:
+            if not conn.execute(
+                "UPDATE webhook_events SET status = 'processing' WHERE id = ? AND status = 'pending'",
+                (row_id,)
+            ).rowcount:
+                return None
+            return conn.execute(
+                'SELECT provider, event_type, order_id, payload, attempts FROM webhook_events WHERE id = ?',
+                (row_id,)
+            ).fetchone()
+
+    def process(self, row_id):
+        event = self.claim(row_id)
+        if not event:
+            return
+
+        provider, event_type, order_id, payload, attempts = event
+        now = datetime.now()
+
+        try:
+            self.handler(provider, event_type, json.loads(payload))
+        except Exception as e:
+            attempts += 1
+            dead = isinstance(e, DeadLetterError) or attempts >= WEBHOOK_INBOX_CONFIG['max_attempts']
+            delay = min(WEBHOOK_INBOX_CONFIG['backoff'] * 2 ** (attempts - 1), WEBHOOK_INBOX_CONFIG['max_backoff'])
+            self.db.execute_query('''
+                UPDATE webhook_events SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?
+                WHERE id = ?
+            ''', (
+                'dead' if dead else 'pending', attempts, str(e)[:500],
+                (now + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S'), row_id
+            ))
+            logging.info(f"Ошибка обработки webhook {provider} #{row_id} (попытка {attempts}): {e}")
+
+            with self.lock:
+                self.metrics['dead' if dead else 'retried'] += 1
+                if dead:
+                    self.release_order(order_id, row_id)
+                else:
+                    self.retrying.setdefault(order_id, set()).add(row_id)
+            return
+
+        self.db.execute_query('''
+            UPDATE webhook_events SET status = 'done', attempts = ?, last_error = NULL, processed_at = ?
+            WHERE id = ?
+        ''', (attempts + 1, now.strftime('%Y-%m-%d %H:%M:%S'), row_id))
+
+        with self.lock:
+            self.metrics['processed'] += 1
+            self.release_order(order_id, row_id)
+
+    def release_order(self, order_id, row_id):
+        """Событие заказа больше не на повторе (вызывается под блокировкой)"""
+        if order_id in self.retrying:
+            self.retrying[order_id].discard(row_id)
+            if not self.retrying[order_id]:
+                del self.retrying[order_id]
+
+    def sweep(self):
+        """Постановка в очередь событий, которым пора; событие заказа не обгоняет более раннее на повторе"""
+        now = datetime.now()
+        now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+
+        with self.db.transaction() as conn:
+            due = conn.execute('''
+                SELECT e.id, e.order_id FROM webhook_events e
+                WHERE e.status = 'pending' AND e.next_attempt_at <= ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM webhook_events earlier
+                    WHERE earlier.order_id = e.order_id AND earlier.status = 'pending'
+                    AND earlier.id < e.id AND earlier.next_attempt_at > ?
+                )
+                ORDER BY e.id
+                LIMIT ?
+            ''', (now_str, now_str, WEBHOOK_INBOX_CONFIG['batch_size'])).fetchall()
+
+            conn.executemany(
+                'UPDATE webhook_events SET next_attempt_at = ? WHERE id = ?',
+                (((now + timedelta(seconds=WEBHOOK_INBOX_CONFIG['stale_after'])).strftime('%Y-%m-%d %H:%M:%S'), row_id)
+                 for row_id, _ in due)
+            )
+
+        for row_id, order_id in due:
+            self.enqueue(row_id, order_id)
+        return len(due)
+
+    def worker(self, events):
+        while not self.stop_event.is_set():
+            try:
+                row_id, order_id = events.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            try:
+                self.process(row_id)
+            except Exception as e:
+                logging.info(f"Ошибка обработчика webhook: {e}")
+            finally:
+                events.task_done()
+
+    def start(self):
+        """Потоки обработки и выбор событий на повтор; прерванные при остановке события возвращаются"""
+        if self.threads:
+            return
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.db.execute_query("UPDATE webhook_events SET status = 'pending' WHERE status = 'processing'")
+        # Непринятые в работу до остановки события - сразу; повторы сохраняют паузу
+        self.db.execute_query('''
+            UPDATE webhook_events SET next_attempt_at = ?
+            WHERE status = 'pending' AND attempts = 0 AND next_attempt_at > ?
+        ''', (now, now))
+
+        with self.lock:
+            for order_id, row_id in self.db.execute_query(
+                "SELECT order_id, id FROM webhook_events WHERE status = 'pending' AND attempts > 0"
+            ) or []:
+                self.retrying.setdefault(order_id, set()).add(row_id)
+
+        def sweeper_worker():
+            while not self.stop_event.wait(WEBHOOK_INBOX_CONFIG['sweep_interval']):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logging.info(f"Ошибка выбора webhook'ов на повтор: {e}")
+
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self.worker, args=(events,), daemon=True) for events in self.queues]
+        self.threads.append(threading.Thread(target=sweeper_worker, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def wait_idle(self):
+        """Ожидание обработки всего, что уже в очередях"""
+        for events in self.queues:
+            events.join()
+
+    def get_dead_letters(self, limit=100):
+        """События, исчерпавшие попытки"""
+        return self.db.execute_query('''
+            SELECT id, provider, event_id, event_type, order_id, attempts, last_error, received_at
+            FROM webhook_events
+            WHERE status = 'dead'
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (limit,)) or []
+
+    def requeue(self, row_id):
+        """Повторная обработка события из dead-letter"""
+        return self.db.execute_query('''
+            UPDATE webhook_events SET status = 'pending', attempts = 0, next_attempt_at = ?
+            WHERE id = ? AND status = 'dead'
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row_id))
+
+    def get_stats(self):
+        """Метрики и число событий по статусам"""
+        counts = self.db.execute_query('SELECT status, COUNT(*) FROM webhook_events GROUP BY status') or []
+        with self.lock:
+            return {
+                **self.metrics,
+                'queued': sum(events.qsize() for events in self.queues),
+                'orders_retrying': len(self.retrying),
+                'by_status': dict(counts)
+            }
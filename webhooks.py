@@ -3,14 +3,18 @@
 """
 import logging
 
+import hashlib
 import json
 from datetime import datetime
+from log_writer import get_log_writer
+from webhook_inbox import DeadLetterError, WebhookInbox
 
 class WebhookManager:
     def __init__(self, bot, db, security_manager):
         self.bot = bot
         self.db = db
         self.security = security_manager
+        self.log_writer = get_log_writer(db.db_path)
         
         # Секретные ключи для проверки подписей
         self.webhook_secrets = {
@@ -20,100 +24,123 @@ class WebhookManager:
             'paypal': 'PAYPAL_WEBHOOK_SECRET',
             'zoodpay': 'ZOODPAY_WEBHOOK_SECRET'
         }
+        
+        # Входящие события: сохранение, дедупликация и обработка пулом потоков
+        self.inbox = WebhookInbox(db, self.process_event)
+        self.inbox.start()
     
     def handle_payment_webhook(self, provider, payload, signature=None):
-        """Обработка webhook'а от платежной системы"""
+        """Прием webhook'а от платежной системы: событие сохраняется, ответ - сразу, обработка - в фоне"""
         try:
             # Проверяем подпись
             if signature and not self.verify_webhook_signature(provider, payload, signature):
                 self.log_webhook_error(provider, "Invalid signature", payload[:100])
                 return {'status': 'error', 'message': 'Invalid signature'}
             
-            # Парсим данные
-            if provider == 'stripe':
-                return self.handle_stripe_webhook(payload)
-            elif provider == 'paypal':
-                return self.handle_paypal_webhook(payload)
-            else:
+            event = self.parse_event(provider, payload)
+            if not event:
                 return {'status': 'error', 'message': 'Unknown provider'}
+            
+            # Повтор от провайдера (тот же id события) подтверждается без повторной обработки
+            if not self.inbox.receive(provider, *event, payload):
+                return {'status': 'success', 'duplicate': True}
+            
+            return {'status': 'success'}
                 
         except Exception as e:
             self.log_webhook_error(provider, str(e), payload[:100])
             return {'status': 'error', 'message': 'Processing error'}
     
-    def handle_stripe_webhook(self, payload):
-        """Обработка Stripe webhook"""
-        try:
-            data = json.loads(payload)
-            
-            if data['type'] == 'payment_intent.succeeded':
-                payment_intent = data['data']['object']
-                order_id = payment_intent['metadata'].get('order_id')
-                
-                if order_id:
-                    self.confirm_payment(order_id, 'stripe')
-                    return {'status': 'success'}
-            
-            return {'status': 'success'}
-        except Exception as e:
-            logging.info(f"Ошибка обработки Stripe webhook: {e}")
-            return {'status': 'error'}
+    def parse_event(self, provider, payload):
+        """id события, тип и заказ из webhook'а; None - неизвестный провайдер"""
+        data = json.loads(payload)
+        
+        if provider == 'stripe':
+            event_type = data.get('type')
+            order_id = data.get('data', {}).get('object', {}).get('metadata', {}).get('order_id')
+        elif provider == 'paypal':
+            event_type = data.get('event_type')
+            purchase_units = data.get('resource', {}).get('purchase_units') or [{}]
+            order_id = purchase_units[0].get('reference_id')
+        else:
+            return None
+        
+        # Без id события дубликаты распознаются по содержимому
+        event_id = data.get('id') or hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        if isinstance(order_id, str) and order_id.isdigit():
+            order_id = int(order_id)
+        
+        return event_id, event_type, order_id
     
-    def handle_paypal_webhook(self, payload):
-        """Обработка PayPal webhook"""
-        try:
-            data = json.loads(payload)
-            
-            if data.get('event_type') == 'PAYMENT.CAPTURE.COMPLETED':
-                purchase_units = data['resource']['purchase_units']
-                if purchase_units:
-                    order_id = purchase_units[0]['reference_id']
-                    self.confirm_payment(order_id, 'paypal')
-            
-            return {'status': 'success'}
-        except Exception as e:
-            logging.info(f"Ошибка обработки PayPal webhook: {e}")
-            return {'status': 'error'}
+    def process_event(self, provider, event_type, data):
+        """Обработка сохраненного события (поток WebhookInbox); исключение - повтор позже"""
+        if provider == 'stripe' and event_type == 'payment_intent.succeeded':
+            order_id = data['data']['object']['metadata'].get('order_id')
+        elif provider == 'paypal' and event_type == 'PAYMENT.CAPTURE.COMPLETED':
+            order_id = (data['resource'].get('purchase_units') or [{}])[0].get('reference_id')
+        else:
+            return
+        
+        if order_id:
+            self.confirm_payment(order_id, provider)
     
     def confirm_payment(self, order_id, provider):
-        """Подтверждение успешной оплаты"""
-        try:
-            # Обновляем статус заказа
-            self.db.execute_query(
-                'UPDATE orders SET payment_status = "paid", status = "confirmed" WHERE id = ?',
+        """Подтверждение успешной оплаты. False - заказ уже был оплачен; оплата отмененного заказа - в dead-letter"""
+        inventory_manager = getattr(self.bot, 'inventory_manager', None)
+        payment_intents = getattr(self.bot, 'payment_intents', None)
+        
+        # Статус заказа, резерв, ссылки на оплату и корзина - одной транзакцией
+        with self.db.transaction() as conn:
+            if not conn.execute(
+                "UPDATE orders SET payment_status = 'paid', status = 'confirmed' "
+                "WHERE id = ? AND IFNULL(payment_status, '') != 'paid' AND IFNULL(status, '') != 'cancelled'",
                 (order_id,)
-            )
+            ).rowcount:
+                order = conn.execute('SELECT status, payment_status FROM orders WHERE id = ?', (order_id,)).fetchone()
+                if not order or order[0] != 'cancelled' or order[1] == 'paid':
+                    return False
+                
+                # Резерв отмененного заказа уже вернулся на склад: деньги - на возврат или ручной разбор
+                self.log_webhook_error(provider, f"Оплата отмененного заказа #{order_id}", str(order_id))
+                raise DeadLetterError(f"Оплата отмененного заказа #{order_id}: требуется возврат")
             
-            # Получаем данные заказа
-            order = self.db.execute_query(
-                'SELECT user_id FROM orders WHERE id = ?',
-                (order_id,)
-            )
+            # Резерв оплаченного заказа больше не истекает
+            if inventory_manager:
+                inventory_manager.reservations.confirm(order_id, conn)
             
-            if order:
-                user_id = order[0][0]
-                
-                # Очищаем корзину
-                self.db.clear_cart(user_id)
-                
-                # Уведомляем клиента
-                user = self.db.execute_query(
-                    'SELECT telegram_id, name FROM users WHERE id = ?',
-                    (user_id,)
-                )
-                
-                if user:
-                    success_text = f"✅ <b>Оплата прошла успешно!</b>\n\n"
-                    success_text += f"💳 Платеж подтвержден\n"
-                    success_text += f"📦 Заказ #{order_id}\n\n"
-                    success_text += f"📞 Мы свяжемся с вами в ближайшее время"
-                    
-                    self.bot.send_message(user[0][0], success_text)
+            # Ссылки на оплату заказа больше не выдаются
+            if payment_intents:
+                payment_intents.mark_paid(order_id, conn)
             
-            self.log_webhook_success(provider, order_id, user_id if order else None)
+            user = conn.execute('''
+                SELECT o.user_id, u.telegram_id FROM orders o
+                JOIN users u ON o.user_id = u.id
+                WHERE o.id = ?
+            ''', (order_id,)).fetchone()
             
-        except Exception as e:
-            logging.info(f"Ошибка подтверждения платежа: {e}")
+            # Очищаем корзину
+            if user:
+                conn.execute('DELETE FROM cart WHERE user_id = ?', (user[0],))
+        
+        # Заявки флеш-распродажи заказа окончательно проданы
+        flash_sale_engine = getattr(self.bot, 'flash_sale_engine', None)
+        if flash_sale_engine:
+            flash_sale_engine.confirm_order(order_id)
+        
+        # Уведомляем клиента после фиксации: ошибка отправки не откатывает оплату
+        if user:
+            success_text = f"✅ <b>Оплата прошла успешно!</b>\n\n"
+            success_text += f"💳 Платеж подтвержден\n"
+            success_text += f"📦 Заказ #{order_id}\n\n"
+            success_text += f"📞 Мы свяжемся с вами в ближайшее время"
+            
+            try:
+                self.bot.send_message(user[1], success_text)
+            except Exception as e:
+                logging.info(f"Ошибка уведомления об оплате заказа #{order_id}: {e}")
+        
+        self.log_webhook_success(provider, order_id, user[0] if user else None)
+        return True
     
     def verify_webhook_signature(self, provider, payload, signature):
         """Проверка подписи webhook'а"""
@@ -126,7 +153,7 @@ class WebhookManager:
     def log_webhook_success(self, provider, order_id, user_id):
         """Логирование успешного webhook'а"""
         try:
-            self.db.execute_query('''
+            self.log_writer.write('''
                 INSERT INTO webhook_logs (provider, order_id, user_id, status, created_at)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
@@ -142,7 +169,7 @@ class WebhookManager:
     def log_webhook_error(self, provider, error_message, payload_preview):
         """Логирование ошибки webhook'а"""
         try:
-            self.db.execute_query('''
+            self.log_writer.write('''
                 INSERT INTO webhook_logs (provider, status, error_message, payload_preview, created_at)
                 VALUES (?, ?, ?, ?, ?)
             ''', (